@@ -4,18 +4,13 @@ import os
 __version__ = "unknown"
 
 try:
-    from .version import get_git_version
-    __version__ = get_git_version()
+    from .version import get_version
+    __version__ = get_version()
 except Exception as message:
     print(message)
 
 __author__ = "Matthew Wood"
 
-try:
-    import pyLikelihood
-except ImportError:
-    pass
-
 
 def get_st_version():
     """Get the version string of the ST release."""
@@ -92,6 +92,21 @@ def row_to_dict(row):
     return o
 
 
+def table_to_dicts(table):
+    """Convert the rows of a table to a list of dictionaries.  This
+    is equivalent to calling `row_to_dict` on every row of the table
+    but extracts the table contents column-wise."""
+    cols = []
+    for colname in table.colnames:
+
+        if table[colname].dtype.kind in ['S', 'U']:
+            cols += [[str(v) for v in table[colname]]]
+        else:
+            cols += [list(table[colname])]
+
+    return [dict(zip(table.colnames, vals)) for vals in zip(*cols)]
+
+
 class Catalog(object):
     """Source catalog object.  This class provides a simple wrapper around
     FITS catalog tables."""
@@ -0,0 +1,242 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Binary checkpoint format for the analysis state saved by
+`~fermipy.gtanalysis.GTAnalysis.write_roi`.
+
+A checkpoint is an uncompressed zip archive containing a JSON index
+and one JSON document per source.  Numpy arrays are stored as
+individual ``.npy`` members and are referenced from the JSON
+documents.  Because each source is an independent member of the
+archive the results of a single source can be read without
+deserializing the rest of the file.  Objects that cannot be
+represented in JSON are pickled into separate members.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import io
+import json
+import zipfile
+import numpy as np
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+CHECKPOINT_VERSION = 1
+INDEX_FILE = 'index.json'
+
+
+def is_checkpoint(path):
+    """Return True if ``path`` is a checkpoint file."""
+    if not os.path.isfile(path) or not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path, 'r') as zf:
+        return INDEX_FILE in zf.namelist()
+
+
+class _Encoder(object):
+    """Convert a python data structure to a JSON-compatible tree.
+    Arrays and unsupported objects are moved to separate archive
+    members whose data is accumulated in ``members``."""
+
+    def __init__(self, prefix):
+        self._prefix = prefix
+        self.members = []
+
+    def _add_member(self, ext, data):
+        name = '%s/%i.%s' % (self._prefix, len(self.members), ext)
+        self.members += [(name, data)]
+        return name
+
+    def encode(self, obj):
+
+        if obj is None or isinstance(obj, (bool, float)):
+            return obj
+        elif isinstance(obj, (int, np.integer)):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, np.bool_):
+            return bool(obj)
+        elif isinstance(obj, bytes) and not isinstance(obj, str):
+            return {'__bytes__': obj.decode('latin-1')}
+        elif isinstance(obj, str):
+            return str(obj)
+        elif isinstance(obj, np.ndarray) and obj.dtype != object:
+            buf = io.BytesIO()
+            np.save(buf, obj, allow_pickle=False)
+            return {'__array__': self._add_member('npy', buf.getvalue())}
+        elif isinstance(obj, dict):
+            if all(isinstance(k, str) for k in obj.keys()):
+                return {'__dict__': [[k, self.encode(v)]
+                                     for k, v in obj.items()]}
+            return {'__items__': [[self.encode(k), self.encode(v)]
+                                  for k, v in obj.items()]}
+        elif isinstance(obj, list):
+            return [self.encode(v) for v in obj]
+        elif isinstance(obj, tuple):
+            return {'__tuple__': [self.encode(v) for v in obj]}
+
+        data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        return {'__pickle__': self._add_member('pkl', data)}
+
+
+def _decode(obj, zf):
+
+    if isinstance(obj, list):
+        return [_decode(v, zf) for v in obj]
+    elif not isinstance(obj, dict):
+        return obj
+    elif '__dict__' in obj:
+        return dict([(k, _decode(v, zf)) for k, v in obj['__dict__']])
+    elif '__array__' in obj:
+        return np.load(io.BytesIO(zf.read(obj['__array__'])),
+                       allow_pickle=False)
+    elif '__tuple__' in obj:
+        return tuple([_decode(v, zf) for v in obj['__tuple__']])
+    elif '__items__' in obj:
+        return dict([(_decode(k, zf), _decode(v, zf))
+                     for k, v in obj['__items__']])
+    elif '__bytes__' in obj:
+        return obj['__bytes__'].encode('latin-1')
+    elif '__pickle__' in obj:
+        return pickle.loads(zf.read(obj['__pickle__']))
+    else:
+        raise Exception('Unrecognized checkpoint object.')
+
+
+def write_checkpoint(outfile, data):
+    """Write an analysis state dictionary to a checkpoint file.
+
+    Parameters
+    ----------
+    outfile : str
+        Path to the output file.
+
+    data : dict
+        Dictionary with the analysis state.  The ``sources``
+        element, if present, must be a dictionary of source data
+        dictionaries keyed by source name.  Each source is written
+        to a separate archive member.
+    """
+
+    data = dict(data)
+    sources = data.pop('sources', {})
+
+    tmpfile = outfile + '.tmp'
+
+    try:
+        with zipfile.ZipFile(tmpfile, 'w', zipfile.ZIP_STORED,
+                             allowZip64=True) as zf:
+
+            src_index = []
+            for i, (name, src) in enumerate(sources.items()):
+                enc = _Encoder('sources/%i' % i)
+                doc = json.dumps(enc.encode(src))
+                member = 'sources/%i.json' % i
+                for k, v in enc.members:
+                    zf.writestr(k, v)
+                zf.writestr(member, doc)
+                src_index += [[name, member]]
+
+            enc = _Encoder('data')
+            index = {'checkpoint_version': CHECKPOINT_VERSION,
+                     'data': enc.encode(data),
+                     'sources': src_index}
+            for k, v in enc.members:
+                zf.writestr(k, v)
+            zf.writestr(INDEX_FILE, json.dumps(index))
+
+        os.rename(tmpfile, outfile)
+    except BaseException:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+
+def load_checkpoint(infile):
+    """Load the full analysis state dictionary from a checkpoint
+    file."""
+    with Checkpoint(infile) as ckpt:
+        return ckpt.load()
+
+
+class Checkpoint(object):
+    """Reader for checkpoint files.  Members of the archive are only
+    read when requested such that the results for individual sources
+    can be extracted without loading the full analysis state.
+
+    Examples
+    --------
+    >>> with Checkpoint('fit0.ckpt') as ckpt:
+    ...     sed = ckpt.get_source('3FGL J2021.0+4031e')['sed']
+    """
+
+    def __init__(self, infile):
+        self._infile = infile
+        self._zf = zipfile.ZipFile(infile, 'r')
+
+        try:
+            index = json.loads(self._zf.read(INDEX_FILE).decode('utf-8'))
+        except KeyError:
+            self._zf.close()
+            raise Exception('Not a checkpoint file: %s' % infile)
+
+        self._version = index['checkpoint_version']
+        self._data = index['data']
+        self._src_members = dict([(k, v) for k, v in index['sources']])
+        self._src_names = [k for k, v in index['sources']]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._zf.close()
+
+    @property
+    def filename(self):
+        return self._infile
+
+    @property
+    def source_names(self):
+        """List of the names of the sources in this checkpoint."""
+        return list(self._src_names)
+
+    def keys(self):
+        """Names of the top-level elements of the analysis state
+        other than ``sources``."""
+        return [k for k, v in self._data['__dict__']]
+
+    def get(self, key):
+        """Load a top-level element of the analysis state (e.g.
+        ``roi`` or ``config``)."""
+        for k, v in self._data['__dict__']:
+            if k == key:
+                return _decode(v, self._zf)
+        raise KeyError(key)
+
+    def get_source(self, name):
+        """Load the data dictionary of a single source."""
+        if name not in self._src_members:
+            raise KeyError(name)
+        doc = self._zf.read(self._src_members[name]).decode('utf-8')
+        return _decode(json.loads(doc), self._zf)
+
+    def get_sources(self, names=None):
+        """Load the data dictionaries of a list of sources.  If
+        ``names`` is None all sources are loaded."""
+        if names is None:
+            names = self._src_names
+        return dict([(name, self.get_source(name)) for name in names])
+
+    def load(self):
+        """Load the full analysis state.  The returned dictionary has
+        the same structure as the one written by
+        `~fermipy.checkpoint.write_checkpoint`."""
+        o = _decode(self._data, self._zf)
+        o['sources'] = self.get_sources()
+        return o
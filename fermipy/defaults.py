@@ -72,6 +72,14 @@ data = {
     'scfile': (None, 'Path to FT2 (spacecraft) file.', str),
     'ltcube': (None, 'Path to livetime cube.  If none a livetime cube will be generated with ``gtmktime``.', str),
     'cacheft1': (True, 'Cache FT1 files when performing binned analysis.  If false then only the counts cube is retained.', bool),
+    'native_binning': (False, 'Select and bin the FT1 data with the numpy engine in `~fermipy.ft1_utils` instead of '
+                       '``gtselect``, ``gtmktime`` and ``gtbin``.  The FT1 files are read once for all components.  '
+                       'Components with a ``filter`` expression that cannot be evaluated natively fall back to the '
+                       'ScienceTools.', bool),
+    'multithread': (False, 'Run the setup of the analysis components in parallel using the number of processes '
+                    'set by the nthread option.  Each component is set up in a separate process and the '
+                    'component logs are written in the order of the components.', bool),
+    'nthread': common['nthread'],
 }
 
 # Options for data selection.
@@ -163,6 +171,11 @@ gtlike = {
     'use_scaled_srcmap': (False, 'Generate source map by scaling an external srcmap file.', bool),
     'wmap': (None, 'Likelihood weights map.', str),
     'llscan_npts': (20, 'Number of evaluation points to use when performing a likelihood scan.', int),
+    'model_counts_threshold': (1E-3, 'Fraction of the model counts of a point source in each energy plane '
+                               'that is neglected in the cache of model-counts maps.  The map of a point '
+                               'source is stored within the smallest box that contains the remaining fraction '
+                               'of its model counts.  Point sources whose footprint covers most of the map are '
+                               'not cached.  A value of zero keeps all pixels with non-zero model counts.', float),
     'src_expscale': (None, 'Dictionary of exposure corrections for individual sources keyed to source name.  The exposure '
                      'for a given source will be scaled by this value.  A value of 1.0 corresponds to the nominal exposure.', dict),
     'expscale': (None, 'Exposure correction that is applied to all sources in the analysis component.  '
@@ -234,6 +247,10 @@ optimizer = {
     'max_iter': (100, 'Maximum number of iterations for the Newtons method fitter.', int),
     'init_lambda': (1E-4, 'Initial value of damping parameter for step size calculation '
                     'when using the NEWTON fitter.  A value of zero disables damping.', float),
+    'newton_engine': ('pylike', 'Set the likelihood engine used by the NEWTON fitter.  '
+                      '``pylike`` uses the FitScanCache of the ScienceTools.  ``numpy`` extracts '
+                      'the counts and model-counts cubes of the free sources and fits them with '
+                      '`~fermipy.likelihood.NormLikelihood`.', str),
     'retries': (3, 'Set the number of times to retry the fit when the fit quality is less than ``min_fit_quality``.', int),
     'min_fit_quality': (2, 'Set the minimum fit quality.', int),
     'verbosity': (0, '', int)
@@ -260,6 +277,24 @@ mc = {
     'seed': (None, '', int)
 }
 
+# MC studies
+mcstudy = {
+    'ntrial': (100, 'Number of simulated realizations of the ROI.', int),
+    'null': (True, 'Generate the realizations from the model without the source of interest '
+             '(null hypothesis).  If False the source is included in the simulated model.', bool),
+    'seed': (None, 'Seed of the random number generator.  If None a seed is drawn from the '
+             'global numpy generator.  The realizations depend only on this seed and '
+             'chunk_size.', int),
+    'chunk_size': (25, 'Number of realizations that are drawn and fit together by each '
+                   'worker task.', int),
+    'loge_bounds': common['loge_bounds'],
+    'write_fits': common['write_fits'],
+    'write_npy': common['write_npy'],
+    'multithread': (False, 'Fit the realizations in parallel using the number of processes '
+                    'set by nthread option.', bool),
+    'nthread': common['nthread'],
+}
+
 # ROI Optimization
 roiopt = {
     'npred_threshold': (1.0, '', float),
@@ -271,7 +306,19 @@ roiopt = {
         (5, 'Maximum number of sources that will be fit simultaneously in '
          'the first optimization step.', int),
     'skip':
-        (None, 'List of str source names to skip while optimizing.', list)
+        (None, 'List of str source names to skip while optimizing.', list),
+    'block_fit':
+        (False, 'Fit the normalizations of the sources in the second '
+         'optimization step simultaneously in blocks of sources with weakly '
+         'overlapping model counts instead of fitting each source '
+         'individually.', bool),
+    'block_overlap':
+        (0.1, 'Maximum correlation of the normalizations of two sources that '
+         'are fit in the same block.', float),
+    'block_max_pass':
+        (10, 'Maximum number of passes over the blocks.  Passes are repeated '
+         'until the log-likelihood changes by less than the optimizer '
+         'tolerance.', int),
 }
 
 roiopt_output = {
@@ -324,6 +371,11 @@ tscube = {
     'remake_test_source': (False, 'If true, recomputes the test source image (otherwise just shifts it)', bool),
     'st_scan_level': (0, 'Level to which to do ST-based fitting (for testing)', int),
     'init_lambda': (0, 'Initial value of damping parameter for newton step size calculation.   A value of zero disables damping.', float),
+    'engine': ('gttscube', 'Fitting engine.  Valid options are gttscube (fit with the ST FitScanner '
+               'including free background components) or numpy (vectorized fit of the test '
+               'source normalization with fixed backgrounds).', str),
+    'multithread': common['multithread'],
+    'nthread': common['nthread'],
 }
 
 # Options for Source Finder
@@ -413,6 +465,9 @@ sed = {
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
     'write_npy': common['write_npy'],
+    'multithread': (False, 'Fit the SED energy bins in parallel using the number of processes '
+                    'set by nthread option.', bool),
+    'nthread': common['nthread'],
 }
 
 # Output for SED analysis
@@ -527,6 +582,13 @@ extension = {
     'fix_shape': common['fix_shape'],
     'free_radius': common['free_radius'],
     'fit_ebin': (False, 'Perform a fit for the angular extension in each analysis energy bin.', bool),
+    'scan_engine': ('pylike', 'Set the likelihood engine used for the scan over spatial extension.  '
+                    '``pylike`` updates the source map of the source and refits the model at each width.  '
+                    '``numpy`` evaluates the model counts of the source for all widths as one stack '
+                    'of templates and fits the free normalizations of all widths in a single '
+                    'vectorized pass with `~fermipy.likelihood.TemplateScan`.  Width templates are '
+                    'cached and reused for later scans at the same position.  ``numpy`` falls back '
+                    'to ``pylike`` when shape parameters are free.', str),
     'update': (False, 'Update this source with the best-fit model for spatial '
                'extension if TS_ext > ``tsext_threshold``.', bool),
     'save_model_map': (False, 'Save model counts cubes for the best-fit model of extension.', bool),
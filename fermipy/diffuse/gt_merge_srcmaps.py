@@ -4,14 +4,17 @@ Merge source maps to build composite sources
 """
 from __future__ import absolute_import, division, print_function
 
-import os
 import sys
+import copy
 
 import argparse
+import xml.etree.cElementTree as ElementTree
 
-import BinnedAnalysis as BinnedAnalysis
-import pyLikelihood as pyLike
+import numpy as np
+from astropy.io import fits
 
+from fermipy import utils
+from fermipy import fits_utils
 from fermipy.jobs.file_archive import FileFlags
 from fermipy.jobs.chain import add_argument, Link
 from fermipy.jobs.scatter_gather import ConfigMaker
@@ -23,6 +26,198 @@ from fermipy.diffuse import defaults as diffuse_defaults
 
 NAME_FACTORY = NameFactory()
 
+SRCMAP_AUX_HDUS = ['EBOUNDS', 'ENERGIES', 'GTI']
+
+
+def eval_xml_spectrum(spectrum_type, pars, energies):
+    """Evaluate the differential flux of a spectral model defined by
+    a set of XML parameters.
+
+    Parameters
+    ----------
+    spectrum_type : str
+        Name of the spectral function (e.g. PowerLaw).
+
+    pars : dict
+        Dictionary of parameter attribute dictionaries as returned by
+        `~fermipy.utils.load_xml_elements`.
+
+    energies : `~numpy.ndarray`
+        Energies in MeV.
+    """
+
+    p = {k: float(v['value']) * float(v.get('scale', 1.0))
+         for k, v in pars.items()}
+    x = np.array(energies, ndmin=1, dtype=float)
+
+    if spectrum_type == 'PowerLaw':
+        return p['Prefactor'] * (x / p['Scale']) ** p['Index']
+    elif spectrum_type == 'PowerLaw2':
+        index1 = p['Index'] + 1.0
+        elo, ehi = p['LowerLimit'], p['UpperLimit']
+        if np.isclose(index1, 0.0):
+            norm = p['Integral'] / np.log(ehi / elo)
+        else:
+            norm = p['Integral'] * index1 / (ehi ** index1 - elo ** index1)
+        return norm * x ** p['Index']
+    elif spectrum_type == 'LogParabola':
+        lx = np.log(x / p['Eb'])
+        return p['norm'] * (x / p['Eb']) ** (-(p['alpha'] + p['beta'] * lx))
+    elif spectrum_type == 'PLSuperExpCutoff':
+        return (p['Prefactor'] * (x / p['Scale']) ** p['Index1'] *
+                np.exp(-(x / p['Cutoff']) ** p['Index2']))
+    elif spectrum_type == 'BrokenPowerLaw':
+        index = np.where(x < p['BreakValue'], p['Index1'], p['Index2'])
+        return p['Prefactor'] * (x / p['BreakValue']) ** index
+    elif spectrum_type == 'ConstantValue':
+        return p['Value'] * np.ones_like(x)
+    else:
+        raise Exception('Unsupported spectral type: %s' % spectrum_type)
+
+
+def read_xml_spectra(xmlfile):
+    """Read the spectral models of all sources in an XML model file.
+
+    Returns
+    -------
+    spectra : list
+        List of (name, spectrum_type, pars, element) tuples in the
+        order they appear in the file.
+    """
+    root = ElementTree.ElementTree(file=xmlfile).getroot()
+    o = []
+    for src in root.findall('source'):
+        spec = utils.load_xml_elements(src, 'spectrum')
+        pars = utils.load_xml_elements(src, 'spectrum/parameter')
+        o += [(src.attrib['name'], spec['type'], pars, src)]
+    return o
+
+
+def get_srcmap_energies(hdulist, nplanes):
+    """Get the energies in MeV at which the planes of a source map
+    file were evaluated."""
+    if 'ENERGIES' in hdulist:
+        hdu = hdulist['ENERGIES']
+        energies = np.array(hdu.data.field(hdu.columns[0].name))
+    else:
+        energies = fits_utils.find_and_read_ebins(hdulist)
+
+    if len(energies) == nplanes:
+        return energies
+    elif len(energies) == nplanes + 1:
+        return np.sqrt(energies[1:] * energies[:-1])
+    raise Exception('Number of source map planes (%i) does not match '
+                    'the energy binning.' % nplanes)
+
+
+def _srcmap_columns(hdu):
+    return [c.name for c in hdu.columns if c.name.upper() != 'PIX']
+
+
+def read_srcmap_plane(hdu, idx):
+    """Read a single energy plane of a source map HDU.  Both image
+    (WCS) and table (HEALPix) source maps are supported."""
+    if isinstance(hdu, fits.BinTableHDU):
+        return hdu.data.field(_srcmap_columns(hdu)[idx])
+    return hdu.data[idx]
+
+
+def get_srcmap_shape(hdu):
+    if isinstance(hdu, fits.BinTableHDU):
+        return (len(_srcmap_columns(hdu)), hdu.header['NAXIS2'])
+    return hdu.data.shape
+
+
+def make_srcmap_hdu(data, template_hdu, name):
+    """Create a source map HDU with the same format as an existing
+    one."""
+    header = template_hdu.header.copy()
+    header['EXTNAME'] = name
+    if isinstance(template_hdu, fits.BinTableHDU):
+        cols = []
+        for c in template_hdu.columns:
+            if c.name.upper() == 'PIX':
+                cols += [fits.Column(c.name, c.format,
+                                     array=template_hdu.data.field(c.name))]
+        for cname, plane in zip(_srcmap_columns(template_hdu), data):
+            cols += [fits.Column(cname, 'E', array=plane)]
+        hdu = fits.BinTableHDU.from_columns(cols, header=header)
+    else:
+        hdu = fits.ImageHDU(data, header=header)
+    hdu.name = name
+    return hdu
+
+
+def merge_srcmaps(hdulist, spectra, dtype=np.float32):
+    """Compute the spectrum-weighted sum of a set of source maps.
+    Source maps are accumulated one energy plane at a time so that
+    only the output cube needs to be held in memory when the input
+    file is memory-mapped.
+
+    Parameters
+    ----------
+    hdulist : `~astropy.io.fits.HDUList`
+        Source map file.
+
+    spectra : list
+        List of (name, spectrum_type, pars) tuples.
+
+    Returns
+    -------
+    data : `~numpy.ndarray`
+        Merged source map.
+
+    merged : list
+        Names of the merged sources.
+
+    missing : list
+        Names of sources without a source map HDU.
+    """
+    data = None
+    energies = None
+    template = None
+    merged, missing = [], []
+
+    for spec in spectra:
+        name, spectrum_type, pars = spec[:3]
+        if name not in hdulist:
+            missing += [name]
+            continue
+
+        hdu = hdulist[name]
+        if data is None:
+            template = hdu
+            shape = get_srcmap_shape(hdu)
+            data = np.zeros(shape, dtype=dtype)
+            energies = get_srcmap_energies(hdulist, shape[0])
+
+        w = eval_xml_spectrum(spectrum_type, pars, energies)
+        for i, wt in enumerate(w):
+            data[i] += wt * read_srcmap_plane(hdu, i)
+        merged += [name]
+
+    return data, template, merged, missing
+
+
+def write_composite_xml(outxml, name, elements):
+    """Write an XML model with a single composite source built from a
+    list of source elements."""
+    root = ElementTree.Element('source_library')
+    root.set('title', 'source_library')
+    src = utils.create_xml_element(root, 'source',
+                                   dict(name=name, type='CompositeSource'))
+    spec = utils.create_xml_element(src, 'spectrum',
+                                    dict(type='ConstantValue'))
+    utils.create_xml_element(spec, 'parameter',
+                             dict(name='Value', value=1.0, scale=1.0,
+                                  min=0.1, max=10.0, free=False))
+    lib = utils.create_xml_element(src, 'source_library', dict(title=name))
+    for el in elements:
+        lib.append(copy.deepcopy(el))
+
+    with open(outxml, 'w') as output_file:
+        output_file.write(utils.prettify_xml(root))
+
 
 class GtMergeSourceMaps(object):
     """Small class to merge source maps for composite sources.
@@ -39,7 +234,11 @@ class GtMergeSourceMaps(object):
                            outfile=diffuse_defaults.gtopts['outfile'],
                            merged=(None, 'Name of merged source', str),
                            outxml=(None, 'Output source model xml file', str),
-                           gzip=(False, 'Compress output file', bool))
+                           gzip=(False, 'Compress output file', bool),
+                           native=(False, 'Merge the source maps with numpy '
+                                   'rather than pyLikelihood', bool),
+                           nthread=(1, 'Number of threads used to compress '
+                                    'the output file', int))
 
     def __init__(self, **kwargs):
         """C'tor
@@ -76,6 +275,46 @@ class GtMergeSourceMaps(object):
     def run(self, argv):
         """Run this analysis"""
         args = self.parser.parse_args(argv)
+        if args.native:
+            self._run_native(args)
+        else:
+            self._run_pylike(args)
+
+    def _run_native(self, args):
+        """Merge the source maps by summing the spectrum-weighted
+        source map planes directly from the input file."""
+        print("Reading xml model from %s" % args.srcmdl)
+        spectra = read_xml_spectra(args.srcmdl)
+
+        hdulist = fits.open(args.srcmaps, memmap=True)
+        data, template, merged, missing = merge_srcmaps(hdulist, spectra)
+        if data is None:
+            raise Exception('No source maps found for sources in %s' %
+                            args.srcmdl)
+
+        print("Merged %i sources into %s" % (len(merged), args.merged))
+        if len(missing) > 0:
+            print("Missed sources: ", missing)
+
+        hdus = [fits.PrimaryHDU(hdulist[0].data, header=hdulist[0].header)]
+        hdus += [make_srcmap_hdu(data, template, args.merged)]
+        hdus += [hdulist[k].copy() for k in SRCMAP_AUX_HDUS if k in hdulist]
+
+        print("Writing output source map file %s" % args.outfile)
+        fits.HDUList(hdus).writeto(args.outfile, clobber=True)
+        hdulist.close()
+        if args.gzip:
+            utils.gzip_file(args.outfile, nthread=args.nthread)
+
+        print("Writing output xml file %s" % args.outxml)
+        write_composite_xml(args.outxml, args.merged,
+                            [s[3] for s in spectra if s[0] in merged])
+
+    def _run_pylike(self, args):
+        """Merge the source maps with pyLikelihood."""
+        import BinnedAnalysis as BinnedAnalysis
+        import pyLikelihood as pyLike
+
         obs = BinnedAnalysis.BinnedObs(irfs=args.irfs,
                                        expCube=args.expcube,
                                        srcMaps=args.srcmaps,
@@ -115,7 +354,7 @@ class GtMergeSourceMaps(object):
         print("Writing output source map file %s" % args.outfile)
         like.logLike.saveSourceMaps(args.outfile, False, False)
         if args.gzip:
-            os.system("gzip -9 %s" % args.outfile)
+            utils.gzip_file(args.outfile, nthread=args.nthread)
 
         print("Writing output xml file %s" % args.outxml)
         like.writeXml(args.outxml)
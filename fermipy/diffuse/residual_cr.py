@@ -7,12 +7,14 @@ from __future__ import absolute_import, division, print_function
 import sys
 import os
 import argparse
+from collections import OrderedDict
 
 import numpy as np
 
-import healpy
+from astropy.io import fits
 
 from fermipy.skymap import HpxMap
+from fermipy.hpx_utils import HPX
 from fermipy import fits_utils
 from fermipy.jobs.job_archive import JobArchive
 from fermipy.jobs.file_archive import FileFlags
@@ -25,7 +27,9 @@ from fermipy.diffuse.gt_split_and_bin import create_sg_split_and_bin
 from fermipy.diffuse.gt_split_and_mktime import create_sg_split_and_mktime
 from fermipy.diffuse.job_library import create_sg_gtexpcube2
 from fermipy.diffuse import defaults as diffuse_defaults
+from fermipy.lazy_import import LazyModule
 
+healpy = LazyModule('healpy')
 
 
 NAME_FACTORY = NameFactory()
@@ -49,8 +53,15 @@ class ResidualCRAnalysis(Link):
                                         float),
                            sigma=(3.0, 'Width of gaussian to smooth output maps [degrees]', float),
                            full_output=(False, 'Include diagnostic output', bool),
+                           dtype=('float32', 'Floating point type of the '
+                                  'intermediate maps', str),
                            clobber=(False, 'Overwrite output file', bool),)
 
+    # Cache of intensity maps keyed on the input files and the HEALPix
+    # order/scheme at which they were computed
+    _intensity_cache = OrderedDict()
+    _intensity_cache_size = 4
+
     def __init__(self, **kwargs):
         """C'tor
         """
@@ -69,6 +80,16 @@ class ResidualCRAnalysis(Link):
                       **kwargs)
 
 
+    @staticmethod
+    def _match_cube(cube, hpx_order, nest):
+        """ Cast a cube to a given HEALPIX order and scheme
+        """
+        if hpx_order != cube.hpx.order:
+            cube = cube.ud_grade(hpx_order, preserve_counts=True)
+        if cube.hpx.nest != nest:
+            cube = cube.swap_scheme()
+        return cube
+
     @staticmethod
     def _match_cubes(ccube_clean, ccube_dirty,
                      bexpcube_clean, bexpcube_dirty,
@@ -77,41 +98,69 @@ class ResidualCRAnalysis(Link):
 
         return a dictionary of cubes with the same HEALPIX scheme and order
         """
-        if hpx_order == ccube_clean.hpx.order:
-            ccube_clean_at_order = ccube_clean
-        else:
-            ccube_clean_at_order = ccube_clean.ud_grade(hpx_order, preserve_counts=True)
-
-        if hpx_order == ccube_dirty.hpx.order:
-            ccube_dirty_at_order = ccube_dirty
-        else:
-            ccube_dirty_at_order = ccube_dirty.ud_grade(hpx_order, preserve_counts=True)
-
-        if hpx_order == bexpcube_clean.hpx.order:
-            bexpcube_clean_at_order = bexpcube_clean
-        else:
-            bexpcube_clean_at_order = bexpcube_clean.ud_grade(hpx_order, preserve_counts=True)
-
-        if hpx_order == bexpcube_dirty.hpx.order:
-            bexpcube_dirty_at_order = bexpcube_dirty
-        else:
-            bexpcube_dirty_at_order = bexpcube_dirty.ud_grade(hpx_order, preserve_counts=True)
-
-        if ccube_dirty_at_order.hpx.nest != ccube_clean.hpx.nest:
-            ccube_dirty_at_order = ccube_dirty_at_order.swap_scheme()
-
-        if bexpcube_clean_at_order.hpx.nest != ccube_clean.hpx.nest:
-            bexpcube_clean_at_order = bexpcube_clean_at_order.swap_scheme()
-
-        if bexpcube_dirty_at_order.hpx.nest != ccube_clean.hpx.nest:
-            bexpcube_dirty_at_order = bexpcube_dirty_at_order.swap_scheme()
-
-        ret_dict = dict(ccube_clean=ccube_clean_at_order,
-                        ccube_dirty=ccube_dirty_at_order,
-                        bexpcube_clean=bexpcube_clean_at_order,
-                        bexpcube_dirty=bexpcube_dirty_at_order)
+        nest = ccube_clean.hpx.nest
+        match = ResidualCRAnalysis._match_cube
+        ret_dict = dict(ccube_clean=match(ccube_clean, hpx_order, nest),
+                        ccube_dirty=match(ccube_dirty, hpx_order, nest),
+                        bexpcube_clean=match(bexpcube_clean, hpx_order, nest),
+                        bexpcube_dirty=match(bexpcube_dirty, hpx_order, nest))
+
+        # Partial-sky cubes are evaluated on the pixels of ccube_clean
+        hpx = ret_dict['ccube_clean'].hpx
+        for k, v in ret_dict.items():
+            ret_dict[k] = ResidualCRAnalysis._match_pixels(v, hpx)
         return ret_dict
 
+    @staticmethod
+    def _match_pixels(cube, hpx):
+        """ Cast a cube to the pixels of another HEALPix geometry
+        """
+        if cube.hpx.is_allsky and hpx.is_allsky:
+            return cube
+        if not cube.hpx.is_allsky and not hpx.is_allsky and \
+                np.array_equal(cube.hpx.ipix, hpx.ipix):
+            return cube
+        return cube.to_hpx(hpx)
+
+    @classmethod
+    def _load_intensity(cls, ccube_file, bexpcube_file, hpx_order=None,
+                        nest=None, dtype=np.float32):
+        """ Read a counts and an exposure cube and compute the intensity map
+        at a given HEALPIX order and scheme.
+
+        Results are cached on the input file names and modification
+        times so that repeated invocations with the same inputs (e.g. the
+        same clean event class for several dirty event classes) only
+        read and process the cubes once.
+        """
+        key = (os.path.abspath(ccube_file), os.path.getmtime(ccube_file),
+               os.path.abspath(bexpcube_file), os.path.getmtime(bexpcube_file),
+               hpx_order, nest, np.dtype(dtype).name)
+        if key in cls._intensity_cache:
+            return cls._intensity_cache[key]
+
+        ccube = HpxMap.create_from_fits(ccube_file, hdu='SKYMAP')
+        bexpcube = HpxMap.create_from_fits(bexpcube_file, hdu='HPXEXPOSURES')
+        if hpx_order is None:
+            hpx_order = ccube.hpx.order
+        if nest is None:
+            nest = ccube.hpx.nest
+
+        ccube = cls._match_cube(ccube, hpx_order, nest)
+        bexpcube = cls._match_pixels(cls._match_cube(bexpcube, hpx_order, nest),
+                                     ccube.hpx)
+
+        data = np.empty(ccube.data.shape, dtype=dtype)
+        np.multiply(bexpcube.data[0:-1], bexpcube.data[1:], out=data)
+        np.sqrt(data, out=data)
+        np.divide(ccube.data, data, out=data)
+        intensity = HpxMap(data, ccube.hpx)
+
+        cls._intensity_cache[key] = intensity
+        while len(cls._intensity_cache) > cls._intensity_cache_size:
+            cls._intensity_cache.popitem(last=False)
+        return intensity
+
     @staticmethod
     def _compute_intensity(ccube, bexpcube):
         """ Compute the intensity map
@@ -216,6 +265,10 @@ class ResidualCRAnalysis(Link):
     def _smooth_hpx_map(hpx_map, sigma):
         """ Smooth a healpix map using a Gaussian
         """
+        hpx_in = hpx_map.hpx
+        if not hpx_in.is_allsky:
+            # Spherical harmonic transforms require a full-sky map
+            hpx_map = hpx_map.to_allsky(hpx_map.data.mean(-1)[:, np.newaxis])
         if hpx_map.hpx.ordering == "NESTED":
             ring_map = hpx_map.swap_scheme()
         else:
@@ -230,9 +283,104 @@ class ResidualCRAnalysis(Link):
         smoothed_data.clip(0., 1e99)
         smoothed_ring_map = HpxMap(smoothed_data, ring_map.hpx)
         if hpx_map.hpx.ordering == "NESTED":
-            return smoothed_ring_map.swap_scheme()
+            smoothed_map = smoothed_ring_map.swap_scheme()
         else:
-            return smoothed_ring_map
+            smoothed_map = smoothed_ring_map
+        if not hpx_in.is_allsky:
+            smoothed_map = smoothed_map.to_hpx(hpx_in)
+        return smoothed_map
+
+    @staticmethod
+    def _smooth_hpx_data(data, nside, nest, sigma, ipix=None):
+        """ Smooth all the planes of a healpix cube using a Gaussian
+
+        The spherical harmonic transforms of all the energy planes are
+        computed together and the beam window function is only
+        evaluated once.  The input array is overwritten.  Partial-sky
+        cubes (with pixels ``ipix``) are smoothed after filling the
+        rest of the sky with the mean of each plane.
+        """
+        if ipix is not None:
+            allsky = np.empty((data.shape[0], 12 * nside * nside))
+            allsky[...] = data.mean(1)[:, np.newaxis]
+            allsky[:, ipix] = data
+            ResidualCRAnalysis._smooth_hpx_data(allsky, nside, nest, sigma)
+            data[...] = allsky[:, ipix]
+            return data
+
+        npix = data.shape[-1]
+        if nest:
+            data[...] = data[:, healpy.ring2nest(nside, np.arange(npix))]
+
+        lmax = 3 * nside - 1
+        alms = healpy.map2alm(data.astype(np.float64), lmax=lmax, pol=False)
+        alms = np.array(alms, ndmin=2)
+        beam = healpy.gauss_beam(np.radians(sigma) * np.sqrt(8. * np.log(2.)),
+                                 lmax=lmax)
+        for alm in alms:
+            healpy.almxfl(alm, beam, inplace=True)
+        data[...] = healpy.alm2map(list(alms), nside, lmax=lmax, pol=False,
+                                   verbose=False)
+
+        if nest:
+            data[...] = data[:, healpy.nest2ring(nside, np.arange(npix))]
+        return data
+
+    @staticmethod
+    def _compute_resid_model(intensity_clean, intensity_dirty,
+                             select_factor, mask_factor, sigma, gamma=-2.0):
+        """ Compute the smoothed differential residual intensity model
+
+        This performs the same sequence of operations as the individual
+        map methods (mean, ratio, bright pixel mask, Aeff correction,
+        masked filling, smoothing and conversion to differential
+        quantities) but works in-place on a single preallocated buffer
+        of the same type as the input maps.
+        """
+        hpx = intensity_clean.hpx
+        clean = intensity_clean.data
+        dirty = ResidualCRAnalysis._match_pixels(intensity_dirty, hpx).data
+        buf = np.empty_like(dirty)
+
+        # Bright pixel selection from the mean intensity
+        np.add(dirty, clean, out=buf)
+        buf *= 0.5
+        sum_intensity = buf.sum(0)
+        mean_intensity = sum_intensity.mean()
+        select = sum_intensity > (select_factor * mean_intensity)
+        mask = sum_intensity > (mask_factor * mean_intensity)
+
+        # Aeff correction from the ratio in the selected pixels
+        clean_sel = clean[:, select]
+        dirty_sel = dirty[:, select]
+        ratio = np.zeros(clean_sel.shape, dtype=buf.dtype)
+        np.divide(dirty_sel, clean_sel, out=ratio, where=clean_sel > 0)
+        aeff_corrections = 1. / ratio.mean(1)
+        print("Aeff correction: ", aeff_corrections)
+
+        # Corrected residual, masked pixels filled with the mean
+        np.multiply(dirty, aeff_corrections[:, np.newaxis].astype(buf.dtype),
+                    out=buf)
+        buf -= clean
+        buf[:, mask] = buf[:, ~mask].mean(1)[:, np.newaxis]
+
+        ResidualCRAnalysis._smooth_hpx_data(buf, hpx.nside, hpx.nest, sigma,
+                                            hpx.ipix)
+
+        # Integral to differential conversion
+        nebins = buf.shape[0]
+        ebins = hpx.ebins
+        ratio = ebins[1:] / ebins[0:-1]
+        half_log_ratio = np.log(ratio) / 2.
+        ratio_gamma = np.power(ratio, gamma)
+        diff_map = np.empty((nebins + 1, buf.shape[1]), dtype=buf.dtype)
+        np.divide(buf[0], (ebins[0] + ratio_gamma[0] * ebins[1]) *
+                  half_log_ratio[0], out=diff_map[0])
+        for i in range(nebins):
+            np.divide(buf[i], ebins[i + 1] * half_log_ratio[i],
+                      out=diff_map[i + 1])
+            diff_map[i + 1] -= diff_map[i] / ratio[i]
+        return HpxMap(diff_map, hpx)
 
     @staticmethod
     def _intergral_to_differential(hpx_map, gamma=-2.0):
@@ -272,6 +420,34 @@ class ResidualCRAnalysis(Link):
         """Run this analysis"""
         args = self._parser.parse_args(argv)
 
+        if not args.full_output:
+            # Fused pipeline working on cached intensity maps
+            hpx_clean = HPX.create_from_header(fits.getheader(args.ccube_clean,
+                                                              'SKYMAP'))
+            if args.hpx_order:
+                hpx_order = args.hpx_order
+            else:
+                hpx_order = HPX.create_from_header(
+                    fits.getheader(args.ccube_dirty, 'SKYMAP')).order
+
+            intensity_clean = self._load_intensity(args.ccube_clean,
+                                                   args.bexpcube_clean,
+                                                   hpx_order, hpx_clean.nest,
+                                                   dtype=args.dtype)
+            intensity_dirty = self._load_intensity(args.ccube_dirty,
+                                                   args.bexpcube_dirty,
+                                                   hpx_order, hpx_clean.nest,
+                                                   dtype=args.dtype)
+            out_model = self._compute_resid_model(intensity_clean,
+                                                  intensity_dirty,
+                                                  args.select_factor,
+                                                  args.mask_factor,
+                                                  args.sigma)
+            out_energies = intensity_dirty.hpx.make_energies_hdu()
+            fits_utils.write_maps(None, dict(SKYMAP=out_model),
+                                  args.outfile, energy_hdu=out_energies)
+            return
+
         # Read the input maps
         ccube_dirty = HpxMap.create_from_fits(args.ccube_dirty, hdu='SKYMAP')
         bexpcube_dirty = HpxMap.create_from_fits(args.bexpcube_dirty, hdu='HPXEXPOSURES')
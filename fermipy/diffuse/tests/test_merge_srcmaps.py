@@ -0,0 +1,70 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+
+import gzip
+
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+
+from fermipy import utils
+from fermipy.diffuse.gt_merge_srcmaps import eval_xml_spectrum, merge_srcmaps
+
+
+def make_pars(**kwargs):
+    return {k: {'name': k, 'value': str(v), 'scale': '1.0'}
+            for k, v in kwargs.items()}
+
+
+def test_eval_xml_spectrum():
+    energies = np.array([100., 1000., 10000.])
+
+    pars = make_pars(Prefactor=1E-12, Index=-2.0, Scale=1000.)
+    assert_allclose(eval_xml_spectrum('PowerLaw', pars, energies),
+                    1E-12 * (energies / 1000.) ** -2.0)
+
+    pars = make_pars(norm=1E-12, alpha=2.0, beta=0.5, Eb=1000.)
+    lx = np.log(energies / 1000.)
+    assert_allclose(eval_xml_spectrum('LogParabola', pars, energies),
+                    1E-12 * (energies / 1000.) ** (-(2.0 + 0.5 * lx)))
+
+    pars = make_pars(Integral=1E-8, Index=-2.0, LowerLimit=100.,
+                     UpperLimit=1E5)
+    dnde = eval_xml_spectrum('PowerLaw2', pars, np.logspace(2, 5, 2001))
+    flux = np.trapz(dnde, np.logspace(2, 5, 2001))
+    assert_allclose(flux, 1E-8, rtol=1E-3)
+
+
+def test_merge_srcmaps():
+    energies = np.array([100., 1000., 10000.])
+    rng = np.random.RandomState(1)
+    maps = [rng.uniform(size=(3, 5, 5)) for i in range(2)]
+    hdus = [fits.PrimaryHDU(np.zeros((2, 5, 5))),
+            fits.ImageHDU(maps[0], name='src0'),
+            fits.ImageHDU(maps[1], name='src1'),
+            fits.BinTableHDU.from_columns([fits.Column('Energy', 'D',
+                                                       array=energies)],
+                                          name='ENERGIES')]
+    hdulist = fits.HDUList(hdus)
+
+    spectra = [('src0', 'PowerLaw',
+                make_pars(Prefactor=1E-12, Index=-2.0, Scale=1000.)),
+               ('src1', 'ConstantValue', make_pars(Value=2.0)),
+               ('src2', 'ConstantValue', make_pars(Value=2.0))]
+
+    data, template, merged, missing = merge_srcmaps(hdulist, spectra,
+                                                    dtype=np.float64)
+    w0 = 1E-12 * (energies / 1000.) ** -2.0
+    assert_allclose(data, w0[:, None, None] * maps[0] + 2.0 * maps[1])
+    assert merged == ['src0', 'src1']
+    assert missing == ['src2']
+
+
+def test_gzip_file(tmpdir):
+    infile = str(tmpdir.join('test.dat'))
+    data = np.random.RandomState(0).randint(0, 16, 100000).astype(np.uint8)
+    data.tofile(infile)
+
+    outfile = utils.gzip_file(infile, nthread=4, blocksize=4096)
+    with gzip.open(outfile, 'rb') as f:
+        assert f.read() == data.tobytes()
@@ -0,0 +1,116 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import os
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from fermipy.hpx_utils import HPX
+from fermipy.skymap import HpxMap
+from fermipy.diffuse.residual_cr import ResidualCRAnalysis
+
+
+EBINS = np.logspace(2.0, 4.0, 5)
+
+
+def make_intensity(nside, nest, seed, scale=1.0):
+    """Create an intensity cube with a falling spectrum and a few
+    bright pixels."""
+
+    rs = np.random.RandomState(seed)
+    hpx = HPX.create_hpx(nside, nest, 'GAL', ebins=EBINS)
+    spec = (EBINS[:-1] / EBINS[0])**-1.5
+    data = rs.uniform(1.0, 2.0, (len(spec), hpx.npix)) * spec[:, None]
+    data[:, ::37] *= 30.0
+    return HpxMap(scale * data, hpx)
+
+
+def compute_resid_model_chained(intensity_clean, intensity_dirty,
+                                select_factor, mask_factor, sigma):
+    """Reference implementation with the chained map operations of
+    the diagnostic path of ResidualCRAnalysis.run_analysis."""
+
+    rc = ResidualCRAnalysis
+    intensity_mean = rc._compute_mean(intensity_dirty, intensity_clean)
+    intensity_ratio = rc._compute_ratio(intensity_dirty, intensity_clean)
+    select = rc._make_bright_pixel_mask(intensity_mean, select_factor)
+    mask = rc._make_bright_pixel_mask(intensity_mean, mask_factor)
+    aeff_corrections = rc._get_aeff_corrections(intensity_ratio, select)
+    corrected_dirty = rc._apply_aeff_corrections(intensity_dirty,
+                                                 aeff_corrections)
+    intensity_resid = rc._compute_diff(corrected_dirty, intensity_clean)
+    filled_resid = rc._fill_masked_intensity_resid(intensity_resid, mask)
+    smooth_resid = rc._smooth_hpx_map(filled_resid, sigma)
+    return rc._intergral_to_differential(smooth_resid)
+
+
+def test_residual_cr_resid_model():
+
+    for nest in [False, True]:
+        intensity_clean = make_intensity(8, nest, 1)
+        intensity_dirty = make_intensity(8, nest, 2, scale=1.2)
+
+        m0 = compute_resid_model_chained(intensity_clean, intensity_dirty,
+                                         3.0, 2.0, 10.0)
+        m1 = ResidualCRAnalysis._compute_resid_model(intensity_clean,
+                                                     intensity_dirty,
+                                                     3.0, 2.0, 10.0)
+        assert m1.data.shape == m0.data.shape
+        assert_allclose(m1.data, m0.data, rtol=1E-6,
+                        atol=1E-8 * np.max(np.abs(m0.data)))
+
+
+def write_cubes(path, counts, exposure):
+    """Write counts and exposure cubes in the format of gtbin and
+    gtexpcube2."""
+
+    hpx = counts.hpx
+    ccube_file = str(path.join('ccube.fits'))
+    bexpcube_file = str(path.join('bexpcube.fits'))
+    fits.HDUList([fits.PrimaryHDU(),
+                  hpx.make_hdu(counts.data, extname='SKYMAP'),
+                  hpx.make_energy_bounds_hdu()]).writeto(ccube_file)
+    hdu_energies = fits.BinTableHDU.from_columns(
+        [fits.Column('ENERGY', '1E', unit='MeV', array=EBINS)],
+        name='ENERGIES')
+    fits.HDUList([fits.PrimaryHDU(),
+                  hpx.make_hdu(exposure, extname='HPXEXPOSURES'),
+                  hdu_energies]).writeto(bexpcube_file)
+    return ccube_file, bexpcube_file
+
+
+def test_residual_cr_intensity_cache(tmpdir):
+
+    counts = make_intensity(4, False, 3)
+    exposure = np.linspace(1.0, 2.0, len(EBINS))[:, None] * \
+        np.ones((1, counts.hpx.npix)) * 1E10
+    ccube_file, bexpcube_file = write_cubes(tmpdir, counts, exposure)
+
+    ResidualCRAnalysis._intensity_cache.clear()
+    args = (ccube_file, bexpcube_file, counts.hpx.order, False)
+    intensity0 = ResidualCRAnalysis._load_intensity(*args,
+                                                    dtype=np.float64)
+    intensity1 = ResidualCRAnalysis._load_intensity(*args,
+                                                    dtype=np.float64)
+    assert intensity1 is intensity0
+
+    # Compare with a fresh computation
+    ResidualCRAnalysis._intensity_cache.clear()
+    intensity2 = ResidualCRAnalysis._load_intensity(*args,
+                                                    dtype=np.float64)
+    assert intensity2 is not intensity0
+    assert_allclose(intensity0.data, intensity2.data)
+
+    ccube = HpxMap.create_from_fits(ccube_file, hdu='SKYMAP')
+    bexpcube = HpxMap.create_from_fits(bexpcube_file, hdu='HPXEXPOSURES')
+    intensity3 = ResidualCRAnalysis._compute_intensity(ccube, bexpcube)
+    assert_allclose(intensity0.data, intensity3.data, rtol=1E-6)
+
+    # Modified input files are not served from the cache
+    os.remove(ccube_file)
+    os.remove(bexpcube_file)
+    write_cubes(tmpdir, counts, 2.0 * exposure)
+    t = os.path.getmtime(ccube_file) + 10.0
+    os.utime(ccube_file, (t, t))
+    intensity4 = ResidualCRAnalysis._load_intensity(*args,
+                                                    dtype=np.float64)
+    assert_allclose(intensity4.data, 0.5 * intensity2.data, rtol=1E-6)
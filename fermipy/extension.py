@@ -13,11 +13,13 @@ import fermipy.config
 from fermipy import utils
 from fermipy import defaults
 from fermipy.config import ConfigSchema
-from fermipy.gtutils import SourceMapState, FreeParameterState
+from fermipy.likelihood import LikelihoodComponent, TemplateScan
 from fermipy.timing import Timer
 from fermipy.data_struct import MutableNamedTuple
 from fermipy import fits_utils
-from LikelihoodState import LikelihoodState
+from fermipy.lazy_import import LazyModule
+
+gtutils = LazyModule('fermipy.gtutils')
 
 
 class ExtensionFit(object):
@@ -69,14 +71,14 @@ class ExtensionFit(object):
 
         self.logger.info('Running extension fit for %s', name)
 
-        free_state = FreeParameterState(self)
+        free_state = gtutils.FreeParameterState(self)
         ext = self._extension(name, **config)
         free_state.restore()
 
         self.logger.info('Finished extension fit.')
 
         if config['make_plots']:
-            self._plotter.make_extension_plots(ext, self.roi,
+            self.plotter.make_extension_plots(ext, self.roi,
                                                prefix=config['prefix'])
 
         outfile = config.get('outfile', None)
@@ -110,6 +112,7 @@ class ExtensionFit(object):
         make_tsmap = kwargs.get('make_tsmap', False)
         update = kwargs['update']
         sqrt_ts_threshold = kwargs['sqrt_ts_threshold']
+        scan_engine = kwargs.get('scan_engine', 'pylike')
 
         if kwargs['psf_scale_fn']:
             def psf_scale_fn(t): return 1.0 + np.interp(np.log10(t),
@@ -118,7 +121,7 @@ class ExtensionFit(object):
         else:
             psf_scale_fn = None
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
         loglike_init = -self.like()
         self.logger.debug('Initial Model Log-Likelihood: %f', loglike_init)
 
@@ -145,7 +148,7 @@ class ExtensionFit(object):
         src = self.roi.copy_source(name)
 
         # Save likelihood value for baseline fit
-        saved_state_base = LikelihoodState(self.like)
+        saved_state_base = gtutils.LikelihoodState(self.like)
         loglike_base = fit_output['loglike']
         self.logger.debug('Baseline Model Log-Likelihood: %f', loglike_base)
 
@@ -184,12 +187,14 @@ class ExtensionFit(object):
         if kwargs['fit_position']:
             ext_fit = self._fit_extension_full(name,
                                                spatial_model=spatial_model,
-                                               optimizer=kwargs['optimizer'])
+                                               optimizer=kwargs['optimizer'],
+                                               scan_engine=scan_engine)
         else:
             ext_fit = self._fit_extension(name,
                                           spatial_model=spatial_model,
                                           optimizer=kwargs['optimizer'],
-                                          psf_scale_fn=psf_scale_fn)
+                                          psf_scale_fn=psf_scale_fn,
+                                          scan_engine=scan_engine)
 
         o.update(ext_fit)
 
@@ -207,7 +212,8 @@ class ExtensionFit(object):
                                          spatial_model=spatial_model,
                                          width=width,
                                          optimizer=kwargs['optimizer'],
-                                         psf_scale_fn=psf_scale_fn)
+                                         psf_scale_fn=psf_scale_fn,
+                                         scan_engine=scan_engine)
 
         self.set_source_morphology(name, spatial_model=spatial_model,
                                    spatial_pars={'ra': o['ra'], 'dec': o['dec'],
@@ -384,7 +390,9 @@ class ExtensionFit(object):
                                                         optimizer=kwargs[
                                                             'optimizer'],
                                                         psf_scale_fn=psf_scale_fn,
-                                                        reoptimize=False)
+                                                        reoptimize=False,
+                                                        scan_engine=kwargs.get(
+                                                            'scan_engine', 'pylike'))
 
         for i, (logemin, logemax) in enumerate(zip(self.log_energies[:-1],
                                                    self.log_energies[1:])):
@@ -405,9 +413,16 @@ class ExtensionFit(object):
 
     def _scan_extension(self, name, **kwargs):
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
+
+        loglike = None
+        if kwargs.get('scan_engine', 'pylike') == 'numpy':
+            loglike = self._scan_extension_numpy(name, **kwargs)
 
-        if not hasattr(self.components[0].like.logLike, 'setSourceMapImage'):
+        if loglike is not None:
+            pass
+        elif not hasattr(self.components[0].like.logLike,
+                         'setSourceMapImage'):
             loglike = self._scan_extension_pylike(name, **kwargs)
         else:
             loglike = self._scan_extension_fast(name, **kwargs)
@@ -418,7 +433,7 @@ class ExtensionFit(object):
 
     def _scan_extension_fast(self, name, **kwargs):
 
-        state = SourceMapState(self.like, [name])
+        state = gtutils.SourceMapState(self.like, [name])
 
         self.free_norm(name)
 
@@ -453,7 +468,12 @@ class ExtensionFit(object):
 
     def _scan_extension_fast_ebin(self, name, **kwargs):
 
-        state = SourceMapState(self.like, [name])
+        if kwargs.get('scan_engine', 'pylike') == 'numpy':
+            loglike = self._scan_extension_numpy(name, ebin=True, **kwargs)
+            if loglike is not None:
+                return loglike
+
+        state = gtutils.SourceMapState(self.like, [name])
 
         self.free_norm(name)
         optimizer = kwargs.get('optimizer', {})
@@ -489,6 +509,150 @@ class ExtensionFit(object):
         state.restore()
         return loglike
 
+    def _scan_extension_numpy(self, name, ebin=False, **kwargs):
+        """Scan the likelihood versus the spatial width of a source
+        with the numpy likelihood engine.  The model counts of the
+        source for all widths are computed as one stack of templates
+        and the likelihood of all widths (and energy bins if ``ebin``
+        is True) is evaluated in a single vectorized pass without
+        updating the source map of the pyLikelihood model.  The
+        templates are integrated over energy with
+        `~fermipy.srcmap_utils.integrate_srcmap`, which uses the same
+        log-log quadrature as the model counts of pyLikelihood.
+        Returns None if the model has free shape parameters or priors
+        that this engine does not support."""
+
+        optimizer = kwargs.get('optimizer', {})
+        width = kwargs.get('width')
+        spatial_model = kwargs.get('spatial_model')
+        skydir = kwargs.get('skydir', self.roi[name].skydir)
+        psf_scale_fn = kwargs.get('psf_scale_fn', None)
+        reoptimize = kwargs.get('reoptimize', True)
+
+        if any([c.projtype != 'WCS' for c in self.components]):
+            return None
+
+        # The free parameters are changed by free_norm and restored
+        # on every return path including the fallbacks to pylike
+        free_state = gtutils.FreeParameterState(self)
+        try:
+            self.free_norm(name)
+            params = self.get_params()
+            free_params = [p for p in params if p['free']]
+            if not all([p['is_norm'] for p in free_params]):
+                self.logger.debug('Free shape parameters in model.  '
+                                  'Using pylike engine for extension scan.')
+                return None
+
+            prior_vals, prior_errs, has_prior = gtutils.get_priors(self.like)
+            if np.any(has_prior[[p['idx'] for p in free_params]]):
+                self.logger.debug('Priors on free parameters in model.  '
+                                  'Using pylike engine for extension scan.')
+                return None
+
+            # Shared normalizations followed by the normalization of the
+            # scanned source
+            pars = ([p for p in free_params if p['src_name'] != name] +
+                    [p for p in free_params if p['src_name'] == name])
+            names = [p['src_name'] for p in pars[:-1]]
+            src = self.roi.copy_source(name)
+
+            # The first alternative is the current model of the source
+            # which is used to match the likelihood offset of
+            # pyLikelihood
+            width = np.array(width, ndmin=1)
+            nalt = len(width) + 1
+            components = []
+
+            for p in pars:
+                bounds = utils.update_bounds(1.0, (p['min'], p['max']))
+                self.like[p['idx']].setBounds(*bounds)
+                self.like[p['idx']] = 1.0
+            self.like.syncSrcParams()
+
+            try:
+                for c in self.components:
+
+                    counts = c.counts_map().data
+                    templates = [c.model_counts_map(t).data for t in names]
+                    ref = c.model_counts_map(name).data
+                    if len(names) + 1 < len(self.roi.sources):
+                        bkg = c.model_counts_map(exclude=names + [name]).data
+                    else:
+                        bkg = None
+
+                    srcmaps = c._create_width_srcmaps(
+                        name, src, spatial_model, width, skydir=skydir,
+                        psf_scale_fn=psf_scale_fn)
+                    alt = [ref] + [c._srcmap_to_model_counts(name, k)
+                                   for k in srcmaps]
+
+                    weights = c._get_likelihood_weights(counts.shape)
+                    components += [LikelihoodComponent(counts, templates + alt,
+                                                       bkg, weights,
+                                                       sparse_threshold=0.0)]
+            finally:
+                for p in pars:
+                    self.like[p['idx']] = p['value']
+                    self.like[p['idx']].setBounds(p['min'], p['max'])
+                self.like.syncSrcParams()
+
+            scan = TemplateScan(components, nalt,
+                                norms=[p['value'] for p in pars],
+                                bounds=[[p['min'], p['max']] for p in pars])
+
+            fit_kw = dict(tol=optimizer.get('tol', 1E-3),
+                          max_iter=optimizer.get('max_iter', 100),
+                          init_lambda=optimizer.get('init_lambda', 1E-4))
+
+            def set_energy_bins(logemin, logemax):
+                for c, lc in zip(self.components, components):
+                    imin = int(utils.val_to_edge(c.log_energies, logemin)[0])
+                    imax = int(utils.val_to_edge(c.log_energies, logemax)[0])
+                    lc.set_energy_bins(imin, imax)
+
+            def eval_loglike():
+                lnl0 = scan.loglike()
+                if reoptimize:
+                    lnl = scan.fit(**fit_kw)['loglike']
+                else:
+                    lnl = lnl0
+                return lnl[1:] + (-self.like() - lnl0[0])
+
+            if not ebin:
+                set_energy_bins(*self.loge_bounds)
+                return eval_loglike()
+
+            loge_bounds = self.loge_bounds
+            loglike = np.zeros((self.enumbins, nalt))
+            offset = np.zeros((self.enumbins, 1))
+            for i, (logemin, logemax) in enumerate(zip(self.log_energies[:-1],
+                                                       self.log_energies[1:])):
+                self.set_energy_range(logemin, logemax)
+                offset[i] = -self.like()
+                if reoptimize:
+                    set_energy_bins(logemin, logemax)
+                    loglike[i] = scan.fit(**fit_kw)['loglike']
+                    offset[i] -= scan.loglike()[0]
+            self.set_energy_range(*loge_bounds)
+
+            if not reoptimize:
+                # Evaluate all energy bins of all widths at once
+                set_energy_bins(self.log_energies[0], self.log_energies[-1])
+                for c, lc, lnl in zip(self.components, components,
+                                      scan.loglike_ebin()):
+                    imin = lc.energy_bins[0]
+                    ectr = utils.edge_to_center(c.log_energies)
+                    ectr = ectr[imin:imin + lnl.shape[0]]
+                    ibin = utils.val_to_bin(self.log_energies, ectr)
+                    m = (ibin >= 0) & (ibin < self.enumbins)
+                    np.add.at(loglike, ibin[m], lnl[m])
+                offset -= loglike[:, :1]
+
+            return (loglike + offset)[:, 1:]
+        finally:
+            free_state.restore()
+
     def _scan_extension_pylike(self, name, **kwargs):
 
         optimizer = kwargs.get('optimizer', {})
@@ -499,6 +663,7 @@ class ExtensionFit(object):
         src = self.roi.copy_source(name)
 
         self._fitcache = None
+        self._norm_like = None
 
         spatial_pars = {'ra': skydir.ra.deg, 'dec': skydir.dec.deg}
 
@@ -526,6 +691,7 @@ class ExtensionFit(object):
         skydir = kwargs.get('skydir', self.roi[name].skydir)
         psf_scale_fn = kwargs.get('psf_scale_fn', None)
         reoptimize = kwargs.get('reoptimize', True)
+        scan_engine = kwargs.get('scan_engine', 'pylike')
 
         src = self.roi.copy_source(name)
 
@@ -541,13 +707,15 @@ class ExtensionFit(object):
                                               optimizer=optimizer,
                                               skydir=skydir,
                                               psf_scale_fn=psf_scale_fn,
-                                              reoptimize=reoptimize)[::-1]
+                                              reoptimize=reoptimize,
+                                              scan_engine=scan_engine)[::-1]
             loglike_hi = self._scan_extension(name, spatial_model=spatial_model,
                                               width=width_hi,
                                               optimizer=optimizer,
                                               skydir=skydir,
                                               psf_scale_fn=psf_scale_fn,
-                                              reoptimize=reoptimize)
+                                              reoptimize=reoptimize,
+                                              scan_engine=scan_engine)
             width = np.concatenate((width_lo, width_hi[1:]))
             loglike = np.concatenate((loglike_lo, loglike_hi[1:]))
         else:
@@ -557,7 +725,8 @@ class ExtensionFit(object):
                                            width=width, optimizer=optimizer,
                                            skydir=skydir,
                                            psf_scale_fn=psf_scale_fn,
-                                           reoptimize=reoptimize)
+                                           reoptimize=reoptimize,
+                                           scan_engine=scan_engine)
 
         ul_data = utils.get_parameter_limits(width, loglike,
                                              bounds=[10**-3.0, 10**0.5])
@@ -584,7 +753,8 @@ class ExtensionFit(object):
                                         width=width2, optimizer=optimizer,
                                         skydir=skydir,
                                         psf_scale_fn=psf_scale_fn,
-                                        reoptimize=reoptimize)
+                                        reoptimize=reoptimize,
+                                        scan_engine=scan_engine)
         ul_data2 = utils.get_parameter_limits(width2, loglike2,
                                               bounds=[10**-3.0, 10**0.5])
 
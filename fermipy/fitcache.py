@@ -1,8 +1,10 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 import numpy as np
-import pyLikelihood as pyLike
 from fermipy import utils
-from fermipy import gtutils
+from fermipy.lazy_import import LazyModule
+
+pyLike = LazyModule('pyLikelihood')
+gtutils = LazyModule('fermipy.gtutils')
 
 
 def get_fitcache_pars(fitcache):
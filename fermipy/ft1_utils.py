@@ -0,0 +1,773 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Selection and binning of LAT photon data (FT1 files) with numpy.  This
+module provides a replacement for the ``gtselect``, ``gtmktime`` and
+``gtbin`` steps of the data preparation.  The ``EVENTS`` tables are read
+once with memory-mapped access and the event cuts are applied as
+vectorized masks.  Selected events can be written to a new FT1 file and
+binned into WCS or HEALPix counts cubes that are equivalent to those
+generated by ``gtbin``.
+"""
+from __future__ import absolute_import, division, print_function
+import re
+import ast
+import copy
+import numpy as np
+from astropy.io import fits
+from fermipy import utils
+from fermipy.hpx_utils import HPX
+
+
+def get_file_list(evfile):
+    """Return the list of FT1 files given either the path to a FITS
+    file or to a text file with one path per line."""
+    if isinstance(evfile, (list, tuple)):
+        return list(evfile)
+    if utils.is_fits_file(evfile):
+        return [evfile]
+    with open(evfile, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def merge_gti(gti):
+    """Compute the union of a set of time intervals.
+
+    Parameters
+    ----------
+    gti : `~numpy.ndarray`
+        Array with shape (N,2) of interval start and stop times.
+
+    Returns
+    -------
+    gti : `~numpy.ndarray`
+        Time-ordered array of disjoint intervals.  Overlapping and
+        adjacent intervals are merged.
+    """
+    gti = np.array(gti, dtype=float, ndmin=2).reshape(-1, 2)
+    gti = gti[gti[:, 1] > gti[:, 0]]
+    if len(gti) == 0:
+        return gti
+
+    gti = gti[np.argsort(gti[:, 0], kind='mergesort')]
+    stop = np.maximum.accumulate(gti[:, 1])
+    new = np.ones(len(gti), dtype=bool)
+    new[1:] = gti[1:, 0] > stop[:-1]
+    idx = np.flatnonzero(new)
+    return np.vstack((gti[idx, 0],
+                      stop[np.append(idx[1:] - 1, len(gti) - 1)])).T
+
+
+def intersect_gti(gti0, gti1):
+    """Compute the intersection of two sets of time intervals."""
+
+    gti0 = merge_gti(gti0)
+    gti1 = merge_gti(gti1)
+    t = np.concatenate((gti0[:, 0], gti0[:, 1], gti1[:, 0], gti1[:, 1]))
+    d = np.concatenate((np.ones(len(gti0)), -np.ones(len(gti0)),
+                        np.ones(len(gti1)), -np.ones(len(gti1))))
+
+    # At equal times interval ends are sorted before interval starts
+    isort = np.lexsort((d, t))
+    t, d = t[isort], d[isort]
+    idx = np.flatnonzero(np.cumsum(d) == 2)
+    gti = np.vstack((t[idx], t[idx + 1])).T
+    return gti[gti[:, 1] > gti[:, 0]]
+
+
+def in_gti(times, gti):
+    """Return a boolean mask that is true for the elements of
+    ``times`` that fall in one of the intervals [start, stop) of a
+    merged set of intervals."""
+
+    times = np.asarray(times)
+    gti = np.array(gti, dtype=float).reshape(-1, 2)
+    if len(gti) == 0:
+        return np.zeros(times.shape, dtype=bool)
+    idx = np.searchsorted(gti[:, 0], times, side='right') - 1
+    return (idx >= 0) & (times < gti[np.clip(idx, 0, None), 1])
+
+
+def _angsep(lon0, lat0, lon1, lat1):
+    cth = utils.separation_cos_angle(np.radians(lon0), np.radians(lat0),
+                                     np.radians(lon1), np.radians(lat1))
+    return np.degrees(np.arccos(np.clip(cth, -1.0, 1.0)))
+
+
+# Functions that may appear in a gtmktime filter expression
+_filter_functions = {'ABS': np.abs,
+                     'SQRT': np.sqrt,
+                     'ANGSEP': _angsep}
+
+_filter_binops = {ast.Add: np.add, ast.Sub: np.subtract,
+                  ast.Mult: np.multiply, ast.Div: np.true_divide,
+                  ast.Pow: np.power, ast.Mod: np.mod}
+
+_filter_cmpops = {ast.Eq: np.equal, ast.NotEq: np.not_equal,
+                  ast.Lt: np.less, ast.LtE: np.less_equal,
+                  ast.Gt: np.greater, ast.GtE: np.greater_equal}
+
+
+def _parse_filter(expr):
+    """Translate a cfitsio row filter into a python expression tree.
+    Raises `ValueError` if the expression uses a construct that is
+    not supported."""
+
+    s = expr.replace('&&', ' and ').replace('||', ' or ')
+    s = re.sub(r'!(?!=)', ' not ', s)
+    s = re.sub(r'(?<![<>!=])=(?!=)', '==', s)
+    try:
+        tree = ast.parse(s.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError('Failed to parse filter expression: %s' % expr)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name) or
+                    node.func.id.upper() not in _filter_functions or
+                    node.keywords):
+                raise ValueError('Unsupported function in filter: %s' % expr)
+        elif isinstance(node, (ast.Expression, ast.BoolOp, ast.And, ast.Or,
+                               ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+                               ast.Compare, ast.BinOp, ast.Name, ast.Load)):
+            continue
+        elif type(node) in _filter_binops or type(node) in _filter_cmpops:
+            continue
+        elif type(node).__name__ in ['Num', 'Constant', 'NameConstant']:
+            continue
+        else:
+            raise ValueError('Unsupported expression in filter: %s' % expr)
+
+    return tree
+
+
+def get_filter_columns(expr):
+    """Return the names of the columns used in a filter expression."""
+    tree = _parse_filter(expr)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id.upper() not in ['T', 'F']:
+            names.add(node.id.upper())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            names.discard(node.func.id.upper())
+    return sorted(names)
+
+
+def is_supported_filter(expr):
+    """Check whether a filter expression can be evaluated with
+    `~fermipy.ft1_utils.eval_filter`."""
+    try:
+        _parse_filter(expr)
+    except ValueError:
+        return False
+    return True
+
+
+def _eval_node(node, columns):
+
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body, columns)
+    elif isinstance(node, ast.BoolOp):
+        fn = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        v = _eval_node(node.values[0], columns)
+        for t in node.values[1:]:
+            v = fn(v, _eval_node(t, columns))
+        return v
+    elif isinstance(node, ast.UnaryOp):
+        v = _eval_node(node.operand, columns)
+        if isinstance(node.op, ast.Not):
+            return np.logical_not(v)
+        elif isinstance(node.op, ast.USub):
+            return np.negative(v)
+        return v
+    elif isinstance(node, ast.Compare):
+        lhs = _eval_node(node.left, columns)
+        v = True
+        for op, t in zip(node.ops, node.comparators):
+            rhs = _eval_node(t, columns)
+            v = np.logical_and(v, _filter_cmpops[type(op)](lhs, rhs))
+            lhs = rhs
+        return v
+    elif isinstance(node, ast.BinOp):
+        return _filter_binops[type(node.op)](_eval_node(node.left, columns),
+                                             _eval_node(node.right, columns))
+    elif isinstance(node, ast.Call):
+        args = [_eval_node(t, columns) for t in node.args]
+        return _filter_functions[node.func.id.upper()](*args)
+    elif isinstance(node, ast.Name):
+        name = node.id.upper()
+        if name in ['T', 'F']:
+            return name == 'T'
+        if name not in columns:
+            raise ValueError('Unknown column in filter: %s' % node.id)
+        return np.asarray(columns[name])
+    return getattr(node, 'value', getattr(node, 'n', None))
+
+
+def eval_filter(expr, columns):
+    """Evaluate a ``gtmktime`` filter expression (e.g. ``DATA_QUAL>0
+    && LAT_CONFIG==1``) on a table of spacecraft data.
+
+    Parameters
+    ----------
+    expr : str
+        Filter expression in the cfitsio row-filter syntax.  Logical
+        and arithmetic operators, comparisons and the functions ABS,
+        SQRT and ANGSEP are supported.
+
+    columns : dict
+        Dictionary or table of column arrays.  Column names are
+        matched case-insensitively.
+
+    Returns
+    -------
+    mask : `~numpy.ndarray`
+        Boolean mask of the rows that pass the filter.
+    """
+    tree = _parse_filter(expr)
+    columns = {k.upper(): columns[k] for k in columns.keys()}
+    nrow = len(columns[list(columns.keys())[0]])
+    v = _eval_node(tree, columns)
+    return np.broadcast_to(np.asarray(v, dtype=bool), (nrow,)).copy()
+
+
+def make_sc_gti(sc, filter=None, roicut=False, skydir=None, radius=None,
+                zmax=None):
+    """Compute the intervals of the spacecraft data that pass the
+    ``gtmktime`` selection.
+
+    Parameters
+    ----------
+    sc : dict
+        Dictionary or table with the columns START and STOP and the
+        columns referenced in ``filter``.  RA_ZENITH and DEC_ZENITH
+        are required when ``roicut`` is true.
+
+    filter : str
+        Filter expression.
+
+    roicut : bool
+        Exclude intervals in which the ROI (a circle of ``radius``
+        around ``skydir``) extends beyond the zenith angle cut
+        ``zmax``.
+
+    Returns
+    -------
+    gti : `~numpy.ndarray`
+        Merged array of good time intervals.
+    """
+
+    m = np.ones(len(sc['START']), dtype=bool)
+    if filter is not None:
+        m &= eval_filter(filter, sc)
+
+    if roicut and zmax is not None:
+        sep = _angsep(np.asarray(sc['RA_ZENITH']),
+                      np.asarray(sc['DEC_ZENITH']),
+                      skydir.icrs.ra.deg, skydir.icrs.dec.deg)
+        m &= (sep + radius) < zmax
+
+    gti = np.vstack((np.asarray(sc['START'])[m],
+                     np.asarray(sc['STOP'])[m])).T
+    return merge_gti(gti)
+
+
+def _bitmask(v, mask):
+    """Evaluate (v & mask) != 0 for an integer column or for a column
+    of bit arrays (FITS X format) with the most significant bit
+    first."""
+
+    v = np.asarray(v)
+    if v.dtype == bool:
+        nbit = v.shape[-1]
+        w = 2**np.arange(nbit - 1, -1, -1, dtype=np.int64)
+        v = np.dot(v, w)
+    return (v.astype(np.int64) & int(mask)) != 0
+
+
+def _make_range_cut(typ, unit, vmin, vmax):
+    return {'type': typ, 'unit': unit, 'value': '%s:%s' % (vmin, vmax),
+            'ref': None}
+
+
+def read_dss_keywords(header):
+    """Read the data subspace (DSS) keywords of a FITS header into a
+    list of dictionaries."""
+
+    cuts = []
+    for i in range(1, int(header.get('NDSKEYS', 0)) + 1):
+        if 'DSTYP%i' % i not in header:
+            continue
+        cuts += [{'type': header['DSTYP%i' % i],
+                  'unit': header.get('DSUNI%i' % i, None),
+                  'value': header.get('DSVAL%i' % i, None),
+                  'ref': header.get('DSREF%i' % i, None)}]
+    return cuts
+
+
+def write_dss_keywords(header, cuts):
+    """Replace the DSS keywords of a FITS header."""
+
+    for i in range(1, int(header.get('NDSKEYS', 0)) + 1):
+        for k in ['DSTYP', 'DSUNI', 'DSVAL', 'DSREF']:
+            header.remove('%s%i' % (k, i), ignore_missing=True)
+
+    header['NDSKEYS'] = len(cuts)
+    for i, c in enumerate(cuts):
+        header['DSTYP%i' % (i + 1)] = c['type']
+        if c['unit'] is not None:
+            header['DSUNI%i' % (i + 1)] = c['unit']
+        header['DSVAL%i' % (i + 1)] = c['value']
+        if c['ref'] is not None:
+            header['DSREF%i' % (i + 1)] = c['ref']
+
+
+def _bitmask_cut_type(cuts, colname, mask):
+
+    irfver = 'P8R2'
+    for c in cuts:
+        m = re.match(r'BIT_MASK\((\w+),(\d+),(\w+)\)', c['type'])
+        if m:
+            irfver = m.group(3)
+    return 'BIT_MASK(%s,%i,%s)' % (colname, mask, irfver)
+
+
+def update_dss_cuts(cuts, new_cuts):
+    """Merge a list of cuts with an existing list of DSS cuts.  Range
+    cuts on the same quantity are replaced by their intersection and
+    other cuts of the same type are replaced."""
+
+    cuts = copy.deepcopy(cuts)
+    for nc in new_cuts:
+
+        ctype = nc['type']
+        m = re.match(r'BIT_MASK\((\w+),', ctype)
+        if m:
+            idx = [i for i, c in enumerate(cuts)
+                   if c['type'].startswith('BIT_MASK(%s,' % m.group(1))]
+        else:
+            idx = [i for i, c in enumerate(cuts) if c['type'] == ctype]
+
+        if not idx:
+            cuts += [nc]
+            continue
+
+        c = cuts[idx[0]]
+        if (c['type'] == ctype and not m and c['value'] is not None and
+                ':' in nc['value'] and ':' in c['value']):
+            lo0, hi0 = c['value'].split(':')
+            lo1, hi1 = nc['value'].split(':')
+            lo = max(float(lo0), float(lo1)) if lo0 else lo1
+            hi = min(float(hi0), float(hi1)) if hi0 else hi1
+            cuts[idx[0]] = dict(nc, value='%s:%s' % (lo, hi))
+        else:
+            cuts[idx[0]] = nc
+
+    return cuts
+
+
+def make_ebounds_hdu(energies, header=None):
+    """Create an EBOUNDS table from an array of energy bin edges in
+    MeV."""
+
+    energies = np.asarray(energies)
+    cols = [fits.Column('CHANNEL', 'I',
+                        array=np.arange(1, len(energies))),
+            fits.Column('E_MIN', '1E', unit='keV',
+                        array=1000. * energies[:-1]),
+            fits.Column('E_MAX', '1E', unit='keV',
+                        array=1000. * energies[1:])]
+    return fits.BinTableHDU.from_columns(cols, header=header, name='EBOUNDS')
+
+
+def make_gti_hdu(gti, header=None):
+    """Create a GTI table from an array of time intervals."""
+
+    gti = np.array(gti, dtype=float).reshape(-1, 2)
+    cols = [fits.Column('START', 'D', unit='s', array=gti[:, 0]),
+            fits.Column('STOP', 'D', unit='s', array=gti[:, 1])]
+    hdu = fits.BinTableHDU.from_columns(cols, header=header, name='GTI')
+    if len(gti):
+        hdu.header['TSTART'] = gti[0, 0]
+        hdu.header['TSTOP'] = gti[-1, 1]
+        hdu.header['ONTIME'] = np.sum(gti[:, 1] - gti[:, 0])
+    return hdu
+
+
+class EventList(object):
+    """In-memory list of LAT events together with the good time
+    intervals and DSS cuts of the observation.  Instances are created
+    with `~fermipy.ft1_utils.EventList.create` and filtered with
+    `~fermipy.ft1_utils.EventList.select`.
+
+    Parameters
+    ----------
+    data : `~astropy.io.fits.FITS_rec`
+        Table with all columns of the FT1 EVENTS table.
+
+    gti : `~numpy.ndarray`
+        Array with shape (N,2) of good time intervals.
+
+    header : `~astropy.io.fits.Header`
+        Header of the EVENTS table.
+
+    cuts : list
+        List of DSS cuts.  If None these are read from ``header``.
+    """
+
+    def __init__(self, data, gti, header, cuts=None):
+        self._data = data
+        self._gti = merge_gti(gti)
+        self._header = header
+        if cuts is None:
+            cuts = read_dss_keywords(header)
+        self._cuts = cuts
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def gti(self):
+        return self._gti
+
+    @property
+    def cuts(self):
+        return self._cuts
+
+    @property
+    def header(self):
+        return self._header
+
+    def field(self, name):
+        return self._data.field(name)
+
+    @classmethod
+    def create(cls, evfile, emin=None, emax=None, skydir=None, radius=None):
+        """Read the events of one or more FT1 files.  The EVENTS
+        tables are accessed with memory mapping and only the rows that
+        pass the energy and radius cuts are copied into memory.  The
+        GTIs of all files are merged.
+
+        Parameters
+        ----------
+        evfile : str or list
+            Path to an FT1 file, to a text file listing FT1 files, or
+            a list of paths.
+
+        emin, emax : float
+            Energy range in MeV.
+
+        skydir : `~astropy.coordinates.SkyCoord`
+            Center of the region.
+
+        radius : float
+            Radius of the region in degrees.
+        """
+
+        files = get_file_list(evfile)
+        data = []
+        gti = []
+        header = None
+        for f in files:
+            with fits.open(f, memmap=True) as hdulist:
+                hdu = hdulist['EVENTS']
+                m = np.ones(hdu.header['NAXIS2'], dtype=bool)
+                if emin is not None:
+                    m &= hdu.data.field('ENERGY') >= emin
+                if emax is not None:
+                    m &= hdu.data.field('ENERGY') <= emax
+                if skydir is not None and radius is not None:
+                    m &= cls._radius_mask(hdu.data, skydir, radius)
+                data += [hdu.data[m]]
+                if header is None:
+                    header = hdu.header.copy()
+                if 'GTI' in hdulist:
+                    tab = hdulist['GTI'].data
+                    gti += [np.vstack((tab.field('START'),
+                                       tab.field('STOP'))).T]
+
+        if len(data) == 1:
+            data = data[0]
+        else:
+            data = cls._concatenate(data)
+        gti = np.concatenate(gti) if gti else np.zeros((0, 2))
+
+        return cls(data, gti, header)
+
+    @staticmethod
+    def _radius_mask(data, skydir, radius):
+        cth = utils.separation_cos_angle(np.radians(data.field('RA')),
+                                         np.radians(data.field('DEC')),
+                                         skydir.icrs.ra.rad,
+                                         skydir.icrs.dec.rad)
+        return cth >= np.cos(np.radians(radius))
+
+    @staticmethod
+    def _concatenate(data):
+        nrow = sum([len(d) for d in data])
+        hdu = fits.BinTableHDU.from_columns(data[0].columns, nrows=nrow)
+        i0 = 0
+        for d in data:
+            for name in d.columns.names:
+                hdu.data.field(name)[i0:i0 + len(d)] = d.field(name)
+            i0 += len(d)
+        return hdu.data
+
+    def select_mask(self, ra=None, dec=None, rad=None, tmin=None, tmax=None,
+                    emin=None, emax=None, zmax=None, evclass=None,
+                    evtype=None, convtype=None, phasemin=None,
+                    phasemax=None):
+        """Compute the mask of events that pass a ``gtselect``
+        selection.  Arguments have the same meaning as the parameters
+        of ``gtselect``.  Cuts set to None are not applied."""
+
+        m = np.ones(len(self._data), dtype=bool)
+        if len(self._data) == 0:
+            return m
+
+        energy = self.field('ENERGY')
+        if emin is not None:
+            m &= energy >= emin
+        if emax is not None:
+            m &= energy <= emax
+
+        time = self.field('TIME')
+        if tmin is not None:
+            m &= time >= tmin
+        if tmax is not None:
+            m &= time <= tmax
+
+        if zmax is not None:
+            m &= self.field('ZENITH_ANGLE') <= zmax
+
+        if evclass is not None:
+            m &= _bitmask(self.field('EVENT_CLASS'), evclass)
+
+        if evtype is not None:
+            m &= _bitmask(self.field('EVENT_TYPE'), evtype)
+
+        if convtype is not None and convtype >= 0:
+            m &= self.field('CONVERSION_TYPE') == convtype
+
+        if ((phasemin is not None and phasemin > 0) or
+                (phasemax is not None and phasemax < 1)):
+            if 'PULSE_PHASE' not in self._data.columns.names:
+                raise Exception('Phase selection requires a PULSE_PHASE '
+                                'column.')
+            phase = self.field('PULSE_PHASE')
+            if phasemin is not None:
+                m &= phase >= phasemin
+            if phasemax is not None:
+                m &= phase <= phasemax
+
+        if None not in [ra, dec, rad]:
+            cth = utils.separation_cos_angle(np.radians(self.field('RA')),
+                                             np.radians(self.field('DEC')),
+                                             np.radians(ra), np.radians(dec))
+            m &= cth >= np.cos(np.radians(rad))
+
+        return m
+
+    def select(self, gti=None, **kwargs):
+        """Create a new event list with the events that pass a
+        ``gtselect`` selection and that fall in the good time
+        intervals ``gti``.  The GTIs and DSS keywords of the new list
+        are updated accordingly.  See
+        `~fermipy.ft1_utils.EventList.select_mask` for the list of
+        cuts."""
+
+        m = self.select_mask(**kwargs)
+
+        tmin = kwargs.get('tmin', None)
+        tmax = kwargs.get('tmax', None)
+        tmin = -np.inf if tmin is None else tmin
+        tmax = np.inf if tmax is None else tmax
+        new_gti = intersect_gti(self._gti, [[tmin, tmax]])
+        if gti is not None:
+            new_gti = intersect_gti(new_gti, gti)
+            m &= in_gti(self.field('TIME'), new_gti)
+
+        return EventList(self._data[m], new_gti, self._header,
+                         update_dss_cuts(self._cuts,
+                                         self._make_cuts(**kwargs)))
+
+    def _make_cuts(self, ra=None, dec=None, rad=None, tmin=None, tmax=None,
+                   emin=None, emax=None, zmax=None, evclass=None,
+                   evtype=None, convtype=None, phasemin=None,
+                   phasemax=None):
+
+        cuts = []
+        if None not in [ra, dec, rad]:
+            cuts += [{'type': 'POS(RA,DEC)', 'unit': 'deg',
+                      'value': 'CIRCLE(%s,%s,%s)' % (ra, dec, rad),
+                      'ref': None}]
+        cuts += [{'type': 'TIME', 'unit': 's', 'value': 'TABLE',
+                  'ref': ':GTI'}]
+        if emin is not None or emax is not None:
+            cuts += [_make_range_cut('ENERGY', 'MeV',
+                                     '' if emin is None else emin,
+                                     '' if emax is None else emax)]
+        if zmax is not None:
+            cuts += [_make_range_cut('ZENITH_ANGLE', 'deg', 0, zmax)]
+        if evclass is not None:
+            cuts += [_make_range_cut(_bitmask_cut_type(self._cuts,
+                                                       'EVENT_CLASS',
+                                                       evclass),
+                                     'DIMENSIONLESS', 1, 1)]
+        if evtype is not None:
+            cuts += [_make_range_cut(_bitmask_cut_type(self._cuts,
+                                                       'EVENT_TYPE', evtype),
+                                     'DIMENSIONLESS', 1, 1)]
+        if convtype is not None and convtype >= 0:
+            cuts += [_make_range_cut('CONVERSION_TYPE', 'dimensionless',
+                                     convtype, convtype)]
+        if ((phasemin is not None and phasemin > 0) or
+                (phasemax is not None and phasemax < 1)):
+            cuts += [_make_range_cut('PULSE_PHASE', 'dimensionless',
+                                     0.0 if phasemin is None else phasemin,
+                                     1.0 if phasemax is None else phasemax)]
+        return cuts
+
+    def get_coords(self, coordsys='CEL'):
+        """Return the longitude and latitude of the events in degrees
+        in the given coordinate system (CEL or GAL)."""
+        if coordsys == 'GAL':
+            return self.field('L'), self.field('B')
+        return self.field('RA'), self.field('DEC')
+
+    def fill_wcs(self, wcs, npix, energies, coordsys='CEL'):
+        """Bin the events into a WCS counts cube.
+
+        Parameters
+        ----------
+        wcs : `~astropy.wcs.WCS`
+            Two-dimensional sky projection.
+
+        npix : int or tuple
+            Number of pixels in each spatial dimension.
+
+        energies : `~numpy.ndarray`
+            Energy bin edges in MeV.
+
+        Returns
+        -------
+        counts : `~numpy.ndarray`
+            Counts cube with shape (nebin, ny, nx).
+        """
+
+        nx, ny = (npix, npix) if np.isscalar(npix) else tuple(npix)
+        ne = len(energies) - 1
+        if len(self._data) == 0:
+            return np.zeros((ne, ny, nx))
+
+        lon, lat = self.get_coords(coordsys)
+        x, y = wcs.wcs_world2pix(lon, lat, 0)
+        ie = np.searchsorted(energies, self.field('ENERGY'), side='right') - 1
+
+        m = np.isfinite(x) & np.isfinite(y)
+        ix = np.floor(x[m] + 0.5).astype(int)
+        iy = np.floor(y[m] + 0.5).astype(int)
+        ie = ie[m]
+        m = ((ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny) &
+             (ie >= 0) & (ie < ne))
+        idx = np.ravel_multi_index((ie[m], iy[m], ix[m]), (ne, ny, nx))
+        counts = np.bincount(idx, minlength=ne * ny * nx)
+        return counts.reshape(ne, ny, nx).astype(float)
+
+    def fill_hpx(self, hpx, energies):
+        """Bin the events into a HEALPix counts cube.
+
+        Parameters
+        ----------
+        hpx : `~fermipy.hpx_utils.HPX`
+            HEALPix geometry.  If the geometry has a region only the
+            pixels inside the region are filled.
+
+        energies : `~numpy.ndarray`
+            Energy bin edges in MeV.
+
+        Returns
+        -------
+        counts : `~numpy.ndarray`
+            Counts cube with shape (nebin, npix).
+        """
+
+        ne = len(energies) - 1
+        if len(self._data) == 0:
+            return np.zeros((ne, hpx.npix))
+
+        lon, lat = self.get_coords(hpx.coordsys)
+        ipix = hpx.get_pixel_indices(lat, lon)
+        ie = np.searchsorted(energies, self.field('ENERGY'), side='right') - 1
+        m = (ie >= 0) & (ie < ne)
+
+        if hpx._ipix is not None:
+            region = np.asarray(hpx._ipix).ravel()
+            isort = np.argsort(region)
+            idx = np.searchsorted(region[isort], ipix)
+            idx = np.clip(idx, 0, len(region) - 1)
+            m &= region[isort][idx] == ipix
+            ipix = isort[idx]
+
+        idx = np.ravel_multi_index((ie[m], ipix[m]), (ne, hpx.npix))
+        counts = np.bincount(idx, minlength=ne * hpx.npix)
+        return counts.reshape(ne, hpx.npix).astype(float)
+
+    def _make_header(self, header=None):
+
+        header = fits.Header() if header is None else header.copy()
+        write_dss_keywords(header, self._cuts)
+        if len(self._gti):
+            header['TSTART'] = self._gti[0, 0]
+            header['TSTOP'] = self._gti[-1, 1]
+        return header
+
+    def write(self, outfile):
+        """Write the events and GTIs to an FT1 file."""
+
+        hdu_events = fits.BinTableHDU(self._data,
+                                      header=self._make_header(self._header),
+                                      name='EVENTS')
+        hdu_gti = make_gti_hdu(self._gti, header=self._make_header())
+        hdulist = fits.HDUList([fits.PrimaryHDU(header=self._make_header()),
+                                hdu_events, hdu_gti])
+        hdulist.writeto(outfile, clobber=True)
+
+    def write_ccube(self, counts, proj, energies, outfile):
+        """Write a counts cube created with
+        `~fermipy.ft1_utils.EventList.fill_wcs` or
+        `~fermipy.ft1_utils.EventList.fill_hpx` in the format of
+        ``gtbin``.
+
+        Parameters
+        ----------
+        counts : `~numpy.ndarray`
+            Counts cube.
+
+        proj : `~astropy.wcs.WCS` or `~fermipy.hpx_utils.HPX`
+            Three-dimensional WCS or HEALPix geometry of the cube.
+
+        energies : `~numpy.ndarray`
+            Energy bin edges in MeV.
+
+        outfile : str
+            Output file path.
+        """
+
+        if isinstance(proj, HPX):
+            hdu = proj.make_hdu(counts.astype(np.float32), extname='SKYMAP')
+            hdu.header.update(self._make_header())
+            hdus = [fits.PrimaryHDU(header=self._make_header()), hdu]
+        else:
+            header = self._make_header()
+            header.update(proj.to_header())
+            hdus = [fits.PrimaryHDU(counts.astype(np.float32),
+                                    header=header)]
+
+        hdus += [make_ebounds_hdu(energies, header=self._make_header()),
+                 make_gti_hdu(self._gti, header=self._make_header())]
+        fits.HDUList(hdus).writeto(outfile, clobber=True)
@@ -9,6 +9,8 @@ import tempfile
 import filecmp
 import time
 import json
+import traceback
+from functools import partial
 import numpy as np
 from astropy.io import fits
 from astropy.table import Table, Column, vstack
@@ -17,10 +19,9 @@ import fermipy.defaults as defaults
 import fermipy.utils as utils
 import fermipy.wcs_utils as wcs_utils
 import fermipy.fits_utils as fits_utils
-import fermipy.gtutils as gtutils
+import fermipy.ft1_utils as ft1_utils
 import fermipy.srcmap_utils as srcmap_utils
 import fermipy.skymap as skymap
-import fermipy.plotting as plotting
 import fermipy.irfs as irfs
 import fermipy.sed as sed
 import fermipy.lightcurve as lightcurve
@@ -28,6 +29,7 @@ from fermipy.residmap import ResidMapGenerator
 from fermipy.tsmap import TSMapGenerator, TSCubeGenerator
 from fermipy.sourcefind import SourceFind
 from fermipy.extension import ExtensionFit
+from fermipy.mcstudy import MCStudy
 from fermipy.utils import merge_dict
 from fermipy.utils import create_hpx_disk_region_string
 from fermipy.utils import resolve_file_path
@@ -35,20 +37,22 @@ from fermipy.skymap import Map, HpxMap
 from fermipy.hpx_utils import HPX
 from fermipy.roi_model import ROIModel
 from fermipy.ltcube import LTCube
-from fermipy.plotting import AnalysisPlotter
 from fermipy.logger import Logger, log_level
 from fermipy.config import ConfigSchema
 from fermipy.timing import Timer
 from fermipy.docstring_utils import DocstringMeta
 from fermipy.fitcache import FitCache
+from fermipy.likelihood import LikelihoodComponent, NormLikelihood
 from fermipy.data_struct import MutableNamedTuple
-# pylikelihood
-import GtApp
-import FluxDensity
-from LikelihoodState import LikelihoodState
-from fermipy.gtutils import BinnedAnalysis, SummedLikelihood
-import BinnedAnalysis as ba
-import pyLikelihood as pyLike
+from fermipy.checkpoint import write_checkpoint
+from fermipy.lazy_import import LazyModule
+
+# The Science Tools are imported on first use
+GtApp = LazyModule('GtApp')
+FluxDensity = LazyModule('FluxDensity')
+ba = LazyModule('BinnedAnalysis')
+pyLike = LazyModule('pyLikelihood')
+gtutils = LazyModule('fermipy.gtutils')
 
 norm_parameters = {
     'ConstantValue': ['Value'],
@@ -93,6 +97,58 @@ index_parameters = {
 }
 
 
+class _RecordHandler(logging.Handler):
+    """Handler that stores the log records of a worker process such
+    that they can be replayed by the logger of the parent process."""
+
+    def __init__(self):
+        super(_RecordHandler, self).__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        # Render the message so that the record can be pickled
+        msg = record.getMessage()
+        if record.exc_info:
+            msg += '\n' + ''.join(traceback.format_exception(*record.exc_info))
+        record.msg, record.args = msg, None
+        record.exc_info, record.exc_text = None, None
+        self.records.append(record)
+
+
+def _setup_component_worker(idx, gta, events, overwrite=False):
+    """Run the setup of a single component.  Returns the log records
+    of the component and the products of the setup or None if the
+    setup failed."""
+
+    c = gta.components[idx]
+    handler = _RecordHandler()
+    c.logger.handlers = [handler]
+
+    # Use a private parameter file directory such that concurrent
+    # instances of the same ScienceTool do not overwrite each other
+    pfiles_orig = os.environ.get('PFILES', None)
+    pfiles = tempfile.mkdtemp(prefix='pfiles_')
+    syspfiles = '' if pfiles_orig is None else pfiles_orig.split(';')[-1]
+    os.environ['PFILES'] = pfiles + ';' + syspfiles
+
+    try:
+        c.setup(overwrite=overwrite,
+                events=events.get(c.name, None))
+        state = c._get_setup_state()
+    except Exception:
+        c.logger.error('Setup failed for component %s.\n%s', c.name,
+                       traceback.format_exc())
+        state = None
+    finally:
+        if pfiles_orig is None:
+            os.environ.pop('PFILES', None)
+        else:
+            os.environ['PFILES'] = pfiles_orig
+        shutil.rmtree(pfiles, ignore_errors=True)
+
+    return handler.records, state
+
+
 def make_scaled_srcmap(roi, srcmap0,
                        bexp_file0, bexproi_file0,
                        bexp_file1, bexproi_file1,
@@ -211,7 +267,7 @@ def filter_dict(d, val):
 
 class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                  ResidMapGenerator, TSMapGenerator, TSCubeGenerator,
-                 SourceFind, ExtensionFit, lightcurve.LightCurve):
+                 SourceFind, ExtensionFit, lightcurve.LightCurve, MCStudy):
     """High-level analysis interface that manages a set of analysis
     component objects.  Most of the functionality of the Fermipy
     package is provided through the methods of this class.  The class
@@ -230,6 +286,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         'residmap': defaults.residmap,
         'lightcurve': defaults.lightcurve,
         'find_sources': defaults.sourcefind,
+        'mcstudy': defaults.mcstudy,
     }
 
     defaults = {'logging': defaults.logging,
@@ -242,6 +299,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                 'ltcube': defaults.ltcube,
                 'gtlike': defaults.gtlike,
                 'mc': defaults.mc,
+                'mcstudy': defaults.mcstudy,
                 'residmap': defaults.residmap,
                 'tsmap': defaults.tsmap,
                 'tscube': defaults.tscube,
@@ -254,6 +312,10 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                 'plotting': defaults.plotting,
                 'components': (None, '', list)}
 
+    # Maximum number of model states for which profile likelihood
+    # points are cached for each source
+    _profile_cache_size = 8
+
     def __init__(self, config, roi=None, **kwargs):
 
         # Setup directories
@@ -314,12 +376,14 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         os.environ['PFILES'] = \
             self.workdir + ';' + os.environ['PFILES'].split(';')[-1]
 
-        # Create Plotter
-        self._plotter = AnalysisPlotter(self.config['plotting'],
-                                        fileio=self.config['fileio'],
-                                        logging=self.config['logging'])
+        # The plotter is created on first use to avoid importing
+        # matplotlib in sessions that do not make plots
+        self._plotter = None
 
         self._like = None
+        self._norm_like = None
+        self._profile_cache = {}
+        self._testsource_cache = collections.OrderedDict()
         self._components = []
         configs = self._create_component_configs()
 
@@ -457,6 +521,11 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
     @property
     def plotter(self):
         """Return the plotter instance."""
+        if self._plotter is None:
+            from fermipy.plotting import AnalysisPlotter
+            self._plotter = AnalysisPlotter(self.config['plotting'],
+                                            fileio=self.config['fileio'],
+                                            logging=self.config['logging'])
         return self._plotter
 
     @property
@@ -592,6 +661,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         if self._fitcache is not None:
             self._fitcache.update_source(name)
+        self._norm_like = None
+        self._profile_cache = {}
 
     def _create_srcmap_cache(self, name, src):
         for c in self.components:
@@ -985,6 +1056,12 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         construct a joint likelihood object.  This function performs
         the following tasks: data selection (gtselect, gtmktime),
         data binning (gtbin), and model generation (gtexpcube2,gtsrcmaps).
+        If the ``data.native_binning`` option is set the data
+        selection and binning are performed with
+        `~fermipy.ft1_utils` and the FT1 files are scanned only once
+        for all components.  If the ``data.multithread`` option is
+        set the components are set up in parallel in separate
+        processes.
 
         Parameters
         ----------
@@ -1015,9 +1092,15 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                 continue
             self.make_template(s)
 
+        # Read the photon data for all components in a single pass
+        events = self._read_events(overwrite=overwrite)
+
         # Run setup for each component
-        for i, c in enumerate(self.components):
-            c.setup(overwrite=overwrite)
+        if self.config['data']['multithread'] and len(self.components) > 1:
+            self._setup_components_parallel(events, overwrite=overwrite)
+        else:
+            for i, c in enumerate(self.components):
+                c.setup(overwrite=overwrite, events=events.get(c.name, None))
 
         # Create likelihood
         self._create_likelihood()
@@ -1039,17 +1122,80 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         self.logger.log(loglevel, 'Finished setup.')
 
+    def _setup_components_parallel(self, events, overwrite=False):
+        """Run the setup of each component in a separate process.  The
+        log records of each component are replayed in the order of
+        the components and the products of the setup (LT cube, PSF
+        model, exposure map) are attached to the components of this
+        process."""
+
+        self.logger.debug('Running setup for %i components in parallel.',
+                          len(self.components))
+
+        results = utils.pool_map(partial(_setup_component_worker,
+                                         overwrite=overwrite),
+                                 range(len(self.components)),
+                                 nthread=self.config['data']['nthread'],
+                                 state=dict(gta=self, events=events),
+                                 chunksize=1)
+
+        failed = []
+        for c, (records, state) in zip(self.components, results):
+            for record in records:
+                c.logger.handle(record)
+            if state is None:
+                failed += [c.name]
+            else:
+                c._set_setup_state(state)
+
+        if failed:
+            raise Exception('Setup failed for components: %s' %
+                            ', '.join(failed))
+
+    def _read_events(self, overwrite=False):
+        """Read the events of the components that use the native
+        data selection.  Components sharing the same FT1 files are
+        served by a single event list that is read with the loosest
+        energy and radius cuts of these components.  Returns a
+        dictionary of event lists keyed by component name."""
+
+        groups = collections.OrderedDict()
+        for c in self.components:
+            if not c._use_native_binning() or not c._need_select_data(overwrite):
+                continue
+            evfile = c.data_files['evfile']
+            if evfile is None:
+                continue
+            groups.setdefault(evfile, []).append(c)
+
+        events = {}
+        for evfile, comps in groups.items():
+            sel = [c.config['selection'] for c in comps]
+            self.logger.debug('Reading events from %s', evfile)
+            evts = ft1_utils.EventList.create(
+                evfile,
+                emin=min([s['emin'] for s in sel]),
+                emax=max([s['emax'] for s in sel]),
+                skydir=self.roi.skydir,
+                radius=max([s['radius'] for s in sel]))
+            for c in comps:
+                events[c.name] = evts
+
+        return events
+
     def _create_likelihood(self, srcmdl=None):
         """Instantiate the likelihood object for each component and
         create a SummedLikelihood."""
 
-        self._like = SummedLikelihood()
+        self._like = gtutils.SummedLikelihood()
         for c in self.components:
             c._create_binned_analysis(srcmdl)
             self._like.addComponent(c.like)
 
         self.like.model = self.like.components[0].model
         self._fitcache = None
+        self._norm_like = None
+        self._profile_cache = {}
         self._init_roi_model()
 
     def _init_roi_model(self):
@@ -1328,6 +1474,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         if self._fitcache is not None:
             self._fitcache.update_source(name)
+        self._norm_like = None
+        self._profile_cache = {}
 
     def add_sources_from_roi(self, names, roi, free=False, **kwargs):
         """Add multiple sources to the current ROI model copied from another ROI model.
@@ -1606,6 +1754,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         for c in self.components:
             c.like[name].src.set_edisp_flag(flag)
 
+        self._profile_cache = {}
+
     def scale_parameter(self, name, par, scale):
 
         idx = self.like.par_index(name, par)
@@ -2013,7 +2163,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         self.set_free_param_vector(self._free_params)
 
     def _latch_state(self):
-        self._saved_state = LikelihoodState(self.like)
+        self._saved_state = gtutils.LikelihoodState(self.like)
         return self._saved_state
 
     def _restore_state(self):
@@ -2095,6 +2245,11 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             Maximum number of sources that will be fit simultaneously
             in the first optimization step.
 
+        block_fit : bool
+            Replace the individual fits of the second optimization
+            step with simultaneous fits of blocks of sources whose
+            model counts do not overlap (see `_optimize_blocks`).
+
         skip : list
             List of str source names to skip while optimizing.
 
@@ -2161,6 +2316,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         self.free_sources(free=False, loglevel=logging.DEBUG)
 
         # Step through remaining sources and re-fit normalizations
+        block_norm_fit = []
         for s in sorted(self.roi.sources, key=lambda t: t['npred'],
                         reverse=True):
 
@@ -2172,6 +2328,10 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                     'Skipping %s with npred %10.3f', s.name, s['npred'])
                 continue
 
+            if config['block_fit']:
+                block_norm_fit.append(s.name)
+                continue
+
             self.logger.debug('Fitting %s npred: %10.3f TS: %10.3f',
                               s.name, s['npred'], s['ts'])
             self.free_norm(s.name, loglevel=logging.DEBUG)
@@ -2180,6 +2340,9 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                               s['npred'], s['ts'])
             self.free_norm(s.name, free=False, loglevel=logging.DEBUG)
 
+        if block_norm_fit:
+            self._optimize_blocks(block_norm_fit, **config)
+
         # Refit spectral shape parameters for sources with TS >
         # shape_ts_threshold
         for s in sorted(self.roi.sources,
@@ -2210,6 +2373,76 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         self.logger.log(loglevel, 'Execution time: %.2f s', timer.elapsed_time)
         return o
 
+    def _optimize_blocks(self, names, **config):
+        """Fit the normalizations of a list of sources with the numpy
+        likelihood engine.  The sources are partitioned into blocks
+        of sources with weakly correlated normalizations (i.e. with
+        model counts that barely overlap).  The normalizations of
+        each block are fit simultaneously with a Newton solve while
+        all other sources are held fixed and the passes over the
+        blocks are repeated until the log-likelihood converges.  All
+        other parameters of the model are held fixed.
+
+        Parameters
+        ----------
+        names : list
+            Source names ordered by decreasing priority.  Sources
+            that come first are assigned to the first blocks.
+        """
+
+        optimizer = config['optimizer']
+        params = copy.deepcopy(self.get_params())
+        for p in params:
+            p['free'] = p['is_norm'] and p['src_name'] in names
+
+        free_norm_params = [p for p in params if p['free']]
+        if not free_norm_params:
+            return
+
+        # The free parameters of the likelihood object are changed by
+        # the block fits so it must not be reused by the fitting methods
+        norm_like = self._create_norm_likelihood(params)
+        self._norm_like = None
+
+        norm_like.norms = [p['value'] for p in free_norm_params]
+        norm_like.bounds = [[p['min'], p['max']] for p in free_norm_params]
+        imin = int(utils.val_to_edge(self.log_energies,
+                                     self.loge_bounds[0])[0])
+        imax = int(utils.val_to_edge(self.log_energies,
+                                     self.loge_bounds[1])[0])
+        norm_like.set_energy_bins(imin, imax)
+
+        src_names = [p['src_name'] for p in free_norm_params]
+        order = sorted(range(len(src_names)),
+                       key=lambda i: names.index(src_names[i]))
+        blocks = norm_like.find_blocks(config['block_overlap'], order)
+
+        self.logger.debug('Fitting %i sources in %i blocks',
+                          len(src_names), len(blocks))
+        fit_output = norm_like.fit_blocks(blocks, tol=optimizer['tol'],
+                                          max_iter=optimizer['max_iter'],
+                                          init_lambda=optimizer['init_lambda'],
+                                          max_pass=config['block_max_pass'])
+        self.logger.debug('Block fit finished after %i passes. '
+                          'Fit Status: %i', fit_output['npass'],
+                          fit_output['fit_status'])
+
+        if fit_output['fit_status'] == 2:
+            self.logger.error('Error in block fit. Fit Status: %i',
+                              fit_output['fit_status'])
+            return
+
+        for p, val, err in zip(free_norm_params, fit_output['values'],
+                               fit_output['errors']):
+            self._set_value_bounded(p['idx'], val)
+            self.like[p['idx']].setError(err)
+        self.like.syncSrcParams()
+
+        for name in src_names:
+            self.update_source(name, reoptimize=optimizer.get('reoptimize',
+                                                              False))
+        self._update_roi()
+
     def profile_norm(self, name, logemin=None, logemax=None, reoptimize=False,
                      xvals=None, npts=None, fix_shape=True, savestate=True,
                      **kwargs):
@@ -2230,7 +2463,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         self.logger.debug('Profiling %s', name)
 
         if savestate:
-            saved_state = LikelihoodState(self.like)
+            saved_state = gtutils.LikelihoodState(self.like)
 
         if fix_shape:
             self.free_sources(False, pars='shape', loglevel=logging.DEBUG)
@@ -2359,32 +2592,30 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                                            cl_limit=0.99)
 
         if not np.isfinite(lims0['ll']) and lims0['x0'] > 1E-6:
-            xvals = np.array([0.0, lims0['x0'],
+            xvals = np.array([0.0, xval0,
                               lims0['x0'] + lims0['err_hi'], lims0['ul']])
         elif not np.isfinite(lims0['ll']) and lims0['x0'] < 1E-6:
             xvals = np.array([0.0, lims0['x0'] + lims0['err_hi'], lims0['ul']])
         else:
-            xvals = np.array([lims0['ll'],
-                              lims0['x0'] - lims0['err_lo'], lims0['x0'],
+            xvals = np.array([0.0, lims0['ll'],
+                              lims0['x0'] - lims0['err_lo'], xval0,
                               lims0['x0'] + lims0['err_hi'], lims0['ul']])
 
+        xvals = np.unique(xvals)
         lnlp1 = self.profile(name, parName, logemin=logemin, logemax=logemax,
                              reoptimize=True, xvals=xvals, **kwargs)
 
-        loglike = copy.deepcopy(lnlp1['loglike'])
         dloglike = copy.deepcopy(lnlp1['dloglike'])
-        dloglike0 = dloglike[-1]
-        xup = xvals[-1]
+        dloglike_ul = utils.onesided_cl_to_dlnl(0.99)
+        iup = np.argmin(np.abs(np.abs(dloglike) - dloglike_ul))
 
+        # Refine the scan only in the vicinity of the upper limit
         for i in range(20):
 
             lims1 = utils.get_parameter_limits(xvals, dloglike,
                                                cl_limit=0.99)
 
-#            print('iter',i,np.abs(np.abs(dloglike0) - utils.onesided_cl_to_dlnl(0.99)),xup)
-#            print(loglike)
-
-            if np.abs(np.abs(dloglike0) - utils.onesided_cl_to_dlnl(0.99)) < 0.1:
+            if np.abs(np.abs(dloglike[iup]) - dloglike_ul) < 0.1:
                 break
 
             if not np.isfinite(lims1['ul']) or np.abs(dloglike[-1]) < 1.0:
@@ -2395,16 +2626,13 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             lnlp = self.profile(name, parName, logemin=logemin,
                                 logemax=logemax,
                                 reoptimize=True, xvals=[xup], **kwargs)
-            dloglike0 = lnlp['dloglike']
-            loglike0 = lnlp['loglike']
 
-            loglike = np.concatenate((loglike, loglike0))
-            dloglike = np.concatenate((dloglike, dloglike0))
-            xvals = np.concatenate((xvals, [xup]))
-            isort = np.argsort(xvals)
-            dloglike = dloglike[isort]
-            loglike = loglike[isort]
-            xvals = xvals[isort]
+            # Drop repeated points so that the scan stays strictly
+            # increasing
+            xvals, iuniq = np.unique(np.concatenate((xvals, [xup])),
+                                     return_index=True)
+            dloglike = np.concatenate((dloglike, lnlp['dloglike']))[iuniq]
+            iup = np.argmin(np.abs(np.abs(dloglike) - dloglike_ul))
 
         if np.isfinite(lims1['ll']):
             xlo = np.concatenate(
@@ -2419,7 +2647,9 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         else:
             xhi = np.linspace(xval0, lims0['ul'], npts + 1 - len(xlo))[1:]
 
-        xvals = np.concatenate((xlo, xhi))
+        # Move the grid onto points that were already evaluated such
+        # that their fits are reused from the profile cache
+        xvals = utils.snap_to_points(np.concatenate((xlo, xhi)), xvals)
         return xvals
 
     def profile(self, name, parName, logemin=None, logemax=None,
@@ -2507,34 +2737,34 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             for c in self.components:
                 c.like.logLike.setUpdateFixedWeights(False)
 
-        for i, x in enumerate(xvals):
+        cache = self._get_profile_cache(name, idx, loge_bounds,
+                                        reoptimize, optimizer)
 
-            self.like[idx] = x
-            if self.like.nFreeParams() > 1 and reoptimize:
-                # Only reoptimize if not all frozen
-                self.like.freeze(idx)
-                fit_output = self._fit(errors=False, **optimizer)
-                loglike1 = fit_output['loglike']
-                self.like.thaw(idx)
-            else:
-                loglike1 = -self.like()
+        # Evaluate the scan points in two sweeps moving away from the
+        # current parameter value such that each fit is initialized
+        # with the solution of the neighbouring point
+        isort = np.argsort(xvals, kind='mergesort')
+        sweeps = [[i for i in isort if xvals[i] >= value],
+                  [i for i in isort[::-1] if xvals[i] < value]]
 
-            flux = self.like[name].flux(10 ** loge_bounds[0],
-                                        10 ** loge_bounds[1])
-            eflux = self.like[name].energyFlux(10 ** loge_bounds[0],
-                                               10 ** loge_bounds[1])
-            prefactor = self.like[idx]
+        if reoptimize:
+            start_state = gtutils.LikelihoodState(self.like)
 
-            o['dloglike'][i] = loglike1 - loglike0
-            o['loglike'][i] = loglike1
-            o['dnde'][i] = prefactor.getTrueValue()
-            o['flux'][i] = flux
-            o['eflux'][i] = eflux
+        for j, sweep in enumerate(sweeps):
 
-            cs = self.model_counts_spectrum(name,
-                                            loge_bounds[0],
-                                            loge_bounds[1], summed=True)
-            o['npred'][i] += np.sum(cs)
+            if j > 0 and reoptimize and len(sweeps[0]):
+                start_state.restore()
+
+            for i in sweep:
+
+                x = float(xvals[i])
+                if x not in cache:
+                    cache[x] = self._profile_point(name, idx, x, loge_bounds,
+                                                   reoptimize, optimizer)
+
+                for k, v in cache[x].items():
+                    o[k][i] = v
+                o['dloglike'][i] = o['loglike'][i] - loglike0
 
         self.like[idx] = value
 
@@ -2554,6 +2784,63 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         return o
 
+    def _profile_point(self, name, idx, x, loge_bounds, reoptimize,
+                       optimizer):
+        """Evaluate the likelihood with parameter ``idx`` set to
+        ``x``."""
+
+        self.like[idx] = x
+        if self.like.nFreeParams() > 1 and reoptimize:
+            # Only reoptimize if not all frozen
+            self.like.freeze(idx)
+            fit_output = self._fit(errors=False, **optimizer)
+            loglike = fit_output['loglike']
+            self.like.thaw(idx)
+        else:
+            loglike = -self.like()
+
+        emin = 10 ** loge_bounds[0]
+        emax = 10 ** loge_bounds[1]
+        cs = self.model_counts_spectrum(name,
+                                        loge_bounds[0],
+                                        loge_bounds[1], summed=True)
+
+        return {'loglike': loglike,
+                'dnde': self.like[idx].getTrueValue(),
+                'flux': self.like[name].flux(emin, emax),
+                'eflux': self.like[name].energyFlux(emin, emax),
+                'npred': np.sum(cs)}
+
+    def _get_profile_cache(self, name, idx, loge_bounds, reoptimize,
+                           optimizer):
+        """Return the dictionary of previously evaluated profile
+        likelihood points of a source for the current model state.
+        Points are keyed by parameter value.  The state is defined by
+        the values, scales and free flags of all other model
+        parameters together with the energy range and fit options such
+        that any change to the model selects a new dictionary."""
+
+        pars = []
+        for i, p in enumerate(self.like.params()):
+            if i == idx:
+                pars += [p.getScale()]
+            else:
+                pars += [p.getValue(), p.getScale(), p.isFree()]
+
+        key = (idx, tuple(loge_bounds), bool(reoptimize), tuple(pars))
+        if reoptimize:
+            key += (json.dumps(optimizer, sort_keys=True, default=str),)
+
+        src_cache = self._profile_cache.setdefault(
+            name, collections.OrderedDict())
+
+        if key not in src_cache:
+            src_cache[key] = {}
+            while len(src_cache) > self._profile_cache_size:
+                src_cache.popitem(last=False)
+
+        return src_cache[key]
+
     def constrain_norms(self, srcNames, cov_scale=1.0):
         """Constrain the normalizations of one or more sources by
         adding gaussian priors with sigma equal to the parameter
@@ -2577,11 +2864,13 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         par = self.like[name].funcs["Spectrum"].params[parName]
         par.addGaussianPrior(mean, sigma)
+        self._profile_cache = {}
 
     def remove_prior(self, name, parName):
 
         par = self.like[name].funcs["Spectrum"].params[parName]
         par.removePrior()
+        self._profile_cache = {}
 
     def remove_priors(self):
         """Clear all priors."""
@@ -2591,6 +2880,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             for par in self.like[src.name].funcs["Spectrum"].params.values():
                 par.removePrior()
 
+        self._profile_cache = {}
+
     def _create_optObject(self, **kwargs):
         """ Make MINUIT or NewMinuit type optimizer object """
 
@@ -2822,7 +3113,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             self.logger.log(loglevel, "Skipping fit.  No free parameters.")
             return o
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
 
         fit_output = self._fit(**config)
         o.update(fit_output)
@@ -2883,6 +3174,11 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
     def _fit_newton(self, fitcache=None, ebin=None, **kwargs):
         """Fast fitting method using newton fitter."""
 
+        engine = kwargs.get('newton_engine',
+                            self.config['optimizer']['newton_engine'])
+        if engine == 'numpy':
+            return self._fit_newton_numpy(ebin=ebin, **kwargs)
+
         tol = kwargs.get('tol', self.config['optimizer']['tol'])
         max_iter = kwargs.get('max_iter',
                               self.config['optimizer']['max_iter'])
@@ -2987,9 +3283,149 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         return o
 
+    def _create_norm_likelihood(self, params):
+        """Create a `~fermipy.likelihood.NormLikelihood` for the free
+        normalization parameters in ``params``.  The object is cached
+        and reused until a parameter other than a free normalization
+        changes or a source map is updated."""
+
+        free_norm_params = [p for p in params if p['free'] and p['is_norm']]
+        key = [(p['idx'], p['free'], p['scale'],
+                None if (p['free'] and p['is_norm']) else p['value'])
+               for p in params]
+
+        if self._norm_like is not None and self._norm_like[0] == key:
+            return self._norm_like[1]
+
+        self.logger.debug('Creating NormLikelihood')
+
+        names = [p['src_name'] for p in free_norm_params]
+
+        # Evaluate the templates for a unit value of each normalization
+        for p in free_norm_params:
+            bounds = utils.update_bounds(1.0, (p['min'], p['max']))
+            self.like[p['idx']].setBounds(*bounds)
+            self.like[p['idx']] = 1.0
+        self.like.syncSrcParams()
+
+        components = []
+        try:
+            for c in self.components:
+                counts = c.counts_map().data
+                templates = [c.model_counts_map(name).data for name in names]
+                if len(names) < len(self.roi.sources):
+                    bkg = c.model_counts_map(exclude=names).data
+                else:
+                    bkg = None
+
+                weights = c._get_likelihood_weights(counts.shape)
+                components += [LikelihoodComponent(counts, templates, bkg,
+                                                   weights)]
+        finally:
+            for p in free_norm_params:
+                self.like[p['idx']] = p['value']
+                self.like[p['idx']].setBounds(p['min'], p['max'])
+            self.like.syncSrcParams()
+
+        norm_like = NormLikelihood(components)
+
+        prior_vals, prior_errs, has_prior = gtutils.get_priors(self.like)
+        idxs = [p['idx'] for p in free_norm_params]
+        if np.any(has_prior[idxs]):
+            norm_like.set_priors(prior_vals[idxs], prior_errs[idxs],
+                                 has_prior[idxs])
+
+        self._norm_like = (key, norm_like)
+        return norm_like
+
+    def _fit_newton_numpy(self, ebin=None, **kwargs):
+        """Newton fit of the free normalizations with the numpy
+        likelihood engine (`~fermipy.likelihood.NormLikelihood`)."""
+
+        tol = kwargs.get('tol', self.config['optimizer']['tol'])
+        max_iter = kwargs.get('max_iter',
+                              self.config['optimizer']['max_iter'])
+        init_lambda = kwargs.get('init_lambda',
+                                 self.config['optimizer']['init_lambda'])
+
+        params = self.get_params()
+        free_params = [p for p in params if p['free']]
+        free_norm_params = [p for p in free_params if p['is_norm'] is True]
+
+        if len(free_params) != len(free_norm_params):
+            msg = 'Executing Newton fitter with one ' + \
+                'or more free shape parameters.'
+            self.logger.error(msg)
+            raise Exception(msg)
+
+        num_free = len(free_norm_params)
+
+        o = {'fit_status': 0,
+             'fit_quality': 3,
+             'fit_success': True,
+             'edm': 0,
+             'loglike': None,
+             'values': np.ones(num_free) * np.nan,
+             'errors': np.ones(num_free) * np.nan,
+             'indices': np.zeros(num_free, dtype=int),
+             'is_norm': np.empty(num_free, dtype=bool),
+             'src_names': num_free * [None],
+             'par_names': num_free * [None],
+             }
+
+        if num_free == 0:
+            return o
+
+        for i, p in enumerate(free_norm_params):
+            o['indices'][i] = p['idx']
+            o['src_names'][i] = p['src_name']
+            o['par_names'][i] = p['par_name']
+            o['is_norm'][i] = p['is_norm']
+
+        norm_like = self._create_norm_likelihood(params)
+        norm_like.norms = [p['value'] for p in free_norm_params]
+        norm_like.bounds = [[p['min'], p['max']] for p in free_norm_params]
+
+        if ebin is not None:
+            norm_like.set_energy_bin(ebin)
+        else:
+            imin = int(utils.val_to_edge(self.log_energies,
+                                         self.loge_bounds[0])[0])
+            imax = int(utils.val_to_edge(self.log_energies,
+                                         self.loge_bounds[1])[0])
+            norm_like.set_energy_bins(imin, imax)
+
+        fit_output = norm_like.fit(tol=tol, max_iter=max_iter,
+                                   init_lambda=init_lambda)
+
+        o['fit_status'] = fit_output['fit_status']
+        o['edm'] = fit_output['edm']
+        o['values'] = fit_output['values']
+        o['errors'] = fit_output['errors']
+        o['covariance'] = fit_output['covariance']
+        errinv = np.zeros_like(o['errors'])
+        m = o['errors'] > 0
+        errinv[m] = 1. / o['errors'][m]
+        o['correlation'] = o['covariance'] * np.outer(errinv, errinv)
+
+        if o['fit_status'] == 0:
+            for idx, val, err in zip(o['indices'], o['values'],
+                                     o['errors']):
+                self._set_value_bounded(idx, val)
+                self.like[idx].setError(err)
+            self.like.syncSrcParams()
+            o['fit_success'] = True
+        else:
+            o['fit_success'] = False
+            self.logger.error('Error in NEWTON fit. Fit Status: %i',
+                              o['fit_status'])
+
+        o['loglike'] = -self.like()
+        return o
+
     def fit_correlation(self):
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
         self.free_sources(False, loglevel=logging.DEBUG)
         self.free_sources(pars='norm', loglevel=logging.DEBUG)
         fit_results = self.fit(loglevel=logging.DEBUG, min_fit_quality=2)
@@ -3031,6 +3467,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             self.update_source(name)
 
         self._fitcache = None
+        self._norm_like = None
+        self._profile_cache = {}
 
         self.logger.info('Finished Loading XML')
 
@@ -3059,7 +3497,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             self._init_roi_model()
         else:
             self.write_xml('tmp')
-            self._like = SummedLikelihood()
+            self._like = gtutils.SummedLikelihood()
             for i, c in enumerate(self._components):
                 c._create_binned_analysis()
                 self._like.addComponent(c.like)
@@ -3079,6 +3517,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         """
 
         self._fitcache = None
+        self._norm_like = None
+        self._profile_cache = {}
 
         if src_dict is None:
             src_dict = {}
@@ -3105,7 +3545,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             self._init_roi_model()
         else:
             self.write_xml('tmp')
-            self._like = SummedLikelihood()
+            self._like = gtutils.SummedLikelihood()
             for i, c in enumerate(self._components):
                 c._create_binned_analysis('tmp.xml')
                 self._like.addComponent(c.like)
@@ -3135,6 +3575,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         self.logger.info('Simulating ROI')
 
         self._fitcache = None
+        self._norm_like = None
+        self._profile_cache = {}
 
         if restore:
             self.logger.info('Restoring')
@@ -3149,7 +3591,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             self._init_roi_model()
         else:
             self.write_xml('tmp')
-            self._like = SummedLikelihood()
+            self._like = gtutils.SummedLikelihood()
             for i, c in enumerate(self._components):
                 c._create_binned_analysis('tmp.xml')
                 self._like.addComponent(c.like)
@@ -3310,6 +3752,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         ----------
 
         infile : str
+            Path to the ROI file.  Files written in numpy, YAML, or
+            checkpoint (``.ckpt``) format are supported.
 
         reload_sources : bool
            Regenerate source maps for non-diffuse sources.
@@ -3403,10 +3847,18 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         save_model_map : bool
             Save the current counts model to a FITS file.
 
+        checkpoint : bool
+            Write the ROI dictionary to a checkpoint file (``.ckpt``)
+            instead of a numpy file.  Array data are stored natively
+            and the results of individual sources can be loaded
+            lazily with `~fermipy.checkpoint.Checkpoint`.  The FITS
+            source catalog file is not written in this mode.
+
         """
         # extract the results in a convenient format
 
         make_plots = kwargs.get('make_plots', False)
+        checkpoint = kwargs.get('checkpoint', False)
 
         if outfile is None:
             pathprefix = os.path.join(self.config['fileio']['workdir'],
@@ -3418,20 +3870,22 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             pathprefix = outfile
 
         pathprefix = utils.strip_suffix(pathprefix,
-                                        ['fits', 'yaml', 'npy'])
+                                        ['fits', 'yaml', 'npy', 'ckpt'])
 #        pathprefix, ext = os.path.splitext(pathprefix)
         prefix = os.path.basename(pathprefix)
 
         xmlfile = pathprefix + '.xml'
         fitsfile = pathprefix + '.fits'
         npyfile = pathprefix + '.npy'
+        ckptfile = pathprefix + '.ckpt'
 
         self.write_xml(xmlfile)
-        self.write_fits(fitsfile)
+        if not checkpoint:
+            self.write_fits(fitsfile)
 
         if not self.config['gtlike']['use_external_srcmap']:
             for c in self.components:
-                c.like.logLike.saveSourceMaps(str(c.files['srcmap']))
+                c.save_source_maps()
 
         if save_model_map:
             self.write_model_map(prefix)
@@ -3450,8 +3904,12 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
             o['roi']['components'][i][
                 'src_expscale'] = copy.deepcopy(c.src_expscale)
 
-        self.logger.info('Writing %s...', npyfile)
-        np.save(npyfile, o)
+        if checkpoint:
+            self.logger.info('Writing %s...', ckptfile)
+            write_checkpoint(ckptfile, o)
+        else:
+            self.logger.info('Writing %s...', npyfile)
+            np.save(npyfile, o)
 
         if make_plots:
             self.make_plots(prefix, None,
@@ -3527,10 +3985,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         if mcube_map is None:
             mcube_map = self.model_counts_map()
 
-        plotter = plotting.AnalysisPlotter(self.config['plotting'],
-                                           fileio=self.config['fileio'],
-                                           logging=self.config['logging'])
-        plotter.run(self, mcube_map, prefix=prefix, **kwargs)
+        self.plotter.run(self, mcube_map, prefix=prefix, **kwargs)
 
     def curvature(self, name, **kwargs):
         """Test whether a source shows spectral curvature by comparing
@@ -3546,7 +4001,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
         name = self.roi.get_source_by_name(name).name
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
         source = self.components[0].like.logLike.getSource(str(name))
 
         old_spectrum = source.spectrum()
@@ -4005,6 +4460,14 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
                     name=('00', '', str),
                     file_suffix=('', '', str))
 
+    # Maximum number of source maps per source that are kept in the
+    # cache of spatial width templates
+    _width_srcmap_cache_size = 64
+
+    # Attributes created by setup that are passed back from the
+    # worker processes when the components are set up in parallel
+    _setup_attrs = ['_ltc', '_tmin', '_tmax', '_psf', '_bexp']
+
     def __init__(self, config, roi, **kwargs):
 
         self._loglevel = kwargs.pop('loglevel', logging.INFO)
@@ -4073,8 +4536,14 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
             else:
                 self._data_files[k] = v
 
+        self._events = None
         self._srcmap_cache = {}
+        self._width_srcmap_cache = {}
+        self._model_counts_cache = None
         self._srcmap = {}
+        # Names of sources whose in-memory source map differs from
+        # the one in the source map file
+        self._srcmaps_dirty = set()
 
         # Fill dictionary of exposure corrections
         self._src_expscale = {}
@@ -4294,11 +4763,13 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         """
 
         src = self.roi.get_source_by_name(name)
+        self._clear_model_counts_cache([name])
 
         if hasattr(self.like.logLike, 'loadSourceMap'):
             self.like.logLike.loadSourceMap(str(name), True, False)
             srcmap_utils.delete_source_map(self.files['srcmap'], name)
             self.like.logLike.saveSourceMaps(str(self.files['srcmap']))
+            self._srcmaps_dirty.discard(name)
             self._scale_srcmap(self._src_expscale, check_header=False,
                                names=[name])
             self.like.logLike.buildFixedModelWts()
@@ -4312,6 +4783,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         """Recompute the source map for a list of sources in the model.
         """
 
+        self._clear_model_counts_cache(names)
         try:
             self.like.logLike.loadSourceMaps(names, True, True)
             # loadSourceMaps doesn't overwrite the header so we need
@@ -4356,6 +4828,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         #    raise Exception(msg)
 
         srcmap_utils.delete_source_map(self.files['srcmap'], name)
+        self._clear_model_counts_cache([name])
 
         src = self.roi[name]
         if self.config['gtlike']['expscale'] is not None and \
@@ -4387,6 +4860,9 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         if save_source_maps and \
                 not self.config['gtlike']['use_external_srcmap']:
             self.like.logLike.saveSourceMaps(str(self.files['srcmap']))
+            self._srcmaps_dirty.discard(name)
+        else:
+            self._srcmaps_dirty.add(name)
 
         self.set_exposure_scale(name)
 
@@ -4457,6 +4933,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         src = self.roi.get_source_by_name(name)
 
         self.logger.debug('Deleting source %s', name)
+        self._clear_model_counts_cache([src.name])
 
         if self.like is not None:
 
@@ -4479,6 +4956,8 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         if delete_source_map:
             srcmap_utils.delete_source_map(self.files['srcmap'], name)
 
+        self._srcmaps_dirty.discard(name)
+
         return src
 
     def set_exposure_scale(self, name, scale=None):
@@ -4508,6 +4987,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         src = self.roi.get_source_by_name(name)
         name = src.name
         self.like[name].src.set_edisp_flag(flag)
+        self._clear_model_counts_cache([name])
 
     def set_energy_range(self, logemin, logemax):
         """Set the energy range of the analysis.
@@ -4538,6 +5018,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         klims = self.like.logLike.klims()
         if imin != klims[0] or imax != klims[1]:
             self.like.selectEbounds(imin, imax)
+            self._clear_model_counts_cache()
 
         return np.array([self.log_energies[imin], self.log_energies[imax]])
 
@@ -4600,9 +5081,9 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
 
         """
         if self.projtype == "WCS":
-            v = pyLike.FloatVector(self.npix ** 2 * self.enumbins)
+            shape = (self.enumbins, self.npix, self.npix)
         elif self.projtype == "HPX":
-            v = pyLike.FloatVector(self._proj.npix * self.enumbins)
+            shape = (self.enumbins, self._proj.npix)
         else:
             raise Exception("Unknown projection type %s", self.projtype)
 
@@ -4614,14 +5095,6 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
             srcs = self.roi.get_sources_by_name(t)
             excluded_names += [s.name for s in srcs]
 
-        if not hasattr(self.like.logLike, 'loadSourceMaps'):
-            # Update fixed model
-            self.like.logLike.buildFixedModelWts()
-            # Populate source map hash
-            self.like.logLike.buildFixedModelWts(True)
-        elif (name is None or name == 'all') and not exclude:
-            self.like.logLike.loadSourceMaps()
-
         src_names = []
         if (name is None) or (name == 'all'):
             src_names = [src.name for src in self.roi.sources]
@@ -4635,32 +5108,95 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         # Remove sources in exclude list
         src_names = [str(t) for t in src_names if t not in excluded_names]
 
-        if len(src_names) == len(self.roi.sources):
-            self.like.logLike.computeModelMap(v)
-        elif not hasattr(self.like.logLike, 'setSourceMapImage'):
-            for s in src_names:
-                model = self.like.logLike.sourceMap(str(s))
-                self.like.logLike.updateModelMap(v, model)
-        else:
-            try:
-                self.like.logLike.computeModelMap(src_names, v)
-            except:
-                vsum = np.zeros(v.size())
-                for s in src_names:
-                    vtmp = pyLike.FloatVector(v.size())
-                    self.like.logLike.computeModelMap(str(s), vtmp)
-                    vsum += vtmp
-                v = pyLike.FloatVector(vsum)
+        if hasattr(self.like.logLike, 'loadSourceMaps') and \
+                (name is None or name == 'all') and not exclude:
+            self.like.logLike.loadSourceMaps()
+
+        uncached = self._update_model_counts_cache(src_names, shape)
+        z = self._model_counts_cache.model_counts([t for t in src_names
+                                                   if t not in uncached])
+        for v in uncached.values():
+            z += v
 
         if self.projtype == "WCS":
-            z = np.array(v).reshape(self.enumbins, self.npix, self.npix)
             return Map(z, copy.deepcopy(self.wcs))
-        elif self.projtype == "HPX":
-            z = np.array(v).reshape(self.enumbins, self._proj.npix)
+        else:
             return HpxMap(z, self.hpx)
+
+    def _get_model_counts_key(self, name):
+        """Return the spectral function type and parameter values of
+        a source.  The cached model counts of a source are recomputed
+        when these change."""
+        spectrum = self.like[name].src.spectrum()
+        pars = pyLike.ParameterVector()
+        spectrum.getParams(pars)
+        return (spectrum.genericName(),) + tuple([p.getTrueValue()
+                                                  for p in pars])
+
+    def _clear_model_counts_cache(self, names=None):
+        """Remove sources from the cache of model-counts maps.  This
+        must be called whenever the source map of a source changes.
+        If ``names`` is None all sources are removed."""
+
+        if self._model_counts_cache is None:
+            return
+        elif names is None:
+            self._model_counts_cache.clear()
         else:
-            raise Exception(
-                "Did not recognize projection type %s", self.projtype)
+            for name in names:
+                self._model_counts_cache.remove(name)
+
+    def _update_model_counts_cache(self, names, shape):
+        """Compute the model-counts maps of the sources in ``names``
+        that are missing from the cache or whose spectral parameters
+        changed since they were cached.  Maps of point sources are
+        stored within their PSF footprint.
+
+        Returns
+        -------
+        uncached : dict
+            Model-counts cubes of the sources in ``names`` whose
+            footprint covers most of the map.  These are not cached
+            and are recomputed on each call.
+        """
+
+        cache = self._model_counts_cache
+        if cache is None or cache.shape != shape:
+            cache = srcmap_utils.ModelCountsCache(
+                shape, self.config['gtlike']['model_counts_threshold'])
+            self._model_counts_cache = cache
+
+        # Drop sources that are no longer in the model
+        for name in cache.names:
+            if not self.roi.has_source(name):
+                cache.remove(name)
+
+        keys = {name: self._get_model_counts_key(name) for name in names}
+        stale = [name for name in names if cache.get(name, keys[name]) is None]
+        uncached = {}
+        if not stale:
+            return uncached
+
+        if not hasattr(self.like.logLike, 'loadSourceMaps'):
+            # Update fixed model
+            self.like.logLike.buildFixedModelWts()
+            # Populate source map hash
+            self.like.logLike.buildFixedModelWts(True)
+
+        for name in stale:
+            v = pyLike.FloatVector(int(np.prod(shape)))
+            if not hasattr(self.like.logLike, 'setSourceMapImage'):
+                model = self.like.logLike.sourceMap(str(name))
+                self.like.logLike.updateModelMap(v, model)
+            else:
+                self.like.logLike.computeModelMap(str(name), v)
+
+            src = self.roi.get_source_by_name(name)
+            v = np.array(v, dtype=float).reshape(shape)
+            if not cache.update(name, keys[name], v, sparse=not src.diffuse):
+                uncached[name] = v
+
+        return uncached
 
     def model_counts_spectrum(self, name, logemin, logemax):
         """Return the model counts spectrum of a source.
@@ -4744,16 +5280,51 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         self.logger.log(loglevel, 'Finished setup for component %s',
                         self.name)
 
+    def _get_setup_state(self):
+        """Return the in-memory products of `setup`."""
+        return {k: getattr(self, k) for k in self._setup_attrs}
+
+    def _set_setup_state(self, state):
+        """Restore the in-memory products of `setup` returned by
+        `_get_setup_state`."""
+        for k in self._setup_attrs:
+            setattr(self, k, state[k])
+
+    def _use_native_binning(self):
+        """Return True if the data selection and binning of this
+        component are performed with `~fermipy.ft1_utils`."""
+
+        if not self.config['data']['native_binning']:
+            return False
+
+        filter = self.config['selection']['filter']
+        return filter is None or ft1_utils.is_supported_filter(filter)
+
+    def _need_select_data(self, overwrite=False):
+
+        if self.config['gtlike']['use_external_srcmap']:
+            return False
+        return (overwrite or not os.path.isfile(self.files['ft1']) or
+                not os.path.isfile(self.files['ccube']))
+
     def _select_data(self, overwrite=False, **kwargs):
 
         loglevel = kwargs.get('loglevel', self.loglevel)
 
-        if (os.path.isfile(self.files['ft1']) and
-            os.path.isfile(self.files['ccube']) and
-                not overwrite):
+        if not self._need_select_data(overwrite):
             self.logger.log(loglevel, 'Skipping data selection.')
             return
 
+        if self._use_native_binning():
+            self._select_data_native(kwargs.get('events', None),
+                                     loglevel=loglevel)
+            return
+        elif self.config['data']['native_binning']:
+            self.logger.warning('Filter expression %s is not supported by '
+                                'the native data selection.  Falling back '
+                                'to gtselect and gtbin.',
+                                self.config['selection']['filter'])
+
         # Run gtselect and gtmktime
         kw_gtselect = dict(infile=self.data_files['evfile'],
                            outfile=self.files['ft1'],
@@ -4787,10 +5358,86 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
             os.system('mv %s %s' % (self.files['ft1_filtered'],
                                     self.files['ft1']))
 
+    def _select_data_native(self, events=None, **kwargs):
+        """Select events with `~fermipy.ft1_utils.EventList`.  This
+        applies the same cuts as gtselect and gtmktime and writes the
+        selected events to the FT1 file of this component."""
+
+        loglevel = kwargs.get('loglevel', self.loglevel)
+        sel = self.config['selection']
+
+        if events is None:
+            events = ft1_utils.EventList.create(self.data_files['evfile'],
+                                                emin=sel['emin'],
+                                                emax=sel['emax'],
+                                                skydir=self.roi.skydir,
+                                                radius=sel['radius'])
+
+        gti = None
+        if sel['roicut'] == 'yes' or sel['filter'] is not None:
+            colnames = ['START', 'STOP']
+            if sel['filter'] is not None:
+                colnames += ft1_utils.get_filter_columns(sel['filter'])
+            if sel['roicut'] == 'yes':
+                colnames += ['RA_ZENITH', 'DEC_ZENITH']
+            tab_sc = create_sc_table(self.data_files['scfile'],
+                                     colnames=list(set(colnames)))
+            gti = ft1_utils.make_sc_gti(tab_sc, filter=sel['filter'],
+                                        roicut=sel['roicut'] == 'yes',
+                                        skydir=self.roi.skydir,
+                                        radius=sel['radius'],
+                                        zmax=sel['zmax'])
+
+        self._events = events.select(gti=gti,
+                                     ra=self.roi.skydir.ra.deg,
+                                     dec=self.roi.skydir.dec.deg,
+                                     rad=sel['radius'],
+                                     convtype=sel['convtype'],
+                                     phasemin=sel['phasemin'],
+                                     phasemax=sel['phasemax'],
+                                     evtype=sel['evtype'],
+                                     evclass=sel['evclass'],
+                                     tmin=sel['tmin'],
+                                     tmax=sel['tmax'],
+                                     emin=sel['emin'],
+                                     emax=sel['emax'],
+                                     zmax=sel['zmax'])
+
+        self.logger.log(loglevel, 'Selected %i events.', len(self._events))
+        self._events.write(self.files['ft1'])
+
+    def _bin_data_native(self, **kwargs):
+        """Bin events with `~fermipy.ft1_utils.EventList` and write
+        a counts cube in the format of gtbin."""
+
+        events = self._events
+        if events is None:
+            events = ft1_utils.EventList.create(self.files['ft1'])
+
+        if self.projtype == "WCS":
+            counts = events.fill_wcs(self._skywcs, self.npix, self.energies,
+                                     self._coordsys)
+        elif self.projtype == "HPX":
+            counts = events.fill_hpx(self._proj, self.energies)
+        else:
+            raise Exception('Unknown projection type, %s. '
+                            'Choices are WCS or HPX' % self.projtype)
+
+        events.write_ccube(counts, self._proj, self.energies,
+                           self.files['ccube'])
+        self._events = None
+
     def _bin_data(self, overwrite=False, **kwargs):
 
         loglevel = kwargs.get('loglevel', self.loglevel)
 
+        if self._use_native_binning():
+            if not os.path.isfile(self.files['ccube']) or overwrite:
+                self._bin_data_native(**kwargs)
+            else:
+                self.logger.debug('Skipping data binning.')
+            return
+
         # Run gtbin
         if self.projtype == "WCS":
             kw = dict(algorithm='ccube',
@@ -4993,8 +5640,9 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
                   resamp_fact=self.config['gtlike']['rfactor'])
         self.logger.debug(kw)
 
-        self._like = BinnedAnalysis(binnedData=self._obs,
+        self._like = gtutils.BinnedAnalysis(binnedData=self._obs,
                                     **utils.unicode_to_str(kw))
+        self._model_counts_cache = None
 
 #        print(self.like.logLike.use_single_fixed_map())
 #        self.like.logLike.set_use_single_fixed_map(False)
@@ -5021,6 +5669,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         self.logger.debug('Updating source maps')
         if not self.config['gtlike']['use_external_srcmap']:
             self.like.logLike.saveSourceMaps(str(self.files['srcmap']))
+        self._srcmaps_dirty = set()
 
         # Apply exposure corrections
         self._scale_srcmap(self._src_expscale)
@@ -5070,6 +5719,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         for name in scale_map.keys():
             self.like.logLike.eraseSourceMap(str(name))
         self.like.logLike.buildFixedModelWts()
+        self._clear_model_counts_cache(list(scale_map.keys()))
 
     def _make_scaled_srcmap(self):
         """Make an exposure cube with the same binning as the counts map."""
@@ -5242,6 +5892,65 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
 
         return k
 
+    def _create_width_srcmaps(self, name, src, spatial_model, widths,
+                              skydir=None, psf_scale_fn=None):
+        """Generate the source maps of a source for a sequence of
+        spatial widths.  Maps are cached by width and reused as long
+        as the source position and spatial model do not change.  Maps
+        generated with a PSF scaling function are not cached."""
+
+        skydir = src.skydir if skydir is None else skydir
+        key = (spatial_model, skydir.ra.deg, skydir.dec.deg)
+        cache = self._width_srcmap_cache.get(name, None)
+        if cache is None or cache[0] != key or psf_scale_fn is not None:
+            cache = (key, collections.OrderedDict())
+            if psf_scale_fn is None:
+                self._width_srcmap_cache[name] = cache
+
+        srcmaps = cache[1]
+        src = copy.deepcopy(src)
+        out = []
+        for w in widths:
+
+            w = max(float(w), 0.00316)
+            k = srcmaps.pop(w, None)
+            if k is None:
+                src.set_spatial_model(spatial_model,
+                                      {'ra': skydir.ra.deg,
+                                       'dec': skydir.dec.deg,
+                                       'SpatialWidth': w})
+                k = self._create_srcmap(name, src, psf_scale_fn=psf_scale_fn)
+            srcmaps[w] = k
+            out += [k]
+
+        while len(srcmaps) > self._width_srcmap_cache_size:
+            srcmaps.popitem(last=False)
+
+        return out
+
+    def _srcmap_to_model_counts(self, name, srcmap):
+        """Compute the model-counts cube of a source from a source
+        map using the current spectral parameters of the source."""
+
+        spectrum = self.like[name].src.spectrum()
+        dnde = np.array([spectrum(pyLike.dArg(float(e)))
+                         for e in self.energies])
+        dnde *= self._src_expscale.get(name, 1.0)
+        return srcmap_utils.integrate_srcmap(srcmap, self.energies, dnde)
+
+    def _get_likelihood_weights(self, shape=None):
+        """Return the likelihood weights cube of this component or
+        None if no weights map is defined."""
+
+        if self.files['wmap'] is None:
+            return None
+
+        weights = skymap.read_map_from_fits(self.files['wmap'])[0].data
+        if shape is not None and weights.shape != tuple(shape):
+            raise Exception('Weights map shape does not match '
+                            'counts map shape.')
+        return weights
+
     def _update_srcmap(self, name, src, **kwargs):
         """Update the source map for an existing source in memory."""
 
@@ -5254,11 +5963,44 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         self.like.logLike.sourceMap(str(name)).model()
         self.like.logLike.setSourceMapImage(str(name), np.ravel(k))
         self.like.logLike.sourceMap(str(name)).model()
+        self._srcmaps_dirty.add(name)
+        self._clear_model_counts_cache([name])
 
         normPar = self.like.normPar(name)
         if not normPar.isFree():
             self.like.logLike.buildFixedModelWts()
 
+    def save_source_maps(self):
+        """Write the source maps that were modified since they were
+        last saved to the source map file.  Maps that are already
+        up to date in the file are not rewritten."""
+
+        if not self._srcmaps_dirty or self._like is None:
+            return
+
+        names = sorted(self._srcmaps_dirty)
+        self.logger.debug('Saving source maps for component %s: %s',
+                          self.name, names)
+        srcmap_utils.delete_source_map(self.files['srcmap'], names)
+        self.like.logLike.saveSourceMaps(str(self.files['srcmap']))
+
+        # The in-memory maps already include the exposure correction.
+        # Source names are matched to HDU names without regard to case.
+        expscale = {k.upper(): v for k, v in self._src_expscale.items()}
+        scale_names = set([name.upper() for name in names]) & set(expscale)
+        if scale_names:
+            srcmap = fits.open(self.files['srcmap'])
+            for hdu in srcmap[1:]:
+                if hdu.name.upper() not in scale_names:
+                    continue
+                hdu.header['EXPSCALE'] = \
+                    (expscale[hdu.name.upper()],
+                     'Exposure correction applied to this map')
+            srcmap.writeto(self.files['srcmap'], clobber=True)
+            srcmap.close()
+
+        self._srcmaps_dirty = set()
+
     def generate_model(self, model_name=None, outfile=None):
         """Generate a counts model map from an XML model file using
         gtmodel.
@@ -5317,6 +6059,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         self.like.logLike.reReadXml(str(xmlfile))
         if not self.like.logLike.fixedModelUpdated():
             self.like.logLike.buildFixedModelWts()
+        self._clear_model_counts_cache()
 
     def write_xml(self, xmlfile):
         """Write the XML model for this analysis component."""
@@ -0,0 +1,226 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Evaluation of 2D convolutions of azimuthally symmetric functions with
+the zeroth-order Hankel transform.  The convolution of a radial
+function f(r) with a gaussian or disk is evaluated as
+
+f'(r) = 1/(2*pi) Int F(k) G(k) J0(k*r) k dk
+
+where F(k) and G(k) are the Hankel transforms of f and of the
+smoothing kernel.  G(k) is known analytically for the gaussian and
+disk such that the convolution of f at many radii (and for many
+energies when f is tabulated versus energy) reduces to two matrix
+products.  The inverse transform is evaluated with the Fourier-Bessel
+series of a function that vanishes beyond ``rmax``.
+"""
+from __future__ import absolute_import, division, print_function
+from collections import OrderedDict
+import numpy as np
+from fermipy.lazy_import import LazyModule
+
+special = LazyModule('scipy.special')
+
+
+class HankelTransform(object):
+    """Zeroth-order Hankel transform of functions tabulated on a
+    radial grid.  The forward transform is evaluated with the
+    trapezoidal rule on the grid points ``r`` and the inverse
+    transform with the Fourier-Bessel series on the interval [0,
+    ``rmax``] truncated at wavenumber ``kmax``.
+
+    Parameters
+    ----------
+    r : `~numpy.ndarray`
+        Increasing array of radii at which the input functions are
+        tabulated.
+
+    kmax : float
+        Maximum wavenumber of the series.  The number of terms is
+        given by the number of zeros of J0 below ``kmax * r[-1]``.
+    """
+
+    # Maximum number of cached transforms
+    _cache_size = 16
+    _cache = OrderedDict()
+
+    def __init__(self, r, kmax):
+
+        r = np.array(r, ndmin=1, dtype=float)
+        rmax = r[-1]
+        nk = max(int(np.ceil(kmax * rmax / np.pi + 0.25)), 1)
+        zeros = special.jn_zeros(0, nk)
+
+        self._r = r
+        self._rmax = rmax
+        self._k = zeros / rmax
+        self._wk = 1.0 / (np.pi * rmax**2 * special.j1(zeros)**2)
+
+        wr = np.zeros_like(r)
+        wr[1:] += 0.5 * (r[1:] - r[:-1])
+        wr[:-1] += 0.5 * (r[1:] - r[:-1])
+        self._fwd = (2.0 * np.pi * r * wr)[:, np.newaxis] * \
+            special.j0(r[:, np.newaxis] * self._k[np.newaxis, :])
+
+    @classmethod
+    def create(cls, rmax, nstep, kmax=None):
+        """Create a transform on a grid of ``nstep`` points between 0
+        and ``rmax`` that are uniformly spaced in sqrt(r).  This
+        samples finely the core of functions peaked at r = 0.  If
+        ``kmax`` is None it is set to the largest wavenumber that is
+        resolved by the grid.  Transforms are cached on their
+        arguments."""
+
+        kmax_grid = np.pi * nstep / (4.0 * rmax)
+        if kmax is None or kmax > kmax_grid:
+            kmax = kmax_grid
+
+        key = (float(rmax), int(nstep), float(kmax))
+        ht = cls._cache.pop(key, None)
+        if ht is None:
+            r = np.linspace(0.0, rmax**0.5, nstep + 1)**2
+            ht = cls(r, kmax)
+        cls._cache[key] = ht
+        while len(cls._cache) > cls._cache_size:
+            cls._cache.popitem(last=False)
+        return ht
+
+    @property
+    def r(self):
+        """Radii of the input grid."""
+        return self._r
+
+    @property
+    def k(self):
+        """Wavenumbers of the series."""
+        return self._k
+
+    def forward(self, f):
+        """Evaluate the transform of functions tabulated at the grid
+        radii.
+
+        Parameters
+        ----------
+        f : `~numpy.ndarray`
+            Array with shape (..., len(r)).
+
+        Returns
+        -------
+        fk : `~numpy.ndarray`
+            Array with shape (..., len(k)).
+        """
+        return np.dot(f, self._fwd)
+
+    def inverse(self, fk, r):
+        """Evaluate the inverse transform at arbitrary radii.
+
+        Parameters
+        ----------
+        fk : `~numpy.ndarray`
+            Array with shape (..., len(k)).
+
+        r : `~numpy.ndarray`
+            Radii at which the inverse is evaluated.  Either a 1D
+            array or an array whose leading dimensions match those of
+            ``fk``.
+
+        Returns
+        -------
+        f : `~numpy.ndarray`
+            Array with shape (..., len(r)) or ``r.shape``.
+        """
+        r = np.array(r, ndmin=1, dtype=float)
+        fk = fk * self._wk
+        jr = special.j0(r[..., np.newaxis] * self._k)
+        if r.ndim == 1:
+            return np.dot(fk, jr.T)
+        return np.einsum('...k,...jk->...j', fk, jr)
+
+    def convolve(self, f, r, gk):
+        """Convolve tabulated functions with a smoothing kernel with
+        transform ``gk`` and evaluate the result at radii ``r``."""
+        return self.inverse(self.forward(f) * gk, r)
+
+
+def gauss_transform(k, sig):
+    """Hankel transform of the 2D gaussian with standard deviation
+    ``sig`` normalized to unit integral."""
+    return np.exp(-0.5 * (k * sig)**2)
+
+
+def disk_transform(k, sig):
+    """Hankel transform of the 2D disk with radius ``sig`` normalized
+    to unit integral."""
+    x = k * sig
+    v = np.ones_like(x)
+    m = x > 1E-8
+    v[m] = 2.0 * special.j1(x[m]) / x[m]
+    return v
+
+
+def _convolve(fn, r, rmax, nstep, rres, kmax, gk_fn):
+
+    if nstep is None:
+        nstep = 1000
+        if rres is not None:
+            nstep = int(np.clip(8. * rmax / rres, 1000, 8000))
+
+    ht = HankelTransform.create(rmax, nstep, kmax)
+    return ht.convolve(fn(ht.r), r, gk_fn(ht.k))
+
+
+def convolve2d_gauss(fn, r, sig, rmax=None, nstep=None, rres=None,
+                     eps=1E-10):
+    """Evaluate the convolution f'(r) = f(r) * g(r) where f(r) is an
+    azimuthally symmetric function in two dimensions and g is a 2D
+    gaussian with standard deviation s.  This is a vectorized
+    alternative to `~fermipy.utils.convolve2d_gauss` that evaluates
+    ``fn`` only once on a common grid.
+
+    Parameters
+    ----------
+    fn : function
+        Input function that takes an array of radial coordinates with
+        shape (nstep + 1,) and returns an array with shape (...,
+        nstep + 1) (e.g. one row per energy).
+
+    r : `~numpy.ndarray`
+        Array of points at which the convolution is to be evaluated.
+        Either a 1D array or an array whose leading dimensions match
+        those returned by ``fn``.
+
+    sig : float
+        Width parameter of the gaussian.
+
+    rmax : float
+        Radius beyond which ``fn`` is assumed to vanish.  Defaults to
+        ``max(r) + 10 * sig``.
+
+    nstep : int
+        Number of grid points on which ``fn`` is evaluated.  If None
+        this is chosen such that the scale ``rres`` is resolved.
+
+    rres : float
+        Smallest radial scale of ``fn`` that should be resolved.
+
+    eps : float
+        Truncate the series at the wavenumber where the transform of
+        the gaussian falls below ``eps``.
+    """
+    if rmax is None:
+        rmax = np.max(r) + 10. * sig
+    kmax = np.sqrt(-2.0 * np.log(eps)) / sig if sig > 0 else None
+    return _convolve(fn, r, rmax, nstep, rres, kmax,
+                     lambda k: gauss_transform(k, sig))
+
+
+def convolve2d_disk(fn, r, sig, rmax=None, nstep=None, rres=None):
+    """Evaluate the convolution f'(r) = f(r) * g(r) where f(r) is an
+    azimuthally symmetric function in two dimensions and g is a 2D
+    disk with radius s.  This is a vectorized alternative to
+    `~fermipy.utils.convolve2d_disk`.  See
+    `~fermipy.hankel.convolve2d_gauss` for a description of the
+    parameters."""
+    if rmax is None:
+        rmax = np.max(r) + 2. * sig
+    return _convolve(fn, r, rmax, nstep, rres, None,
+                     lambda k: disk_transform(k, sig))
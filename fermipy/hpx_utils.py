@@ -4,7 +4,7 @@ Utilities for dealing with HEALPix projections and mappings
 """
 from __future__ import absolute_import, division, print_function
 import re
-import healpy as hp
+from collections import OrderedDict
 import numpy as np
 from astropy.io import fits
 from astropy.wcs import WCS
@@ -12,6 +12,9 @@ from astropy.coordinates import SkyCoord
 from astropy.coordinates import Galactic, ICRS
 
 from fermipy.wcs_utils import WCSProj
+from fermipy.lazy_import import LazyModule
+
+hp = LazyModule('healpy')
 
 # This is an approximation of the size of HEALPix pixels (in degrees)
 # for a particular order.   It is used to convert from HEALPix to WCS-based
@@ -178,22 +181,12 @@ def make_hpx_to_wcs_mapping(hpx, wcs):
     ipixs[mask] = hp.pixelfunc.ang2pix(hpx.nside, sky_crds[0:, 1][mask],
                                        sky_crds[0:, 0][mask], hpx.nest)
 
-    # Here we are counting the number of HEALPix pixels each WCS pixel points to;
-    # this could probably be vectorized by filling a histogram.
-    d_count = {}
-    for ipix in ipixs:
-        if ipix in d_count:
-            d_count[ipix] += 1
-        else:
-            d_count[ipix] = 1
-
     # Here we are getting a multiplicative factor that tells use how to split up
     # the counts in each HEALPix pixel (by dividing the corresponding WCS pixels
-    # by the number of associated HEALPix pixels).
-    # This could also likely be vectorized.
-    mult_val = np.ones(ipixs.shape)
-    for i, ipix in enumerate(ipixs):
-        mult_val[i] /= d_count[ipix]
+    # by the number of WCS pixels pointing at each HEALPix pixel).
+    inv, d_count = np.unique(ipixs, return_inverse=True,
+                             return_counts=True)[1:]
+    mult_val = 1. / d_count[inv]
 
     ipixs = ipixs.reshape(npix).flatten()
     mult_val = mult_val.reshape(npix).flatten()
@@ -239,11 +232,314 @@ def pix_to_upix(pix, nside):
     return pix + 4 * np.power(nside, 2)
 
 
+# Cache of pixel index maps used by reorder_cube and ud_grade_cube.
+# The least recently used maps are dropped when the total size of the
+# cached arrays exceeds the limit in bytes.  Maps larger than the limit
+# (e.g. at nside >= 2048) are not cached.
+_index_cache = OrderedDict()
+_index_cache_max_bytes = 2**28
+
+
+def _get_cached_index(key, fn):
+
+    idx = _index_cache.pop(key, None)
+    if idx is None:
+        idx = fn()
+    if idx.nbytes > _index_cache_max_bytes:
+        return idx
+    _index_cache[key] = idx
+    nbytes = sum(v.nbytes for v in _index_cache.values())
+    while nbytes > _index_cache_max_bytes:
+        nbytes -= _index_cache.popitem(last=False)[1].nbytes
+    return idx
+
+
+def get_reorder_index(nside, n2r):
+    """Return the permutation ``idx`` such that ``data[..., idx]``
+    converts a map from NESTED to RING ordering (``n2r`` True) or
+    from RING to NESTED ordering (``n2r`` False).  Permutations are
+    cached."""
+
+    def fn():
+        ipix = np.arange(12 * nside * nside)
+        return hp.ring2nest(nside, ipix) if n2r else hp.nest2ring(nside, ipix)
+
+    return _get_cached_index(('reorder', int(nside), bool(n2r)), fn)
+
+
+def get_ud_grade_index(nside_in, nside_out, nest):
+    """Return the pixel index map of a change of resolution.  For an
+    upgrade this is the index of the parent pixel of each output
+    pixel with shape (npix_out,).  For a degrade this is the index of
+    the children of each output pixel with shape (npix_out, nchild).
+    Index maps are cached."""
+
+    def fn():
+        npix_out = 12 * nside_out * nside_out
+        if nside_out > nside_in:
+            nchild = (nside_out // nside_in)**2
+            idx = np.arange(npix_out) // nchild
+        else:
+            nchild = (nside_in // nside_out)**2
+            idx = np.arange(npix_out * nchild).reshape(npix_out, nchild)
+
+        if not nest:
+            idx = get_reorder_index(nside_in, False)[idx]
+            idx = idx[get_reorder_index(nside_out, True)]
+        return idx
+
+    return _get_cached_index(('ud_grade', int(nside_in), int(nside_out),
+                              bool(nest)), fn)
+
+
+def reorder_cube(data, nside, n2r, dtype=None):
+    """Convert the ordering scheme of every plane of a HEALPix cube.
+    This is equivalent to applying `~healpy.pixelfunc.reorder` to
+    each plane.
+
+    Parameters
+    ----------
+    data : `~numpy.ndarray`
+        Array with shape (..., npix).
+
+    nside : int
+        HEALPix nside parameter.
+
+    n2r : bool
+        Convert from NESTED to RING if True and from RING to NESTED
+        otherwise.
+
+    dtype : data-type
+        Type of the output array.  If None the input type is used.
+    """
+    data = np.asarray(data)
+    dtype = data.dtype if dtype is None else np.dtype(dtype)
+    data = data.astype(dtype, copy=False)
+    out = np.empty(data.shape, dtype=dtype)
+    np.take(data, get_reorder_index(nside, n2r), axis=-1, out=out)
+    return out
+
+
+def _get_ud_grade_dtype(data, dtype):
+    """Return the output type of a change of resolution.  Maps that
+    are not floating point are promoted to `numpy.float64` since a
+    degrade averages the pixels."""
+    if dtype is not None:
+        return np.dtype(dtype)
+    elif np.issubdtype(data.dtype, np.floating):
+        return data.dtype
+    else:
+        return np.dtype(np.float64)
+
+
+def ud_grade_cube(data, nside_in, nside_out, nest, power=0, dtype=None):
+    """Change the resolution of every plane of a HEALPix cube.  This
+    is equivalent to applying `~healpy.pixelfunc.ud_grade` with the
+    same input and output ordering to each plane of a cube without
+    bad pixels.
+
+    Parameters
+    ----------
+    data : `~numpy.ndarray`
+        Array with shape (..., npix).
+
+    nside_in, nside_out : int
+        HEALPix nside parameters of the input and output maps.
+
+    nest : bool
+        Ordering scheme of the maps.
+
+    power : float
+        Output values are scaled by (nside_out/nside_in)**power.  Use
+        -2 to preserve the sum of the map.
+
+    dtype : data-type
+        Type of the output array.  If None the input type is used if
+        it is a floating point type and `numpy.float64` otherwise.
+    """
+    data = np.asarray(data)
+    dtype = _get_ud_grade_dtype(data, dtype)
+    data = data.astype(dtype, copy=False)
+    npix_out = 12 * nside_out * nside_out
+
+    if nside_in == nside_out:
+        return data.copy()
+
+    idx = get_ud_grade_index(nside_in, nside_out, nest)
+    out = np.empty(data.shape[:-1] + (npix_out,), dtype=dtype)
+    if nside_out > nside_in:
+        np.take(data, idx, axis=-1, out=out)
+    elif nest:
+        # Children of each pixel are contiguous in the NESTED scheme
+        data.reshape(data.shape[:-1] + idx.shape).mean(axis=-1, out=out)
+    else:
+        np.take(data, idx, axis=-1).mean(axis=-1, out=out)
+
+    ratio = (float(nside_out) / float(nside_in))**power
+    if ratio != 1.0:
+        out *= ratio
+    return out
+
+
+def get_sparse_ud_grade_index(ipix, nside_in, nside_out, nest):
+    """Return the pixel indices of a partial-sky map after a change of
+    resolution together with the mapping between input and output
+    pixels.  For an upgrade the output pixels are the children of the
+    input pixels and ``idx`` is the local index of the parent of each
+    output pixel.  For a degrade the output pixels are the parents of
+    the input pixels and ``idx`` is the local index of the output
+    pixel containing each input pixel.  Output pixels are sorted.
+
+    Parameters
+    ----------
+    ipix : `~numpy.ndarray`
+        Global indices of the input pixels.
+
+    nside_in, nside_out : int
+        HEALPix nside parameters of the input and output maps.
+
+    nest : bool
+        Ordering scheme of the maps.
+
+    Returns
+    -------
+    ipix_out : `~numpy.ndarray`
+        Global indices of the output pixels.
+
+    idx : `~numpy.ndarray`
+        Local pixel index map.
+    """
+    ipix = np.asarray(ipix)
+    if not nest:
+        ipix = hp.ring2nest(nside_in, ipix)
+
+    if nside_out >= nside_in:
+        nchild = (nside_out // nside_in)**2
+        ipix_out = (ipix[:, np.newaxis] * nchild +
+                    np.arange(nchild)[np.newaxis, :]).ravel()
+        idx = np.repeat(np.arange(len(ipix)), nchild)
+        if not nest:
+            ipix_out = hp.nest2ring(nside_out, ipix_out)
+        isort = np.argsort(ipix_out)
+        return ipix_out[isort], idx[isort]
+
+    nchild = (nside_in // nside_out)**2
+    ipix_out = ipix // nchild
+    if not nest:
+        ipix_out = hp.nest2ring(nside_out, ipix_out)
+    return np.unique(ipix_out, return_inverse=True)
+
+
+def reorder_sparse(data, ipix, nside, n2r, dtype=None):
+    """Convert the ordering scheme of every plane of a partial-sky
+    HEALPix cube.
+
+    Parameters
+    ----------
+    data : `~numpy.ndarray`
+        Array with shape (..., npix).
+
+    ipix : `~numpy.ndarray`
+        Global indices of the pixels in the input scheme.
+
+    nside : int
+        HEALPix nside parameter.
+
+    n2r : bool
+        Convert from NESTED to RING if True and from RING to NESTED
+        otherwise.
+
+    dtype : data-type
+        Type of the output array.  If None the input type is used.
+
+    Returns
+    -------
+    ipix_out : `~numpy.ndarray`
+        Sorted global indices of the pixels in the output scheme.
+
+    data_out : `~numpy.ndarray`
+        Output array with shape (..., npix).
+    """
+    data = np.asarray(data)
+    dtype = data.dtype if dtype is None else np.dtype(dtype)
+    ipix = np.asarray(ipix)
+    ipix_out = hp.nest2ring(nside, ipix) if n2r else hp.ring2nest(nside, ipix)
+    isort = np.argsort(ipix_out)
+    return ipix_out[isort], np.take(data, isort, axis=-1).astype(dtype,
+                                                                   copy=False)
+
+
+def ud_grade_sparse(data, ipix, nside_in, nside_out, nest, power=0,
+                    dtype=None):
+    """Change the resolution of every plane of a partial-sky HEALPix
+    cube.  This is equivalent to applying `~healpy.pixelfunc.ud_grade`
+    to each plane of the full-sky map in which the pixels outside of
+    the partial-sky map are flagged as bad pixels (i.e. output pixels
+    are averaged over the input pixels that are present).  The output
+    map contains the children (upgrade) or parents (degrade) of the
+    input pixels.
+
+    Parameters
+    ----------
+    data : `~numpy.ndarray`
+        Array with shape (..., npix).
+
+    ipix : `~numpy.ndarray`
+        Global indices of the input pixels.
+
+    nside_in, nside_out : int
+        HEALPix nside parameters of the input and output maps.
+
+    nest : bool
+        Ordering scheme of the maps.
+
+    power : float
+        Output values are scaled by (nside_out/nside_in)**power.
+
+    dtype : data-type
+        Type of the output array.  If None the input type is used if
+        it is a floating point type and `numpy.float64` otherwise.
+
+    Returns
+    -------
+    ipix_out : `~numpy.ndarray`
+        Global indices of the output pixels.
+
+    data_out : `~numpy.ndarray`
+        Output array with shape (..., npix_out).
+    """
+    data = np.asarray(data)
+    dtype = _get_ud_grade_dtype(data, dtype)
+    ipix_out, idx = get_sparse_ud_grade_index(ipix, nside_in, nside_out,
+                                              nest)
+
+    if nside_out >= nside_in:
+        out = np.take(data, idx, axis=-1).astype(dtype, copy=False)
+    else:
+        # Sum the pixels of every plane with a single bincount
+        npix_out = len(ipix_out)
+        shape = data.shape[:-1]
+        nplane = int(np.prod(shape))
+        flat = data.reshape(nplane, data.shape[-1])
+        bins = (np.arange(nplane)[:, np.newaxis] * npix_out +
+                idx[np.newaxis, :])
+        out = np.bincount(bins.ravel(), weights=flat.ravel(),
+                          minlength=nplane * npix_out)
+        out = out.reshape(shape + (npix_out,))
+        out /= np.bincount(idx, minlength=npix_out)
+        out = out.astype(dtype, copy=False)
+
+    ratio = (float(nside_out) / float(nside_in))**power
+    if ratio != 1.0:
+        out *= ratio
+    return ipix_out, out
+
+
 class HPX(object):
     """ Encapsulation of basic healpix map parameters """
 
     def __init__(self, nside, nest, coordsys, order=-1, region=None,
-                 ebins=None, conv=HPX_Conv('FGST_CCUBE')):
+                 ebins=None, conv=HPX_Conv('FGST_CCUBE'), ipix=None):
         """C'tor
 
         Parameters
@@ -254,6 +550,10 @@ class HPX(object):
 
         nest      : bool, True -> 'NESTED', False -> 'RING' indexing scheme
         coordsys  : Coordinate system, 'CEL' | 'GAL'
+        region    : HEALPix region string for partial-sky maps
+        ipix      : Explicit list of the global indices of the pixels
+                    in a partial-sky map.  If None the pixels are
+                    generated from the region string.
 
         """
         if nside >= 0:
@@ -273,14 +573,16 @@ class HPX(object):
         self._coordsys = coordsys
         self._region = region
         self._maxpix = 12 * self._nside * self._nside
-        if self._region:
-            self._ipix = self.get_index_list(
-                self._nside, self._nest, self._region)
-            self._rmap = {}
+        if ipix is None and self._region:
+            ipix = self.get_index_list(self._nside, self._nest, self._region)
+
+        if ipix is not None:
+            self._ipix = np.asarray(ipix, dtype=int)
+            self._isort = np.argsort(self._ipix)
             self._npix = len(self._ipix)
         else:
             self._ipix = None
-            self._rmap = None
+            self._isort = None
             self._npix = self._maxpix
 
         self._ebins = ebins
@@ -290,10 +592,6 @@ class HPX(object):
         else:
             self._evals = None
 
-        if self._ipix is not None:
-            for i, ipixel in enumerate(self._ipix.flat):
-                self._rmap[ipixel] = i
-
     def __getitem__(self, sliced):
         """This implements the global-to-local lookup.  For all-sky maps it
         just returns the input array.  For partial-sky maps in returns
@@ -307,11 +605,13 @@ class HPX(object):
             An array of HEALPix pixel indices
 
         """
-        if self._rmap is not None:
-            retval = np.empty((sliced.size), 'i')
-            retval.fill(-1)
-            m = np.in1d(sliced.flat, self._ipix)
-            retval[m] = np.searchsorted(self._ipix, sliced.flat[m])
+        if self._ipix is not None:
+            sliced = np.asarray(sliced)
+            ipix_sorted = self._ipix[self._isort]
+            idx = np.searchsorted(ipix_sorted, sliced.flat)
+            idx[idx == self._npix] = 0
+            retval = self._isort[idx]
+            retval[ipix_sorted[idx] != sliced.flat] = -1
             return retval.reshape(sliced.shape)
         return sliced
 
@@ -357,23 +657,61 @@ class HPX(object):
     def region(self):
         return self._region
 
+    @property
+    def ipix(self):
+        """Global indices of the pixels of a partial-sky map (None for
+        all-sky maps)."""
+        return self._ipix
+
+    @property
+    def maxpix(self):
+        """Number of pixels in the full sky."""
+        return self._maxpix
+
+    @property
+    def is_allsky(self):
+        return self._ipix is None
+
     def ud_graded_hpx(self, order):
-        """
+        """Return the geometry of this map at a different order.  The
+        pixels of a partial-sky map are the children or parents of
+        the pixels of this map.
         """
         if self.order < 0:
             raise RuntimeError(
                 "Upgrade and degrade only implemented for standard maps")
-        return HPX(-1, self.nest, self.coordsys, order, self.region, self.ebins, self.conv)
+        ipix = None
+        if self._ipix is not None:
+            ipix = get_sparse_ud_grade_index(self._ipix, self.nside,
+                                             2**order, self.nest)[0]
+        return HPX(-1, self.nest, self.coordsys, order, self.region,
+                   self.ebins, self.conv, ipix=ipix)
 
     def make_swapped_hpx(self):
         """
         """
-        return HPX(self.nside, not self.nest, self.coordsys, -1, self.region, self.ebins, self.conv)
+        ipix = None
+        if self._ipix is not None:
+            ipix = self._ipix
+            ipix = np.sort(hp.nest2ring(self.nside, ipix) if self.nest
+                           else hp.ring2nest(self.nside, ipix))
+        return HPX(self.nside, not self.nest, self.coordsys, -1, self.region,
+                   self.ebins, self.conv, ipix=ipix)
 
     def copy_and_drop_energy(self):
         """
         """
-        return HPX(self.nside, not self.nest, self.coordsys, -1, self.region, None, self.conv)
+        return HPX(self.nside, self.nest, self.coordsys, -1, self.region,
+                   None, self.conv, ipix=self._ipix)
+
+    def make_sparse_hpx(self, ipix, ebins=None):
+        """Return a partial-sky geometry with the same pixelization as
+        this map that contains the pixels ``ipix``.  The region string
+        is not copied.
+        """
+        ebins = self.ebins if ebins is None else ebins
+        return HPX(self.nside, self.nest, self.coordsys, -1, None,
+                   ebins, self.conv, ipix=ipix)
 
     @classmethod
     def create_hpx(cls, nside, nest, coordsys='CEL', order=-1, region=None,
@@ -444,11 +782,12 @@ class HPX(object):
             raise ValueError("Could not identify HEALPix convention")
 
     @classmethod
-    def create_from_header(cls, header, ebins=None):
+    def create_from_header(cls, header, ebins=None, ipix=None):
         """ Creates an HPX object from a FITS header.
 
         header : The FITS header
         ebins  : Energy bin edges [optional]
+        ipix   : Pixel indices of a partial-sky map [optional]
         """
         convname = HPX.identify_HPX_convention(header)
         conv = HPX_FITS_CONVENTIONS[convname]
@@ -488,7 +827,24 @@ class HPX(object):
             except KeyError:
                 region = None
 
-        return cls(nside, nest, coordsys, order, region, ebins=ebins, conv=conv)
+        return cls(nside, nest, coordsys, order, region, ebins=ebins,
+                   conv=conv, ipix=ipix)
+
+    @classmethod
+    def create_from_hdu(cls, hdu, ebins=None):
+        """ Creates an HPX object from a FITS table HDU.  The pixels of
+        maps in the explicit indexing scheme are read from the PIX
+        column.
+
+        hdu    : The FITS HDU
+        ebins  : Energy bin edges [optional]
+        """
+        ipix = None
+        indxschm = hdu.header.get('INDXSCHM', None)
+        if indxschm == 'EXPLICIT' or (indxschm is None and
+                                      'PIX' in hdu.columns.names):
+            ipix = np.array(hdu.data.field('PIX'), dtype=int)
+        return cls.create_from_header(hdu.header, ebins, ipix=ipix)
 
     def make_header(self):
         """ Builds and returns FITS header for this HEALPix map """
@@ -501,6 +857,8 @@ class HPX(object):
                  fits.Card("NSIDE", self._nside),
                  fits.Card("FIRSTPIX", 0),
                  fits.Card("LASTPIX", self._maxpix - 1),
+                 fits.Card("INDXSCHM", "IMPLICIT" if self._ipix is None
+                           else "EXPLICIT"),
                  fits.Card("HPX_CONV", self._conv.convname)]
 
         if self._coordsys == "CEL":
@@ -530,7 +888,7 @@ class HPX(object):
             raise Exception(
                 "Size of data array does not match number of pixels")
         cols = []
-        if self._region:
+        if self._ipix is not None:
             cols.append(fits.Column("PIX", "J", array=self._ipix))
 
         if self.conv.convname == 'FGST_SRCMAP_SPARSE':
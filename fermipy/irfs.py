@@ -2,24 +2,36 @@
 from __future__ import absolute_import, division, print_function
 import glob
 import re
+import collections
 import numpy as np
 from scipy.interpolate import RegularGridInterpolator
 from scipy.interpolate import UnivariateSpline
-import healpy as hp
 from astropy.io import fits
-
-import pyIrfLoader
-
-pyIrfLoader.Loader_go()
-
 from fermipy import utils
 from fermipy import spectrum
+from fermipy import hankel
 from fermipy.utils import edge_to_center
 from fermipy.utils import edge_to_width
 from fermipy.utils import sum_bins
 from fermipy.skymap import HpxMap
 from fermipy.hpx_utils import HPX
 from fermipy.ltcube import LTCube
+from fermipy.lazy_import import LazyModule
+
+hp = LazyModule('healpy')
+pyIrfLoader = LazyModule('pyIrfLoader', lambda m: m.Loader_go())
+
+# IRF grids summed over event types.  These do not depend on the sky
+# position and are shared by all calls with the same binning.  The
+# least recently used grids are dropped when the total size of the
+# cached arrays exceeds the limit in bytes.
+_irf_cache = collections.OrderedDict()
+_irf_cache_max_bytes = 2**27
+
+# Detector response matrices keyed on the IRFs, the binning and the
+# quantized livetime distribution of the sky position.
+_drm_cache = collections.OrderedDict()
+_drm_cache_max_bytes = 2**26
 
 evtype_string = {
     1: 'FRONT',
@@ -48,6 +60,7 @@ def loglog_quad(x, y, dim):
 
     xs0[dim] = slice(None, -1)
     xs1[dim] = slice(1, None)
+    ys0, ys1, xs0, xs1 = tuple(ys0), tuple(ys1), tuple(xs0), tuple(xs1)
     log_ratio = np.log(x[xs1] / x[xs0])
     return 0.5 * (y[ys0] * x[xs0] + y[ys1] * x[xs1]) * log_ratio
 
@@ -56,6 +69,54 @@ def bins_per_dec(edges):
     return (len(edges) - 1) / np.log10(edges[-1] / edges[0])
 
 
+def clear_cache():
+    """Drop the cached IRF grids and detector response matrices."""
+    _irf_cache.clear()
+    _drm_cache.clear()
+
+
+def _cache_get(cache, key):
+    v = cache.pop(key, None)
+    if v is not None:
+        cache[key] = v
+    return v
+
+
+def _cache_nbytes(v):
+    if isinstance(v, tuple):
+        return sum([_cache_nbytes(t) for t in v])
+    return 0 if v is None else v.nbytes
+
+
+def _cache_put(cache, key, v, max_bytes):
+    """Add an entry to a cache and drop the least recently used
+    entries until the size of the cached arrays is below
+    ``max_bytes``.  The new entry is always kept."""
+    cache[key] = v
+    nbytes = sum([_cache_nbytes(t) for t in cache.values()])
+    while nbytes > max_bytes and len(cache) > 1:
+        nbytes -= _cache_nbytes(cache.popitem(last=False)[1])
+
+
+def _array_key(*args):
+    return tuple([np.asarray(t, dtype=float).tobytes() for t in args])
+
+
+def _quantize_lthist(ltw, tol):
+    """Round the fractional livetime in each incidence angle bin to a
+    multiple of ``tol``."""
+    ltw = np.asarray(ltw, dtype=float)
+    norm = np.sum(ltw)
+    if norm > 0:
+        ltw = ltw / norm
+    return np.round(ltw / tol).astype(np.int64).tobytes()
+
+
+def _etrue_bins(nbin):
+    """Bin edges in true energy with ``nbin`` bins per decade."""
+    return 10**np.linspace(1.0, 6.5, int(nbin * 5.5) + 1)
+
+
 def bitmask_to_bits(mask):
 
     bits = []
@@ -97,6 +158,44 @@ def compute_ps_loc(egy, flux):
     pass
 
 
+def _convolve_psf(psf, ectr, theta, psf_r68, spatial_model, spatial_size,
+                  group_ratio=4.0):
+    """Evaluate the convolution of the PSF with a RadialGaussian or
+    RadialDisk at the radii ``theta`` (one row per energy).  Energies
+    are convolved in groups over which the PSF 68% containment radius
+    varies by less than ``group_ratio`` such that the grid of each
+    Hankel transform resolves the core of the narrowest PSF without
+    extending to the tails of the broadest one."""
+
+    v = np.zeros(theta.shape)
+    tmax = np.max(theta, axis=1)
+    grp = np.floor(np.log(psf_r68 / np.min(psf_r68)) / np.log(group_ratio))
+
+    for g in np.unique(grp):
+
+        m = grp == g
+
+        def psf_fn(t):
+            return psf.interp(ectr[m][:, np.newaxis], t)
+
+        # The radial range is extended beyond the largest radius to
+        # capture the PSF tails that scatter into it
+        rmax = 2.0 * np.max(tmax[m])
+        rres = 0.25 * np.min(psf_r68[m])
+        if spatial_model == 'RadialGaussian':
+            sigma = spatial_size / 1.5095921854516636
+            v[m] = hankel.convolve2d_gauss(psf_fn, theta[m], sigma,
+                                           rmax=rmax + 10. * sigma,
+                                           rres=rres)
+        else:
+            sigma = spatial_size / 0.8246211251235321
+            v[m] = hankel.convolve2d_disk(psf_fn, theta[m], sigma,
+                                          rmax=rmax + 2. * sigma,
+                                          rres=rres)
+
+    return v
+
+
 def compute_ps_counts(ebins, exp, psf, bkg, fn, egy_dim=0, spatial_model='PointSource',
                       spatial_size=1E-3):
     """Calculate the observed signal and background counts given models
@@ -125,7 +224,8 @@ def compute_ps_counts(ebins, exp, psf, bkg, fn, egy_dim=0, spatial_model='PointS
     ewidth = utils.edge_to_width(ebins)
     ectr = np.exp(utils.edge_to_center(np.log(ebins)))
 
-    r68 = psf.containment_angle(ectr, fraction=0.68)
+    psf_r68 = psf.containment_angle(ectr, fraction=0.68)
+    r68 = np.array(psf_r68, copy=True)
     if spatial_model != 'PointSource':
         r68[r68 < spatial_size] = spatial_size
 
@@ -137,12 +237,9 @@ def compute_ps_counts(ebins, exp, psf, bkg, fn, egy_dim=0, spatial_model='PointS
 
     if spatial_model == 'PointSource':
         sig_pdf = domega * psf.interp(ectr[:, np.newaxis], theta)
-    elif spatial_model == 'RadialGaussian':
-        sig_pdf = domega * utils.convolve2d_gauss(lambda t: psf.interp(ectr[:, np.newaxis, np.newaxis], t),
-                                                  theta, spatial_size / 1.5095921854516636, nstep=2000)
-    elif spatial_model == 'RadialDisk':
-        sig_pdf = domega * utils.convolve2d_disk(lambda t: psf.interp(ectr[:, np.newaxis, np.newaxis], t),
-                                                 theta, spatial_size / 0.8246211251235321)
+    elif spatial_model in ['RadialGaussian', 'RadialDisk']:
+        sig_pdf = domega * _convolve_psf(psf, ectr, theta, psf_r68,
+                                         spatial_model, spatial_size)
     else:
         raise ValueError('Invalid spatial model: {}'.format(spatial_model))
 
@@ -249,19 +346,28 @@ def _solve_norm(sig, bkg, ts_thresh, min_counts, sig_scale, sum_axes,
                                                     bkg, bkg_fit),
                             sum_axes)
 
-    vals = np.ones(ts.shape[:-1])
-    for idx, v in np.ndenumerate(ts[..., 0]):
+    sig_scale = np.broadcast_to(sig_scale, ts.shape)
+    ts = ts.reshape((-1, ts.shape[-1]))
+    scale = sig_scale.reshape(ts.shape)
+    nrow, npts = ts.shape
 
-        if ts[idx][0] >= ts_thresh:
-            vals[idx] = sig_scale[idx][0]
-            continue
+    # Find the first point above threshold at or after the TS minimum
+    # and interpolate linearly from the preceding point
+    imin = np.argmin(ts, axis=1)
+    above = (ts >= ts_thresh) & (np.arange(npts)[None, :] >= imin[:, None])
+    iup = np.where(np.any(above, axis=1), np.argmax(above, axis=1), npts - 1)
+    ilo = np.maximum(iup - 1, imin)
 
-        m = slice(np.argmin(ts[idx]), None)
-        vals[idx] = np.interp(ts_thresh, ts[idx][m], sig_scale[idx][m])
-        #fn = UnivariateSpline(ts[idx][m], sig_scale[idx][m], k=2, s=0)
-        #vals[idx] = fn(ts_thresh)
+    rows = np.arange(nrow)
+    ts_lo, ts_up = ts[rows, ilo], ts[rows, iup]
+    scale_lo, scale_up = scale[rows, ilo], scale[rows, iup]
+    dts = ts_up - ts_lo
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(dts > 0, (ts_thresh - ts_lo) / dts, 1.0)
+    vals = scale_lo + np.clip(w, 0.0, 1.0) * (scale_up - scale_lo)
+    vals[ts[:, 0] >= ts_thresh] = scale[ts[:, 0] >= ts_thresh, 0]
 
-    return vals
+    return vals.reshape(sig_scale.shape[:-1])
 
 
 class ExposureMap(HpxMap):
@@ -273,7 +379,8 @@ class ExposureMap(HpxMap):
     def create(cls, ltc, event_class, event_types, ebins):
         """Create an exposure map from a livetime cube.  This method will
         generate an exposure map with the same geometry as the
-        livetime cube (nside, etc.).
+        livetime cube (nside, etc.).  Partial-sky livetime cubes yield
+        exposure maps with the same pixels.
 
         Parameters
         ----------
@@ -295,11 +402,11 @@ class ExposureMap(HpxMap):
         exp = np.zeros((len(evals), ltc.hpx.npix))
         for et in event_types:
             aeff = create_aeff(event_class, et, evals, ltc.costh_center)
-            exp += np.sum(aeff.T[:, :, np.newaxis] *
-                          ltc.data[:, np.newaxis, :], axis=0)
+            exp += np.dot(aeff, ltc.data)
 
         hpx = HPX(ltc.hpx.nside, ltc.hpx.nest,
-                  ltc.hpx.coordsys, ebins=ebins)
+                  ltc.hpx.coordsys, region=ltc.hpx.region, ebins=ebins,
+                  ipix=ltc.hpx.ipix)
         return cls(exp, hpx)
 
 
@@ -686,16 +793,81 @@ def calc_exp(skydir, ltc, event_class, event_types,
     if npts is None:
         npts = int(np.ceil(np.max(cth_bins[1:] - cth_bins[:-1]) / 0.025))
 
-    exp = np.zeros((len(egy), len(cth_bins) - 1))
+    shape = (len(egy), len(cth_bins) - 1, npts)
     cth_bins = utils.split_bin_edges(cth_bins, npts)
     cth = edge_to_center(cth_bins)
     ltw = ltc.get_skydir_lthist(skydir, cth_bins).reshape(-1, npts)
+    aeff = get_irf_grids(None, event_class, event_types, None, egy, cth)[1]
+    return np.sum(aeff.reshape(shape) * ltw[np.newaxis, :, :], axis=-1)
+
+
+def get_irf_grids(rsp_fn, event_class, event_types, x, egy, cth):
+    """Return the response ``rsp_fn`` weighted by the effective area
+    and the effective area, both summed over event types.  The grids
+    are cached such that the IRFs are evaluated only once for a given
+    binning.
+
+    Parameters
+    ----------
+    rsp_fn : function
+        Function that evaluates the response (e.g. `create_edisp`) on
+        a grid of ``x``, true energy and incidence angle.  If None
+        only the effective area is computed.
+
+    egy : `~numpy.ndarray`
+        True energies in MeV.
+
+    cth : `~numpy.ndarray`
+        Cosine of the incidence angle.
+
+    Returns
+    -------
+    wrsp : `~numpy.ndarray`
+        Weighted response with shape (len(x), len(egy), len(cth)) or
+        None if ``rsp_fn`` is None.
+
+    aeff : `~numpy.ndarray`
+        Effective area with shape (len(egy), len(cth)).
+    """
+    name = None if rsp_fn is None else rsp_fn.__name__
+    key = (name, event_class, tuple(event_types)) + _array_key(egy, cth)
+    if rsp_fn is not None:
+        key += _array_key(x)
+
+    v = _cache_get(_irf_cache, key)
+    if v is not None:
+        return v
+
+    wrsp = None
+    aeff = np.zeros((len(egy), len(cth)))
     for et in event_types:
-        aeff = create_aeff(event_class, et, egy, cth)
-        aeff = aeff.reshape(exp.shape + (npts,))
-        exp += np.sum(aeff * ltw[np.newaxis, :, :], axis=-1)
+        aeff_et = create_aeff(event_class, et, egy, cth)
+        aeff += aeff_et
+        if rsp_fn is None:
+            continue
+        rsp = rsp_fn(event_class, et, x, egy, cth) * aeff_et[np.newaxis]
+        wrsp = rsp if wrsp is None else wrsp + rsp
+
+    for t in (wrsp, aeff):
+        if t is not None:
+            t.setflags(write=False)
+
+    v = (wrsp, aeff)
+    _cache_put(_irf_cache, key, v, _irf_cache_max_bytes)
+    return v
 
-    return exp
+
+def _weight_rsp(wrsp, aeff, ltw):
+    """Average a response over the subintervals of each incidence
+    angle bin with the livetime ``ltw`` (shape (ncth, npts)) and the
+    effective area as weights."""
+
+    ncth, npts = ltw.shape
+    wrsp = wrsp.reshape(wrsp.shape[:2] + (ncth, npts))
+    aeff = aeff.reshape(aeff.shape[:1] + (ncth, npts))
+    exps = np.sum(aeff * ltw[np.newaxis, :, :], axis=-1)
+    wrsp = np.einsum('ijkl,kl->ijk', wrsp, ltw)
+    return wrsp / exps[np.newaxis, :, :]
 
 
 def create_avg_rsp(rsp_fn, skydir, ltc, event_class, event_types, x,
@@ -704,25 +876,13 @@ def create_avg_rsp(rsp_fn, skydir, ltc, event_class, event_types, x,
     if npts is None:
         npts = int(np.ceil(np.max(cth_bins[1:] - cth_bins[:-1]) / 0.05))
 
-    wrsp = np.zeros((len(x), len(egy), len(cth_bins) - 1))
-    exps = np.zeros((len(egy), len(cth_bins) - 1))
-
     cth_bins = utils.split_bin_edges(cth_bins, npts)
     cth = edge_to_center(cth_bins)
     ltw = ltc.get_skydir_lthist(skydir, cth_bins)
     ltw = ltw.reshape(-1, npts)
 
-    for et in event_types:
-        rsp = rsp_fn(event_class, et, x, egy, cth)
-        aeff = create_aeff(event_class, et, egy, cth)
-        rsp = rsp.reshape(wrsp.shape + (npts,))
-        aeff = aeff.reshape(exps.shape + (npts,))
-        wrsp += np.sum(rsp * aeff[np.newaxis, :, :, :] *
-                       ltw[np.newaxis, np.newaxis, :, :], axis=-1)
-        exps += np.sum(aeff * ltw[np.newaxis, :, :], axis=-1)
-
-    wrsp /= exps[np.newaxis, :, :]
-    return wrsp
+    wrsp, aeff = get_irf_grids(rsp_fn, event_class, event_types, x, egy, cth)
+    return _weight_rsp(wrsp, aeff, ltw)
 
 
 def create_avg_psf(skydir, ltc, event_class, event_types, dtheta,
@@ -788,7 +948,7 @@ def create_wtd_psf(skydir, ltc, event_class, event_types, dtheta,
     """
     #npts = int(np.ceil(32. / bins_per_dec(egy_bins)))
     egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
-    etrue_bins = 10**np.linspace(1.0, 6.5, nbin * 5.5 + 1)
+    etrue_bins = _etrue_bins(nbin)
     etrue = 10**utils.edge_to_center(np.log10(etrue_bins))
 
     psf = create_avg_psf(skydir, ltc, event_class, event_types, dtheta,
@@ -815,20 +975,59 @@ def create_wtd_psf(skydir, ltc, event_class, event_types, dtheta,
 
 
 def calc_drm(skydir, ltc, event_class, event_types,
-             egy_bins, cth_bins, nbin=64):
-    """Calculate the detector response matrix."""
+             egy_bins, cth_bins, nbin=64, lthist_tol=1E-4):
+    """Calculate the detector response matrix.  Matrices are cached
+    on the IRFs, the binning and the livetime distribution of the
+    sky position quantized to a fraction ``lthist_tol`` of the total
+    livetime such that the matrix is reused for sky positions with
+    the same observing profile.
+
+    Parameters
+    ----------
+    egy_bins : `~numpy.ndarray`
+        Bin edges in observed energy in MeV.
+
+    cth_bins : `~numpy.ndarray`
+        Bin edges in cosine of the true incidence angle.
+
+    nbin : int
+        Number of bins per decade in true energy.
+
+    lthist_tol : float
+        Quantization of the livetime distribution used to look up
+        cached matrices.
+
+    Returns
+    -------
+    drm : `~numpy.ndarray`
+        Read-only array with the response vs. observed energy, true
+        energy and incidence angle.
+    """
     npts = int(np.ceil(128. / bins_per_dec(egy_bins)))
-    egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
+    cth_npts = int(np.ceil(np.max(cth_bins[1:] - cth_bins[:-1]) / 0.05))
+    cth_fine = utils.split_bin_edges(cth_bins, cth_npts)
+    ltw = ltc.get_skydir_lthist(skydir, cth_fine).reshape(-1, cth_npts)
+
+    key = (event_class, tuple(event_types), nbin, lthist_tol,
+           _quantize_lthist(ltw, lthist_tol)) + _array_key(egy_bins, cth_bins)
+    drm = _cache_get(_drm_cache, key)
+    if drm is not None:
+        return drm
 
-    etrue_bins = 10**np.linspace(1.0, 6.5, nbin * 5.5 + 1)
+    egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
+    etrue_bins = _etrue_bins(nbin)
     egy = 10**utils.edge_to_center(np.log10(egy_bins))
     egy_width = utils.edge_to_width(egy_bins)
     etrue = 10**utils.edge_to_center(np.log10(etrue_bins))
-    edisp = create_avg_edisp(skydir, ltc, event_class, event_types,
-                             egy, etrue, cth_bins)
+    wrsp, aeff = get_irf_grids(create_edisp, event_class, event_types,
+                               egy, etrue, edge_to_center(cth_fine))
+    edisp = _weight_rsp(wrsp, aeff, ltw)
     edisp = edisp * egy_width[:, None, None]
-    edisp = sum_bins(edisp, 0, npts)
-    return edisp
+    drm = sum_bins(edisp, 0, npts)
+    drm.setflags(write=False)
+
+    _cache_put(_drm_cache, key, drm, _drm_cache_max_bytes)
+    return drm
 
 
 def calc_counts(skydir, ltc, event_class, event_types,
@@ -882,19 +1081,70 @@ def calc_counts_edisp(skydir, ltc, event_class, event_types,
         Number of points by which to oversample each energy bin.
 
     """
-    #npts = int(np.ceil(32. / bins_per_dec(egy_bins)))
+    return calc_counts_edisp_batch(skydir, ltc, event_class, event_types,
+                                   egy_bins, cth_bins, [fn], nbin=nbin,
+                                   npts=npts)[0, 0]
+
+
+def calc_counts_edisp_batch(skydir, ltc, event_class, event_types,
+                            egy_bins, cth_bins, fns, nbin=64, npts=1,
+                            lthist_tol=1E-4):
+    """Calculate the expected counts vs. observed energy and true
+    incidence angle for a set of sky positions and spectral models.
+    The true-energy counts of all spectra are folded with the
+    detector response matrix of each position with one matrix-matrix
+    product per incidence angle bin.  Response matrices are shared
+    by positions with the same observing profile (see `calc_drm`).
+
+    Parameters
+    ----------
+    skydir : `~astropy.coordinate.SkyCoord`
+        Scalar or array of sky positions.
+
+    ltc : `~fermipy.irfs.LTCube`
+
+    egy_bins : `~numpy.ndarray`
+        Bin edges in observed energy in MeV.
+
+    cth_bins : `~numpy.ndarray`
+        Bin edges in cosine of the true incidence angle.
+
+    fns : list
+        List of spectral models.
+
+    npts : int
+        Number of points by which to oversample each energy bin.
+
+    Returns
+    -------
+    cnts : `~numpy.ndarray`
+        Array of counts with shape (nskydir, nfn, negy, ncth).
+    """
+
+    skydirs = [skydir] if skydir.isscalar else list(skydir.ravel())
 
     # Split energy bins
     egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
-    etrue_bins = 10**np.linspace(1.0, 6.5, nbin * 5.5 + 1)
-    drm = calc_drm(skydir, ltc, event_class, event_types,
-                   egy_bins, cth_bins, nbin=nbin)
-    cnts_etrue = calc_counts(skydir, ltc, event_class, event_types,
-                             etrue_bins, cth_bins, fn)
-
-    cnts = np.sum(cnts_etrue[None, :, :] * drm[:, :, :], axis=1)
-    cnts = sum_bins(cnts, 0, npts)
-    return cnts
+    etrue_bins = _etrue_bins(nbin)
+    dnde = np.array([fn.dnde(etrue_bins) for fn in fns])
+
+    cnts = np.zeros((len(skydirs), len(fns), len(egy_bins) - 1,
+                     len(cth_bins) - 1))
+    for i, c in enumerate(skydirs):
+
+        drm = calc_drm(c, ltc, event_class, event_types,
+                       egy_bins, cth_bins, nbin=nbin, lthist_tol=lthist_tol)
+        exp = calc_exp(c, ltc, event_class, event_types,
+                       etrue_bins, cth_bins)
+        cnts_etrue = loglog_quad(etrue_bins,
+                                 exp[None, :, :] * dnde[:, :, None], 1)
+
+        # (ncth, negy, netrue) x (ncth, netrue, nfn)
+        v = np.matmul(np.transpose(drm, (2, 0, 1)),
+                      np.transpose(cnts_etrue, (2, 1, 0)))
+        cnts[i] = np.transpose(v, (2, 1, 0))
+
+    return sum_bins(cnts, 2, npts)
 
 
 def calc_wtd_exp(skydir, ltc, event_class, event_types,
@@ -8,7 +8,9 @@ import sys
 import os
 
 from fermipy.jobs.chain import Link
-import GtApp
+from fermipy.lazy_import import LazyModule
+
+GtApp = LazyModule('GtApp')
 
 
 def extract_parameters(pil, keys=None):
@@ -0,0 +1,301 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Cache for PSF-convolved spatial kernels.  Kernels are stored in a
+bounded in-memory LRU cache and optionally in an on-disk store that
+persists between sessions.  Entries are keyed on a fingerprint of the
+PSF model together with the arguments of the kernel function (spatial
+model, width, number of pixels, pixel size, etc.).
+
+The on-disk store is enabled by setting the ``FERMIPY_KERNEL_CACHE``
+environment variable to a directory path or by calling
+`~fermipy.kernel_cache.KernelCache.set_cachedir` on
+``fermipy.kernel_cache.kernel_cache``.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import hashlib
+import inspect
+import functools
+import tempfile
+from collections import OrderedDict
+import numpy as np
+
+
+class KernelCache(object):
+    """Bounded LRU cache of numpy arrays with an optional on-disk
+    store.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum size in bytes of the arrays held in memory.  The least
+        recently used arrays are evicted when this limit is exceeded.
+
+    cachedir : str
+        Directory of the on-disk store.  If None arrays are only
+        cached in memory.
+    """
+
+    def __init__(self, max_bytes=2**28, cachedir=None):
+        self._max_bytes = int(max_bytes)
+        self._cachedir = None
+        self._data = OrderedDict()
+        self._nbytes = 0
+        self.set_cachedir(cachedir)
+        self.reset_stats()
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        self._max_bytes = int(max_bytes)
+        self._evict()
+
+    @property
+    def cachedir(self):
+        return self._cachedir
+
+    def set_cachedir(self, cachedir):
+        """Set the directory of the on-disk store.  If None the
+        on-disk store is disabled."""
+        if cachedir is not None:
+            cachedir = os.path.expandvars(os.path.expanduser(cachedir))
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+        self._cachedir = cachedir
+
+    def reset_stats(self):
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0,
+                       'evictions': 0}
+
+    def stats(self):
+        """Return a dictionary with the number of memory hits, disk
+        hits, misses and evictions together with the current number
+        and size in bytes of the arrays held in memory."""
+        o = dict(self._stats)
+        o['nitems'] = len(self._data)
+        o['nbytes'] = self._nbytes
+        return o
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data or os.path.isfile(self._diskpath(key))
+
+    def _diskpath(self, key):
+        if self._cachedir is None:
+            return ''
+        return os.path.join(self._cachedir, '%s.npy' % key)
+
+    def _evict(self):
+        while self._nbytes > self._max_bytes and self._data:
+            k, v = self._data.popitem(last=False)
+            self._nbytes -= v.nbytes
+            self._stats['evictions'] += 1
+
+    def _insert(self, key, value):
+        if value.nbytes > self._max_bytes:
+            return
+        if key in self._data:
+            self._nbytes -= self._data.pop(key).nbytes
+        self._data[key] = value
+        self._nbytes += value.nbytes
+        self._evict()
+
+    def get(self, key):
+        """Return a copy of the array stored under ``key`` or None if
+        the key is not in the cache."""
+
+        value = self._data.pop(key, None)
+        if value is not None:
+            self._data[key] = value
+            self._stats['hits'] += 1
+            return value.copy()
+
+        path = self._diskpath(key)
+        if path and os.path.isfile(path):
+            try:
+                value = np.load(path, allow_pickle=False)
+            except (IOError, OSError, ValueError):
+                value = None
+            if value is not None:
+                self._insert(key, value)
+                self._stats['disk_hits'] += 1
+                return value.copy()
+
+        self._stats['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        """Store a copy of an array under ``key``."""
+
+        value = np.array(value)
+        self._insert(key, value)
+
+        path = self._diskpath(key)
+        if not path or os.path.isfile(path):
+            return
+
+        # Write to a temporary file first such that concurrent
+        # processes never read a partial file
+        fd, tmpfile = tempfile.mkstemp(suffix='.npy', dir=self._cachedir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, value, allow_pickle=False)
+            os.rename(tmpfile, path)
+        except (IOError, OSError):
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+
+    def clear(self, disk=False):
+        """Remove all arrays from memory and optionally from the
+        on-disk store."""
+
+        self._data.clear()
+        self._nbytes = 0
+
+        if not disk or self._cachedir is None:
+            return
+
+        for f in os.listdir(self._cachedir):
+            if f.endswith('.npy'):
+                os.remove(os.path.join(self._cachedir, f))
+
+
+kernel_cache = KernelCache(cachedir=os.environ.get('FERMIPY_KERNEL_CACHE',
+                                                   None))
+
+
+def psf_fingerprint(psf):
+    """Compute a hash that identifies the tabulated values of a
+    `~fermipy.irfs.PSFModel`."""
+
+    h = hashlib.sha1()
+    for v in [psf.dtheta, psf.energies, psf.val,
+              getattr(psf, '_wts', None), getattr(psf, '_cth_bins', None)]:
+        if v is None:
+            continue
+        v = np.ascontiguousarray(v, dtype=float)
+        h.update(str(v.shape).encode('utf-8'))
+        h.update(v.tobytes())
+
+    if psf.scale_fn is not None:
+        h.update(_scale_fn_values(psf, psf.scale_fn).tobytes())
+
+    return h.hexdigest()
+
+
+def _scale_fn_values(psf, scale_fn):
+    return np.array([scale_fn(e) for e in psf.energies], dtype=float)
+
+
+def _hash_arg(h, v):
+    """Add an argument value to a hash.  Returns False if the value
+    cannot be hashed reproducibly."""
+
+    if v is None or isinstance(v, (bool, int, float, np.number, str)):
+        h.update(repr(v).encode('utf-8'))
+    elif isinstance(v, np.ndarray):
+        h.update(str(v.shape).encode('utf-8'))
+        h.update(np.ascontiguousarray(v, dtype=float).tobytes())
+    elif isinstance(v, (list, tuple)):
+        h.update(b'(')
+        for t in v:
+            if not _hash_arg(h, t):
+                return False
+        h.update(b')')
+    elif callable(v) and _get_qualname(v) is not None:
+        h.update(('%s.%s' % (v.__module__, _get_qualname(v))).encode('utf-8'))
+    else:
+        return False
+    return True
+
+
+def _get_qualname(fn):
+    """Return the qualified name of a function or None if the name
+    does not identify the function uniquely.  This is the case for
+    lambdas, functions defined inside another function and closures
+    whose result depends on the values of the enclosing scope.
+    Decorated functions (with a ``__wrapped__`` attribute) are
+    identified by the name of the wrapped function."""
+
+    name = getattr(fn, '__qualname__', getattr(fn, '__name__', None))
+    if name is None or '<lambda>' in name or '<locals>' in name:
+        return None
+    elif (getattr(fn, '__closure__', None) is not None and
+          not hasattr(fn, '__wrapped__')):
+        return None
+    return name
+
+
+def make_kernel_key(fn, psf, args, psf_scale_fn=None):
+    """Create the cache key of a kernel.
+
+    Parameters
+    ----------
+    fn : callable
+        The kernel function.
+
+    psf : `~fermipy.irfs.PSFModel`
+        PSF model.
+
+    args : dict
+        Dictionary of the remaining arguments of the kernel function.
+
+    psf_scale_fn : callable
+        PSF scaling function.  This is identified by its values at
+        the energies of the PSF model.
+
+    Returns
+    -------
+    key : str
+        Hash string or None if the arguments cannot be hashed.
+    """
+
+    name = _get_qualname(fn)
+    if name is None:
+        return None
+
+    h = hashlib.sha1()
+    h.update(('%s.%s' % (fn.__module__, name)).encode('utf-8'))
+    h.update(psf_fingerprint(psf).encode('utf-8'))
+    for k in sorted(args.keys()):
+        h.update(k.encode('utf-8'))
+        if not _hash_arg(h, args[k]):
+            return None
+
+    if psf_scale_fn is not None:
+        h.update(_scale_fn_values(psf, psf_scale_fn).tobytes())
+
+    return h.hexdigest()
+
+
+def cached_kernel(fn):
+    """Decorator for kernel functions with the signature ``fn(psf,
+    ...)`` that caches the returned array in
+    ``fermipy.kernel_cache.kernel_cache``.  The ``psf_scale_fn``
+    argument, if present, is identified by its values at the PSF
+    energies."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+
+        callargs = inspect.getcallargs(fn, *args, **kwargs)
+        psf = callargs.pop('psf')
+        psf_scale_fn = callargs.pop('psf_scale_fn', None)
+        key = make_kernel_key(fn, psf, callargs, psf_scale_fn)
+
+        if key is not None:
+            k = kernel_cache.get(key)
+            if k is not None:
+                return k
+
+        k = fn(*args, **kwargs)
+        if key is not None:
+            kernel_cache.put(key, k)
+        return k
+
+    return wrapper
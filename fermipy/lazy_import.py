@@ -0,0 +1,53 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Deferred imports of expensive modules.  A `LazyModule` stands in for a
+module and imports it on first attribute access, which keeps
+``import fermipy`` and the command-line tools that never touch
+e.g. healpy from paying its import time.
+"""
+from __future__ import absolute_import, division, print_function
+import importlib
+
+
+class LazyModule(object):
+    """Proxy for a module that is imported on first use.
+
+    Parameters
+    ----------
+    name : str
+        Fully qualified name of the module (e.g. ``'scipy.optimize'``).
+
+    on_load : callable, optional
+        Function that is called with the module after it is imported
+        (e.g. to initialize a library).
+    """
+
+    def __init__(self, name, on_load=None):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+        self.__dict__['_lazy_on_load'] = on_load
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_lazy_name'])
+            on_load = self.__dict__['_lazy_on_load']
+            if on_load is not None:
+                on_load(module)
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            return '<lazy module %r>' % self.__dict__['_lazy_name']
+        return repr(module)
@@ -16,20 +16,18 @@ import numpy as np
 
 import fermipy.config as config
 import fermipy.utils as utils
-import fermipy.gtutils as gtutils
 import fermipy.roi_model as roi_model
 import fermipy.gtanalysis
 from fermipy import defaults
 from fermipy import fits_utils
 from fermipy.config import ConfigSchema
-from fermipy.gtutils import FreeParameterState
-
-import pyLikelihood as pyLike
+from fermipy.lazy_import import LazyModule
 from astropy.io import fits
 from astropy.time import Time
 from astropy.table import Table, Column
 
-import pyLikelihood as pyLike
+pyLike = LazyModule('pyLikelihood')
+gtutils = LazyModule('fermipy.gtutils')
 
 
 def _fit_lc(gta, name, **kwargs):
@@ -53,7 +51,7 @@ def _fit_lc(gta, name, **kwargs):
     if name in free_sources:
         free_sources.remove(name)
 
-    free_state = FreeParameterState(gta)
+    free_state = gtutils.FreeParameterState(gta)
     gta.free_sources(free=False)
     gta.free_sources_by_name(free_sources + [name], pars='norm')
     gta.fit()
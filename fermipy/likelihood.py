@@ -0,0 +1,984 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Standalone binned Poisson likelihood for fits in which only the
+normalizations of a set of sources are free.  The model for each
+analysis component is the sum of a fixed background cube and a linear
+combination of per-source model-count templates:
+
+.. math::
+
+   \\mu_i = b_i + \\sum_j x_j T_{ji}
+
+The log-likelihood, its gradient and its Hessian with respect to the
+normalizations are evaluated in vectorized form with numpy and the
+fit is performed with a bounded, damped Newton method.  Templates can
+be stored as dense arrays or as `scipy.sparse` matrices.
+"""
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from fermipy.lazy_import import LazyModule
+
+sparse = LazyModule('scipy.sparse')
+
+
+def _is_sparse(m):
+    return sparse.issparse(m)
+
+
+def _as_template_matrix(templates, nbin, sparse_threshold):
+    """Convert a sequence of templates to a matrix with shape (ntemplate,
+    nbin).  The matrix is stored in sparse (CSR) form when the fraction
+    of non-zero elements is below ``sparse_threshold``."""
+
+    if _is_sparse(templates):
+        return sparse.csr_matrix(templates, dtype=float)
+
+    if len(templates) == 0:
+        return np.zeros((0, nbin))
+
+    rows = []
+    for t in templates:
+        if _is_sparse(t):
+            rows += [sparse.csr_matrix(t.reshape((1, -1)), dtype=float)]
+        else:
+            rows += [np.asarray(t, dtype=float).reshape((1, -1))]
+
+    if any(_is_sparse(r) for r in rows):
+        m = sparse.vstack(rows, format='csr')
+    else:
+        m = np.vstack(rows)
+
+    if m.shape[1] != nbin:
+        raise Exception('Template shape does not match counts shape.')
+
+    if not _is_sparse(m) and sparse_threshold > 0:
+        if np.count_nonzero(m) < sparse_threshold * m.size:
+            m = sparse.csr_matrix(m)
+
+    return m
+
+
+class LikelihoodComponent(object):
+    """Data and model cubes of a single binned analysis component.
+
+    Parameters
+    ----------
+    counts : `~numpy.ndarray`
+        Counts cube.  The first dimension is energy.
+
+    templates : list
+        List of model-counts cubes (one per source) evaluated for a
+        normalization of one.  Each template must have the same shape
+        as ``counts``.  Templates may be dense arrays or
+        `scipy.sparse` matrices with one row per energy bin.
+
+    bkg : `~numpy.ndarray`
+        Model-counts cube of the fixed part of the model.  If None the
+        fixed model is zero.
+
+    weights : `~numpy.ndarray`
+        Likelihood weights cube.  If None all bins have unit weight.
+
+    sparse_threshold : float
+        Templates with a fraction of non-zero bins below this value
+        are stored as sparse matrices.
+    """
+
+    def __init__(self, counts, templates, bkg=None, weights=None,
+                 sparse_threshold=0.1):
+
+        counts = np.asarray(counts, dtype=float)
+        self._shape = counts.shape
+        self._nebin = counts.shape[0]
+        self._npix = int(counts.size // self._nebin)
+        self._counts = counts.ravel()
+
+        if bkg is None:
+            self._bkg = np.zeros(counts.size)
+        else:
+            self._bkg = np.array(bkg, dtype=float).ravel()
+
+        if weights is None:
+            self._weights = None
+        else:
+            self._weights = np.array(weights, dtype=float).ravel()
+
+        if self._bkg.size != counts.size:
+            raise Exception('Background shape does not match counts shape.')
+
+        if self._weights is not None and self._weights.size != counts.size:
+            raise Exception('Weights shape does not match counts shape.')
+
+        self._templates = _as_template_matrix(templates, counts.size,
+                                              sparse_threshold)
+        self.set_energy_bins()
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ntemplate(self):
+        return self._templates.shape[0]
+
+    @property
+    def nebin(self):
+        return self._nebin
+
+    def set_energy_bins(self, imin=None, imax=None):
+        """Restrict the likelihood to the energy bins in the range
+        [imin, imax).  If no arguments are given all energy bins are
+        used."""
+
+        imin = 0 if imin is None else int(imin)
+        imax = self._nebin if imax is None else int(imax)
+        s = slice(imin * self._npix, imax * self._npix)
+
+        counts = self._counts[s]
+        bkg = self._bkg[s]
+        templates = self._templates[:, s]
+        weights = None if self._weights is None else self._weights[s]
+
+        # Drop bins with zero weight or that can never contribute
+        if _is_sparse(templates):
+            used = np.asarray(abs(templates).sum(axis=0)).ravel() > 0
+        else:
+            used = np.any(templates != 0, axis=0)
+        m = (counts > 0) | (bkg != 0) | used
+        if weights is not None:
+            m &= weights > 0
+
+        self._ebins = (imin, imax)
+        self._idx = s.start + np.where(m)[0]
+        self._ie = np.where(m)[0] // self._npix
+        self._c = counts[m]
+        self._b = bkg[m]
+        self._t = templates[:, np.where(m)[0]] if _is_sparse(templates) \
+            else templates[:, m]
+        self._w = None if weights is None else weights[m]
+
+        # Weighted counts
+        self._wc = self._c if self._w is None else self._w * self._c
+
+    @property
+    def energy_bins(self):
+        return self._ebins
+
+    def set_counts(self, counts):
+        """Replace the counts cube (e.g. with a simulated realization
+        of the model).  The selection of bins is only recomputed if
+        the new counts populate a bin that was previously dropped."""
+
+        counts = np.asarray(counts, dtype=float).ravel()
+        if counts.size != self._counts.size:
+            raise Exception('Counts shape does not match counts shape '
+                            'of the likelihood component.')
+
+        s = slice(self._ebins[0] * self._npix, self._ebins[1] * self._npix)
+        m = counts[s] > 0
+        if self._weights is not None:
+            m &= self._weights[s] > 0
+
+        self._counts = counts
+        if np.count_nonzero(counts[self._idx]) < np.count_nonzero(m):
+            self.set_energy_bins(*self._ebins)
+            return
+
+        self._c = counts[self._idx]
+        self._wc = self._c if self._w is None else self._w * self._c
+
+    def model(self, norms):
+        """Model-counts vector for the selected bins."""
+        norms = np.asarray(norms, dtype=float)
+        if norms.ndim == 2:
+            return self._b[:, None] + self._t.T.dot(norms)
+        return self._b + self._t.T.dot(norms)
+
+    def loglike(self, norms):
+        """Evaluate the Poisson log-likelihood.  ``norms`` may be a
+        vector of normalizations or an array with shape (ntemplate,
+        nvals) in which case the likelihood is evaluated for each
+        column."""
+
+        mu = self.model(norms)
+        return self._loglike(mu)
+
+    def loglike_ebin(self, norms):
+        """Evaluate the Poisson log-likelihood separately in each of
+        the selected energy bins.  Returns an array with shape
+        (nebin,) or (nebin, nvals) when ``norms`` is two-dimensional."""
+
+        mu = self.model(norms)
+        nebin = self._ebins[1] - self._ebins[0]
+        ie = self._ie
+
+        c = self._c if mu.ndim == 1 else self._c[:, None]
+        w = self._w if (self._w is None or mu.ndim == 1) else \
+            self._w[:, None]
+
+        logmu = np.zeros(mu.shape)
+        ok = (c > 0) & (mu > 0)
+        if mu.ndim == 2:
+            ok = np.broadcast_to(ok, mu.shape)
+        logmu[ok] = np.log(mu[ok])
+        bad = (c > 0) & (mu <= 0)
+
+        wc = c if w is None else w * c
+        wmu = mu if w is None else w * mu
+        terms = wc * logmu - wmu
+
+        # Elements are ordered by energy bin so the sums over each bin
+        # are contiguous segments
+        lnl = np.zeros((nebin,) + mu.shape[1:])
+        nbad = np.zeros((nebin,) + mu.shape[1:])
+        if len(ie):
+            ibin, istart = np.unique(ie, return_index=True)
+            lnl[ibin] = np.add.reduceat(terms, istart, axis=0)
+            nbad[ibin] = np.add.reduceat(bad.astype(float), istart, axis=0)
+
+        lnl[nbad > 0] = -np.inf
+        return lnl
+
+    def _loglike(self, mu):
+        c = self._c if mu.ndim == 1 else self._c[:, None]
+        w = self._w if (self._w is None or mu.ndim == 1) else \
+            self._w[:, None]
+
+        m = c > 0
+        if mu.ndim == 2:
+            m = np.broadcast_to(m, mu.shape)
+        bad = np.any((mu <= 0) & m, axis=0)
+
+        logmu = np.zeros(mu.shape)
+        ok = m & (mu > 0)
+        logmu[ok] = np.log(mu[ok])
+
+        wmu = mu if w is None else w * mu
+        lnl = np.dot(self._wc, logmu) - np.sum(wmu, axis=0)
+
+        if mu.ndim == 1:
+            return -np.inf if bad else lnl
+
+        lnl[bad] = -np.inf
+        return lnl
+
+    def gradient_hessian(self, norms, idx=None):
+        """Compute the gradient and Hessian of the log-likelihood with
+        respect to the template normalizations.  If ``idx`` is given
+        the derivatives are only computed for the templates with
+        these indices."""
+
+        mu = self.model(norms)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.where(self._c > 0, self._c / mu, 0.0)
+            h = np.where(self._c > 0, self._c / mu**2, 0.0)
+
+        if self._w is not None:
+            r = self._w * (r - 1.0)
+            h = self._w * h
+        else:
+            r = r - 1.0
+
+        t = self._t if idx is None else self._t[idx]
+        grad = np.asarray(t.dot(r)).ravel()
+        if _is_sparse(t):
+            hess = -np.asarray(t.multiply(h).dot(t.T).todense())
+        else:
+            hess = -np.dot(t * h, t.T)
+
+        return grad, hess
+
+
+class NormLikelihood(object):
+    """Binned Poisson likelihood summed over one or more analysis
+    components in which the free parameters are the normalizations of
+    a common set of templates.
+
+    Parameters
+    ----------
+    components : list
+        List of `~fermipy.likelihood.LikelihoodComponent` objects.
+        All components must have the same number of templates.
+
+    norms : `~numpy.ndarray`
+        Initial values of the normalizations.  Defaults to one.
+
+    bounds : `~numpy.ndarray`
+        Array with shape (ntemplate, 2) with the lower and upper
+        bound of each normalization.  Defaults to [0, inf].
+
+    free : `~numpy.ndarray`
+        Boolean mask of the free normalizations.  Fixed
+        normalizations are held at their current value.
+    """
+
+    def __init__(self, components, norms=None, bounds=None, free=None):
+
+        self._components = list(components)
+        ntemplate = set([c.ntemplate for c in self._components])
+        if len(ntemplate) != 1:
+            raise Exception('Components must have the same number '
+                            'of templates.')
+        self._npar = ntemplate.pop()
+
+        if norms is None:
+            norms = np.ones(self._npar)
+        self._norms = np.array(norms, dtype=float, ndmin=1)
+
+        if bounds is None:
+            bounds = np.array([[0.0, np.inf]] * self._npar)
+        self._bounds = np.array(bounds, dtype=float).reshape((-1, 2))
+
+        if free is None:
+            free = np.ones(self._npar, dtype=bool)
+        self._free = np.array(free, dtype=bool, ndmin=1)
+
+        self._prior_vals = np.zeros(self._npar)
+        self._prior_errs = np.ones(self._npar)
+        self._has_prior = np.zeros(self._npar, dtype=bool)
+
+    @property
+    def components(self):
+        return self._components
+
+    @property
+    def npar(self):
+        return self._npar
+
+    @property
+    def norms(self):
+        return self._norms
+
+    @norms.setter
+    def norms(self, norms):
+        self._norms = np.array(norms, dtype=float, ndmin=1)
+
+    @property
+    def bounds(self):
+        return self._bounds
+
+    @bounds.setter
+    def bounds(self, bounds):
+        self._bounds = np.array(bounds, dtype=float).reshape((-1, 2))
+
+    @property
+    def free(self):
+        return self._free
+
+    @free.setter
+    def free(self, free):
+        self._free = np.array(free, dtype=bool, ndmin=1)
+
+    def set_energy_bins(self, imin=None, imax=None):
+        """Restrict all components to the energy bins [imin, imax)."""
+        for c in self._components:
+            c.set_energy_bins(imin, imax)
+
+    def set_energy_bin(self, ebin=None):
+        """Restrict all components to a single energy bin.  If ``ebin``
+        is None all energy bins are used."""
+        if ebin is None or ebin < 0:
+            self.set_energy_bins()
+        else:
+            self.set_energy_bins(ebin, ebin + 1)
+
+    def set_priors(self, vals, errs, has_prior=None):
+        """Set gaussian priors on the normalizations.
+
+        Parameters
+        ----------
+        vals : `~numpy.ndarray`
+            Prior mean of each normalization.
+
+        errs : `~numpy.ndarray`
+            Prior width of each normalization.
+
+        has_prior : `~numpy.ndarray`
+            Boolean mask selecting the normalizations with a prior.
+            Defaults to all.
+        """
+        self._prior_vals = np.array(vals, dtype=float, ndmin=1)
+        self._prior_errs = np.array(errs, dtype=float, ndmin=1)
+        if has_prior is None:
+            has_prior = np.ones(self._npar, dtype=bool)
+        self._has_prior = np.array(has_prior, dtype=bool, ndmin=1)
+
+    def clear_priors(self):
+        self._has_prior = np.zeros(self._npar, dtype=bool)
+
+    def _prior_loglike(self, norms):
+        if not np.any(self._has_prior):
+            return 0.0
+        m = self._has_prior
+        dx = (norms[m] - self._prior_vals[m, None]
+              if norms.ndim == 2 else norms[m] - self._prior_vals[m])
+        sig = (self._prior_errs[m, None] if norms.ndim == 2 else
+               self._prior_errs[m])
+        return -0.5 * np.sum((dx / sig)**2, axis=0)
+
+    def loglike(self, norms=None):
+        """Evaluate the log-likelihood including priors.  ``norms`` may
+        be an array with shape (npar, nvals) to evaluate the
+        likelihood for several sets of normalizations at once."""
+        if norms is None:
+            norms = self._norms
+        norms = np.asarray(norms, dtype=float)
+        lnl = self._prior_loglike(norms)
+        for c in self._components:
+            lnl = lnl + c.loglike(norms)
+        return lnl
+
+    def gradient_hessian(self, norms=None, idx=None):
+        """Gradient and Hessian of the log-likelihood including
+        priors.  If ``idx`` is given the derivatives are only
+        computed for the normalizations with these indices."""
+        if norms is None:
+            norms = self._norms
+        norms = np.asarray(norms, dtype=float)
+        idx = np.arange(self._npar) if idx is None else np.asarray(idx)
+        grad = np.zeros(len(idx))
+        hess = np.zeros((len(idx), len(idx)))
+        for c in self._components:
+            g, h = c.gradient_hessian(norms, idx)
+            grad += g
+            hess += h
+
+        m = self._has_prior[idx]
+        if np.any(m):
+            i = idx[m]
+            sig2 = self._prior_errs[i]**2
+            grad[m] -= (norms[i] - self._prior_vals[i]) / sig2
+            hess[m, m] -= 1.0 / sig2
+
+        return grad, hess
+
+    def fit(self, tol=1E-3, max_iter=100, init_lambda=1E-4):
+        """Maximize the likelihood with respect to the free
+        normalizations using a bounded Newton method.  The step is
+        damped with a Levenberg-Marquardt term, truncated at the
+        parameter bounds and shortened until the likelihood
+        increases.  Parameters sitting on a bound with a
+        gradient pointing out of the allowed region are held fixed
+        for that iteration.
+
+        Parameters
+        ----------
+        tol : float
+            Convergence threshold on the estimated distance to the
+            maximum (EDM).
+
+        max_iter : int
+            Maximum number of iterations.
+
+        init_lambda : float
+            Damping parameter added to the diagonal of the Hessian.  A
+            value of zero disables damping.
+
+        Returns
+        -------
+        o : dict
+            Dictionary with the best-fit normalizations (``values``),
+            their errors and covariance, the log-likelihood, the EDM,
+            the number of iterations and the fit status (0 = ok, 1 =
+            maximum number of iterations reached, 2 = failure).
+        """
+
+        x = np.clip(self._norms, self._bounds[:, 0], self._bounds[:, 1])
+        free = self._free.copy()
+        lnl = self.loglike(x)
+        edm = np.inf
+        status = 1
+
+        if not np.any(free):
+            status = 0
+            max_iter = 0
+        elif not np.isfinite(lnl):
+            status = 2
+            max_iter = 0
+
+        # Derivatives are only evaluated for the free normalizations
+        ifree = np.where(free)[0]
+        lo = self._bounds[ifree, 0]
+        hi = self._bounds[ifree, 1]
+
+        niter = 0
+        for niter in range(1, max_iter + 1):
+
+            grad, hess = self.gradient_hessian(x, ifree)
+
+            # Hold parameters at a bound when the gradient points
+            # outside the allowed region
+            at_lo = (x[ifree] <= lo) & (grad < 0)
+            at_hi = (x[ifree] >= hi) & (grad > 0)
+            m = ~at_lo & ~at_hi
+
+            if not np.any(m):
+                edm = 0.0
+                status = 0
+                break
+
+            g = grad[m]
+            a = -hess[np.ix_(m, m)]
+            try:
+                dx = np.linalg.solve(a + init_lambda * np.diag(np.diag(a)),
+                                     g)
+            except np.linalg.LinAlgError:
+                status = 2
+                break
+
+            edm = 0.5 * np.dot(g, dx)
+            if not edm > 0:
+                # Hessian is not negative definite; fall back to a
+                # diagonal step
+                dx = g / np.abs(np.diag(a))
+                edm = 0.5 * np.dot(g, dx)
+
+            # Backtracking line search on the bounded step
+            step = 1.0
+            while step > 1E-10:
+                x1 = x.copy()
+                x1[ifree[m]] = np.clip(x[ifree[m]] + step * dx,
+                                       lo[m], hi[m])
+                lnl1 = self.loglike(x1)
+                if np.isfinite(lnl1) and lnl1 >= lnl:
+                    break
+                step *= 0.5
+            else:
+                status = 0 if edm < tol else 2
+                break
+
+            x, lnl = x1, lnl1
+            if edm < tol:
+                status = 0
+                break
+
+        self._norms = x
+        o = {'values': x.copy(),
+             'errors': np.zeros(self._npar),
+             'covariance': np.zeros((self._npar, self._npar)),
+             'loglike': lnl,
+             'edm': edm,
+             'niter': niter,
+             'fit_status': status}
+
+        if np.any(free):
+            grad, hess = self.gradient_hessian(x, ifree)
+            a = -hess
+            try:
+                cov = np.linalg.inv(a)
+            except np.linalg.LinAlgError:
+                cov = np.linalg.pinv(a)
+            o['covariance'][np.ix_(free, free)] = cov
+            o['errors'][free] = np.sqrt(np.abs(np.diag(cov)))
+
+        return o
+
+    def find_blocks(self, threshold=0.1, order=None):
+        """Partition the free normalizations into blocks of weakly
+        correlated parameters.  Two normalizations are correlated
+        when the normalized off-diagonal element of the Hessian
+        :math:`|H_{ij}|/\\sqrt{H_{ii}H_{jj}}` exceeds ``threshold``,
+        i.e. when the model counts of the two templates overlap in
+        bins with counts.  Parameters are assigned greedily to the
+        first block that contains no parameter correlated with them.
+
+        Parameters
+        ----------
+        threshold : float
+            Maximum correlation of two parameters in the same block.
+
+        order : list
+            Indices of the parameters in the order in which they are
+            assigned to blocks.  Defaults to the parameter order.
+
+        Returns
+        -------
+        blocks : list
+            List of arrays with the parameter indices of each block.
+        """
+        if order is None:
+            order = np.arange(self._npar)
+        idx = np.array([i for i in order if self._free[i]], dtype=int)
+        grad, hess = self.gradient_hessian(idx=idx)
+
+        d = np.sqrt(np.abs(np.diag(hess)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rho = np.abs(hess) / np.outer(d, d)
+        conflict = np.nan_to_num(rho) > threshold
+
+        blocks = []
+        for k in range(len(idx)):
+            for blk in blocks:
+                if not np.any(conflict[k, blk]):
+                    blk.append(k)
+                    break
+            else:
+                blocks.append([k])
+
+        return [idx[blk] for blk in blocks]
+
+    def fit_blocks(self, blocks, tol=1E-3, max_iter=100, init_lambda=1E-4,
+                   max_pass=10):
+        """Maximize the likelihood with respect to the free
+        normalizations by block coordinate ascent.  In each pass the
+        normalizations of each block are fit in turn with `fit` while
+        all other normalizations are held at their current values.
+        Passes are repeated until the log-likelihood improves by less
+        than ``tol``.  This converges quickly when the parameters of
+        different blocks are weakly correlated (see `find_blocks`).
+
+        Parameters
+        ----------
+        blocks : list
+            List of arrays with the parameter indices of each block.
+
+        tol : float
+            Convergence threshold on the EDM of each block fit and on
+            the change of the log-likelihood in one pass.
+
+        max_iter : int
+            Maximum number of iterations of each block fit.
+
+        init_lambda : float
+            Damping parameter of the block fits.
+
+        max_pass : int
+            Maximum number of passes over the blocks.
+
+        Returns
+        -------
+        o : dict
+            Dictionary with the same keys as the output of `fit` and
+            the number of passes (``npass``).  The covariance matrix
+            is block-diagonal.
+        """
+
+        free0 = self._free.copy()
+        lnl = self.loglike()
+        dlnl = np.inf
+        status = 1
+        fits = []
+        npass = 0
+
+        try:
+            for npass in range(1, max_pass + 1):
+
+                lnl0 = lnl
+                fits = []
+                for blk in blocks:
+                    self._free = np.zeros(self._npar, dtype=bool)
+                    self._free[blk] = free0[blk]
+                    fits += [self.fit(tol=tol, max_iter=max_iter,
+                                      init_lambda=init_lambda)]
+
+                lnl = self.loglike()
+                dlnl = lnl - lnl0
+                if dlnl < tol:
+                    status = 0
+                    break
+        finally:
+            self._free = free0
+
+        o = {'values': self._norms.copy(),
+             'errors': np.zeros(self._npar),
+             'covariance': np.zeros((self._npar, self._npar)),
+             'loglike': lnl,
+             'edm': dlnl,
+             'niter': sum([f['niter'] for f in fits]),
+             'npass': npass,
+             'fit_status': max([status] + [f['fit_status'] for f in fits])}
+
+        for blk, f in zip(blocks, fits):
+            o['covariance'][np.ix_(blk, blk)] = f['covariance'][np.ix_(blk,
+                                                                       blk)]
+        o['errors'] = np.sqrt(np.diag(o['covariance']))
+        return o
+
+    def profile(self, ipar, xvals, reoptimize=False, **kwargs):
+        """Compute the likelihood profile of a single normalization.
+
+        Parameters
+        ----------
+        ipar : int
+            Index of the normalization to scan.
+
+        xvals : `~numpy.ndarray`
+            Values of the normalization.
+
+        reoptimize : bool
+            Refit the other free normalizations at each point of the
+            scan.  If False the profile is evaluated in a single
+            vectorized pass with the other normalizations held at
+            their current values.
+
+        Returns
+        -------
+        loglike : `~numpy.ndarray`
+            Log-likelihood at each point of the scan.
+        """
+        xvals = np.array(xvals, dtype=float, ndmin=1)
+
+        if not reoptimize:
+            norms = np.repeat(self._norms[:, None], len(xvals), axis=1)
+            norms[ipar] = xvals
+            return self.loglike(norms)
+
+        norms0 = self._norms.copy()
+        free0 = self._free.copy()
+        bounds0 = self._bounds.copy()
+        self._free[ipar] = False
+        self._bounds[ipar] = [min(np.min(xvals), bounds0[ipar, 0]),
+                              max(np.max(xvals), bounds0[ipar, 1])]
+
+        loglike = np.zeros(len(xvals))
+        try:
+            for i, x in enumerate(xvals):
+                self._norms[ipar] = x
+                loglike[i] = self.fit(**kwargs)['loglike']
+        finally:
+            self._norms = norms0
+            self._free = free0
+            self._bounds = bounds0
+
+        return loglike
+
+
+class TemplateScan(object):
+    """Likelihood of a set of alternative models that differ in the
+    template of a single normalization, e.g. the model counts of a
+    source evaluated for a sequence of spatial widths.  The likelihood
+    of every alternative is evaluated, and optionally maximized with
+    respect to the free normalizations, in a single vectorized pass.
+
+    Each component must be created with the templates of the shared
+    normalizations followed by the ``nalt`` alternative templates of
+    the scanned normalization.  The parameter vector of each
+    alternative contains the shared normalizations followed by the
+    scanned normalization.
+
+    Parameters
+    ----------
+    components : list
+        List of `~fermipy.likelihood.LikelihoodComponent` objects.
+
+    nalt : int
+        Number of alternative templates.
+
+    norms : `~numpy.ndarray`
+        Initial values of the normalizations (length nshared + 1).
+
+    bounds : `~numpy.ndarray`
+        Array with shape (nshared + 1, 2) with the bounds of each
+        normalization.
+
+    free : `~numpy.ndarray`
+        Boolean mask of the free normalizations.
+    """
+
+    def __init__(self, components, nalt, norms=None, bounds=None, free=None):
+
+        self._components = list(components)
+        ntemplate = set([c.ntemplate for c in self._components])
+        if len(ntemplate) != 1:
+            raise Exception('Components must have the same number '
+                            'of templates.')
+        self._ntemplate = ntemplate.pop()
+        self._nalt = int(nalt)
+        self._nshared = self._ntemplate - self._nalt
+        self._npar = self._nshared + 1
+
+        if self._nshared < 0:
+            raise Exception('Number of alternative templates exceeds the '
+                            'number of templates.')
+
+        if norms is None:
+            norms = np.ones(self._npar)
+        self._norms = np.array(norms, dtype=float, ndmin=1)
+
+        if bounds is None:
+            bounds = np.array([[0.0, np.inf]] * self._npar)
+        self._bounds = np.array(bounds, dtype=float).reshape((-1, 2))
+
+        if free is None:
+            free = np.ones(self._npar, dtype=bool)
+        self._free = np.array(free, dtype=bool, ndmin=1)
+
+    @property
+    def npar(self):
+        return self._npar
+
+    @property
+    def nalt(self):
+        return self._nalt
+
+    def set_energy_bins(self, imin=None, imax=None):
+        """Restrict all components to the energy bins [imin, imax)."""
+        for c in self._components:
+            c.set_energy_bins(imin, imax)
+
+    def _expand(self, x):
+        """Map an array of parameter vectors with shape (npar, nalt)
+        to the template normalizations of each alternative."""
+        n = np.zeros((self._ntemplate, self._nalt))
+        n[:self._nshared] = x[:self._nshared]
+        ialt = np.arange(self._nalt)
+        n[self._nshared + ialt, ialt] = x[self._nshared]
+        return n
+
+    def _init_norms(self):
+        x = np.repeat(self._norms[:, None], self._nalt, axis=1)
+        return np.clip(x, self._bounds[:, :1], self._bounds[:, 1:])
+
+    def loglike(self, x=None):
+        """Log-likelihood of each alternative.  ``x`` is an array of
+        parameter vectors with shape (npar, nalt).  If None the
+        initial normalizations are used for all alternatives."""
+        if x is None:
+            x = self._init_norms()
+        n = self._expand(np.asarray(x, dtype=float))
+        lnl = np.zeros(self._nalt)
+        for c in self._components:
+            lnl = lnl + c.loglike(n)
+        return lnl
+
+    def loglike_ebin(self, x=None):
+        """Log-likelihood of each alternative in each energy bin.
+        Returns a list with one array of shape (nebin, nalt) per
+        component."""
+        if x is None:
+            x = self._init_norms()
+        n = self._expand(np.asarray(x, dtype=float))
+        return [c.loglike_ebin(n) for c in self._components]
+
+    def gradient_hessian(self, x):
+        """Gradient and Hessian of the log-likelihood of each
+        alternative with respect to its parameter vector.  Returns
+        arrays with shape (nalt, npar) and (nalt, npar, npar)."""
+
+        ns = self._nshared
+        n = self._expand(x)
+        grad = np.zeros((self._nalt, self._npar))
+        hess = np.zeros((self._nalt, self._npar, self._npar))
+
+        for c in self._components:
+
+            t = c._t.toarray() if _is_sparse(c._t) else c._t
+            mu = c.model(n)
+            cc = c._c[:, None]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = np.where(cc > 0, cc / mu, 0.0)
+                h = np.where(cc > 0, cc / mu**2, 0.0)
+            if c._w is not None:
+                r = c._w[:, None] * (r - 1.0)
+                h = c._w[:, None] * h
+            else:
+                r = r - 1.0
+
+            ts = t[:ns]
+            ta = t[ns:]
+            grad[:, :ns] += np.dot(r.T, ts.T)
+            grad[:, ns] += np.sum(ta.T * r, axis=0)
+            hess[:, :ns, :ns] -= np.einsum('kn,na,ln->akl', ts, h, ts)
+            hsa = np.einsum('kn,na,an->ak', ts, h, ta)
+            hess[:, :ns, ns] -= hsa
+            hess[:, ns, :ns] -= hsa
+            hess[:, ns, ns] -= np.sum(ta.T**2 * h, axis=0)
+
+        return grad, hess
+
+    def fit(self, tol=1E-3, max_iter=100, init_lambda=1E-4):
+        """Maximize the likelihood of every alternative with respect to
+        the free normalizations.  This applies the bounded, damped
+        Newton method of `~fermipy.likelihood.NormLikelihood.fit` to
+        all alternatives simultaneously.
+
+        Returns
+        -------
+        o : dict
+            Dictionary with the best-fit parameter vectors
+            (``values``, shape (npar, nalt)), the log-likelihood and
+            EDM of each alternative and the fit status of each
+            alternative (0 = ok, 1 = maximum number of iterations
+            reached, 2 = failure).
+        """
+
+        x = self._init_norms()
+        lo = self._bounds[:, :1]
+        hi = self._bounds[:, 1:]
+        free = self._free[:, None]
+        lnl = self.loglike(x)
+        edm = np.ones(self._nalt) * np.inf
+        status = np.ones(self._nalt, dtype=int)
+        status[~np.isfinite(lnl)] = 2
+        if not np.any(self._free):
+            status[:] = 0
+        active = status == 1
+        ipar = np.arange(self._npar)
+
+        for niter in range(max_iter):
+
+            if not np.any(active):
+                break
+
+            grad, hess = self.gradient_hessian(x)
+            grad = grad.T
+
+            # Hold parameters at a bound when the gradient points
+            # outside the allowed region
+            m = free & ~((x <= lo) & (grad < 0)) & ~((x >= hi) & (grad > 0))
+            done = active & ~np.any(m, axis=0)
+            status[done] = 0
+            edm[done] = 0.0
+            active &= ~done
+
+            # Solve the Newton system of each alternative with the
+            # held parameters decoupled
+            mt = m.T
+            a = np.where(mt[:, :, None] & mt[:, None, :], -hess, 0.0)
+            diag = a[:, ipar, ipar].copy()
+            a[:, ipar, ipar] += init_lambda * diag + np.where(mt, 0.0, 1.0)
+            g = np.where(m, grad, 0.0).T
+
+            try:
+                dx = np.linalg.solve(a, g[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                dx = g / np.where(diag > 0, diag, 1.0)
+
+            e = 0.5 * np.sum(g * dx, axis=1)
+            neg = ~(e > 0)
+            if np.any(neg):
+                # Hessian is not negative definite; fall back to a
+                # diagonal step
+                dx[neg] = g[neg] / np.where(diag[neg] > 0, diag[neg], 1.0)
+                e[neg] = 0.5 * np.sum(g[neg] * dx[neg], axis=1)
+            edm[active] = e[active]
+            dx = dx.T
+
+            # Backtracking line search on the bounded steps
+            step = np.ones(self._nalt)
+            pending = active.copy()
+            x1 = x.copy()
+            lnl1 = lnl.copy()
+            while np.any(pending):
+                xt = np.where(m & pending[None, :],
+                              np.clip(x + step[None, :] * dx, lo, hi), x)
+                lt = self.loglike(xt)
+                ok = pending & np.isfinite(lt) & (lt >= lnl)
+                x1[:, ok] = xt[:, ok]
+                lnl1[ok] = lt[ok]
+                pending &= ~ok
+                step[pending] *= 0.5
+                failed = pending & (step < 1E-10)
+                status[failed] = np.where(edm[failed] < tol, 0, 2)
+                active &= ~failed
+                pending &= ~failed
+
+            x[:, active] = x1[:, active]
+            lnl[active] = lnl1[active]
+
+            conv = active & (edm < tol)
+            status[conv] = 0
+            active &= ~conv
+
+        return {'values': x, 'loglike': lnl, 'edm': edm,
+                'fit_status': status}
@@ -4,7 +4,6 @@ import glob
 import re
 import copy
 import numpy as np
-import healpy as hp
 from astropy.io import fits
 from astropy.coordinates import SkyCoord
 from astropy.table import Table, Column
@@ -15,6 +14,9 @@ from fermipy.utils import edge_to_width
 from fermipy.utils import angle_to_cartesian
 from fermipy.skymap import HpxMap
 from fermipy.hpx_utils import HPX
+from fermipy.lazy_import import LazyModule
+
+hp = LazyModule('healpy')
 
 
 def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
@@ -225,7 +227,7 @@ class LTCube(HpxMap):
         cth_min = cth_min.astype(float)
         cth_max = cth_max.astype(float)
         cth_edges = np.concatenate((cth_max[:1], cth_min))[::-1]
-        hpx = HPX.create_from_header(hdulist['EXPOSURE'].header, cth_edges)
+        hpx = HPX.create_from_hdu(hdulist['EXPOSURE'], cth_edges)
         #header = dict(hdulist['EXPOSURE'].header)
         tab_gti = Table.read(ltfile, 'GTI')
         hdulist.close()
@@ -255,6 +257,9 @@ class LTCube(HpxMap):
 
     @classmethod
     def create_from_gti(cls, skydir, tab_sc, tab_gti, zmax, **kwargs):
+        """Create a livetime cube from spacecraft and GTI tables.  If
+        ``radius`` is smaller than 180 deg the livetime cube only
+        contains the HEALPix pixels within ``radius`` of ``skydir``."""
 
         radius = kwargs.get('radius', 180.0)
         cth_edges = kwargs.get('cth_edges', None)
@@ -275,7 +280,11 @@ class LTCube(HpxMap):
         map_lt.data[:, m] = lt
         map_lt_wt.data[:, m] = lt_wt
 
-        hpx2 = HPX(2**6, True, 'CEL', ebins=cth_edges)
+        region = None
+        if radius < 180.0:
+            region = 'DISK(%.6f,%.6f,%.6f)' % (skydir.icrs.ra.deg,
+                                                skydir.icrs.dec.deg, radius)
+        hpx2 = HPX(2**6, True, 'CEL', region=region, ebins=cth_edges)
 
         ltc = cls(np.zeros((len(cth_edges) - 1, hpx2.npix)), hpx2, cth_edges)
         ltc_skydir = ltc.hpx.get_sky_dirs()
@@ -296,7 +305,12 @@ class LTCube(HpxMap):
 
     def load(self, ltc):
 
-        self._counts += ltc.data
+        if self.hpx.is_allsky == ltc.hpx.is_allsky and \
+                (self.hpx.is_allsky or
+                 np.array_equal(self.hpx.ipix, ltc.hpx.ipix)):
+            self._counts += ltc.data
+        else:
+            self._counts += ltc.to_hpx(self.hpx).data
 
         if self._tstart is not None:
             self._tstart = min(self.tstart, ltc.tstart)
@@ -333,6 +347,7 @@ class LTCube(HpxMap):
         width = edge_to_width(bins)
         ipix = hp.ang2pix(self.hpx.nside, np.pi / 2. - np.radians(dec),
                           np.radians(ra), nest=self.hpx.nest)
+        ipix = self._get_local_index(ipix)
         lt = np.histogram(self._cth_center,
                           weights=self.data[:, ipix], bins=bins)[0]
         lt = np.sum(lt.reshape(-1, npts), axis=1)
@@ -364,7 +379,7 @@ class LTCube(HpxMap):
         lt, lt_wt = fill_livetime_hist(skydir, tab_sc, tab_gti, zmax,
                                        self.costh_edges)
 
-        ipix = self.hpx.skydir_to_pixel(skydir)
+        ipix = self._get_local_index(self.hpx.skydir_to_pixel(skydir))
 
         lt_scale = np.ones_like(lt)
         lt_wt_scale = np.ones_like(lt_wt)
@@ -379,10 +394,21 @@ class LTCube(HpxMap):
                       # tstop=np.max(tab_gti_t1),
                       zmax=zmax, data_wt=data_wt)
 
+    def _get_local_index(self, ipix):
+        """Convert global HEALPix pixel indices to indices in the data
+        array."""
+        ipix = self.hpx[np.array(ipix)]
+        if np.any(ipix < 0):
+            raise Exception('Sky direction outside of livetime cube.')
+        return ipix
+
     def _create_exp_hdu(self, data):
 
         pix_skydir = self.hpx.get_sky_dirs()
-        cols = [Column(name='COSBINS', unit='s', dtype='f4',
+        cols = []
+        if not self.hpx.is_allsky:
+            cols += [Column(name='PIX', dtype='i4', data=self.hpx.ipix)]
+        cols += [Column(name='COSBINS', unit='s', dtype='f4',
                        data=data.T[:, ::-1],
                        shape=(len(self.costh_center),)),
                 Column(name='RA', unit='deg', dtype='f4',
@@ -0,0 +1,284 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Monte Carlo studies of the likelihood of a source (e.g. calibration of
+the TS distribution under the null hypothesis).  Realizations of the
+ROI are drawn from the model-counts cubes in memory and fit with the
+numpy likelihood engine (`~fermipy.likelihood.NormLikelihood`) such
+that the ScienceTools likelihood and the source map files are never
+modified.
+"""
+from __future__ import absolute_import, division, print_function
+import copy
+import os
+
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table, Column
+
+from fermipy import utils
+from fermipy.config import ConfigSchema
+from fermipy.timing import Timer
+
+
+def _run_trials_worker(args, norm_like, models, **kwargs):
+    return run_trials(norm_like, models, *args, **kwargs)
+
+
+def run_trials(norm_like, models, ntrial, seed, ipar, **kwargs):
+    """Simulate and fit a sequence of realizations of a set of
+    model-counts cubes.  The realizations of each component are drawn
+    together from a generator initialized with ``seed``.  Each
+    realization is fit twice: once with all free normalizations and
+    once with the normalization ``ipar`` fixed to zero.
+
+    Parameters
+    ----------
+    norm_like : `~fermipy.likelihood.NormLikelihood`
+        Likelihood that is fit to each realization.  The counts cubes
+        of its components are overwritten.
+
+    models : list
+        Model-counts cubes (one per likelihood component) from which
+        the realizations are drawn.
+
+    ntrial : int
+        Number of realizations.
+
+    seed : int
+        Seed of the random number generator.
+
+    ipar : int
+        Index of the normalization of the source of interest.
+
+    norms : `~numpy.ndarray`
+        Starting values of the normalizations.
+
+    Returns
+    -------
+    o : dict
+        Dictionary of arrays with the TS, best-fit normalizations and
+        log-likelihood values of each realization.
+    """
+
+    norms = np.array(kwargs.pop('norms', norm_like.norms), dtype=float)
+    rs = np.random.RandomState(seed)
+    counts = [rs.poisson(m, size=(ntrial,) + m.shape) for m in models]
+
+    npar = norm_like.npar
+    o = {'ts': np.zeros(ntrial),
+         'loglike': np.zeros(ntrial),
+         'loglike0': np.zeros(ntrial),
+         'fit_status': np.zeros(ntrial, dtype=int),
+         'values': np.zeros((ntrial, npar)),
+         'errors': np.zeros((ntrial, npar))}
+
+    free = norm_like.free.copy()
+    free0 = free.copy()
+    free0[ipar] = False
+
+    try:
+        for i in range(ntrial):
+
+            for c, cnts in zip(norm_like.components, counts):
+                c.set_counts(cnts[i])
+
+            norm_like.free = free
+            norm_like.norms = norms
+            fit1 = norm_like.fit(**kwargs)
+
+            x0 = fit1['values'].copy()
+            x0[ipar] = 0.0
+            norm_like.free = free0
+            norm_like.norms = x0
+            fit0 = norm_like.fit(**kwargs)
+
+            o['loglike'][i] = fit1['loglike']
+            o['loglike0'][i] = fit0['loglike']
+            o['ts'][i] = max(2.0 * (fit1['loglike'] - fit0['loglike']), 0.0)
+            o['fit_status'][i] = max(fit1['fit_status'], fit0['fit_status'])
+            o['values'][i] = fit1['values']
+            o['errors'][i] = fit1['errors']
+    finally:
+        norm_like.free = free
+
+    return o
+
+
+class MCStudy(object):
+    """Mixin class for `~fermipy.gtanalysis.GTAnalysis` that runs
+    Monte Carlo studies of the likelihood of a source."""
+
+    def mcstudy(self, name, **kwargs):
+        """Simulate and fit many realizations of the ROI to study the
+        distribution of the TS and normalization of a source.  Each
+        realization is a set of Poisson counts cubes drawn from the
+        current model.  The free normalizations and the normalization
+        of the source of interest are fit to every realization with
+        the numpy likelihood engine.  Free shape parameters are held
+        fixed.  The counts cubes and source map files of the analysis
+        are not modified.
+
+        Parameters
+        ----------
+        name : str
+            Source name.
+
+        prefix : str
+            Optional string that will be prepended to all output files.
+
+        {options}
+
+        optimizer : dict
+            Dictionary that overrides the default optimizer settings.
+
+        Returns
+        -------
+        mcstudy : dict
+            Dictionary with the TS, normalization and log-likelihood
+            of the source of interest in each realization.
+        """
+        timer = Timer.create(start=True)
+        name = self.roi.get_source_by_name(name).name
+
+        schema = ConfigSchema(self.defaults['mcstudy'],
+                              optimizer=self.defaults['optimizer'])
+        schema.add_option('prefix', '')
+        config = utils.create_dict(self.config['mcstudy'],
+                                   optimizer=self.config['optimizer'])
+        config = schema.create_config(config, **kwargs)
+
+        self.logger.info('Running MC study for %s with %i trials',
+                         name, config['ntrial'])
+
+        o = self._make_mcstudy(name, **config)
+
+        self.logger.info('Finished MC study')
+
+        outfile = utils.format_filename(self.workdir, 'mcstudy',
+                                        prefix=[config['prefix'],
+                                                name.lower().replace(' ', '_')])
+
+        o['file'] = None
+        if config['write_fits']:
+            o['file'] = os.path.basename(outfile) + '.fits'
+            self._make_mcstudy_fits(o, outfile + '.fits')
+
+        if config['write_npy']:
+            np.save(outfile + '.npy', o)
+
+        self.logger.info('Execution time: %.2f s', timer.elapsed_time)
+        return o
+
+    def _make_mcstudy(self, name, **config):
+
+        loge_bounds = list(self.loge_bounds)
+        if config['loge_bounds'] is not None:
+            if len(config['loge_bounds']) != 2:
+                raise Exception('Wrong size of loge_bounds array.')
+            loge_bounds = [v if v is not None else v0 for v, v0 in
+                           zip(config['loge_bounds'], loge_bounds)]
+
+        # Free the normalization of the source of interest and hold
+        # the shape parameters fixed
+        params = copy.deepcopy(self.get_params())
+        for p in params:
+            if p['src_name'] == name and p['is_norm']:
+                p['free'] = True
+            elif p['free'] and not p['is_norm']:
+                self.logger.warning('Holding shape parameter %s of %s fixed.',
+                                    p['par_name'], p['src_name'])
+                p['free'] = False
+
+        free_norm_params = [p for p in params if p['free'] and p['is_norm']]
+        names = [p['src_name'] for p in free_norm_params]
+        ipar = names.index(name)
+
+        # The likelihood object is modified by the simulations and
+        # must not be reused by the fitting methods
+        norm_like = self._create_norm_likelihood(params)
+        self._norm_like = None
+
+        bounds = np.array([[p['min'], p['max']] for p in free_norm_params])
+        bounds[ipar, 0] = min(bounds[ipar, 0], 0.0)
+        norm_like.bounds = bounds
+
+        imin = int(utils.val_to_edge(self.log_energies, loge_bounds[0])[0])
+        imax = int(utils.val_to_edge(self.log_energies, loge_bounds[1])[0])
+        norm_like.set_energy_bins(imin, imax)
+
+        exclude = [name] if config['null'] else None
+        models = [c.model_counts_map(exclude=exclude).data
+                  for c in self.components]
+
+        ntrial = config['ntrial']
+        chunk_size = max(config['chunk_size'], 1)
+        nchunk = int(np.ceil(ntrial / float(chunk_size)))
+        seed = config['seed']
+        if seed is None:
+            seed = np.random.randint(0, 2**31 - 1)
+        seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, nchunk)
+        args = [(min(chunk_size, ntrial - i * chunk_size), s, ipar)
+                for i, s in enumerate(seeds)]
+
+        kwargs = {'norms': [p['value'] for p in free_norm_params],
+                  'tol': config['optimizer']['tol'],
+                  'max_iter': config['optimizer']['max_iter'],
+                  'init_lambda': config['optimizer']['init_lambda']}
+
+        if config['multithread'] and nchunk > 1:
+            results = utils.pool_map(_run_trials_worker, args,
+                                     nthread=config['nthread'],
+                                     state=dict(norm_like=norm_like,
+                                                models=models, **kwargs))
+        else:
+            results = [run_trials(norm_like, models, *t, **kwargs)
+                       for t in args]
+
+        o = {'name': name,
+             'ntrial': ntrial,
+             'seed': seed,
+             'null': config['null'],
+             'par_names': names,
+             'loge_bounds': loge_bounds,
+             'config': config}
+
+        for k in results[0].keys():
+            o[k] = np.concatenate([r[k] for r in results])
+
+        o['norm'] = o['values'][:, ipar]
+        o['norm_err'] = o['errors'][:, ipar]
+
+        nfail = np.sum(o['fit_status'] != 0)
+        if nfail:
+            self.logger.warning('Fit failed in %i of %i trials.',
+                                nfail, ntrial)
+
+        return o
+
+    def _make_mcstudy_fits(self, data, filename):
+
+        cols = [Column(name='ts', dtype='f8', data=data['ts']),
+                Column(name='norm', dtype='f8', data=data['norm']),
+                Column(name='norm_err', dtype='f8', data=data['norm_err']),
+                Column(name='loglike', dtype='f8', data=data['loglike']),
+                Column(name='loglike0', dtype='f8', data=data['loglike0']),
+                Column(name='fit_status', dtype='i4',
+                       data=data['fit_status']),
+                Column(name='values', dtype='f8', data=data['values']),
+                Column(name='errors', dtype='f8', data=data['errors'])]
+
+        tab = Table(cols)
+        tab.meta['SRCNAME'] = data['name']
+        tab.meta['NTRIAL'] = data['ntrial']
+        tab.meta['SEED'] = data['seed']
+        tab.meta['NULL'] = data['null']
+        hdu_trials = fits.table_to_hdu(tab)
+        hdu_trials.name = 'TRIALS'
+
+        cols = [Column(name='par_names', dtype='S32',
+                       data=data['par_names'])]
+        hdu_pars = fits.table_to_hdu(Table(cols))
+        hdu_pars.name = 'PARAMS'
+
+        hdulist = fits.HDUList([fits.PrimaryHDU(), hdu_trials, hdu_pars])
+        hdulist.writeto(filename, clobber=True)
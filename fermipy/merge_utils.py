@@ -155,6 +155,28 @@ def update_hpx_skymap_allsky(hdu_in, hdu):
     return hdu
 
 
+def update_hpx_skymap_explicit(hdu_in, hdu):
+    """ 'Update' a partial-sky HEALPix skymap in the explicit indexing scheme
+
+    This checks hdu exists and creates it from hdu_in if it does not.
+    If hdu does exist, this adds the data in hdu_in to hdu.  The output
+    map contains the union of the pixels of the two maps.
+    """
+    from fermipy.skymap import HpxMap
+    if hdu is None:
+        return fits.BinTableHDU(
+            data=hdu_in.data, header=hdu_in.header, name=hdu_in.name)
+
+    hpxmap = HpxMap.create_from_hdu(hdu, None)
+    hpxmap += HpxMap.create_from_hdu(hdu_in, None)
+    hdu_out = hpxmap.hpx.make_hdu(hpxmap.data, extname=hdu.name)
+    for card in hdu.header.cards:
+        if card.keyword not in hdu_out.header and not card.keyword.startswith(
+                ('TTYPE', 'TFORM', 'TUNIT', 'TDIM', 'TNULL', 'TSCAL', 'TZERO')):
+            hdu_out.header.append(card)
+    return hdu_out
+
+
 def merge_wcs_counts_cubes(filelist):
     """ Merge all the files in filelist, assuming that they WCS counts cubes
     """
@@ -215,7 +237,10 @@ def merge_hpx_counts_cubes(filelist):
         sys.stdout.flush()
         if i == 0:
             out_prim = update_null_primary(fin[0], out_prim)
-        out_skymap = update_hpx_skymap_allsky(fin[1], out_skymap)
+        if 'PIX' in fin[1].columns.names:
+            out_skymap = update_hpx_skymap_explicit(fin[1], out_skymap)
+        else:
+            out_skymap = update_hpx_skymap_allsky(fin[1], out_skymap)
         if i == 0:
             try:
                 out_ebounds = update_ebounds(fin["EBOUNDS"], out_ebounds)
@@ -8,7 +8,6 @@ import scipy.signal
 import fermipy.utils as utils
 import fermipy.wcs_utils as wcs_utils
 import fermipy.fits_utils as fits_utils
-import fermipy.plotting as plotting
 from fermipy.skymap import Map
 from fermipy.config import ConfigSchema
 from fermipy.timing import Timer
@@ -169,11 +168,7 @@ class ResidMapGenerator(object):
         o = self._make_residual_map(prefix, **config)
 
         if config['make_plots']:
-            plotter = plotting.AnalysisPlotter(self.config['plotting'],
-                                               fileio=self.config['fileio'],
-                                               logging=self.config['logging'])
-
-            plotter.make_residmap_plots(o, self.roi)
+            self.plotter.make_residmap_plots(o, self.roi)
 
         self.logger.info('Finished residual maps')
 
@@ -293,6 +293,279 @@ def spectral_pars_from_catalog(cat):
     return pars
 
 
+def make_parameter_dicts(pdict, value, scale=None, pmin=None, pmax=None,
+                         fixed_par=False, rescale=True):
+    """Vectorized version of `~fermipy.model_utils.make_parameter_dict`
+    that creates one parameter dictionary for every element of the
+    ``value`` array.  The ``scale``, ``pmin``, and ``pmax`` arguments
+    override the scale and bounds of the template dictionary ``pdict``
+    and can be scalars or arrays with the same length as ``value``.
+    """
+
+    value = np.asarray(value)
+    scale = np.broadcast_to(pdict.get('scale', 1.0)
+                            if scale is None else scale, value.shape)
+    pmin = np.broadcast_to(pdict['min'] if pmin is None else pmin,
+                           value.shape)
+    pmax = np.broadcast_to(pdict['max'] if pmax is None else pmax,
+                           value.shape)
+    error = np.broadcast_to(pdict.get('error', np.nan), value.shape)
+
+    if rescale:
+        p = value * scale
+        m = p > 0
+        pscale = np.ones(p.shape)
+        pscale[m] = 10**-np.round(np.log10(1. / p[m]))
+        value, scale = (np.abs(np.where(m, p / pscale, p)) * np.sign(value),
+                        np.abs(pscale) * np.sign(scale))
+        error = error / np.abs(pscale)
+
+    if fixed_par:
+        pmin = pmax = value
+
+    pmin = np.where(pmin > value, value, pmin)
+    pmax = np.where(pmax < value, value, pmax)
+
+    o = []
+    for i in range(len(value)):
+        pars = dict(pdict, value=value[i], scale=scale[i],
+                    min=pmin[i], max=pmax[i])
+        if 'error' in pdict:
+            pars['error'] = error[i]
+        o += [pars]
+    return o
+
+
+def spatial_pars_from_catalog_table(tab):
+    """Create spatial parameters for every row of a catalog table.
+    Vectorized version of `spatial_pars_from_catalog`."""
+
+    fn = np.array([str(t) for t in tab['Spatial_Function']])
+    pars = [{} for i in range(len(tab))]
+    m = (fn == 'RadialDisk') | (fn == 'RadialGaussian')
+    if not np.any(m):
+        return pars
+
+    sigma_to_r68 = np.sqrt(-2.0 * np.log(1.0 - 0.6827))
+    rext = np.sqrt(np.asarray(tab['Model_SemiMajor']) *
+                   np.asarray(tab['Model_SemiMinor']))
+    for i in np.nonzero(m)[0]:
+        if fn[i] == 'RadialDisk':
+            pars[i] = {'Radius': {'value': rext[i]}}
+        else:
+            pars[i] = {'Sigma': {'value': rext[i] / sigma_to_r68}}
+    return pars
+
+
+def spectral_pars_from_catalog_table(tab):
+    """Create spectral parameters for every row of a catalog table
+    with 3FGL catalog columns.  Vectorized version of
+    `spectral_pars_from_catalog`."""
+
+    spectrum_type = np.array([str(t) for t in tab['SpectrumType']])
+    pars = [None] * len(tab)
+
+    for t in np.unique(spectrum_type):
+
+        idx = np.nonzero(spectrum_type == t)[0]
+        defaults = get_function_defaults(t)
+
+        def col(colname):
+            return np.asarray(tab[colname])[idx]
+
+        if t == 'PowerLaw':
+
+            index = col('Spectral_Index')
+            vals = {}
+            vals['Prefactor'] = make_parameter_dicts(defaults['Prefactor'],
+                                                     col('Flux_Density'))
+            vals['Scale'] = make_parameter_dicts(defaults['Scale'],
+                                                 col('Pivot_Energy'),
+                                                 scale=1.0, fixed_par=True,
+                                                 rescale=False)
+            vals['Index'] = make_parameter_dicts(defaults['Index'], index,
+                                                 scale=-1.0,
+                                                 pmin=np.minimum(
+                                                     0.0, index - 1.0),
+                                                 pmax=np.maximum(
+                                                     5.0, index + 1.0),
+                                                 rescale=False)
+
+        elif t == 'LogParabola':
+
+            vals = {}
+            vals['norm'] = make_parameter_dicts(defaults['norm'],
+                                                col('Flux_Density'),
+                                                rescale=True)
+            vals['Eb'] = make_parameter_dicts(defaults['Eb'],
+                                              col('Pivot_Energy'),
+                                              fixed_par=True, rescale=False)
+            vals['alpha'] = make_parameter_dicts(defaults['alpha'],
+                                                 col('Spectral_Index'),
+                                                 rescale=False)
+            vals['beta'] = make_parameter_dicts(defaults['beta'],
+                                                col('beta'), rescale=False)
+
+        elif t == 'PLSuperExpCutoff':
+
+            prefactor = (col('Flux_Density') *
+                         np.exp((col('Pivot_Energy') / col('Cutoff')) **
+                                col('Exp_Index')))
+            vals = {}
+            vals['Prefactor'] = make_parameter_dicts(defaults['Prefactor'],
+                                                     prefactor)
+            vals['Index1'] = make_parameter_dicts(defaults['Index1'],
+                                                  col('Spectral_Index'),
+                                                  scale=-1.0, rescale=False)
+            vals['Index2'] = make_parameter_dicts(defaults['Index2'],
+                                                  col('Exp_Index'),
+                                                  scale=1.0, rescale=False)
+            vals['Scale'] = make_parameter_dicts(defaults['Scale'],
+                                                 col('Pivot_Energy'),
+                                                 fixed_par=True,
+                                                 rescale=False)
+            vals['Cutoff'] = make_parameter_dicts(defaults['Cutoff'],
+                                                  col('Cutoff'),
+                                                  rescale=True)
+
+        else:
+            raise Exception('Unsupported spectral type:' + t)
+
+        for j, i in enumerate(idx):
+            pars[i] = {k: vals[k][j] if k in vals else dict(v)
+                       for k, v in defaults.items()}
+
+    return pars
+
+
+def _scalar_value(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _minmax_mask(vals, val_minmax):
+    """Vectorized version of `~fermipy.utils.apply_minmax_selection`."""
+
+    msk = np.ones(len(vals), dtype=bool)
+    if val_minmax is None:
+        return msk
+
+    with np.errstate(invalid='ignore'):
+        if val_minmax[0] is not None:
+            msk &= np.isfinite(vals) & (vals >= val_minmax[0])
+        if val_minmax[1] is not None:
+            msk &= np.isfinite(vals) & (vals <= val_minmax[1])
+    return msk
+
+
+def fill_table(tab, rows):
+    """Create a table with the columns of ``tab`` from a list of rows.
+    This is equivalent to calling ``tab.add_row`` for every row but
+    creates each column with a single array operation."""
+
+    if not rows:
+        return tab
+
+    cols = []
+    for i, col in enumerate(tab.columns.values()):
+        shape = col.shape[1:]
+        if shape:
+            data = np.array([np.broadcast_to(r[i], shape) for r in rows],
+                            dtype=col.dtype)
+        else:
+            data = np.array([r[i] for r in rows], dtype=col.dtype)
+        cols += [Column(name=col.name, data=data, unit=col.unit,
+                        format=col.format, description=col.description)]
+
+    return Table(cols, meta=tab.meta)
+
+
+class SourceStore(object):
+    """Columnar store for the scalar properties (position, offsets,
+    TS, Npred, fluxes, etc.) of a list of sources.  Each source
+    attached to a store is a view onto one row of the store: updates
+    of its scalar properties are written through to the store so that
+    selections and table exports over many sources can be evaluated
+    with array operations.
+
+    The store holds a copy of these properties.  The dictionary of
+    each source remains the primary record of its properties so the
+    store does not reduce the memory footprint of a source.
+    """
+
+    fields = [k for k, v in defaults.source_output.items()
+              if v[2] == float and isinstance(v[0], float)]
+
+    def __init__(self, srcs=None):
+
+        if srcs is None:
+            srcs = []
+
+        self._data = np.full(len(srcs), np.nan,
+                             dtype=[(k, 'f8') for k in self.fields])
+        for i, src in enumerate(srcs):
+            if src._store is not None:
+                self._data[i] = src._store.data[src._store_idx]
+            else:
+                self._data[i] = tuple(_scalar_value(src.data.get(k, np.nan))
+                                      for k in self.fields)
+            src._store, src._store_idx = self, i
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data.dtype.fields
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    @property
+    def data(self):
+        return self._data
+
+    def set_value(self, idx, key, value):
+        if key in self._data.dtype.fields:
+            self._data[key][idx] = _scalar_value(value)
+
+    def update(self, idx, d):
+        for k in self.fields:
+            if k in d:
+                self._data[k][idx] = _scalar_value(d[k])
+
+    def get_selection_mask(self, cuts=None, minmax_ts=None,
+                           minmax_npred=None):
+        """Evaluate a selection on source properties.  The ``cuts``
+        argument follows the conventions of
+        `~fermipy.roi_model.Model.check_cuts`.
+
+        Returns
+        -------
+        msk : `~numpy.ndarray`
+            Boolean mask array or None if the selection uses a
+            property that is not held in the store.
+        """
+
+        if isinstance(cuts, tuple):
+            cuts = {cuts[0]: (cuts[1], cuts[2])}
+        elif isinstance(cuts, list):
+            cuts = {c[0]: (c[1], c[2]) for c in cuts}
+        elif cuts is None:
+            cuts = {}
+
+        if not all([k in self for k in cuts.keys()]):
+            return None
+
+        msk = np.ones(len(self), dtype=bool)
+        for k, v in cuts.items():
+            msk &= _minmax_mask(self[k], v)
+        msk &= _minmax_mask(self['ts'], minmax_ts)
+        msk &= _minmax_mask(self['npred'], minmax_npred)
+        return msk
+
+
 class Model(object):
     """Base class for point-like and diffuse source components.  This
     class is a container for spectral and spatial parameters as well
@@ -300,6 +573,9 @@ class Model(object):
     the ROI.
     """
 
+    _store = None
+    _store_idx = None
+
     def __init__(self, name, data):
 
         self._data = defaults.make_default_dict(defaults.source_output)
@@ -340,10 +616,23 @@ class Model(object):
 
     def __setitem__(self, key, value):
         self._data[key] = value
+        if self._store is not None:
+            self._store.set_value(self._store_idx, key, value)
 
     def __eq__(self, other):
         return self.name == other.name
 
+    def __getstate__(self):
+        # Copies are detached from the source store
+        state = self.__dict__.copy()
+        state.pop('_store', None)
+        state.pop('_store_idx', None)
+        return state
+
+    def _sync_store(self):
+        if self._store is not None:
+            self._store.update(self._store_idx, self._data)
+
     def __str__(self):
 
         data = copy.deepcopy(self.data)
@@ -450,6 +739,11 @@ class Model(object):
         return float(val) * float(scale)
 
     def add_to_table(self, tab):
+        tab.add_row(self.get_table_row(tab))
+
+    def get_table_row(self, tab):
+        """Return the row of this source for a table with the columns
+        of ``tab``."""
 
         row_dict = {}
         row_dict['Source_Name'] = self['name']
@@ -488,8 +782,7 @@ class Model(object):
             if t in tab.columns:
                 row_dict[t] = self[t]
 
-        row = [row_dict[k] for k in tab.columns]
-        tab.add_row(row)
+        return [row_dict[k] for k in tab.columns]
 
     def get_catalog_dict(self):
 
@@ -572,6 +865,7 @@ class Model(object):
 
     def update_data(self, d):
         self._data = utils.merge_dict(self._data, d, add_new_keys=True)
+        self._sync_store()
 
     def update_from_source(self, src):
 
@@ -579,6 +873,7 @@ class Model(object):
         self._data['spatial_pars'] = {}
 
         self._data = utils.merge_dict(self.data, src.data, add_new_keys=True)
+        self._sync_store()
         self._name = src.name
         self._names = list(set(self._names + src.names))
 
@@ -789,7 +1084,7 @@ class Source(Model):
             self.spatial_pars['DEC']['value'] = radec[1]
 
     def _set_spatial_width(self, spatial_width):
-        self.data['SpatialWidth'] = spatial_width
+        self['SpatialWidth'] = spatial_width
         if self['SpatialType'] in ['RadialGaussian']:
             self.spatial_pars['Sigma'][
                 'value'] = spatial_width / 1.5095921854516636
@@ -835,6 +1130,7 @@ class Source(Model):
 
     def update_data(self, d):
         self._data = utils.merge_dict(self._data, d, add_new_keys=True)
+        self._sync_store()
         if 'ra' in d and 'dec' in d:
             self._set_radec([d['ra'], d['dec']])
 
@@ -1296,9 +1592,21 @@ class ROIModel(fermipy.config.Configurable):
         self._diffuse_srcs = []
         self._src_dict = collections.defaultdict(list)
         self._src_radius = []
+        self._src_store = SourceStore()
 
         self.load(coordsys=coordsys, srcname=srcname)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_src_store', None)
+        return state
+
+    def __setstate__(self, state):
+        # Sources are detached from the store when they are copied or
+        # pickled so the store is rebuilt from the source dictionaries
+        self.__dict__.update(state)
+        self._build_src_index()
+
     def __contains__(self, key):
         key = key.replace(' ', '').lower()
         return key in self._src_dict.keys()
@@ -1353,6 +1661,12 @@ class ROIModel(fermipy.config.Configurable):
     def sources(self):
         return self._srcs + self._diffuse_srcs
 
+    @property
+    def source_store(self):
+        """Return the `~fermipy.roi_model.SourceStore` holding the
+        scalar properties of the point sources in the ROI."""
+        return self._src_store
+
     @property
     def point_sources(self):
         return self._srcs
@@ -1381,6 +1695,7 @@ class ROIModel(fermipy.config.Configurable):
         self._diffuse_srcs = []
         self._src_dict = collections.defaultdict(list)
         self._src_radius = []
+        self._src_store = SourceStore()
 
     def load_diffuse_srcs(self):
 
@@ -1538,8 +1853,13 @@ class ROIModel(fermipy.config.Configurable):
         build_index : bool 
            Re-make the source index after loading this source.
 
+        copy_source : bool
+           Load a copy of the input source object.  Disable this when
+           the caller does not retain a reference to the source.
+
         """
-        src = copy.deepcopy(src)
+        if kwargs.get('copy_source', True):
+            src = copy.deepcopy(src)
         name = src.name.replace(' ', '').lower()
 
         min_sep = kwargs.get('min_separation', None)
@@ -1805,10 +2125,17 @@ class ROIModel(fermipy.config.Configurable):
         if exclude is None:
             exclude = []
 
-        rsrc, srcs = self.get_sources_by_position(skydir,
-                                                  distance,
-                                                  square=square,
-                                                  coordsys=coordsys)
+        rsrc, idx = self._get_src_indices_by_position(skydir,
+                                                      distance,
+                                                      square=square,
+                                                      coordsys=coordsys)
+
+        # Apply selections on point sources with the source store
+        msk = self._src_store.get_selection_mask(cuts, minmax_ts,
+                                                 minmax_npred)
+        if msk is not None:
+            idx = idx[msk[idx]]
+        srcs = [self._srcs[i] for i in idx]
 
         o = []
         for s in srcs + self.diffuse_sources:
@@ -1817,6 +2144,9 @@ class ROIModel(fermipy.config.Configurable):
                 continue
             if s.name in exclude:
                 continue
+            if msk is not None and not s.diffuse:
+                o.append(s)
+                continue
             if not s.check_cuts(cuts):
                 continue
             ts = s['ts']
@@ -1832,6 +2162,15 @@ class ROIModel(fermipy.config.Configurable):
 
     def get_sources_by_property(self, pname, pmin, pmax=None):
 
+        if pname in self._src_store:
+            vals = self._src_store[pname]
+            msk = np.ones(len(vals), dtype=bool)
+            if pmin is not None:
+                msk &= ~(vals < pmin)
+            if pmax is not None:
+                msk &= ~(vals > pmax)
+            return [self._srcs[i] for i in np.nonzero(msk)[0]]
+
         srcs = []
         for i, s in enumerate(self._srcs):
             if pname not in s:
@@ -1870,20 +2209,24 @@ class ROIModel(fermipy.config.Configurable):
 
         """
 
+        radius, idx = self._get_src_indices_by_position(skydir, dist,
+                                                        min_dist, square,
+                                                        coordsys)
+        return radius, [self._srcs[i] for i in idx]
+
+    def _get_src_indices_by_position(self, skydir, dist, min_dist=None,
+                                     square=False, coordsys='CEL'):
+
         msk = get_skydir_distance_mask(self._src_skydir, skydir, dist,
                                        min_dist=min_dist, square=square,
                                        coordsys=coordsys)
 
         radius = self._src_skydir.separation(skydir).deg
         radius = radius[msk]
-
-        srcs = [self._srcs[i] for i in np.nonzero(msk)[0]]
+        idx = np.nonzero(msk)[0]
 
         isort = np.argsort(radius)
-        radius = radius[isort]
-        srcs = [srcs[i] for i in isort]
-
-        return radius, srcs
+        return radius[isort], idx[isort]
 
     def load_fits_catalog(self, name, **kwargs):
         """Load sources from a FITS catalog file.
@@ -1921,37 +2264,45 @@ class ROIModel(fermipy.config.Configurable):
             m &= utils.find_rows_by_string(cat.table, [srcname],
                                            self.src_name_cols)
 
-        offset = self.skydir.separation(cat.skydir).deg
+        # Extract catalog rows, parameters, and offsets column-wise
+        idx = np.nonzero(m)[0]
+        tab = cat.table[idx]
+        radec = cat.radec[idx]
+        glonlat = cat.glonlat[idx]
+        offset = self.skydir.separation(cat.skydir[idx]).deg
         offset_cel = wcs_utils.sky_to_offset(self.skydir,
-                                             cat.radec[:, 0], cat.radec[:, 1],
-                                             'CEL')
+                                             radec[:, 0], radec[:, 1], 'CEL')
         offset_gal = wcs_utils.sky_to_offset(self.skydir,
-                                             cat.glonlat[
-                                                 :, 0], cat.glonlat[:, 1],
+                                             glonlat[:, 0], glonlat[:, 1],
                                              'GAL')
+        catalog_dicts = catalog.table_to_dicts(tab)
+        spectral_pars = spectral_pars_from_catalog_table(tab)
+        spatial_pars = spatial_pars_from_catalog_table(tab)
+
+        for i, catalog_dict in enumerate(catalog_dicts):
 
-        for i, (row, radec) in enumerate(zip(cat.table[m],
-                                             cat.radec[m])):
-            catalog_dict = catalog.row_to_dict(row)
             src_dict = {'catalog': catalog_dict}
-            src_dict['Source_Name'] = row['Source_Name']
-            src_dict['SpectrumType'] = row['SpectrumType']
+            src_dict['Source_Name'] = catalog_dict['Source_Name']
+            src_dict['SpectrumType'] = catalog_dict['SpectrumType']
 
-            if row['extended']:
+            if catalog_dict['extended']:
                 src_dict['SourceType'] = 'DiffuseSource'
-                src_dict['SpatialType'] = str(row['Spatial_Function'])
-                src_dict['SpatialModel'] = str(row['Spatial_Function'])
+                src_dict['SpatialType'] = str(
+                    catalog_dict['Spatial_Function'])
+                src_dict['SpatialModel'] = str(
+                    catalog_dict['Spatial_Function'])
 
                 search_dirs = []
                 if extdir is not None:
                     search_dirs += [extdir, os.path.join(extdir, 'Templates')]
 
-                search_dirs += [row['extdir'],
-                                os.path.join(row['extdir'], 'Templates')]
+                search_dirs += [catalog_dict['extdir'],
+                                os.path.join(catalog_dict['extdir'],
+                                             'Templates')]
 
                 if src_dict['SpatialType'] == 'SpatialMap':
                     src_dict['Spatial_Filename'] = utils.resolve_file_path(
-                        row['Spatial_Filename'],
+                        catalog_dict['Spatial_Filename'],
                         search_dirs=search_dirs)
 
             else:
@@ -1959,18 +2310,21 @@ class ROIModel(fermipy.config.Configurable):
                 src_dict['SpatialType'] = 'SkyDirFunction'
                 src_dict['SpatialModel'] = 'PointSource'
 
-            src_dict['spectral_pars'] = spectral_pars_from_catalog(
-                catalog_dict)
-            src_dict['spatial_pars'] = spatial_pars_from_catalog(catalog_dict)
+            src_dict['spectral_pars'] = spectral_pars[i]
+            src_dict['spatial_pars'] = spatial_pars[i]
 
-            src = Source(src_dict['Source_Name'], src_dict, radec=radec)
-            src.data['offset'] = offset[m][i]
-            src.data['offset_ra'] = offset_cel[:, 0][m][i]
-            src.data['offset_dec'] = offset_cel[:, 1][m][i]
-            src.data['offset_glon'] = offset_gal[:, 0][m][i]
-            src.data['offset_glat'] = offset_gal[:, 1][m][i]
+            src = Source(src_dict['Source_Name'], src_dict, radec=radec[i])
+            src['offset'] = offset[i]
+            src['offset_ra'] = offset_cel[i, 0]
+            src['offset_dec'] = offset_cel[i, 1]
+            src['offset_glon'] = offset_gal[i, 0]
+            src['offset_glat'] = offset_gal[i, 1]
+
+            # Sources are created here so they can be loaded without
+            # copying
             self.load_source(src, False,
-                             merge_sources=self.config['merge_sources'])
+                             merge_sources=self.config['merge_sources'],
+                             copy_source=False)
 
         self._build_src_index()
 
@@ -2017,11 +2371,11 @@ class ROIModel(fermipy.config.Configurable):
         m = (m0 & m1)
         srcs = np.array(srcs)[m]
         for i, s in enumerate(srcs):
-            s.data['offset'] = offset[m][i]
-            s.data['offset_ra'] = offset_cel[:, 0][m][i]
-            s.data['offset_dec'] = offset_cel[:, 1][m][i]
-            s.data['offset_glon'] = offset_gal[:, 0][m][i]
-            s.data['offset_glat'] = offset_gal[:, 1][m][i]
+            s['offset'] = offset[m][i]
+            s['offset_ra'] = offset_cel[:, 0][m][i]
+            s['offset_dec'] = offset_cel[:, 1][m][i]
+            s['offset_glon'] = offset_gal[:, 0][m][i]
+            s['offset_glat'] = offset_gal[:, 1][m][i]
             self.load_source(s, False,
                              merge_sources=self.config['merge_sources'])
 
@@ -2035,14 +2389,13 @@ class ROIModel(fermipy.config.Configurable):
         """Build an indices for fast lookup of a source given its name
         or coordinates."""
 
-        self._srcs = sorted(self._srcs, key=lambda t: t['offset'])
-        nsrc = len(self._srcs)
-        radec = np.zeros((2, nsrc))
-
-        for i, src in enumerate(self._srcs):
-            radec[:, i] = src.radec
+        store = SourceStore(self._srcs)
+        isort = np.argsort(store['offset'], kind='mergesort')
+        self._srcs = [self._srcs[i] for i in isort]
+        self._src_store = SourceStore(self._srcs)
 
-        self._src_skydir = SkyCoord(ra=radec[0], dec=radec[1], unit=u.deg)
+        self._src_skydir = SkyCoord(ra=self._src_store['ra'],
+                                    dec=self._src_store['dec'], unit=u.deg)
         self._src_radius = self._src_skydir.separation(self.skydir)
 
     def write_xml(self, xmlfile, config=None):
@@ -2080,16 +2433,12 @@ class ROIModel(fermipy.config.Configurable):
         cols = [Column(name=k, **v) for k, v in cols_dict.items()]
         tab = Table(cols)
 
-        row_dict = {}
+        rows = []
         for s in self.sources:
-            row_dict['source_name'] = s.name
-            row_dict['spectrum_type'] = s['SpectrumType']
-            row_dict['spatialModel_type'] = s['SpatialType']
-            row_dict['spectrum_file'] = s['Spectrum_Filename']
-            row_dict['spatialModel_file'] = s['Spatial_Filename']
-            tab.add_row([row_dict[k] for k in tab.columns])
+            rows += [[s.name, s['SpectrumType'], s['SpatialType'],
+                      s['Spectrum_Filename'], s['Spatial_Filename']]]
 
-        return tab
+        return fill_table(tab, rows)
 
     def create_param_table(self):
 
@@ -2108,6 +2457,7 @@ class ROIModel(fermipy.config.Configurable):
         cols = [Column(name=k, **v) for k, v in cols_dict.items()]
         tab = Table(cols)
 
+        rows = []
         row_dict = {}
         for s in self.sources:
             row_dict['source_name'] = s.name
@@ -2117,16 +2467,16 @@ class ROIModel(fermipy.config.Configurable):
             for k, v in s.spectral_pars.items():
                 row_dict['name'] = k
                 row_dict.update(v)
-                tab.add_row([row_dict[k] for k in tab.columns])
+                rows += [[row_dict[k] for k in tab.columns]]
 
             row_dict['type'] = s['SpatialType']
             row_dict['group'] = 'spatialModel'
             for k, v in s.spatial_pars.items():
                 row_dict['name'] = k
                 row_dict.update(v)
-                tab.add_row([row_dict[k] for k in tab.columns])
+                rows += [[row_dict[k] for k in tab.columns]]
 
-        return tab
+        return fill_table(tab, rows)
 
     def create_table(self, names=None):
         """Create an astropy Table object with the contents of the ROI model.
@@ -2137,12 +2487,9 @@ class ROIModel(fermipy.config.Configurable):
             scan_shape = max(scan_shape, src['dloglike_scan'].shape)
 
         tab = create_source_table(scan_shape)
-        for s in self._srcs:
-            if names is not None and s.name not in names:
-                continue
-            s.add_to_table(tab)
-
-        return tab
+        rows = [s.get_table_row(tab) for s in self._srcs
+                if names is None or s.name in names]
+        return fill_table(tab, rows)
 
     def write_fits(self, fitsfile):
         """Write the ROI model to a FITS file."""
@@ -82,6 +82,11 @@ def main(args=None):
                         help='Set the pixel size in deg of the WCS sensitivity map.')
     parser.add_argument('--wcs_proj', default='AIT', type=str,
                         help='Set the projection of the WCS sensitivity map.')
+    parser.add_argument('--map_nstep', default=500, type=int,
+                        help='Set the number of map pixels that are evaluated together in a '
+                        'single vectorized pass.')
+    parser.add_argument('--nthread', default=1, type=int,
+                        help='Set the number of processes used to evaluate the sensitivity map.')
     parser.add_argument('--spatial_model', default='PointSource', type=str,
                         help='Set the spatial morphology of the signal (PointSource, RadialDisk, RadialGaussian).')
     parser.add_argument('--spatial_size', default=1.0, type=float,
@@ -123,6 +128,8 @@ def run_flux_sensitivity(**kwargs):
     ts_thresh = kwargs.get('ts_thresh', 25.0)
     nside = kwargs.get('hpx_nside', 16)
     output = kwargs.get('output', None)
+    map_nstep = kwargs.get('map_nstep', 500)
+    nthread = kwargs.get('nthread', 1)
 
     event_types = [['FRONT', 'BACK']]
     fn = spectrum.PowerLaw([1E-13, -index], scale=1E3)
@@ -175,66 +182,25 @@ def run_flux_sensitivity(**kwargs):
     map_int_flux = None
     map_int_npred = None
 
-    map_nstep = 500
-
     if map_type == 'hpx':
-
-        hpx = HPX(nside, True, 'GAL', ebins=ebins)
-        map_diff_flux = HpxMap(np.zeros((nbin, hpx.npix)), hpx)
-        map_diff_npred = HpxMap(np.zeros((nbin, hpx.npix)), hpx)
-        map_skydir = map_diff_flux.hpx.get_sky_dirs()
-
-        for i in range(0, len(map_skydir), map_nstep):
-            s = slice(i, i + map_nstep)
-            o = scalc.diff_flux_threshold(
-                map_skydir[s], fn, ts_thresh, min_counts)
-            map_diff_flux.data[:, s] = o['flux'].T
-            map_diff_npred.data[:, s] = o['npred'].T
-
-        hpx = HPX(nside, True, 'GAL')
-        map_int_flux = HpxMap(np.zeros((hpx.npix)), hpx)
-        map_int_npred = HpxMap(np.zeros((hpx.npix)), hpx)
-        map_skydir = map_int_flux.hpx.get_sky_dirs()
-
-        for i in range(0, len(map_skydir), map_nstep):
-            s = slice(i, i + map_nstep)
-            o = scalc.int_flux_threshold(
-                map_skydir[s], fn, ts_thresh, min_counts)
-            map_int_flux.data[s] = o['flux']
-            map_int_npred.data[s] = o['npred']
-
+        geom = HPX(nside, True, 'GAL')
     elif map_type == 'wcs':
+        geom = Map.create(c, wcs_cdelt, [wcs_npix, wcs_npix],
+                          'GAL', wcs_proj)
 
-        wcs_shape = [wcs_npix, wcs_npix]
-        wcs_size = wcs_npix * wcs_npix
-
-        map_diff_flux = Map.create(
-            c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj, ebins=ebins)
-        map_diff_npred = Map.create(
-            c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj, ebins=ebins)
-        map_skydir = map_diff_flux.get_pixel_skydirs()
-
-        for i in range(0, len(map_skydir), map_nstep):
-            idx = np.unravel_index(
-                np.arange(i, min(i + map_nstep, wcs_size)), wcs_shape)
-            s = (slice(None), idx[1], idx[0])
-            o = scalc.diff_flux_threshold(
-                map_skydir[slice(i, i + map_nstep)], fn, ts_thresh, min_counts)
-            map_diff_flux.data[s] = o['flux'].T
-            map_diff_npred.data[s] = o['npred'].T
-
-        map_int_flux = Map.create(c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj)
-        map_int_npred = Map.create(c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj)
-        map_skydir = map_int_flux.get_pixel_skydirs()
-
-        for i in range(0, len(map_skydir), map_nstep):
-            idx = np.unravel_index(
-                np.arange(i, min(i + map_nstep, wcs_size)), wcs_shape)
-            s = (idx[1], idx[0])
-            o = scalc.int_flux_threshold(
-                map_skydir[slice(i, i + map_nstep)], fn, ts_thresh, min_counts)
-            map_int_flux.data[s] = o['flux']
-            map_int_npred.data[s] = o['npred']
+    if map_type is not None:
+        maps = scalc.flux_threshold_map(geom, fn, ts_thresh, min_counts,
+                                        chunk_size=map_nstep,
+                                        nthread=nthread)
+        map_diff_flux = maps['flux']
+        map_diff_npred = maps['npred']
+
+        maps = scalc.flux_threshold_map(geom, fn, ts_thresh, min_counts,
+                                        integral=True,
+                                        chunk_size=map_nstep,
+                                        nthread=nthread)
+        map_int_flux = maps['flux']
+        map_int_npred = maps['npred']
 
     o = scalc.diff_flux_threshold(c, fn, ts_thresh, min_counts)
 
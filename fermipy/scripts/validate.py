@@ -48,6 +48,10 @@ def main():
     parser.add_argument('--dry_run', default=False, action='store_true')
     parser.add_argument('--mode', default='fill', type=str)
     parser.add_argument('--overwrite', default=False, action='store_true')
+    parser.add_argument('--nthread', default=1, type=int,
+                        help='Number of processes used to fill the histograms.')
+    parser.add_argument('--chunk_size', default=1000000, type=int,
+                        help='Number of events processed at a time.')
 
     args = parser.parse_args()
 
@@ -93,19 +97,20 @@ def main():
             continue
 
         if v['data_type'] == 'agn':
-            val = AGNValidator(config['scfile'], 100.)
+            val = AGNValidator(config['scfile'], 100.,
+                               chunk_size=args.chunk_size)
         elif v['data_type'] == 'psr':
-            val = PSRValidator(config['scfile'], 100.)
+            val = PSRValidator(config['scfile'], 100.,
+                               chunk_size=args.chunk_size)
         elif v['data_type'] == 'ridge':
-            val = GRValidator(config['scfile'], 100.)
+            val = GRValidator(config['scfile'], 100.,
+                              chunk_size=args.chunk_size)
         else:
             raise Exception('Unknown data type {}'.format(v['data_type']))
 
         infiles = glob.glob(v['files'])
 
-        for f in infiles:
-            print('processing', f)
-            val.process(f)
+        val.process_files(infiles, nthread=args.nthread)
 
         val.calc_eff()
         if v['data_type'] in ['agn', 'psr']:
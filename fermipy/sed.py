@@ -12,6 +12,8 @@ import logging
 import os
 import json
 
+from functools import partial
+
 import numpy as np
 
 from astropy.io import fits
@@ -19,15 +21,19 @@ from astropy.table import Table, Column
 
 import fermipy.config
 from fermipy import utils
-from fermipy import gtutils
 from fermipy import fits_utils
 from fermipy import roi_model
 from fermipy.config import ConfigSchema
 from fermipy.timing import Timer
 from fermipy import model_utils
+from fermipy.lazy_import import LazyModule
+
+pyLike = LazyModule('pyLikelihood')
+gtutils = LazyModule('fermipy.gtutils')
 
-from LikelihoodState import LikelihoodState
-import pyLikelihood as pyLike
+
+def _fit_sed_bin_worker(ibin, gta, name, **kwargs):
+    return gta._fit_sed_bin(name, ibin, **kwargs)
 
 
 class SEDGenerator(object):
@@ -105,7 +111,7 @@ class SEDGenerator(object):
             np.save(outfile + '.npy', o)
 
         if config['make_plots']:
-            self._plotter.make_sed_plots(o, **config)
+            self.plotter.make_sed_plots(o, **config)
 
         self.logger.info('Execution time: %.2f s', timer.elapsed_time)
         return o
@@ -281,7 +287,7 @@ class SEDGenerator(object):
             o['%s_ul95' % t] = np.zeros(nbins) * np.nan
             o['%s_ul' % t] = np.zeros(nbins) * np.nan
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
         source = self.components[0].like.logLike.getSource(str(name))
 
         # Perform global spectral fit
@@ -405,111 +411,39 @@ class SEDGenerator(object):
             o['correlation'][p['src_name']] = np.zeros(nbins) * np.nan
 
         self._fitcache = None
+        self._norm_like = None
 
-        for i, (logemin, logemax) in enumerate(zip(loge_bins[:-1],
-                                                   loge_bins[1:])):
-
-            logectr = 0.5 * (logemin + logemax)
-            emin = 10 ** logemin
-            emax = 10 ** logemax
-            ectr = 10 ** logectr
-            ectr2 = ectr**2
-
-            saved_state_bin = LikelihoodState(self.like)
+        for i in range(nbins):
             if use_local_index:
                 o['index'][i] = -min(gf_bin_index[i], max_index)
             else:
                 o['index'][i] = -bin_index
 
-            self.set_norm(name, 1.0, update_source=False)
-            self.set_parameter(name, 'Index', o['index'][i], scale=1.0,
-                               update_source=False)
-            self.like.syncSrcParams(str(name))
-
-            ref_flux = self.like[name].flux(emin, emax)
-
-            o['ref_flux'][i] = self.like[name].flux(emin, emax)
-            o['ref_eflux'][i] = self.like[name].energyFlux(emin, emax)
-            o['ref_dnde'][i] = self.like[name].spectrum()(pyLike.dArg(ectr))
-            o['ref_dnde_e_min'][i] = self.like[
-                name].spectrum()(pyLike.dArg(emin))
-            o['ref_dnde_e_max'][i] = self.like[
-                name].spectrum()(pyLike.dArg(emax))
-            o['ref_e2dnde'][i] = o['ref_dnde'][i] * ectr2
-            cs = self.model_counts_spectrum(
-                name, logemin, logemax, summed=True)
-            o['ref_npred'][i] = np.sum(cs)
-
-            normVal = self.like.normPar(name).getValue()
-            flux_ratio = gf_bin_flux[i] / ref_flux
-            newVal = max(normVal * flux_ratio, 1E-10)
-            self.set_norm(name, newVal, update_source=False)
-            self.set_norm_bounds(name, [newVal * 1E-6, newVal * 1E4])
-
-            self.like.syncSrcParams(str(name))
-            self.free_norm(name)
-            self.logger.debug('Fitting %s SED from %.0f MeV to %.0f MeV' %
-                              (name, emin, emax))
-            self.set_energy_range(logemin, logemax)
-
-            fit_output = self._fit(**config['optimizer'])
-            free_params = self.get_params(True)
-            for j, p in enumerate(free_params):
-
-                if not p['is_norm']:
-                    continue
-
-                o['correlation'][p['src_name']][i] = \
-                    fit_output['correlation'][src_norm_idx, j]
-
-            o['fit_quality'][i] = fit_output['fit_quality']
-            o['fit_status'][i] = fit_output['fit_status']
-
-            flux = self.like[name].flux(emin, emax)
-            eflux = self.like[name].energyFlux(emin, emax)
-            dnde = self.like[name].spectrum()(pyLike.dArg(ectr))
-
-            o['norm'][i] = flux / o['ref_flux'][i]
-            o['flux'][i] = flux
-            o['eflux'][i] = eflux
-            o['dnde'][i] = dnde
-            o['e2dnde'][i] = dnde * ectr2
-
-            cs = self.model_counts_spectrum(name, logemin,
-                                            logemax, summed=True)
-            o['npred'][i] = np.sum(cs)
-            o['loglike'][i] = fit_output['loglike']
-
-            lnlp = self.profile_norm(name, logemin=logemin, logemax=logemax,
-                                     savestate=True, reoptimize=True,
-                                     npts=npts, optimizer=config['optimizer'])
-
-            o['ts'][i] = max(
-                2.0 * (fit_output['loglike'] - lnlp['loglike'][0]), 0.0)
-            o['loglike_scan'][i] = lnlp['loglike']
-            o['dloglike_scan'][i] = lnlp['dloglike']
-            o['norm_scan'][i] = lnlp['flux'] / ref_flux
-
-            ul_data = utils.get_parameter_limits(
-                lnlp['flux'], lnlp['dloglike'])
-
-            o['norm_err_hi'][i] = ul_data['err_hi'] / ref_flux
-            o['norm_err_lo'][i] = ul_data['err_lo'] / ref_flux
-
-            if np.isfinite(ul_data['err_lo']):
-                o['norm_err'][i] = 0.5 * (ul_data['err_lo'] +
-                                          ul_data['err_hi']) / ref_flux
-            else:
-                o['norm_err'][i] = ul_data['err_hi'] / ref_flux
-
-            o['norm_ul95'][i] = ul_data['ul'] / ref_flux
-
-            ul_data = utils.get_parameter_limits(lnlp['flux'],
-                                                 lnlp['dloglike'],
-                                                 cl_limit=ul_confidence)
-            o['norm_ul'][i] = ul_data['ul'] / ref_flux
+        bin_kwargs = dict(loge_bins=loge_bins, index=o['index'],
+                          gf_bin_flux=gf_bin_flux,
+                          src_norm_idx=src_norm_idx, npts=npts,
+                          ul_confidence=ul_confidence,
+                          optimizer=config['optimizer'])
+
+        if config['multithread'] and nbins > 1:
+            # Energy bins are independent so each worker can fit a
+            # subset of bins starting from its own copy of the
+            # likelihood state
+            results = utils.pool_map(partial(_fit_sed_bin_worker, name=name,
+                                             **bin_kwargs), range(nbins),
+                                     nthread=config['nthread'],
+                                     state=dict(gta=self))
+        else:
+            results = [self._fit_sed_bin(name, i, **bin_kwargs)
+                       for i in range(nbins)]
 
-            saved_state_bin.restore()
+        for i, r in enumerate(results):
+            for k, v in r.items():
+                if k == 'correlation':
+                    for src_name, corr in v.items():
+                        o['correlation'][src_name][i] = corr
+                else:
+                    o[k][i] = v
 
         for t in ['flux', 'eflux', 'dnde', 'e2dnde']:
 
@@ -532,6 +466,119 @@ class SEDGenerator(object):
 
         return o
 
+    def _fit_sed_bin(self, name, ibin, loge_bins, index, gf_bin_flux,
+                     src_norm_idx, npts, ul_confidence, optimizer):
+        """Fit the normalization of a source in a single SED energy
+        bin.  The likelihood state is restored before returning.
+
+        Returns
+        -------
+        o : dict
+            Dictionary with the values of the SED output quantities in
+            this bin.
+        """
+
+        logemin = loge_bins[ibin]
+        logemax = loge_bins[ibin + 1]
+        logectr = 0.5 * (logemin + logemax)
+        emin = 10 ** logemin
+        emax = 10 ** logemax
+        ectr = 10 ** logectr
+        ectr2 = ectr**2
+
+        o = {'correlation': {}}
+        saved_state_bin = gtutils.LikelihoodState(self.like)
+
+        self.set_norm(name, 1.0, update_source=False)
+        self.set_parameter(name, 'Index', index[ibin], scale=1.0,
+                           update_source=False)
+        self.like.syncSrcParams(str(name))
+
+        ref_flux = self.like[name].flux(emin, emax)
+
+        o['ref_flux'] = self.like[name].flux(emin, emax)
+        o['ref_eflux'] = self.like[name].energyFlux(emin, emax)
+        o['ref_dnde'] = self.like[name].spectrum()(pyLike.dArg(ectr))
+        o['ref_dnde_e_min'] = self.like[name].spectrum()(pyLike.dArg(emin))
+        o['ref_dnde_e_max'] = self.like[name].spectrum()(pyLike.dArg(emax))
+        o['ref_e2dnde'] = o['ref_dnde'] * ectr2
+        cs = self.model_counts_spectrum(
+            name, logemin, logemax, summed=True)
+        o['ref_npred'] = np.sum(cs)
+
+        normVal = self.like.normPar(name).getValue()
+        flux_ratio = gf_bin_flux[ibin] / ref_flux
+        newVal = max(normVal * flux_ratio, 1E-10)
+        self.set_norm(name, newVal, update_source=False)
+        self.set_norm_bounds(name, [newVal * 1E-6, newVal * 1E4])
+
+        self.like.syncSrcParams(str(name))
+        self.free_norm(name)
+        self.logger.debug('Fitting %s SED from %.0f MeV to %.0f MeV' %
+                          (name, emin, emax))
+        self.set_energy_range(logemin, logemax)
+
+        fit_output = self._fit(**optimizer)
+        free_params = self.get_params(True)
+        for j, p in enumerate(free_params):
+
+            if not p['is_norm']:
+                continue
+
+            o['correlation'][p['src_name']] = \
+                fit_output['correlation'][src_norm_idx, j]
+
+        o['fit_quality'] = fit_output['fit_quality']
+        o['fit_status'] = fit_output['fit_status']
+
+        flux = self.like[name].flux(emin, emax)
+        eflux = self.like[name].energyFlux(emin, emax)
+        dnde = self.like[name].spectrum()(pyLike.dArg(ectr))
+
+        o['norm'] = flux / o['ref_flux']
+        o['flux'] = flux
+        o['eflux'] = eflux
+        o['dnde'] = dnde
+        o['e2dnde'] = dnde * ectr2
+
+        cs = self.model_counts_spectrum(name, logemin,
+                                        logemax, summed=True)
+        o['npred'] = np.sum(cs)
+        o['loglike'] = fit_output['loglike']
+
+        lnlp = self.profile_norm(name, logemin=logemin, logemax=logemax,
+                                 savestate=True, reoptimize=True,
+                                 npts=npts, optimizer=optimizer)
+
+        o['ts'] = max(2.0 * (fit_output['loglike'] - lnlp['loglike'][0]),
+                      0.0)
+        o['loglike_scan'] = lnlp['loglike']
+        o['dloglike_scan'] = lnlp['dloglike']
+        o['norm_scan'] = lnlp['flux'] / ref_flux
+
+        ul_data = utils.get_parameter_limits(
+            lnlp['flux'], lnlp['dloglike'])
+
+        o['norm_err_hi'] = ul_data['err_hi'] / ref_flux
+        o['norm_err_lo'] = ul_data['err_lo'] / ref_flux
+
+        if np.isfinite(ul_data['err_lo']):
+            o['norm_err'] = 0.5 * (ul_data['err_lo'] +
+                                   ul_data['err_hi']) / ref_flux
+        else:
+            o['norm_err'] = ul_data['err_hi'] / ref_flux
+
+        o['norm_ul95'] = ul_data['ul'] / ref_flux
+
+        ul_data = utils.get_parameter_limits(lnlp['flux'],
+                                             lnlp['dloglike'],
+                                             cl_limit=ul_confidence)
+        o['norm_ul'] = ul_data['ul'] / ref_flux
+
+        saved_state_bin.restore()
+
+        return o
+
 
 if __name__ == "__main__":
 
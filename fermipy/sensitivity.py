@@ -1,7 +1,7 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
 
-import pyLikelihood as pyLike
+from functools import partial
 
 import numpy as np
 from astropy.coordinates import SkyCoord
@@ -13,6 +13,46 @@ from fermipy import spectrum
 from fermipy import irfs
 from fermipy import skymap
 from fermipy.ltcube import LTCube
+from fermipy.hpx_utils import HPX
+from fermipy.skymap import HpxMap, Map
+from fermipy.lazy_import import LazyModule
+
+pyLike = LazyModule('pyLikelihood')
+
+
+def _threshold_worker(bounds, scalc, skydir, fn, ts_thresh, min_counts,
+                      integral):
+    """Evaluate the flux threshold for one chunk of the sky
+    directions."""
+    skydir = skydir[slice(*bounds)]
+    if integral:
+        return scalc.int_flux_threshold(skydir, fn, ts_thresh, min_counts)
+    else:
+        return scalc.diff_flux_threshold(skydir, fn, ts_thresh, min_counts)
+
+
+def _stack_threshold_results(results, nebin, integral):
+    """Concatenate the outputs of a sequence of chunked flux threshold
+    evaluations along the sky direction axis."""
+
+    keys = ['npred', 'flux', 'eflux', 'dnde', 'e2dnde']
+    o = dict(results[0])
+    for k in keys:
+        if integral:
+            o[k] = np.concatenate([np.array(r[k], ndmin=1).ravel()
+                                   for r in results])
+        else:
+            o[k] = np.concatenate([np.reshape(r[k], (-1, nebin))
+                                   for r in results])
+
+    if integral:
+        o['bins'] = dict(results[0]['bins'])
+        for k in keys:
+            o['bins'][k] = np.concatenate([np.reshape(r['bins'][k],
+                                                      (-1, nebin))
+                                           for r in results])
+
+    return o
 
 
 class SensitivityCalc(object):
@@ -272,3 +312,128 @@ class SensitivityCalc(object):
                          e_ref=self.ectr)
 
         return o
+
+    def flux_threshold_batch(self, skydir, fn, ts_thresh, min_counts,
+                             integral=False, chunk_size=500, nthread=1):
+        """Compute the differential or integral flux threshold for an
+        array of sky directions.  Directions are processed in chunks
+        of ``chunk_size`` for which the exposure, background, and
+        threshold normalization are evaluated in a single vectorized
+        pass.  Chunks are distributed over ``nthread`` processes.
+
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Array of sky coordinates at which the sensitivity will be
+            evaluated.
+
+        fn : `~fermipy.spectrum.SpectralFunction`
+
+        ts_thresh : float
+            Threshold on the detection test statistic (TS).
+
+        min_counts : float
+            Threshold on the minimum number of counts.
+
+        integral : bool
+            Compute the integral flux threshold instead of the
+            differential flux threshold.
+
+        chunk_size : int
+            Number of sky directions evaluated per chunk.
+
+        nthread : int
+            Number of processes.  If None the number of CPUs will be
+            used.
+
+        Returns
+        -------
+        o : dict
+            Dictionary with the same keys as `diff_flux_threshold` or
+            `int_flux_threshold`.  The first dimension of each
+            direction-dependent array runs over ``skydir``.
+
+        """
+
+        skydir = skydir.reshape((-1,))
+        nebin = len(self.ebins) - 1
+        bounds = [(i, min(i + chunk_size, len(skydir)))
+                  for i in range(0, len(skydir), chunk_size)]
+        fn_chunk = partial(_threshold_worker, fn=fn, ts_thresh=ts_thresh,
+                           min_counts=min_counts, integral=integral)
+
+        state = dict(scalc=self, skydir=skydir)
+        if (nthread is None or nthread > 1) and len(bounds) > 1:
+            results = utils.pool_map(fn_chunk, bounds, nthread=nthread,
+                                     state=state)
+        else:
+            results = [fn_chunk(b, **state) for b in bounds]
+
+        return _stack_threshold_results(results, nebin, integral)
+
+    def flux_threshold_map(self, geom, fn, ts_thresh, min_counts,
+                           integral=False, chunk_size=500, nthread=1):
+        """Compute maps of the differential or integral flux threshold
+        evaluated at the center of every pixel of a HEALPix or WCS
+        geometry.
+
+        Parameters
+        ----------
+        geom : `~fermipy.hpx_utils.HPX` or `~fermipy.skymap.Map`
+            HEALPix geometry or WCS map defining the pixelization of
+            the output maps.
+
+        fn : `~fermipy.spectrum.SpectralFunction`
+
+        ts_thresh : float
+            Threshold on the detection test statistic (TS).
+
+        min_counts : float
+            Threshold on the minimum number of counts.
+
+        integral : bool
+            Compute the integral flux threshold instead of the
+            differential flux threshold.  Differential maps have an
+            energy dimension with the binning of this calculator.
+
+        chunk_size : int
+            Number of pixels evaluated per chunk.
+
+        nthread : int
+            Number of processes.  If None the number of CPUs will be
+            used.
+
+        Returns
+        -------
+        maps : dict
+            Dictionary of `~fermipy.skymap.HpxMap` or
+            `~fermipy.skymap.Map` objects with keys ``npred``,
+            ``flux``, ``eflux``, ``dnde``, and ``e2dnde``.
+
+        """
+
+        ebins = None if integral else self.ebins
+
+        if isinstance(geom, HPX):
+            hpx = HPX(geom.nside, geom.nest, geom.coordsys,
+                      region=geom.region, ebins=ebins, conv=geom.conv)
+            skydir = hpx.get_sky_dirs()
+        else:
+            wcs = geom.wcs.celestial
+            skydir = geom.get_pixel_skydirs()
+
+        o = self.flux_threshold_batch(skydir, fn, ts_thresh, min_counts,
+                                      integral=integral,
+                                      chunk_size=chunk_size,
+                                      nthread=nthread)
+
+        maps = {}
+        for k in ['npred', 'flux', 'eflux', 'dnde', 'e2dnde']:
+            if isinstance(geom, HPX):
+                maps[k] = HpxMap(np.array(o[k].T), hpx)
+            else:
+                # Sky directions are ordered with LON as the slow index
+                v = o[k].reshape(tuple(geom.npix[:2]) + o[k].shape[1:])
+                maps[k] = Map(np.array(v.T), wcs, ebins=ebins)
+
+        return maps
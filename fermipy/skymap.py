@@ -1,10 +1,8 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
 import copy
+from collections import OrderedDict
 import numpy as np
-import healpy as hp
-from scipy.interpolate import RegularGridInterpolator
-from scipy.ndimage.interpolation import map_coordinates
 from astropy.io import fits
 from astropy.wcs import WCS
 from astropy.table import Table
@@ -15,6 +13,9 @@ import fermipy.wcs_utils as wcs_utils
 import fermipy.hpx_utils as hpx_utils
 import fermipy.fits_utils as fits_utils
 from fermipy.hpx_utils import HPX, HpxToWcsMapping
+from fermipy.lazy_import import LazyModule
+
+hp = LazyModule('healpy')
 
 
 def make_coadd_map(maps, proj, shape):
@@ -62,11 +63,100 @@ def read_map_from_fits(fitsfile, extname=None):
     return m, f
 
 
+def _linear_weights(x, n):
+    """Compute the indices and weights of the lower and upper grid
+    points for linear interpolation on the integer grid [0,n-1].
+    Points outside the grid are extrapolated from the first or last
+    interval."""
+    x = np.asarray(x, dtype=float)
+    if n == 1:
+        i0 = np.zeros(x.shape, dtype=int)
+        return i0, i0, np.zeros(x.shape)
+    i0 = np.clip(np.floor(x).astype(int), 0, n - 2)
+    return i0, i0 + 1, x - i0
+
+
+def _same_pixels(hpx0, hpx1):
+    """Test whether two HEALPix geometries contain the same pixels."""
+    if hpx0.ipix is None or hpx1.ipix is None:
+        return hpx0.ipix is None and hpx1.ipix is None
+    return np.array_equal(hpx0.ipix, hpx1.ipix)
+
+
+def _make_cache_key(*args):
+    key = []
+    for a in args:
+        if a is None or np.isscalar(a):
+            key += [a]
+        else:
+            a = np.asarray(a, dtype=float)
+            key += [(a.shape, a.tobytes())]
+    return tuple(key)
+
+
+class MapInterpolator(object):
+    """Precomputed linear interpolation of a map at a fixed set of
+    points.  The flattened data indices and weights of the grid points
+    neighbouring every query point are computed once so that each
+    evaluation reduces to a single gather and weighted sum.  The same
+    interpolator can be applied to any data array with the geometry
+    of the map it was created from.
+
+    Parameters
+    ----------
+    idx : `~numpy.ndarray`
+        Flattened data indices of the neighbouring grid points with
+        shape (nvertex, npts).  When ``planes`` is True these are
+        indices into the spatial dimension of the data.
+
+    wts : `~numpy.ndarray`
+        Interpolation weights with the same shape as ``idx``.
+
+    shape : tuple
+        Shape of the output array (excluding the energy dimension).
+
+    planes : bool
+        Interpolate every energy plane of the data.
+    """
+
+    def __init__(self, idx, wts, shape, planes=False):
+        self._idx = idx
+        self._wts = wts
+        self._shape = tuple(shape)
+        self._planes = planes
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def __call__(self, data):
+        """Evaluate the interpolation for a data array."""
+        data = np.asarray(data)
+        if self._planes:
+            # Accumulate one vertex at a time into a preallocated
+            # array to avoid a temporary with shape (nplane, nvertex,
+            # npts).  Floating-point data keep their precision.
+            data = data.reshape((data.shape[0], -1))
+            dtype = (data.dtype if np.issubdtype(data.dtype, np.floating)
+                     else float)
+            v = np.zeros((data.shape[0], self._idx.shape[-1]), dtype=dtype)
+            for idx, wts in zip(self._idx, self._wts):
+                v += data[:, idx] * wts
+            return v.reshape((data.shape[0],) + self._shape)
+
+        v = np.sum(data.ravel()[self._idx] * self._wts, axis=0)
+        return v.reshape(self._shape)
+
+
 class Map_Base(object):
     """ Abstract representation of a 2D or 3D counts map."""
 
+    # Maximum number of interpolators cached per map
+    interp_cache_size = 8
+
     def __init__(self, counts):
         self._counts = counts
+        self._interp_cache = OrderedDict()
 
     @property
     def counts(self):
@@ -102,6 +192,25 @@ class Map_Base(object):
         """Return the interpolated map values corresponding to a set of coordinates. """
         raise NotImplementedError("MapBase.interpolate()")
 
+    def create_interpolator(self, lon, lat, egy=None, **kwargs):
+        """Return a `~fermipy.skymap.MapInterpolator` for a set of coordinates. """
+        raise NotImplementedError("MapBase.create_interpolator()")
+
+    def get_interpolator(self, lon, lat, egy=None, **kwargs):
+        """Return a `~fermipy.skymap.MapInterpolator` for a set of
+        coordinates.  Interpolators are cached so that repeated
+        evaluations at the same coordinates reuse the precomputed
+        indices and weights."""
+        key = _make_cache_key(lon, lat, egy) + tuple(sorted(kwargs.items()))
+        if key in self._interp_cache:
+            return self._interp_cache[key]
+
+        fn = self.create_interpolator(lon, lat, egy, **kwargs)
+        self._interp_cache[key] = fn
+        while len(self._interp_cache) > self.interp_cache_size:
+            self._interp_cache.popitem(last=False)
+        return fn
+
 
 class Map(Map_Base):
     """ Representation of a 2D or 3D counts map using WCS. """
@@ -353,8 +462,29 @@ class Map(Map_Base):
         vals[~m] = np.nan
         return vals
 
-    def interpolate(self, lon, lat, egy=None):
+    def create_interpolator(self, lon, lat, egy=None):
+        """Create an interpolator for this map at a set of coordinates.
+        Interpolation is linear in pixel coordinates and in log(energy)
+        for the energy dimension.
+
+        Parameters
+        ----------
+        lon, lat : array-like
+            Coordinates in the map coordinate system in degrees.
+
+        egy : array-like
+            Energies in MeV.  If None the interpolation will be
+            performed at the energies of the map planes.  Energies
+            outside of the range of the energy planes are clamped to
+            the first/last plane while spatial coordinates outside of
+            the map are linearly extrapolated (as
+            `~scipy.interpolate.RegularGridInterpolator` with
+            ``fill_value=None``).
 
+        Returns
+        -------
+        fn : `~fermipy.skymap.MapInterpolator`
+        """
         if len(self.npix) == 2:
             pixcrd = self.wcs.wcs_world2pix(lon, lat, 0)
         else:
@@ -365,14 +495,25 @@ class Map(Map_Base):
             pixcrd[2] = np.array(utils.val_to_pix(np.log(self._ectr),
                                                   np.log(egy)), ndmin=1)
 
-        points = []
-        for npix in self.npix:
-            points += [np.linspace(0, npix - 1., npix)]
-        data = self.counts
-        fn = RegularGridInterpolator(points, data.T,
-                                     bounds_error=False,
-                                     fill_value=None)
-        return fn(np.column_stack(pixcrd))
+        pixcrd = [np.ravel(t) for t in pixcrd]
+        shape = (len(pixcrd[0]),)
+        lims = [_linear_weights(x, n) for x, n in zip(pixcrd, self.npix)]
+
+        idx, wts = [], []
+        for vertex in np.ndindex(*([2] * len(lims))):
+            xyidx = [l[v] for l, v in zip(lims, vertex)]
+            w = np.ones(shape)
+            for l, v in zip(lims, vertex):
+                w *= l[2] if v else 1.0 - l[2]
+            idx += [self.xypix_to_ipix(xyidx, colwise=True)]
+            wts += [w]
+
+        return MapInterpolator(np.array(idx), np.array(wts), shape)
+
+    def interpolate(self, lon, lat, egy=None):
+
+        fn = self.get_interpolator(lon, lat, egy)
+        return fn(self.counts)
 
     def interpolate_at_skydir(self, skydir):
 
@@ -388,6 +529,11 @@ class Map(Map_Base):
 class HpxMap(Map_Base):
     """ Representation of a 2D or 3D counts map using HEALPix. """
 
+    # Arithmetic with numpy arrays on the left-hand side is delegated
+    # to the reflected operators of the map
+    __array_ufunc__ = None
+    __array_priority__ = 100
+
     def __init__(self, counts, hpx):
         """ C'tor, fill with a counts vector and a HPX object """
         Map_Base.__init__(self, counts)
@@ -406,7 +552,7 @@ class HpxMap(Map_Base):
         hdu    : The FITS
         ebins  : Energy bin edges [optional]
         """
-        hpx = HPX.create_from_header(hdu.header, ebins)
+        hpx = HPX.create_from_hdu(hdu, ebins)
         colnames = hdu.columns.names
         cnames = []
         if hpx.conv.convname == 'FGST_SRCMAP_SPARSE':
@@ -583,10 +729,77 @@ class HpxMap(Map_Base):
 
         pix = hp.ang2pix(self.hpx.nside, theta, phi, nest=self.hpx.nest)
 
+        if self.hpx.is_allsky:
+            if self.data.ndim == 2:
+                return self.data[:, pix] if ibin is None else self.data[ibin, pix]
+            else:
+                return self.data[pix]
+
+        # Partial-sky map: flag the coordinates outside of the map
+        pix = self.hpx[pix]
+        m = pix < 0
+        pix[m] = 0
         if self.data.ndim == 2:
-            return self.data[:, pix] if ibin is None else self.data[ibin, pix]
+            vals = self.data[:, pix] if ibin is None else self.data[ibin, pix]
+        else:
+            vals = self.data[pix]
+        vals = np.array(vals, dtype=float)
+        vals[..., m] = np.nan
+        return vals
+
+    def create_interpolator(self, lon, lat, egy=None, interp_log=True):
+        """Create an interpolator for this map at a set of coordinates.
+        The HEALPix neighbour pixels and bilinear weights are computed
+        with `~healpy.pixelfunc.get_interp_weights` and combined with
+        the weights for linear interpolation between energy planes.
+
+        Parameters
+        ----------
+        lon, lat : array-like
+            Coordinates in the map coordinate system in degrees.
+
+        egy : array-like
+            Energies in MeV.  If None the interpolator will return
+            values for every energy plane of the map.  Energies
+            outside of the range of the energy planes are clamped to
+            the first/last plane.
+
+        interp_log : bool
+            Interpolate the z-coordinate in logspace.
+
+        Returns
+        -------
+        fn : `~fermipy.skymap.MapInterpolator`
+        """
+        shape = np.broadcast(lon, lat, egy).shape
+        lon = np.ravel(lon * np.ones(shape))
+        lat = np.ravel(lat * np.ones(shape))
+        theta = np.pi / 2. - np.radians(lat)
+        phi = np.radians(lon)
+        pix, wts = hp.pixelfunc.get_interp_weights(self.hpx.nside, theta, phi,
+                                                   nest=self.hpx.nest)
+        if not self.hpx.is_allsky:
+            # Neighbours outside of a partial-sky map have zero weight
+            pix = self.hpx[pix]
+            wts = np.where(pix < 0, 0.0, wts)
+            pix[pix < 0] = 0
+
+        if self.data.ndim == 1:
+            return MapInterpolator(pix, wts, shape)
+        elif egy is None:
+            return MapInterpolator(pix, wts, shape, planes=True)
+
+        egy = np.ravel(egy * np.ones(shape))
+        if interp_log:
+            xvals = utils.val_to_pix(np.log(self.hpx.evals), np.log(egy))
         else:
-            return self.data[pix]
+            xvals = utils.val_to_pix(self.hpx.evals, egy)
+
+        i0, i1, w1 = _linear_weights(xvals, len(self.hpx.evals))
+        npix = self.data.shape[-1]
+        idx = np.vstack((i0 * npix + pix, i1 * npix + pix))
+        wts = np.vstack((wts * (1.0 - w1), wts * w1))
+        return MapInterpolator(idx, wts, shape)
 
     def interpolate(self, lon, lat, egy=None, interp_log=True):
         """Interpolate map values.
@@ -594,15 +807,15 @@ class HpxMap(Map_Base):
         Parameters
         ----------
         interp_log : bool
-            Interpolate the z-coordinate in logspace.
+            Interpolate the z-coordinate in logspace.  Energies
+            outside of the range of the energy planes are clamped to
+            the first/last plane.
 
         """
 
         if self.data.ndim == 1:
-            theta = np.pi / 2. - np.radians(lat)
-            phi = np.radians(lon)
-            return hp.pixelfunc.get_interp_val(self.counts, theta,
-                                               phi, nest=self.hpx.nest)
+            fn = self.get_interpolator(lon, lat)
+            return fn(self.counts)
         else:
             return self._interpolate_cube(lon, lat, egy, interp_log)
 
@@ -612,76 +825,177 @@ class HpxMap(Map_Base):
         planes.
 
         """
+        fn = self.get_interpolator(lon, lat, egy, interp_log=interp_log)
+        return fn(self.counts)
 
-        shape = np.broadcast(lon, lat, egy).shape
-        lon = lon * np.ones(shape)
-        lat = lat * np.ones(shape)
-        theta = np.pi / 2. - np.radians(lat)
-        phi = np.radians(lon)
-        vals = []
-        for i, _ in enumerate(self.hpx.evals):
-            v = hp.pixelfunc.get_interp_val(self.counts[i], theta,
-                                            phi, nest=self.hpx.nest)
-            vals += [np.expand_dims(np.array(v, ndmin=1), -1)]
-
-        vals = np.concatenate(vals, axis=-1)
-
-        if egy is None:
-            return vals.T
+    def swap_scheme(self, dtype=None):
+        """Convert the map from RING to NESTED ordering or vice versa.
+        All energy planes are reordered with a single cached
+        permutation.
 
-        egy = egy * np.ones(shape)
-
-        if interp_log:
-            xvals = utils.val_to_pix(np.log(self.hpx.evals), np.log(egy))
-        else:
-            xvals = utils.val_to_pix(self.hpx.evals, egy)
-
-        vals = vals.reshape((-1, vals.shape[-1]))
-        xvals = np.ravel(xvals)
-        v = map_coordinates(vals, [np.arange(vals.shape[0]), xvals],
-                            order=1)
-        return v.reshape(shape)
-
-    def swap_scheme(self):
-        """
+        Parameters
+        ----------
+        dtype : data-type
+            Type of the output array (e.g. `numpy.float32`).  If None
+            the type of the map data is used.
         """
         hpx_out = self.hpx.make_swapped_hpx()
-        if self.hpx.nest:
-            if self.data.ndim == 2:
-                data_out = np.vstack([hp.pixelfunc.reorder(
-                    self.data[i], n2r=True) for i in range(self.data.shape[0])])
-            else:
-                data_out = hp.pixelfunc.reorder(self.data, n2r=True)
+        if self.hpx.is_allsky:
+            data_out = hpx_utils.reorder_cube(self.data, self.hpx.nside,
+                                              n2r=self.hpx.nest, dtype=dtype)
         else:
-            if self.data.ndim == 2:
-                data_out = np.vstack([hp.pixelfunc.reorder(
-                    self.data[i], r2n=True) for i in range(self.data.shape[0])])
-            else:
-                data_out = hp.pixelfunc.reorder(self.data, r2n=True)
+            data_out = hpx_utils.reorder_sparse(self.data, self.hpx.ipix,
+                                                self.hpx.nside,
+                                                n2r=self.hpx.nest,
+                                                dtype=dtype)[1]
         return HpxMap(data_out, hpx_out)
 
-    def ud_grade(self, order, preserve_counts=False):
-        """
+    def ud_grade(self, order, preserve_counts=False, dtype=None):
+        """Upgrade or degrade the resolution of the map.  All energy
+        planes are processed with a single cached parent/child pixel
+        index map.
+
+        The output of a partial-sky map contains the children
+        (upgrade) or parents (degrade) of its pixels.  Parent pixels
+        on the boundary of the map are averaged over the children
+        that are present.
+
+        Parameters
+        ----------
+        order : int
+            HEALPix order of the output map.
+
+        preserve_counts : bool
+            Preserve the sum of the map rather than the pixel values.
+
+        dtype : data-type
+            Type of the output array (e.g. `numpy.float32`).  If None
+            the type of the map data is used if it is a floating point
+            type and `numpy.float64` otherwise.
         """
         new_hpx = self.hpx.ud_graded_hpx(order)
-        nebins = len(new_hpx.evals)
-        shape = self.counts.shape
 
         if preserve_counts:
             power = -2.
         else:
             power = 0
 
-        if len(shape) == 1:
-            new_data = hp.pixelfunc.ud_grade(self.counts,
-                                             nside_out=new_hpx.nside,
-                                             order_in=new_hpx.ordering,
-                                             order_out=new_hpx.ordering,
-                                             power=power)
+        if self.hpx.is_allsky:
+            new_data = hpx_utils.ud_grade_cube(self.counts, self.hpx.nside,
+                                               new_hpx.nside, self.hpx.nest,
+                                               power=power, dtype=dtype)
         else:
-            new_data = np.vstack([hp.pixelfunc.ud_grade(self.counts[i],
-                                                        nside_out=new_hpx.nside,
-                                                        order_in=new_hpx.ordering,
-                                                        order_out=new_hpx.ordering,
-                                                        power=power) for i in range(shape[0])])
+            new_data = hpx_utils.ud_grade_sparse(self.counts, self.hpx.ipix,
+                                                 self.hpx.nside,
+                                                 new_hpx.nside, self.hpx.nest,
+                                                 power=power, dtype=dtype)[1]
         return HpxMap(new_data, new_hpx)
+
+    def to_hpx(self, hpx, fill_value=0.0):
+        """Return a copy of this map on the pixels of another geometry
+        with the same nside and ordering scheme.  This can be used to
+        expand a partial-sky map to the full sky or to extract a
+        partial-sky map from a larger map.  The energy binning of
+        this map is preserved.
+
+        Parameters
+        ----------
+        hpx : `~fermipy.hpx_utils.HPX`
+            Geometry of the output map.
+
+        fill_value : float or `~numpy.ndarray`
+            Value of the output pixels that are not contained in this
+            map.  Arrays must be broadcastable to the shape of the
+            output map.
+        """
+        if hpx.nside != self.hpx.nside or hpx.nest != self.hpx.nest:
+            raise Exception('HEALPix geometries have different nside '
+                            'or ordering scheme.')
+
+        hpx_out = HPX(hpx.nside, hpx.nest, hpx.coordsys, -1, hpx.region,
+                      self.hpx.ebins, self.hpx.conv, ipix=hpx.ipix)
+        ipix = hpx.ipix
+        if ipix is None:
+            ipix = np.arange(hpx.npix)
+        idx = self.hpx[ipix]
+        m = idx >= 0
+
+        data = np.empty(self.data.shape[:-1] + (hpx.npix,),
+                        dtype=self.data.dtype)
+        data[...] = fill_value
+        data[..., m] = self.data[..., idx[m]]
+        return HpxMap(data, hpx_out)
+
+    def to_allsky(self, fill_value=0.0):
+        """Expand this map to the full sky."""
+        if self.hpx.is_allsky:
+            return self
+        hpx = HPX(self.hpx.nside, self.hpx.nest, self.hpx.coordsys,
+                  ebins=self.hpx.ebins, conv=self.hpx.conv)
+        return self.to_hpx(hpx, fill_value)
+
+    def _apply_op(self, other, op, union=True):
+        """Apply a binary operator to this map and a scalar, an array
+        or another map.  Maps with different pixels are evaluated on
+        the union of their pixels with missing pixels set to zero if
+        ``union`` is True or otherwise on the intersection of their
+        pixels."""
+        if not isinstance(other, HpxMap):
+            return HpxMap(op(self.data, other), self.hpx)
+
+        if other.hpx.nside != self.hpx.nside or other.hpx.nest != self.hpx.nest:
+            raise Exception('HEALPix geometries have different nside '
+                            'or ordering scheme.')
+
+        ipix0, ipix1 = self.hpx.ipix, other.hpx.ipix
+        if _same_pixels(self.hpx, other.hpx):
+            map0 = self
+        elif union and ipix0 is None:
+            map0 = self
+        elif union and ipix1 is None:
+            map0 = self.to_allsky()
+        elif union:
+            map0 = self.to_hpx(self.hpx.make_sparse_hpx(np.union1d(ipix0,
+                                                                   ipix1)))
+        elif ipix1 is None:
+            map0 = self
+        elif ipix0 is None:
+            map0 = self.to_hpx(other.hpx)
+        else:
+            map0 = self.to_hpx(self.hpx.make_sparse_hpx(
+                np.intersect1d(ipix0, ipix1)))
+
+        if _same_pixels(map0.hpx, other.hpx):
+            data1 = other.data
+        else:
+            data1 = other.to_hpx(map0.hpx).data
+        return HpxMap(op(map0.data, data1), map0.hpx)
+
+    def __add__(self, other):
+        return self._apply_op(other, np.add)
+
+    def __sub__(self, other):
+        return self._apply_op(other, np.subtract)
+
+    def __mul__(self, other):
+        return self._apply_op(other, np.multiply, union=False)
+
+    def __truediv__(self, other):
+        return self._apply_op(other, np.true_divide, union=False)
+
+    __div__ = __truediv__
+
+    def __radd__(self, other):
+        return self._apply_op(other, np.add)
+
+    def __rsub__(self, other):
+        return self._apply_op(other, lambda x, y: np.subtract(y, x))
+
+    def __rmul__(self, other):
+        return self._apply_op(other, np.multiply, union=False)
+
+    def __rtruediv__(self, other):
+        return self._apply_op(other, lambda x, y: np.true_divide(y, x),
+                              union=False)
+
+    __rdiv__ = __rtruediv__
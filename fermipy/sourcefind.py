@@ -18,11 +18,12 @@ from fermipy.sourcefind_utils import fit_error_ellipse
 from fermipy.sourcefind_utils import find_peaks
 from fermipy.skymap import Map
 from fermipy.config import ConfigSchema
-from fermipy.gtutils import FreeParameterState, SourceMapState
 from fermipy.timing import Timer
 from fermipy.model_utils import get_function_norm_par_name
-from LikelihoodState import LikelihoodState
-import pyLikelihood as pyLike
+from fermipy.lazy_import import LazyModule
+
+pyLike = LazyModule('pyLikelihood')
+gtutils = LazyModule('fermipy.gtutils')
 
 
 class SourceFind(object):
@@ -273,14 +274,14 @@ class SourceFind(object):
 
         self.logger.info('Running localization for %s' % name)
 
-        free_state = FreeParameterState(self)
+        free_state = gtutils.FreeParameterState(self)
         loc = self._localize(name, **config)
         free_state.restore()
 
         self.logger.info('Finished localization.')
 
         if config['make_plots']:
-            self._plotter.make_localization_plots(loc, self.roi,
+            self.plotter.make_localization_plots(loc, self.roi,
                                                   prefix=config['prefix'])
 
         outfile = \
@@ -324,7 +325,7 @@ class SourceFind(object):
         free_radius = kwargs.get('free_radius', None)
         fix_shape = kwargs.get('fix_shape', False)
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
         loglike_init = -self.like()
         self.logger.debug('Initial Model Log-Likelihood: %f', loglike_init)
 
@@ -583,7 +584,7 @@ class SourceFind(object):
 
     def _scan_position(self, name, **kwargs):
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
 
         skydir = kwargs.pop('skydir', self.roi[name].skydir)
         scan_cdelt = kwargs.pop('scan_cdelt', 0.02)
@@ -633,7 +634,7 @@ class SourceFind(object):
 
     def _fit_position_opt(self, name, use_cache=True):
 
-        state = SourceMapState(self.like, [name])
+        state = gtutils.SourceMapState(self.like, [name])
 
         src = self.roi.copy_source(name)
 
@@ -3,7 +3,6 @@ from __future__ import absolute_import, division, print_function
 import os
 import copy
 import numpy as np
-from scipy.interpolate import RegularGridInterpolator
 
 
 def cast_args(x):
@@ -547,6 +546,7 @@ class DMFitFunction(SpectralFunction):
                                150.0, 176.0, 200.0, 250.0, 350.0, 500.0, 750.0,
                                1000.0, 1500.0, 2000.0, 3000.0, 5000.0, 7000.0, 1E4])
         self._dndx = data.reshape((12, 24, 250))
+        from scipy.interpolate import RegularGridInterpolator
         self._dndx_interp = RegularGridInterpolator([self._mass, self._x],
                                                     self._dndx[ichan, :, :],
                                                     bounds_error=False,
@@ -597,6 +597,7 @@ class DMFitFunction(SpectralFunction):
             chan_code = DMFitFunction.channel_rev_map[chan]
             ichan = DMFitFunction.channel_index_mapping[chan_code]
 
+        from scipy.interpolate import RegularGridInterpolator
         self._dndx_interp = RegularGridInterpolator([self._mass, self._x],
                                                     self._dndx[ichan, :, :],
                                                     bounds_error=False,
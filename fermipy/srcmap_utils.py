@@ -174,6 +174,199 @@ class SourceMapCache(object):
         return cls(m0, m1)
 
 
+class ModelCountsCache(object):
+    """Cache of the model-counts cubes of the sources of an analysis
+    component.  The cubes of sources with a compact footprint (e.g.
+    point sources) are stored only within the smallest region of each
+    energy plane that contains a fraction 1 - ``threshold`` of their
+    model counts.  Compact sources whose footprint covers most of the
+    cube are not cached.  A running total of all cached cubes is
+    maintained such that the summed model counts of all but a few
+    sources are computed by subtracting the excluded sources from the
+    total.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the model-counts cube.  The first dimension is
+        energy.  For cubes with two spatial dimensions the footprint
+        in each energy plane is a rectangular box, otherwise (e.g.
+        HEALPix) it is the list of pixels in the footprint.
+
+    threshold : float
+        Fraction of the model counts of a compact source in each
+        energy plane that is neglected outside of its footprint.  A
+        value of zero keeps all pixels with non-zero model counts.
+    """
+
+    # Number of updates after which the running total is recomputed
+    # from the cached cubes to bound the accumulated rounding errors
+    _max_updates = 1000
+
+    def __init__(self, shape, threshold=1E-3):
+        self._shape = tuple(shape)
+        self._nebin = self._shape[0]
+        self._npix = int(np.prod(self._shape[1:]))
+        self._threshold = threshold
+        self._entries = {}
+        self._total = np.zeros((self._nebin, self._npix))
+        self._nupdate = 0
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def names(self):
+        return list(self._entries.keys())
+
+    def get(self, name, key=None):
+        """Return the cached entry ``(key, ipix, data)`` of a source
+        or None if the source is not cached or was cached with a
+        different key.  ``ipix`` is a list with the index of the
+        footprint pixels of each energy plane in the flattened
+        spatial dimensions and ``data`` is the list of the
+        corresponding model counts.  If the full cube is stored
+        ``ipix`` is None and ``data`` has shape (nebin, npix).
+        """
+        entry = self._entries.get(name, None)
+        if entry is None or (key is not None and entry[0] != key):
+            return None
+        return entry
+
+    def footprint(self, data):
+        """Return the index of the footprint pixels of each energy
+        plane of a model-counts cube with shape (nebin, npix) or None
+        if the footprint covers most of the cube."""
+
+        ipix = []
+        for v in np.abs(data):
+            if self._threshold > 0 and np.sum(v) > 0:
+                isort = np.argsort(v)[::-1]
+                csum = np.cumsum(v[isort])
+                n = np.searchsorted(csum, (1.0 - self._threshold) * csum[-1])
+                idx = np.sort(isort[:n + 1])
+            else:
+                idx = np.nonzero(v)[0]
+
+            if len(self._shape) == 3 and len(idx):
+                idx = np.unravel_index(idx, self._shape[1:])
+                axes = [np.arange(np.min(t), np.max(t) + 1) for t in idx]
+                idx = np.ravel_multi_index(np.meshgrid(*axes, indexing='ij'),
+                                           self._shape[1:]).ravel()
+            ipix += [idx]
+
+        if sum([len(t) for t in ipix]) > 0.5 * self._nebin * self._npix:
+            return None
+        return ipix
+
+    def update(self, name, key, data, sparse=True):
+        """Store the model-counts cube of a source.
+
+        Parameters
+        ----------
+        name : str
+            Source name.
+
+        key : object
+            Key identifying the source parameters with which the cube
+            was computed.
+
+        data : `~numpy.ndarray`
+            Model-counts cube.
+
+        sparse : bool
+            Store the cube within the footprint of the source.  Cubes
+            of extended diffuse components should be stored in full.
+
+        Returns
+        -------
+        cached : bool
+            False if the footprint of a sparse cube covers most of
+            the cube, in which case the source is not cached.
+        """
+        data = np.asarray(data, dtype=float).reshape(self._nebin, self._npix)
+        self.remove(name)
+
+        if not sparse:
+            ipix, vals = None, data.copy()
+        else:
+            ipix = self.footprint(data)
+            if ipix is None:
+                return False
+            vals = [data[i, t] for i, t in enumerate(ipix)]
+
+        self._entries[name] = (key, ipix, vals)
+        self._add(self._total, ipix, vals)
+        self._nupdate += 1
+        if self._nupdate > self._max_updates:
+            self._rebuild()
+        return True
+
+    def remove(self, name):
+        """Remove a source from the cache."""
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._add(self._total, entry[1], entry[2], -1.0)
+            self._nupdate += 1
+
+    def clear(self):
+        """Remove all sources from the cache."""
+        self._entries = {}
+        self._total = np.zeros((self._nebin, self._npix))
+        self._nupdate = 0
+
+    def model_counts(self, names):
+        """Return the summed model-counts cube of a list of cached
+        sources.  If the list contains most of the cached sources the
+        cube is computed by subtracting the other sources from the
+        running total.
+
+        Parameters
+        ----------
+        names : list
+            Source names.
+
+        Returns
+        -------
+        counts : `~numpy.ndarray`
+            Model-counts cube.
+        """
+        names = set(names)
+        missing = names - set(self._entries.keys())
+        if missing:
+            raise Exception('Sources not found in model counts cache: %s' %
+                            ', '.join(sorted(missing)))
+
+        excluded = set(self._entries.keys()) - names
+        if len(excluded) < len(names):
+            v = self._total.copy()
+            for name in excluded:
+                _, ipix, vals = self._entries[name]
+                self._add(v, ipix, vals, -1.0)
+        else:
+            v = np.zeros((self._nebin, self._npix))
+            for name in names:
+                _, ipix, vals = self._entries[name]
+                self._add(v, ipix, vals)
+
+        return v.reshape(self._shape)
+
+    def _rebuild(self):
+        self._total = np.zeros((self._nebin, self._npix))
+        for _, ipix, vals in self._entries.values():
+            self._add(self._total, ipix, vals)
+        self._nupdate = 0
+
+    @staticmethod
+    def _add(v, ipix, vals, scale=1.0):
+        if ipix is None:
+            v += scale * vals
+            return
+        for i, (t, x) in enumerate(zip(ipix, vals)):
+            v[i, t] += scale * x
+
+
 def make_srcmap_old(psf, spatial_model, sigma, npix=500, xpix=0.0, ypix=0.0,
                     cdelt=0.01, rebin=1, psf_scale_fn=None):
     """Compute the source map for a given spatial model.
@@ -280,6 +473,50 @@ def make_srcmap(psf, exp, spatial_model, sigma, npix=500, xpix=0.0, ypix=0.0,
     return k
 
 
+def integrate_srcmap(srcmap, energies, dnde):
+    """Integrate a source map over energy to obtain a model-counts
+    cube.  The product of the source map and the differential flux is
+    interpolated in each pixel as a power law between the energy bin
+    edges.  Pixels where the product vanishes at one of the edges are
+    integrated with the trapezoidal rule.  This is the log-log
+    quadrature that the binned likelihood of the ScienceTools applies
+    to source maps (``BinnedLikelihood::pixelCounts``).
+
+    Parameters
+    ----------
+    srcmap : `~numpy.ndarray`
+        Source map evaluated at the energy bin edges.  The first
+        dimension is energy.
+
+    energies : `~numpy.ndarray`
+        Energy bin edges in MeV.
+
+    dnde : `~numpy.ndarray`
+        Differential flux at the energy bin edges.
+
+    Returns
+    -------
+    counts : `~numpy.ndarray`
+        Model-counts cube with one plane per energy bin.
+    """
+    energies = np.asarray(energies, dtype=float)
+    shape = (-1,) + (1,) * (srcmap.ndim - 1)
+    y = srcmap * np.asarray(dnde, dtype=float).reshape(shape)
+    y1, y2 = y[:-1], y[1:]
+    emin = energies[:-1].reshape(shape)
+    emax = energies[1:].reshape(shape)
+    lnr = np.log(emax / emin)
+
+    counts = 0.5 * (y1 + y2) * (emax - emin)
+    m = (y1 > 0) & (y2 > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gam1 = np.log(y2 / y1) / lnr + 1.0
+        pl = y1 * emin * np.expm1(gam1 * lnr) / gam1
+        lg = y1 * emin * lnr
+    counts[m] = np.where(np.abs(gam1) > 1E-6, pl, lg)[m]
+    return counts
+
+
 def make_cgauss_mapcube(skydir, psf, sigma, outfile, npix=500, cdelt=0.01,
                         rebin=1):
     energies = psf.energies
@@ -0,0 +1,73 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_array_equal
+from fermipy import utils
+from fermipy.checkpoint import Checkpoint, write_checkpoint, is_checkpoint
+
+
+def make_roi_data():
+
+    sources = {}
+    for i in range(5):
+        name = 'src%i' % i
+        sources[name] = {'name': name,
+                         'ts': float(i),
+                         'offset_glon': np.float64(0.5 * i),
+                         'free': bool(i % 2),
+                         'param_names': np.array([b'Prefactor', b'Index']),
+                         'param_values': np.random.uniform(size=10),
+                         'sed': {'e_min': np.logspace(2, 5, 13),
+                                 'norm': np.ones(12),
+                                 'dloglike_scan': np.zeros((12, 21))},
+                         'extension': None,
+                         'pos_err': (0.1, 0.2)}
+
+    return {'roi': {'components': [{'src_expscale': {'src0': 0.9}}],
+                    'loge_bounds': [2.0, 5.0]},
+            'config': {'selection': {'ra': 10.0, 'dec': None},
+                       'model': {'catalogs': ['3FGL']}},
+            'version': '0.0.0',
+            'sources': sources}
+
+
+def test_checkpoint_roundtrip(tmpdir):
+
+    o = make_roi_data()
+    outfile = str(tmpdir / 'test.ckpt')
+    write_checkpoint(outfile, o)
+    assert is_checkpoint(outfile)
+
+    path, data = utils.load_data(outfile)
+    assert path == outfile
+    assert data['roi'] == o['roi']
+    assert data['config'] == o['config']
+    assert data['version'] == o['version']
+    assert sorted(data['sources'].keys()) == sorted(o['sources'].keys())
+
+    for name, src in o['sources'].items():
+        src1 = data['sources'][name]
+        assert src1['ts'] == src['ts']
+        assert src1['free'] == src['free']
+        assert src1['extension'] is None
+        assert src1['pos_err'] == src['pos_err']
+        assert src1['param_names'].dtype == src['param_names'].dtype
+        assert_array_equal(src1['param_names'], src['param_names'])
+        assert_array_equal(src1['param_values'], src['param_values'])
+        assert_array_equal(src1['sed']['dloglike_scan'],
+                           src['sed']['dloglike_scan'])
+
+
+def test_checkpoint_lazy_source(tmpdir):
+
+    o = make_roi_data()
+    outfile = str(tmpdir / 'test.ckpt')
+    write_checkpoint(outfile, o)
+
+    with Checkpoint(outfile) as ckpt:
+        assert sorted(ckpt.source_names) == sorted(o['sources'].keys())
+        assert ckpt.get('roi') == o['roi']
+        src = ckpt.get_source('src3')
+        assert src['name'] == 'src3'
+        assert_array_equal(src['sed']['e_min'],
+                           o['sources']['src3']['sed']['e_min'])
@@ -0,0 +1,186 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from astropy.io import fits
+from astropy.coordinates import SkyCoord
+from fermipy import wcs_utils
+from fermipy import ft1_utils
+from fermipy.ft1_utils import EventList
+from fermipy.hpx_utils import HPX
+
+
+def make_ft1_file(path, nevt, gti, seed, ra0=83.6, dec0=22.0):
+    """Write an FT1 file with events distributed uniformly within
+    8 deg of (ra0, dec0)."""
+
+    rs = np.random.RandomState(seed)
+    skydir = SkyCoord(ra0, dec0, unit='deg')
+    sep = 8.0 * np.sqrt(rs.uniform(size=nevt))
+    pa = rs.uniform(0.0, 360.0, size=nevt)
+    c = skydir.directional_offset_by(np.radians(pa), np.radians(sep))
+    time = np.concatenate([rs.uniform(t0, t1, nevt // len(gti) + 1)
+                           for t0, t1 in gti])[:nevt]
+
+    evclass = np.zeros((nevt, 32), dtype=bool)
+    evclass[:, 31 - 7] = rs.uniform(size=nevt) < 0.7
+    evclass[:, 31 - 4] = True
+    evtype = np.zeros((nevt, 32), dtype=bool)
+    conv = rs.randint(0, 2, nevt)
+    evtype[conv == 0, 31 - 0] = True
+    evtype[conv == 1, 31 - 1] = True
+
+    cols = [fits.Column('ENERGY', 'E', unit='MeV',
+                        array=10**rs.uniform(2.0, 5.0, nevt)),
+            fits.Column('RA', 'E', unit='deg', array=c.icrs.ra.deg),
+            fits.Column('DEC', 'E', unit='deg', array=c.icrs.dec.deg),
+            fits.Column('L', 'E', unit='deg', array=c.galactic.l.deg),
+            fits.Column('B', 'E', unit='deg', array=c.galactic.b.deg),
+            fits.Column('TIME', 'D', unit='s', array=time),
+            fits.Column('ZENITH_ANGLE', 'E', unit='deg',
+                        array=rs.uniform(0.0, 120.0, nevt)),
+            fits.Column('EVENT_CLASS', '32X', array=evclass),
+            fits.Column('EVENT_TYPE', '32X', array=evtype),
+            fits.Column('CONVERSION_TYPE', 'I', array=conv)]
+
+    hdu_events = fits.BinTableHDU.from_columns(cols, name='EVENTS')
+    hdu_events.header['NDSKEYS'] = 2
+    hdu_events.header['DSTYP1'] = 'BIT_MASK(EVENT_CLASS,16,P8R3)'
+    hdu_events.header['DSUNI1'] = 'DIMENSIONLESS'
+    hdu_events.header['DSVAL1'] = '1:1'
+    hdu_events.header['DSTYP2'] = 'ENERGY'
+    hdu_events.header['DSUNI2'] = 'MeV'
+    hdu_events.header['DSVAL2'] = '100:100000'
+    hdu_gti = ft1_utils.make_gti_hdu(gti)
+    fits.HDUList([fits.PrimaryHDU(), hdu_events, hdu_gti]).writeto(path)
+
+
+def test_ft1_utils_gti():
+
+    gti = ft1_utils.merge_gti([[5., 6.], [0., 2.], [1., 3.], [3., 4.]])
+    assert_array_equal(gti, [[0., 4.], [5., 6.]])
+
+    gti = ft1_utils.intersect_gti([[0., 4.], [5., 6.]], [[1., 5.5], [7., 8.]])
+    assert_array_equal(gti, [[1., 4.], [5., 5.5]])
+    assert len(ft1_utils.intersect_gti([[0., 1.]], [[1., 2.]])) == 0
+
+    m = ft1_utils.in_gti([-1., 0., 1., 4., 5.2, 7.], [[0., 4.], [5., 6.]])
+    assert_array_equal(m, [False, True, True, False, True, False])
+
+
+def test_ft1_utils_filter():
+
+    sc = {'START': np.arange(6.), 'STOP': np.arange(1., 7.),
+          'DATA_QUAL': np.array([1, 1, 0, 1, 1, 1]),
+          'LAT_CONFIG': np.array([1, 1, 1, 1, 0, 1]),
+          'ROCK_ANGLE': np.array([10., -60., 10., 10., 10., 10.])}
+
+    expr = 'DATA_QUAL>0 && LAT_CONFIG==1 && ABS(ROCK_ANGLE)<52'
+    assert ft1_utils.get_filter_columns(expr) == ['DATA_QUAL', 'LAT_CONFIG',
+                                                  'ROCK_ANGLE']
+    assert_array_equal(ft1_utils.eval_filter(expr, sc),
+                       [True, False, False, True, False, True])
+    assert_array_equal(ft1_utils.eval_filter('!(DATA_QUAL==0) || LAT_CONFIG=0',
+                                             sc),
+                       [True, True, False, True, True, True])
+
+    gti = ft1_utils.make_sc_gti(sc, filter=expr)
+    assert_array_equal(gti, [[0., 1.], [3., 4.], [5., 6.]])
+
+    assert ft1_utils.is_supported_filter(expr)
+    assert not ft1_utils.is_supported_filter('gtifilter()')
+    assert not ft1_utils.is_supported_filter('DATA_QUAL.__class__')
+
+
+def test_ft1_utils_select(tmpdir):
+
+    files = [str(tmpdir.join('ft1_%i.fits' % i)) for i in range(2)]
+    make_ft1_file(files[0], 4000, [[0., 100.], [150., 200.]], 1)
+    make_ft1_file(files[1], 3000, [[200., 300.]], 2)
+    listfile = str(tmpdir.join('ft1.lst'))
+    with open(listfile, 'w') as f:
+        f.write('\n'.join(files))
+
+    skydir = SkyCoord(83.6, 22.0, unit='deg')
+    evts = EventList.create(listfile, emin=200., emax=50000.,
+                            skydir=skydir, radius=7.0)
+    assert_array_equal(evts.gti, [[0., 100.], [150., 300.]])
+
+    data = np.concatenate([fits.getdata(f, 'EVENTS') for f in files])
+    sep = SkyCoord(data['RA'], data['DEC'], unit='deg').separation(skydir).deg
+    msk = ((data['ENERGY'] >= 1000.) & (data['ENERGY'] <= 50000.) &
+           (data['TIME'] >= 50.) & (data['TIME'] <= 250.) &
+           (data['ZENITH_ANGLE'] <= 90.) & (sep <= 5.0) &
+           (data['CONVERSION_TYPE'] == 1))
+    evclass = np.concatenate([fits.getdata(f, 'EVENTS')['EVENT_CLASS']
+                              for f in files])
+    msk &= evclass[:, 31 - 7]
+
+    sel = evts.select(ra=83.6, dec=22.0, rad=5.0, tmin=50., tmax=250.,
+                      emin=1000., emax=50000., zmax=90., evclass=128,
+                      evtype=3, convtype=1)
+    assert len(sel) == np.sum(msk)
+    assert_allclose(np.sort(sel.field('TIME')), np.sort(data['TIME'][msk]))
+    assert_array_equal(sel.gti, [[50., 100.], [150., 250.]])
+
+    cuts = {c['type']: c['value'] for c in sel.cuts}
+    assert cuts['BIT_MASK(EVENT_CLASS,128,P8R3)'] == '1:1'
+    assert cuts['ENERGY'] == '1000.0:50000.0'
+    assert cuts['TIME'] == 'TABLE'
+
+    # Event type selection with an integer column
+    assert_array_equal(ft1_utils._bitmask([0, 1, 2, 3, 4], 3),
+                       [False, True, True, True, False])
+
+    # Apply a GTI selection
+    sel = evts.select(gti=[[0., 80.], [160., 170.]], tmin=50.)
+    t = sel.field('TIME')
+    assert np.all(((t >= 50.) & (t < 80.)) | ((t >= 160.) & (t < 170.)))
+    assert_array_equal(sel.gti, [[50., 80.], [160., 170.]])
+
+
+def test_ft1_utils_fill_wcs(tmpdir):
+
+    ft1file = str(tmpdir.join('ft1.fits'))
+    make_ft1_file(ft1file, 5000, [[0., 100.]], 3)
+    evts = EventList.create(ft1file)
+
+    skydir = SkyCoord(83.6, 22.0, unit='deg')
+    npix = 40
+    energies = np.logspace(2.0, 5.0, 7)
+    for coordsys in ['CEL', 'GAL']:
+        wcs = wcs_utils.create_wcs(skydir, coordsys=coordsys,
+                                   projection='AIT', cdelt=0.25,
+                                   crpix=1.0 + 0.5 * (npix - 1), naxis=2)
+        counts = evts.fill_wcs(wcs, npix, energies, coordsys)
+        assert counts.shape == (6, npix, npix)
+
+        lon, lat = evts.get_coords(coordsys)
+        x, y = wcs.wcs_world2pix(lon, lat, 0)
+        edges = np.arange(npix + 1) - 0.5
+        h = np.histogramdd(np.vstack((evts.field('ENERGY'), y, x)).T,
+                           bins=[energies, edges, edges])[0]
+        assert_array_equal(counts, h)
+
+
+def test_ft1_utils_fill_hpx(tmpdir):
+
+    ft1file = str(tmpdir.join('ft1.fits'))
+    make_ft1_file(ft1file, 5000, [[0., 100.]], 4)
+    evts = EventList.create(ft1file)
+
+    energies = np.logspace(2.0, 5.0, 4)
+    region = 'DISK(83.6,22.0,5.0)'
+    hpx = HPX.create_hpx(-1, False, 'CEL', 5, region, energies)
+    counts = evts.fill_hpx(hpx, energies)
+    assert counts.shape == (3, hpx.npix)
+
+    ipix = hpx.get_pixel_indices(evts.field('DEC'), evts.field('RA'))
+    ie = np.digitize(evts.field('ENERGY'), energies) - 1
+    for i in range(3):
+        for j, p in enumerate(hpx._ipix):
+            if not np.any(ipix == p):
+                continue
+            assert counts[i, j] == np.sum((ipix == p) & (ie == i))
+
+    assert np.sum(counts) == np.sum(np.in1d(ipix, hpx._ipix))
@@ -1,14 +1,17 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
 import os
+import copy
 import numpy as np
 from numpy.testing import assert_allclose
 from astropy.tests.helper import pytest
 from astropy.table import Table
+from astropy.io import fits
 from fermipy.tests.utils import requires_dependency, requires_st_version
 from fermipy import spectrum
 
 try:
+    import pyLikelihood as pyLike
     from fermipy import gtanalysis
 except ImportError:
     pass
@@ -73,6 +76,47 @@ def test_gtanalysis_setup(create_draco_analysis):
     gta.print_roi()
 
 
+def test_gtanalysis_setup_multithread(create_draco_analysis):
+    gta0 = create_draco_analysis
+
+    config = copy.deepcopy(gta0.config)
+    config['data']['multithread'] = True
+    config['data']['nthread'] = 2
+    config['components'] = [{'selection': {'evtype': 8}},
+                            {'selection': {'evtype': 16}},
+                            {'selection': {'evtype': 32}}]
+    gta = gtanalysis.GTAnalysis(config)
+    gta.setup()
+
+    assert len(gta.components) == 3
+    for c in gta.components:
+        assert c._ltc is not None
+        assert c._psf is not None
+        assert c._bexp is not None
+        assert c.tmin == gta0.components[0].tmin
+    assert np.isfinite(gta.like())
+
+
+def test_gtanalysis_setup_native_binning(create_draco_analysis, tmpdir):
+    gta0 = create_draco_analysis
+
+    config = copy.deepcopy(gta0.config)
+    config['fileio']['outdir'] = str(tmpdir)
+    config['fileio']['usescratch'] = False
+    config['data']['native_binning'] = True
+    gta = gtanalysis.GTAnalysis(config)
+    gta.setup(overwrite=True)
+
+    for c0, c1 in zip(gta0.components, gta.components):
+        assert c1.files['ccube'] != c0.files['ccube']
+        assert_allclose(c1.counts_map().counts, c0.counts_map().counts)
+        gti0 = fits.getdata(c0.files['ft1'], 'GTI')
+        gti1 = fits.getdata(c1.files['ft1'], 'GTI')
+        assert_allclose(gti1['START'], gti0['START'])
+        assert_allclose(gti1['STOP'], gti0['STOP'])
+    assert_allclose(gta.like(), gta0.like())
+
+
 def test_print_model(create_draco_analysis):
     gta = create_draco_analysis
     gta.print_model()
@@ -124,6 +168,24 @@ def test_gtanalysis_optimize(create_draco_analysis):
     gta.optimize()
 
 
+def test_gtanalysis_optimize_block_fit(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit0')
+    o0 = gta.optimize()
+    npred0 = {s.name: s['npred'] for s in gta.roi.sources}
+
+    gta.load_roi('fit0')
+    o1 = gta.optimize(block_fit=True)
+    npred1 = {s.name: s['npred'] for s in gta.roi.sources}
+
+    assert_allclose(o1['loglike0'], o0['loglike0'])
+    assert o1['loglike1'] > o0['loglike1'] - 0.1
+    assert_allclose(o1['loglike1'], o0['loglike1'], atol=1.0)
+    for name, v in npred0.items():
+        if v > 10.0:
+            assert_allclose(npred1[name], v, rtol=5E-2)
+
+
 def test_gtanalysis_fit(create_draco_analysis):
     gta = create_draco_analysis
     gta.load_roi('fit0')
@@ -149,12 +211,77 @@ def test_gtanalysis_fit_newton(create_draco_analysis):
     assert (np.abs(fit_output0['loglike'] - fit_output1['loglike']) < 0.01)
 
 
+def test_gtanalysis_fit_newton_numpy(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit0')
+    gta.free_sources(distance=3.0, pars='norm')
+    gta.write_xml('fit_test')
+    fit_output0 = gta.fit(optimizer='MINUIT')
+    gta.load_xml('fit_test')
+    fit_output1 = gta.fit(optimizer='NEWTON', newton_engine='numpy')
+
+    assert (np.abs(fit_output0['loglike'] - fit_output1['loglike']) < 0.01)
+
+
+def test_gtanalysis_profile_norm(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit1')
+    gta.free_sources(distance=3.0, pars='norm')
+    gta.fit()
+
+    lnlp0 = gta.profile_norm('draco', reoptimize=True)
+    lnlp1 = gta.profile_norm('draco', reoptimize=True)
+    assert_allclose(lnlp0['xvals'], lnlp1['xvals'])
+    assert_allclose(lnlp0['loglike'], lnlp1['loglike'])
+
+    # Cached points must agree with a scan evaluated from scratch
+    gta._profile_cache = {}
+    lnlp2 = gta.profile('draco', 'Prefactor', reoptimize=True,
+                        xvals=lnlp0['xvals'])
+    assert_allclose(lnlp0['dloglike'], lnlp2['dloglike'], atol=0.05)
+
+
 def test_gtanalysis_tsmap(create_draco_analysis):
     gta = create_draco_analysis
     gta.load_roi('fit1')
     gta.tsmap(model={}, make_plots=True)
 
 
+def test_gtanalysis_tsmap_templates(create_draco_analysis, monkeypatch):
+    gta = create_draco_analysis
+    gta.load_roi('fit1')
+
+    src_dict = {'SpatialModel': 'PointSource', 'Index': 2.0,
+                'Prefactor': 1E-13, 'ra': gta.roi.skydir.ra.deg,
+                'dec': gta.roi.skydir.dec.deg}
+    eslices = [slice(0, c.enumbins) for c in gta.components]
+    xpix = np.round((gta.npix - 1.0) / 2.)
+
+    gta._testsource_cache.clear()
+    tmpl0 = gta._get_testsource_templates(src_dict, eslices, xpix)
+    assert not tmpl0['model'][0].flags.writeable
+    tmpl0['model'].pop()
+
+    # A repeat call is served from the cache without adding the
+    # test source to the model
+    with monkeypatch.context() as m:
+        m.setattr(gta, 'add_source', None)
+        tmpl1 = gta._get_testsource_templates(src_dict, eslices, xpix)
+    assert len(tmpl1['model']) == len(gta.components)
+    for i in range(len(tmpl0['model'])):
+        assert tmpl1['model'][i] is tmpl0['model'][i]
+
+    # Swapping the PSF or exposure objects forces a rebuild
+    for attr in ['_psf', '_bexp']:
+        c = gta.components[0]
+        with monkeypatch.context() as m:
+            m.setattr(c, attr, copy.copy(getattr(c, attr)))
+            tmpl2 = gta._get_testsource_templates(src_dict, eslices, xpix)
+        assert tmpl2['model'][0] is not tmpl1['model'][0]
+        for mm1, mm2 in zip(tmpl1['model'], tmpl2['model']):
+            assert_allclose(mm1, mm2)
+
+
 @requires_st_version('11-04-00')
 def test_gtanalysis_tscube(create_draco_analysis):
     gta = create_draco_analysis
@@ -162,12 +289,96 @@ def test_gtanalysis_tscube(create_draco_analysis):
     gta.tscube(model={}, make_plots=True)
 
 
+@requires_st_version('11-04-00')
+def test_gtanalysis_tscube_numpy(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit1')
+    # The numpy engine holds the background normalizations fixed
+    gta.free_sources(free=False)
+
+    kw = dict(model={}, make_plots=False, write_fits=False, write_npy=False)
+    o0 = gta.tscube(**kw)
+    o1 = gta.tscube(engine='numpy', **kw)
+
+    ts0 = o0['ts'].counts
+    ts1 = o1['ts'].counts
+    assert ts1.shape == ts0.shape
+    assert_allclose(ts1, ts0, rtol=5E-2, atol=0.5)
+    assert_allclose(o1['npred'].counts, o0['npred'].counts,
+                    rtol=5E-2, atol=1E-2 * np.max(o0['npred'].counts))
+    assert_allclose(o1['tscube'].tscube.counts, o0['tscube'].tscube.counts,
+                    rtol=5E-2, atol=0.5)
+
+
 def test_gtanalysis_residmap(create_draco_analysis):
     gta = create_draco_analysis
     gta.load_roi('fit1')
     gta.residmap(model={}, make_plots=True)
 
 
+def compute_model_map(c, names=None):
+    """Compute the model counts of an analysis component with
+    pyLikelihood without the cache of model-counts maps."""
+
+    nbin = c.enumbins * c.npix**2
+    if names is None:
+        v = pyLike.FloatVector(nbin)
+        c.like.logLike.computeModelMap(v)
+        z = np.array(v)
+    else:
+        z = np.zeros(nbin)
+        for name in names:
+            v = pyLike.FloatVector(nbin)
+            c.like.logLike.computeModelMap(str(name), v)
+            z += np.array(v)
+    return z.reshape(c.enumbins, c.npix, c.npix)
+
+
+def test_gtanalysis_model_counts_map(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit1')
+    c = gta.components[0]
+    threshold = c.config['gtlike']['model_counts_threshold']
+    assert threshold > 0
+
+    def assert_model_counts(z0, z1):
+        # Point sources are truncated to a fraction 1 - threshold of
+        # their model counts in each energy plane
+        dz = np.sum(np.abs(z0 - z1), axis=(1, 2))
+        assert np.all(dz <= (threshold + 1E-5) * np.sum(z1, axis=(1, 2)))
+
+    def check_model_counts():
+        names = [s.name for s in gta.roi.sources]
+        assert_model_counts(c.model_counts_map().counts,
+                            compute_model_map(c))
+        assert_model_counts(c.model_counts_map('draco').counts,
+                            compute_model_map(c, ['draco']))
+        z = compute_model_map(c, [t for t in names if t != 'draco'])
+        assert_model_counts(c.model_counts_map(exclude=['draco']).counts, z)
+
+        # No full cubes are cached for point sources
+        for name in c._model_counts_cache.names:
+            if not gta.roi[name].diffuse:
+                assert c._model_counts_cache.get(name)[1] is not None
+
+    check_model_counts()
+    gta.set_norm('draco', 2.0 * gta.get_norm('draco'))
+    check_model_counts()
+    gta.set_parameter('draco', 'Index', -2.5)
+    check_model_counts()
+
+    src_dict = {'SpatialModel': 'PointSource', 'Index': 2.0,
+                'offset_glon': 0.5, 'offset_glat': 0.5, 'Prefactor': 1E-12}
+    gta.add_source('testsource', src_dict)
+    check_model_counts()
+    z = compute_model_map(c, [s.name for s in gta.roi.sources
+                              if s.name != 'testsource'])
+    assert_model_counts(c.model_counts_map(exclude=['testsource']).counts, z)
+    gta.delete_source('testsource')
+    check_model_counts()
+    gta.load_roi('fit1')
+
+
 def test_gtanalysis_find_sources(create_draco_analysis):
     gta = create_draco_analysis
     gta.load_roi('fit1')
@@ -258,6 +469,21 @@ def test_gtanalysis_sed(create_draco_analysis):
     gta.simulate_roi(restore=True)
 
 
+def test_gtanalysis_sed_multithread(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit1')
+
+    o0 = gta.sed('draco', write_fits=False, write_npy=False)
+    o1 = gta.sed('draco', multithread=True, nthread=2,
+                 write_fits=False, write_npy=False)
+
+    for k in ['norm', 'norm_err', 'norm_ul', 'ts', 'loglike', 'npred']:
+        assert_allclose(o0[k], o1[k], rtol=1E-3)
+
+    assert_allclose(o0['dloglike_scan'], o1['dloglike_scan'],
+                    rtol=1E-3, atol=1E-3)
+
+
 def test_gtanalysis_extension_gaussian(create_draco_analysis):
     gta = create_draco_analysis
     gta.simulate_roi(restore=True)
@@ -278,6 +504,56 @@ def test_gtanalysis_extension_gaussian(create_draco_analysis):
     gta.simulate_roi(restore=True)
 
 
+def test_gtanalysis_extension_numpy(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.simulate_roi(restore=True)
+    gta.load_roi('fit1')
+    np.random.seed(1)
+
+    # Templates computed from a source map agree with the model
+    # counts of pyLikelihood
+    for c in gta.components:
+        srcmap = np.array(c.like.logLike.sourceMap('draco').model())
+        srcmap = srcmap.reshape((len(c.energies), c.npix, c.npix))
+        srcmap /= c._src_expscale.get('draco', 1.0)
+        z = compute_model_map(c, ['draco'])
+        assert_allclose(c._srcmap_to_model_counts('draco', srcmap), z,
+                        rtol=1E-2, atol=1E-6 * np.max(z))
+    spatial_width = 0.5
+
+    gta.simulate_source({'SpatialModel': 'RadialGaussian',
+                         'SpatialWidth': spatial_width,
+                         'Prefactor': 3E-12})
+
+    kw = dict(width=[0.4, 0.45, 0.5, 0.55, 0.6],
+              spatial_model='RadialGaussian', make_tsmap=False,
+              write_fits=False, write_npy=False)
+    o0 = gta.extension('draco', **kw)
+    o1 = gta.extension('draco', scan_engine='numpy', **kw)
+
+    assert_allclose(o1['ext'], o0['ext'], atol=0.01)
+    assert_allclose(o1['dloglike'], o0['dloglike'], atol=0.1)
+
+    gta.simulate_roi(restore=True)
+
+
+def test_gtanalysis_mcstudy(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.simulate_roi(restore=True)
+    gta.load_roi('fit1')
+
+    o = gta.mcstudy('draco', ntrial=20, seed=1, chunk_size=10,
+                    write_fits=False, write_npy=False)
+    assert o['ts'].shape == (20,)
+    assert np.all(o['ts'] >= 0)
+    assert np.all(np.isfinite(o['loglike']))
+
+    o1 = gta.mcstudy('draco', ntrial=20, seed=1, chunk_size=10,
+                     multithread=True, nthread=2,
+                     write_fits=False, write_npy=False)
+    assert_allclose(o1['ts'], o['ts'])
+
+
 def test_gtanalysis_localization(create_draco_analysis):
     gta = create_draco_analysis
     gta.simulate_roi(restore=True)
@@ -0,0 +1,228 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import timeit
+import numpy as np
+from numpy.testing import assert_allclose
+import pytest
+from fermipy import utils
+from fermipy import hankel
+from fermipy import irfs
+from fermipy import spectrum
+from fermipy.kernel_cache import kernel_cache
+
+
+def king(r, sigma, gamma=2.5):
+    return ((1.0 - 1.0 / gamma) / (2.0 * np.pi * sigma**2) *
+            (1.0 + r**2 / (2.0 * gamma * sigma**2))**-gamma)
+
+
+class KingPSF(object):
+    """Tabulated King-function PSF with the interface of
+    `~fermipy.irfs.PSFModel` used by the kernel functions."""
+
+    gamma = 2.5
+
+    def __init__(self):
+        self.dtheta = np.insert(np.logspace(-4, 1.75, 500), 0, 0.0)
+        self.energies = np.logspace(2.0, 5.0, 25)
+        self.scale_fn = None
+        self.val = king(self.dtheta[:, None],
+                        self.sigma(self.energies)[None, :], self.gamma)
+        self.val /= np.radians(1.0)**2
+
+    def sigma(self, energies):
+        return 0.8 * (energies / 1000.)**-0.8 + 0.03
+
+    def eval(self, ebin, dtheta, scale_fn=None):
+        return 10**np.interp(dtheta, self.dtheta,
+                             np.log10(self.val[:, ebin]))
+
+    def interp(self, energies, dtheta, scale_fn=None):
+        return king(dtheta, self.sigma(energies),
+                    self.gamma) / np.radians(1.0)**2
+
+    def containment_angle(self, energies=None, fraction=0.68,
+                          scale_fn=None):
+        g = self.gamma
+        return self.sigma(energies) * np.sqrt(2.0 * g * (
+            (1.0 - fraction)**(1.0 / (1.0 - g)) - 1.0))
+
+
+def test_hankel_gauss_analytic():
+
+    sig0, sig1 = 0.1, 0.3
+    r = np.linspace(0.0, 2.0, 101)
+    v = hankel.convolve2d_gauss(
+        lambda t: np.exp(-t**2 / (2 * sig0**2)) / (2 * np.pi * sig0**2),
+        r, sig1)
+    s2 = sig0**2 + sig1**2
+    assert_allclose(v, np.exp(-r**2 / (2 * s2)) / (2 * np.pi * s2),
+                    rtol=0.0, atol=1E-6 / s2)
+
+
+@pytest.mark.parametrize('sig', [0.02, 0.1, 0.5, 1.0])
+def test_hankel_convolve(sig):
+
+    spsf = np.array([0.03, 0.1, 0.5, 2.0])
+    r = np.linspace(0.0, 2.0, 200)**2
+
+    for fn, hfn in [(utils.convolve2d_gauss, hankel.convolve2d_gauss),
+                    (utils.convolve2d_disk, hankel.convolve2d_disk)]:
+
+        # Reference values with a fine quadrature
+        v0 = np.array([fn(lambda t: king(t, s), r, sig, nstep=4000)
+                       for s in spsf])
+        v1 = hfn(lambda t: king(t[np.newaxis, :], spsf[:, np.newaxis]),
+                 r, sig, rres=0.01)
+        vmax = np.max(v0, axis=1)[:, np.newaxis]
+        assert_allclose(v1 / vmax, v0 / vmax, rtol=0.0, atol=2E-4)
+
+        # Radii that differ for each row
+        rr = r[np.newaxis, :] * np.linspace(0.5, 1.0, 4)[:, np.newaxis]
+        rmax = np.max(r) + 10.0 * sig
+        v2 = hfn(lambda t: king(t[np.newaxis, :], spsf[:, np.newaxis]),
+                 rr, sig, rmax=rmax, rres=0.01)
+        for i in range(len(spsf)):
+            v3 = hfn(lambda t: king(t, spsf[i]), rr[i], sig, rmax=rmax,
+                     rres=0.01)
+            assert_allclose(v2[i], v3, rtol=1E-8)
+
+
+@pytest.mark.parametrize('fn', ['convolve2d_gauss', 'convolve2d_disk'])
+@pytest.mark.parametrize('sparse', [False, True])
+def test_make_radial_kernel(fn, sparse):
+
+    psf = KingPSF()
+    fn = getattr(utils, fn)
+
+    for sigma in [0.05, 1.0]:
+
+        k = utils.make_radial_kernel(psf, fn, sigma, 41, 0.1, 20., 20.,
+                                     sparse=sparse)
+
+        # Reference kernel with a fine quadrature
+        def fn_ref(psf_fn, dtheta, sigma):
+            return fn(psf_fn, dtheta, sigma, nstep=4000)
+
+        k0 = utils.make_radial_kernel(psf, fn_ref, sigma, 41, 0.1, 20., 20.,
+                                      sparse=sparse)
+        kmax = np.max(k0, axis=(1, 2))[:, np.newaxis, np.newaxis]
+        assert_allclose(k / kmax, k0 / kmax, rtol=0.0, atol=5E-4)
+
+
+def min_time(fn, nrep=3):
+    """Return the shortest of ``nrep`` timings of ``fn``."""
+    return min(timeit.repeat(fn, number=1, repeat=nrep))
+
+
+def compute_ps_counts_quad(ebins, exp, psf, bkg, fn, spatial_model,
+                           spatial_size, nstep):
+    """Signal counts of `~fermipy.irfs.compute_ps_counts` evaluated with
+    the quadrature of `~fermipy.utils.convolve2d_gauss` and
+    `~fermipy.utils.convolve2d_disk` used previously."""
+
+    ectr = np.exp(utils.edge_to_center(np.log(ebins)))
+    r68 = psf.containment_angle(ectr, fraction=0.68)
+    r68[r68 < spatial_size] = spatial_size
+    theta_edges = np.linspace(0.0, 3.0, 31)[np.newaxis, :]
+    theta_edges = theta_edges * r68[:, np.newaxis]
+    theta = 0.5 * (theta_edges[:, :-1] + theta_edges[:, 1:])
+    domega = np.pi * (theta_edges[:, 1:]**2 - theta_edges[:, :-1]**2)
+
+    def psf_fn(t):
+        return psf.interp(ectr[:, np.newaxis, np.newaxis], t)
+
+    if spatial_model == 'RadialGaussian':
+        v = utils.convolve2d_gauss(psf_fn, theta,
+                                   spatial_size / 1.5095921854516636,
+                                   nstep=nstep)
+    else:
+        v = utils.convolve2d_disk(psf_fn, theta,
+                                  spatial_size / 0.8246211251235321,
+                                  nstep=nstep)
+
+    sig_pdf = domega * v * (np.pi / 180.)**2
+    sig_flux = fn.flux(ebins[:-1], ebins[1:])
+    return sig_pdf * sig_flux[:, np.newaxis] * exp[:, np.newaxis]
+
+
+def make_ps_counts_args():
+    ebins = np.logspace(2.0, 6.0, 17)
+    exp = np.linspace(1E11, 3E11, 16)
+    bkg = 1E-7 * (np.sqrt(ebins[:-1] * ebins[1:]) / 1E3)**-2.5
+    fn = spectrum.PowerLaw([1E-13, -2.0], scale=1E3)
+    return ebins, exp, KingPSF(), bkg, fn
+
+
+@pytest.mark.parametrize('spatial_model', ['RadialGaussian', 'RadialDisk'])
+@pytest.mark.parametrize('spatial_size', [0.02, 0.2, 1.0])
+def test_compute_ps_counts(spatial_model, spatial_size):
+
+    ebins, exp, psf, bkg, fn = make_ps_counts_args()
+    ectr = np.sqrt(ebins[:-1] * ebins[1:])
+    assert np.min(psf.containment_angle(ectr)) < 0.1
+
+    sigc, bkgc = irfs.compute_ps_counts(ebins, exp, psf, bkg, fn,
+                                        spatial_model=spatial_model,
+                                        spatial_size=spatial_size)
+    sigc0 = compute_ps_counts_quad(ebins, exp, psf, bkg, fn, spatial_model,
+                                   spatial_size, nstep=4000)
+    smax = np.max(sigc0, axis=1)[:, np.newaxis]
+    assert_allclose(sigc / smax, sigc0 / smax, rtol=0.0, atol=1E-4)
+    assert_allclose(np.sum(sigc, axis=1), np.sum(sigc0, axis=1), rtol=1E-3)
+
+
+@pytest.mark.parametrize('fn', ['convolve2d_gauss', 'convolve2d_disk'])
+def test_make_radial_kernel_benchmark(fn):
+    """Compare RadialGaussian and RadialDisk kernels computed with the
+    Hankel transform with those of the quadrature used previously (one
+    convolution per energy bin) and check that they are faster to
+    compute."""
+
+    psf = KingPSF()
+    fn = getattr(utils, fn)
+    sigmas = [0.1, 0.2, 0.4]
+
+    def fn_quad(psf_fn, dtheta, sigma):
+        return fn(psf_fn, dtheta, sigma)
+
+    def make_kernels(kfn):
+        kernel_cache.clear()
+        return [utils.make_radial_kernel(psf, kfn, sigma, 81, 0.05, 40., 40.)
+                for sigma in sigmas]
+
+    for k0, k1 in zip(make_kernels(fn_quad), make_kernels(fn)):
+        kmax = np.max(k0, axis=(1, 2))[:, np.newaxis, np.newaxis]
+        assert_allclose(k1 / kmax, k0 / kmax, rtol=0.0, atol=2E-2)
+
+    t_quad = min_time(lambda: make_kernels(fn_quad))
+    t_hankel = min_time(lambda: make_kernels(fn))
+    assert t_hankel < t_quad
+
+
+@pytest.mark.parametrize('spatial_model', ['RadialGaussian', 'RadialDisk'])
+def test_compute_ps_counts_benchmark(spatial_model):
+    """Compare the signal counts of `SensitivityCalc` computed with the
+    Hankel transform with those of the quadrature used previously and
+    check that they are faster to compute.  The quadrature is
+    evaluated with 2000 steps for which its accuracy is comparable to
+    that of the Hankel transform."""
+
+    ebins, exp, psf, bkg, fn = make_ps_counts_args()
+
+    def run_hankel():
+        return irfs.compute_ps_counts(ebins, exp, psf, bkg, fn,
+                                      spatial_model=spatial_model,
+                                      spatial_size=0.2)[0]
+
+    def run_quad():
+        return compute_ps_counts_quad(ebins, exp, psf, bkg, fn,
+                                      spatial_model, 0.2, nstep=2000)
+
+    sigc0 = run_quad()
+    smax = np.max(sigc0, axis=1)[:, np.newaxis]
+    assert_allclose(run_hankel() / smax, sigc0 / smax, rtol=0.0, atol=1E-4)
+
+    t_quad = min_time(run_quad)
+    t_hankel = min_time(run_hankel)
+    assert t_hankel < t_quad
@@ -0,0 +1,95 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import sys
+import subprocess
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7),
+                                reason='-X importtime requires python 3.7')
+
+
+def get_import_times(module):
+    """Import a module in a fresh interpreter and return a dictionary
+    of the cumulative import time in microseconds of every module
+    that was loaded."""
+
+    p = subprocess.Popen([sys.executable, '-X', 'importtime',
+                          '-c', 'import %s' % module],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    assert p.returncode == 0, err.decode('utf-8', 'replace')
+
+    times = {}
+    for line in err.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('import time:'):
+            continue
+        cols = line[len('import time:'):].split('|')
+        if len(cols) != 3 or not cols[1].strip().isdigit():
+            continue
+        times[cols[2].strip()] = int(cols[1])
+
+    return times
+
+
+@pytest.mark.parametrize('module', ['fermipy', 'fermipy.utils',
+                                    'fermipy.skymap', 'fermipy.roi_model'])
+def test_lazy_imports(module):
+
+    pytest.importorskip('healpy')
+    times = get_import_times(module)
+    assert module in times
+
+    for m in ['healpy', 'matplotlib', 'pyLikelihood', 'scipy.optimize',
+              'scipy.interpolate', 'fermipy.plotting']:
+        assert m not in times, '%s imported by %s' % (m, module)
+
+
+def get_imported_modules(module):
+    """Import a module in a fresh interpreter and return the names of
+    all modules in ``sys.modules``."""
+
+    code = 'import sys; import %s; print(chr(10).join(sys.modules))' % module
+    p = subprocess.Popen([sys.executable, '-c', code],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    assert p.returncode == 0, err.decode('utf-8', 'replace')
+    return set(out.decode('utf-8', 'replace').split())
+
+
+@pytest.mark.parametrize('module', ['fermipy', 'fermipy.irfs',
+                                    'fermipy.sensitivity',
+                                    'fermipy.gtanalysis',
+                                    'fermipy.jobs.gtlink'])
+def test_deferred_st_imports(module):
+
+    modules = get_imported_modules(module)
+    assert module in modules
+
+    for m in ['pyLikelihood', 'GtApp', 'pyIrfLoader', 'BinnedAnalysis',
+              'LikelihoodState', 'FluxDensity', 'fermipy.gtutils',
+              'matplotlib', 'healpy']:
+        assert m not in modules, '%s imported by %s' % (m, module)
+
+
+def test_get_version(monkeypatch):
+
+    from fermipy import version
+
+    def fail(*args, **kwargs):
+        raise AssertionError('get_version must not call git')
+
+    monkeypatch.setattr(version, 'call_git_describe', fail)
+    monkeypatch.setattr(version, 'write_release_version', fail)
+    assert version.get_version()
+
+
+def test_lazy_module_on_load():
+
+    from fermipy.lazy_import import LazyModule
+
+    loaded = []
+    m = LazyModule('colorsys', loaded.append)
+    assert not loaded
+    assert m.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    m.hls_to_rgb(0.0, 0.5, 1.0)
+    assert len(loaded) == 1 and loaded[0].__name__ == 'colorsys'
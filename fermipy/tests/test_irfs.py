@@ -7,6 +7,7 @@ from astropy.tests.helper import pytest
 from astropy.coordinates import SkyCoord
 from fermipy.tests.utils import requires_dependency
 from fermipy import spectrum
+from fermipy import utils
 
 try:
     from fermipy import irfs
@@ -85,6 +86,79 @@ def test_create_avg_edisp():
                     rtol=1E-3)
 
 
+def calc_drm_ref(skydir, ltc, event_class, event_types, egy_bins,
+                 cth_bins, nbin=64):
+    """Detector response matrix computed with `create_avg_edisp`
+    without the cached IRF grids and matrices."""
+
+    npts = int(np.ceil(128. / irfs.bins_per_dec(egy_bins)))
+    egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
+    etrue_bins = 10**np.linspace(1.0, 6.5, int(nbin * 5.5) + 1)
+    egy = 10**utils.edge_to_center(np.log10(egy_bins))
+    egy_width = utils.edge_to_width(egy_bins)
+    etrue = 10**utils.edge_to_center(np.log10(etrue_bins))
+    irfs.clear_cache()
+    edisp = irfs.create_avg_edisp(skydir, ltc, event_class, event_types,
+                                  egy, etrue, cth_bins)
+    edisp = edisp * egy_width[:, None, None]
+    return utils.sum_bins(edisp, 0, npts)
+
+
+def calc_counts_edisp_ref(skydir, ltc, event_class, event_types,
+                          egy_bins, cth_bins, fn, nbin=64, npts=1):
+    """Counts vs. observed energy computed by folding the true-energy
+    counts with the matrix of `calc_drm_ref`."""
+
+    egy_bins = np.exp(utils.split_bin_edges(np.log(egy_bins), npts))
+    etrue_bins = 10**np.linspace(1.0, 6.5, int(nbin * 5.5) + 1)
+    drm = calc_drm_ref(skydir, ltc, event_class, event_types,
+                       egy_bins, cth_bins, nbin=nbin)
+    irfs.clear_cache()
+    cnts_etrue = irfs.calc_counts(skydir, ltc, event_class, event_types,
+                                  etrue_bins, cth_bins, fn)
+    cnts = np.sum(cnts_etrue[None, :, :] * drm[:, :, :], axis=1)
+    return utils.sum_bins(cnts, 0, npts)
+
+
+def test_calc_counts_edisp():
+
+    ltc = irfs.LTCube.create_from_obs_time(3.1536E8)
+    c = SkyCoord([10.0, 10.0, 80.0], [10.0, 10.0, -30.0], unit='deg')
+
+    # Change the livetime distribution of the southern hemisphere
+    m = ltc.hpx.get_sky_dirs().dec.deg < 0.0
+    ltc._counts[:, m] *= np.linspace(0.2, 1.8, ltc.counts.shape[0])[:, None]
+
+    egy_bins = 10**np.linspace(2.0, 4.0, 9)
+    cth_bins = np.array([0.2, 0.6, 1.0])
+    fns = [spectrum.PowerLaw([1E-13, -2.0], scale=1E3),
+           spectrum.PowerLaw([1E-13, -2.5], scale=1E3)]
+    args = (ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'], egy_bins, cth_bins)
+
+    irfs.clear_cache()
+    drm = irfs.calc_drm(c[0], *args, nbin=32)
+    assert irfs.calc_drm(c[1], *args, nbin=32) is drm
+    assert not drm.flags.writeable
+    assert_allclose(drm, calc_drm_ref(c[0], *args, nbin=32), rtol=1E-8)
+
+    # A position with a different livetime distribution has a
+    # different matrix
+    drm2 = irfs.calc_drm(c[2], *args, nbin=32)
+    assert drm2 is not drm
+    assert not np.allclose(drm2, drm, rtol=1E-3)
+    assert_allclose(drm2, calc_drm_ref(c[2], *args, nbin=32), rtol=1E-8)
+
+    irfs.clear_cache()
+    cnts = irfs.calc_counts_edisp_batch(c, *(args + (fns,)), nbin=32, npts=2)
+    assert cnts.shape == (3, 2, 8, 2)
+    for i in range(len(c)):
+        for j, fn in enumerate(fns):
+            v = calc_counts_edisp_ref(c[i], *(args + (fn,)), nbin=32, npts=2)
+            assert_allclose(cnts[i, j], v, rtol=1E-8)
+            v = irfs.calc_counts_edisp(c[i], *(args + (fn,)), nbin=32, npts=2)
+            assert_allclose(cnts[i, j], v, rtol=1E-8)
+
+
 def test_psfmodel():
 
     ltc = irfs.LTCube.create_from_obs_time(3.1536E8)
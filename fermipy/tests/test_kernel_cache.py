@@ -0,0 +1,156 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy import utils
+from fermipy import kernel_cache
+from fermipy.kernel_cache import KernelCache
+
+
+class GaussPSF(object):
+    """Tabulated gaussian PSF with the interface of
+    `~fermipy.irfs.PSFModel` used by the kernel functions."""
+
+    def __init__(self, width):
+        self.dtheta = np.linspace(0.0, 5.0, 101)
+        self.energies = np.array([1000., 3000., 10000.])
+        self.sigma = width * (self.energies / 1000.)**-0.8
+        self.val = np.exp(-self.dtheta[:, None]**2 /
+                          (2.0 * self.sigma[None, :]**2))
+        self.val /= 2.0 * np.pi * np.radians(self.sigma[None, :])**2
+        self.scale_fn = None
+
+    def eval(self, ebin, dtheta, scale_fn=None):
+        if scale_fn is not None:
+            dtheta = dtheta / scale_fn(self.energies[ebin])
+        return np.interp(dtheta, self.dtheta, self.val[:, ebin])
+
+    def containment_angle(self, energies=None, fraction=0.68,
+                          scale_fn=None):
+        sigma = np.interp(energies, self.energies, self.sigma)
+        return sigma * np.sqrt(-2.0 * np.log(1.0 - fraction))
+
+
+def make_psf(width=0.5):
+    return GaussPSF(width)
+
+
+def test_kernel_cache_lru():
+
+    c = KernelCache(max_bytes=3 * 800)
+    for i in range(3):
+        c.put('k%i' % i, np.full(100, float(i)))
+    assert len(c) == 3
+
+    # Touch k0 such that k1 is the least recently used entry
+    assert_allclose(c.get('k0'), 0.0)
+    c.put('k3', np.full(100, 3.0))
+
+    assert c.get('k1') is None
+    assert_allclose(c.get('k3'), 3.0)
+    stats = c.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['evictions'] == 1
+    assert stats['nitems'] == 3
+    assert stats['nbytes'] == 3 * 800
+
+    # Returned arrays are copies
+    v = c.get('k3')
+    v *= 0.0
+    assert_allclose(c.get('k3'), 3.0)
+
+
+def test_kernel_cache_disk(tmpdir):
+
+    cachedir = str(tmpdir.join('kernels'))
+    c = KernelCache(cachedir=cachedir)
+    c.put('k0', np.arange(10.))
+
+    c = KernelCache(cachedir=cachedir)
+    assert 'k0' in c
+    assert_allclose(c.get('k0'), np.arange(10.))
+    assert c.stats()['disk_hits'] == 1
+    assert_allclose(c.get('k0'), np.arange(10.))
+    assert c.stats()['hits'] == 1
+
+    c.clear(disk=True)
+    assert c.get('k0') is None
+
+
+def test_cached_kernel():
+
+    kernel_cache.kernel_cache.clear()
+    kernel_cache.kernel_cache.reset_stats()
+
+    psf = make_psf()
+    k0 = utils.make_cgauss_kernel(psf, 0.3, 21, 0.1, 10.0, 10.0)
+    k1 = utils.make_cgauss_kernel(psf, 0.3, 21, 0.1, 10.0, 10.0)
+    stats = kernel_cache.kernel_cache.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+    assert_allclose(k0, k1)
+
+    # Callers modify the kernel in place
+    k1 *= 2.0
+    assert_allclose(utils.make_cgauss_kernel(psf, 0.3, 21, 0.1, 10.0, 10.0),
+                    k0)
+
+    # A different width, PSF or scaling function is a new entry
+    utils.make_cgauss_kernel(psf, 0.4, 21, 0.1, 10.0, 10.0)
+    utils.make_cgauss_kernel(make_psf(0.6), 0.3, 21, 0.1, 10.0, 10.0)
+    k2 = utils.make_cgauss_kernel(psf, 0.3, 21, 0.1, 10.0, 10.0,
+                                  psf_scale_fn=lambda e: 1.2)
+    assert kernel_cache.kernel_cache.stats()['misses'] == 4
+    assert not np.allclose(k0, k2)
+
+
+class KernelFnA(object):
+
+    @staticmethod
+    def fn(psf_fn, dtheta, sigma):
+        return utils.convolve2d_gauss(psf_fn, dtheta, sigma)
+
+
+class KernelFnB(object):
+
+    @staticmethod
+    def fn(psf_fn, dtheta, sigma):
+        return utils.convolve2d_disk(psf_fn, dtheta, sigma)
+
+
+def test_kernel_key_callables():
+
+    psf = make_psf()
+
+    def make_key(fn):
+        return kernel_cache.make_kernel_key(utils.make_radial_kernel, psf,
+                                            {'fn': fn, 'sigma': 0.3})
+
+    # Functions are identified by their qualified name
+    key = make_key(utils.convolve2d_gauss)
+    assert key is not None
+    assert make_key(utils.convolve2d_gauss) == key
+    assert make_key(KernelFnA.fn) is not None
+    assert make_key(KernelFnA.fn) != make_key(KernelFnB.fn)
+
+    # Lambdas, local functions and closures are not cached
+    def fn_local(psf_fn, dtheta, sigma):
+        return utils.convolve2d_gauss(psf_fn, dtheta, sigma)
+
+    def make_closure(nstep):
+        def fn(psf_fn, dtheta, sigma):
+            return utils.convolve2d_gauss(psf_fn, dtheta, sigma, nstep=nstep)
+        return fn
+
+    assert make_key(lambda t: t) is None
+    assert make_key(fn_local) is None
+    assert make_key(make_closure(100)) is None
+
+    kernel_cache.kernel_cache.clear()
+    k0 = utils.make_radial_kernel(psf, make_closure(100), 0.3, 21, 0.1,
+                                  10.0, 10.0)
+    k1 = utils.make_radial_kernel(psf, make_closure(1000), 0.3, 21, 0.1,
+                                  10.0, 10.0)
+    assert len(kernel_cache.kernel_cache) == 0
+    assert not np.allclose(k0, k1, rtol=1E-8)
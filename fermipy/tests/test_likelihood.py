@@ -0,0 +1,257 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import copy
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.likelihood import LikelihoodComponent, NormLikelihood
+from fermipy.likelihood import TemplateScan
+
+
+def make_component(seed=1, sparse_threshold=0.1, weights=None):
+
+    rng = np.random.RandomState(seed)
+    nebin, npix = 6, 30
+    yy, xx = np.mgrid[:npix, :npix]
+    bkg = rng.uniform(0.5, 2.0, (nebin, npix, npix))
+    spec = np.linspace(5.0, 1.0, nebin)[:, None, None]
+
+    templates = []
+    for x0, y0 in [(8., 10.), (20., 15.), (12., 22.)]:
+        t = np.exp(-((xx - x0)**2 + (yy - y0)**2) / (2 * 1.5**2))
+        t[t < 1E-3] = 0.0
+        templates += [spec * t[None, :, :]]
+
+    norms = np.array([1.0, 2.0, 0.5])
+    counts = rng.poisson(bkg + np.tensordot(norms, templates, axes=1))
+    return LikelihoodComponent(counts, templates, bkg, weights=weights,
+                               sparse_threshold=sparse_threshold)
+
+
+def test_norm_likelihood_gradient():
+
+    like = NormLikelihood([make_component()])
+    x = np.array([1.2, 1.5, 0.7])
+    grad, hess = like.gradient_hessian(x)
+
+    eps = 1E-4
+    for i in range(3):
+        dx = eps * np.eye(3)[i]
+        g = (like.loglike(x + dx) - like.loglike(x - dx)) / (2 * eps)
+        assert_allclose(grad[i], g, rtol=1E-5)
+        g0, h = like.gradient_hessian(x - dx)
+        g1, h = like.gradient_hessian(x + dx)
+        assert_allclose(hess[i], (g1 - g0) / (2 * eps), rtol=1E-5)
+
+
+def test_norm_likelihood_fit():
+
+    from scipy.optimize import minimize
+
+    like_sparse = NormLikelihood([make_component()],
+                                 bounds=[[0.0, 10.0]] * 3)
+    like_dense = NormLikelihood([make_component(sparse_threshold=0)],
+                                bounds=[[0.0, 10.0]] * 3)
+
+    o0 = like_sparse.fit(tol=1E-8)
+    o1 = like_dense.fit(tol=1E-8)
+    assert o0['fit_status'] == 0
+    assert_allclose(o0['values'], o1['values'], rtol=1E-8)
+
+    r = minimize(lambda x: -like_dense.loglike(x), np.ones(3),
+                 method='L-BFGS-B', bounds=[(0.0, 10.0)] * 3,
+                 options={'ftol': 1E-14, 'gtol': 1E-10})
+    assert_allclose(o0['values'], r.x, rtol=1E-4, atol=1E-6)
+    assert_allclose(o0['loglike'], -r.fun, rtol=1E-10)
+    assert np.all(o0['errors'] > 0)
+
+
+def test_norm_likelihood_multiple_components():
+
+    c0 = make_component(seed=1)
+    c1 = make_component(seed=2, weights=0.5 * np.ones((6, 30, 30)))
+    like0 = NormLikelihood([c0])
+    like1 = NormLikelihood([c1])
+    like = NormLikelihood([c0, c1])
+
+    x = np.array([0.8, 1.9, 0.4])
+    assert_allclose(like.loglike(x), like0.loglike(x) + like1.loglike(x))
+
+    # Vectorized evaluation
+    xs = np.vstack((x, 2 * x)).T
+    assert_allclose(like.loglike(xs),
+                    [like.loglike(x), like.loglike(2 * x)])
+
+
+def test_norm_likelihood_bounds_and_priors():
+
+    like = NormLikelihood([make_component()],
+                          bounds=[[0.0, 10.0], [0.0, 1.0], [0.0, 10.0]])
+    o = like.fit()
+    assert o['fit_status'] == 0
+    assert_allclose(o['values'][1], 1.0)
+
+    like = NormLikelihood([make_component()], bounds=[[0.0, 10.0]] * 3)
+    like.set_priors([3.0, 1.0, 1.0], [1E-3, 1.0, 1.0],
+                    [True, False, False])
+    o = like.fit()
+    assert_allclose(o['values'][0], 3.0, atol=1E-2)
+
+    # Fixed parameters are held at their initial value
+    like = NormLikelihood([make_component()], norms=[1.0, 1.5, 1.0],
+                          free=[True, False, True])
+    o = like.fit()
+    assert o['values'][1] == 1.5
+    assert o['errors'][1] == 0.0
+
+
+def test_norm_likelihood_energy_bins_and_profile():
+
+    like = NormLikelihood([make_component()])
+    lnl = like.loglike()
+    like.set_energy_bin(2)
+    lnl2 = like.loglike()
+    like.set_energy_bins()
+    assert_allclose(lnl, like.loglike())
+    assert lnl2 > lnl
+
+    like.fit()
+    xvals = np.linspace(0.5, 1.5, 5)
+    lnl = like.profile(0, xvals)
+    for x, v in zip(xvals, lnl):
+        norms = like.norms.copy()
+        norms[0] = x
+        assert_allclose(v, like.loglike(norms))
+
+    lnl_opt = like.profile(0, xvals, reoptimize=True)
+    assert np.all(lnl_opt >= lnl - 1E-6)
+
+
+def test_norm_likelihood_blocks():
+
+    rng = np.random.RandomState(4)
+    nebin, npix = 4, 40
+    yy, xx = np.mgrid[:npix, :npix]
+    bkg = rng.uniform(0.5, 2.0, (nebin, npix, npix))
+
+    templates = []
+    for x0, y0 in [(8., 10.), (9., 11.), (30., 15.), (12., 30.),
+                   (31., 17.)]:
+        t = np.exp(-((xx - x0)**2 + (yy - y0)**2) / (2 * 1.5**2))
+        t[t < 1E-3] = 0.0
+        templates += [5.0 * np.ones((nebin, 1, 1)) * t[None, :, :]]
+
+    norms = np.array([1.0, 2.0, 0.5, 1.5, 1.0])
+    counts = rng.poisson(bkg + np.tensordot(norms, templates, axes=1))
+    like = NormLikelihood([LikelihoodComponent(counts, templates, bkg)],
+                          bounds=[[0.0, 10.0]] * 5)
+
+    # Derivatives of a subset of the parameters
+    grad, hess = like.gradient_hessian()
+    g, h = like.gradient_hessian(idx=[3, 0])
+    assert_allclose(g, grad[[3, 0]])
+    assert_allclose(h, hess[np.ix_([3, 0], [3, 0])])
+
+    blocks = like.find_blocks(0.1)
+    assert [list(b) for b in blocks] == [[0, 2, 3], [1, 4]]
+    blocks = like.find_blocks(0.1, order=[4, 3, 2, 1, 0])
+    assert [list(b) for b in blocks] == [[4, 3, 1], [2, 0]]
+
+    # Fixed parameters are not assigned to blocks
+    like.free = [True, True, False, True, True]
+    blocks = like.find_blocks(0.1)
+    assert [list(b) for b in blocks] == [[0, 3, 4], [1]]
+    like.free = np.ones(5, dtype=bool)
+
+    o0 = copy.deepcopy(like).fit(tol=1E-8)
+    blocks = like.find_blocks(0.1)
+    o1 = like.fit_blocks(blocks, tol=1E-8, max_pass=30)
+    assert o1['fit_status'] == 0
+    assert o1['npass'] > 1
+    assert np.all(like.free)
+    assert_allclose(o1['values'], o0['values'], rtol=1E-3)
+    assert_allclose(o1['loglike'], o0['loglike'], atol=1E-6)
+
+    # Errors of the block fit neglect the correlations between blocks
+    assert_allclose(o1['errors'][3], o0['errors'][3], rtol=1E-3)
+    assert np.all(o1['errors'] <= o0['errors'] * (1.0 + 1E-3))
+
+
+def make_width_scan(widths, seed=2):
+
+    rng = np.random.RandomState(seed)
+    nebin, npix = 5, 30
+    yy, xx = np.mgrid[:npix, :npix] - 15.
+    bkg = rng.uniform(0.5, 2.0, (nebin, npix, npix))
+    spec = np.linspace(4.0, 1.0, nebin)[:, None, None]
+    other = spec * np.exp(-((xx - 8.)**2 + yy**2) / 8.)[None, :, :]
+
+    def src(w):
+        k = np.exp(-(xx**2 + yy**2) / (2 * w**2))
+        return 50. * spec * (k / np.sum(k))[None, :, :]
+
+    counts = rng.poisson(bkg + 0.5 * other + src(2.0))
+    alt = [src(w) for w in widths]
+    comp = LikelihoodComponent(counts, [other] + alt, bkg,
+                               sparse_threshold=0)
+    like = [NormLikelihood([LikelihoodComponent(counts, [other, t], bkg)],
+                           bounds=[[0.0, 10.0]] * 2) for t in alt]
+    return comp, like
+
+
+def test_template_scan_fit():
+
+    widths = np.linspace(0.5, 5.0, 10)
+    comp, like = make_width_scan(widths)
+    scan = TemplateScan([comp], len(widths), bounds=[[0.0, 10.0]] * 2)
+
+    lnl0 = scan.loglike()
+    o = scan.fit(tol=1E-8)
+    assert np.all(o['fit_status'] == 0)
+
+    for i, l in enumerate(like):
+        assert_allclose(lnl0[i], l.loglike(np.ones(2)))
+        o1 = l.fit(tol=1E-8)
+        assert_allclose(o['loglike'][i], o1['loglike'], rtol=1E-10)
+        assert_allclose(o['values'][:, i], o1['values'], rtol=1E-4)
+
+    assert 1.0 < widths[np.argmax(o['loglike'])] < 3.0
+
+
+def test_template_scan_energy_bins():
+
+    widths = [1.0, 2.0, 4.0]
+    comp, like = make_width_scan(widths)
+    scan = TemplateScan([comp], len(widths))
+    x = np.array([[0.3, 0.5, 0.7], [1.2, 1.0, 0.8]])
+
+    lnl = scan.loglike_ebin(x)[0]
+    assert lnl.shape == (5, 3)
+    assert_allclose(np.sum(lnl, axis=0), scan.loglike(x))
+
+    for i, l in enumerate(like):
+        l.set_energy_bin(2)
+        assert_allclose(lnl[2, i], l.loglike(x[:, i]))
+
+
+def test_likelihood_component_set_counts():
+
+    c0 = make_component(seed=1)
+    c0.set_energy_bins(1, 5)
+    x = np.array([1.2, 1.5, 0.7])
+
+    mu = c0._bkg.reshape(c0.shape) + 1.0
+    counts = np.random.RandomState(2).poisson(mu)
+    c1 = copy.deepcopy(c0)
+    c0.set_counts(counts)
+    c1._counts = counts.ravel().astype(float)
+    c1.set_energy_bins(1, 5)
+    assert_allclose(c0.loglike(x), c1.loglike(x))
+
+    # Counts in a bin that was dropped from the selection
+    bkg = np.ones(c1.shape)
+    bkg[-1, 0, 0] = 0.0
+    counts = np.zeros(c1.shape)
+    c0 = LikelihoodComponent(counts, np.zeros((1,) + c1.shape), bkg)
+    counts[-1, 0, 0] = 1.0
+    c0.set_counts(counts)
+    assert c0.loglike([0.0]) == -np.inf
@@ -0,0 +1,51 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.likelihood import LikelihoodComponent, NormLikelihood
+from fermipy.mcstudy import run_trials
+
+
+def make_likelihood():
+
+    nebin, npix = 4, 20
+    yy, xx = np.mgrid[:npix, :npix]
+    bkg = np.ones((nebin, npix, npix))
+    spec = np.linspace(4.0, 1.0, nebin)[:, None, None]
+    t = np.exp(-((xx - 10.)**2 + (yy - 10.)**2) / (2 * 1.5**2))
+    templates = [bkg, spec * t[None, :, :]]
+    c = LikelihoodComponent(bkg, templates)
+    like = NormLikelihood([c], bounds=[[0.0, 10.0], [0.0, 100.0]])
+    return like, bkg, templates
+
+
+def test_run_trials_null():
+
+    like, bkg, templates = make_likelihood()
+    o = run_trials(like, [bkg], 200, 1, 1, norms=[1.0, 1.0])
+
+    assert o['ts'].shape == (200,)
+    assert np.all(o['fit_status'] == 0)
+    assert np.all(o['ts'] >= 0)
+    assert_allclose(np.mean(o['values'][:, 0]), 1.0, atol=0.01)
+
+    # TS follows a 1/2 chi2(1) distribution under the null hypothesis
+    assert 0.3 < np.mean(o['ts']) < 0.8
+    assert 0.35 < np.mean(o['ts'] == 0) < 0.65
+
+    # Realizations only depend on the seed
+    o1 = run_trials(like, [bkg], 20, 1, 1, norms=[1.0, 1.0])
+    assert_allclose(o1['ts'], o['ts'][:20])
+    assert_allclose(o1['values'], o['values'][:20])
+
+
+def test_run_trials_signal():
+
+    like, bkg, templates = make_likelihood()
+    model = templates[0] + 2.0 * templates[1]
+    o = run_trials(like, [model], 50, 3, 1, norms=[1.0, 1.0])
+
+    assert np.all(o['ts'] > 25.0)
+    assert_allclose(np.mean(o['values'][:, 1]), 2.0, rtol=0.1)
+    assert_allclose(np.std(o['values'][:, 1]),
+                    np.mean(o['errors'][:, 1]), rtol=0.3)
@@ -1,11 +1,14 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
+import copy
+import pickle
 import xml.etree.cElementTree as ElementTree
 from numpy.testing import assert_allclose
 from astropy.tests.helper import pytest
 from astropy.coordinates import SkyCoord
 from fermipy.tests.utils import requires_dependency
 from fermipy import roi_model
+from fermipy import catalog
 from fermipy.roi_model import Source, ROIModel
 
 # Skip tests in this file if Fermi ST aren't available
@@ -36,6 +39,134 @@ def test_load_3fgl_catalog_xml():
     assert len(rm.sources) == 175
 
 
+def test_spectral_pars_from_catalog_table():
+    cat = catalog.Catalog.create('3FGL')
+    tab = cat.table[::50]
+    spectral_pars = roi_model.spectral_pars_from_catalog_table(tab)
+    spatial_pars = roi_model.spatial_pars_from_catalog_table(tab)
+    for catalog_dict, sp0, sp1 in zip(catalog.table_to_dicts(tab),
+                                      spectral_pars, spatial_pars):
+        sp = roi_model.spectral_pars_from_catalog(catalog_dict)
+        assert sorted(sp.keys()) == sorted(sp0.keys())
+        for k, v in sp.items():
+            for t in ['value', 'scale', 'min', 'max']:
+                assert_allclose(v[t], sp0[k][t])
+        assert sp1 == roi_model.spatial_pars_from_catalog(catalog_dict)
+
+
+def test_source_store():
+    skydir = SkyCoord(0.0, 0.0, unit='deg', frame='galactic').icrs
+    rm = ROIModel(catalogs=['3FGL'], skydir=skydir, src_radius=20.0)
+    srcs = rm.point_sources
+
+    for i, s in enumerate(srcs):
+        s['ts'] = float(i)
+        s.update_data({'npred': 2.0 * i})
+
+    store = rm.source_store
+    assert len(store) == len(srcs)
+    assert_allclose(store['ts'], [s['ts'] for s in srcs])
+    assert_allclose(store['npred'], [s['npred'] for s in srcs])
+    assert_allclose(store['offset'], [s['offset'] for s in srcs])
+
+    names = [s.name for s in rm.get_sources(minmax_ts=[10., 100.],
+                                            cuts=('offset', 2.0, None))]
+    names_loop = [s.name for s in srcs if 10. <= s['ts'] <= 100. and
+                  s['offset'] >= 2.0]
+    assert sorted(names) == sorted(names_loop)
+
+    names = [s.name for s in rm.get_sources_by_property('npred', 20., 40.)]
+    names_loop = [s.name for s in srcs if 20. <= s['npred'] <= 40.]
+    assert names == names_loop
+
+    # Copies are detached from the store
+    src = copy.deepcopy(srcs[0])
+    src['ts'] = -1.0
+    assert_allclose(store['ts'][0], srcs[0]['ts'])
+
+    tab = rm.create_table()
+    assert len(tab) == len(srcs)
+    assert_allclose(tab['ts'], store['ts'])
+
+
+
+def test_source_store_copy():
+    skydir = SkyCoord(0.0, 0.0, unit='deg', frame='galactic').icrs
+    rm = ROIModel(catalogs=['3FGL'], skydir=skydir, src_radius=10.0)
+    for i, s in enumerate(rm.point_sources):
+        s['ts'] = float(i)
+
+    for rm1 in [copy.deepcopy(rm), pickle.loads(pickle.dumps(rm))]:
+        srcs = rm1.point_sources
+        assert len(rm1.source_store) == len(srcs)
+        assert_allclose(rm1.source_store['ts'], [s['ts'] for s in srcs])
+
+        # Updates of the copied sources are visible to selections on
+        # the copied model but not on the original model
+        for i, s in enumerate(srcs):
+            s['ts'] = float(len(srcs) - i)
+            s.update_data({'npred': 3.0 * (len(srcs) - i)})
+
+        names = [s.name for s in rm1.get_sources(minmax_ts=[5., 20.],
+                                                 minmax_npred=[0., 30.],
+                                                 cuts=('offset', 1.0, None))]
+        names_loop = [s.name for s in srcs if 5. <= s['ts'] <= 20. and
+                      s['npred'] <= 30. and s['offset'] >= 1.0]
+        assert len(names) > 0
+        assert sorted(names) == sorted(names_loop)
+
+        names = [s.name for s in
+                 rm1.get_sources_by_property('npred', 15., 45.)]
+        names_loop = [s.name for s in srcs if 15. <= s['npred'] <= 45.]
+        assert names == names_loop
+
+        assert_allclose(rm.source_store['ts'],
+                        [s['ts'] for s in rm.point_sources])
+
+def test_source_store_sync(tmppath):
+    skydir = SkyCoord(252.0, 52.0, unit='deg')
+    radec = [(252.367, 52.6356), (251.2, 51.5), (253.5, 52.1)]
+
+    xmlsrc = """
+    <source name="ptsrc{0}" type="PointSource">
+    <spatialModel type="SkyDirFunction">
+    <parameter free="0" max="90.0" min="-90.0" name="DEC" scale="1.0" value="{2}"/>
+    <parameter free="0" max="360.0" min="-360.0" name="RA" scale="1.0" value="{1}"/>
+    </spatialModel>
+    <spectrum type="PowerLaw">
+    <parameter free="0" max="5.0" min="0.0" name="Index" scale="-1.0" value="2.0"/>
+    <parameter free="0" max="1000.0" min="1000.0" name="Scale" scale="1.0" value="1000.0"/>
+    <parameter free="0" max="100.0" min="0.01" name="Prefactor" scale="1e-12" value="1.0"/>
+    </spectrum>
+    </source>"""
+    xmlmodel = '<source_library title="source_library">%s</source_library>' % \
+        ''.join([xmlsrc.format(i, *c) for i, c in enumerate(radec)])
+
+    root = ElementTree.fromstring(xmlmodel)
+    xmlfile = str(tmppath.join('test_source_store.xml'))
+    ElementTree.ElementTree(root).write(xmlfile)
+
+    roi = ROIModel(catalogs=[xmlfile], skydir=skydir, src_radius=5.0)
+    srcs = roi.point_sources
+    store = roi.source_store
+    assert len(srcs) == len(radec)
+    for k in ['offset', 'offset_ra', 'offset_dec',
+              'offset_glon', 'offset_glat']:
+        assert_allclose(store[k], [s[k] for s in srcs])
+    assert_allclose(store['offset'],
+                    [skydir.separation(s.skydir).deg for s in srcs],
+                    atol=1E-6)
+
+    src = roi['ptsrc0']
+    src.set_radec(src['ra'] + 0.1, src['dec'] - 0.1)
+    src._set_spatial_width(0.2)
+    assert_allclose(src['SpatialWidth'], 0.2)
+    idx = srcs.index(src)
+    assert_allclose(store['ra'][idx], src['ra'])
+    assert_allclose(store['dec'][idx], src['dec'])
+    assert_allclose(store['glon'][idx], src['glon'])
+
+
 def test_load_2fhl_catalog_fits():
     rm = ROIModel(catalogs=['2FHL'])
     assert len(rm.sources) == 360
@@ -96,6 +96,37 @@ def test_calc_int_flux_sensitivity():
                     rtol=1E-3)
 
 
+@requires_file(galdiff_path)
+def test_calc_flux_sensitivity_batch():
+
+    ltc = LTCube.create_from_obs_time(3.1536E8)
+    c = SkyCoord([10.0, 30.0, 60.0], [10.0, 5.0, -20.0], unit='deg',
+                 frame='galactic')
+    ebins = 10**np.linspace(2.0, 5.0, 8 * 3 + 1)
+
+    gdiff = Map.create_from_fits(galdiff_path)
+    iso = np.loadtxt(os.path.expandvars('$FERMIPY_ROOT/data/iso_P8R2_SOURCE_V6_v06.txt'),
+                     unpack=True)
+    scalc = SensitivityCalc(gdiff, iso, ltc, ebins,
+                            'P8R2_SOURCE_V6', [['FRONT', 'BACK']])
+
+    fn = spectrum.PowerLaw([1E-13, -2.0], scale=1E3)
+    o = scalc.flux_threshold_batch(c, fn, 25.0, 3.0, chunk_size=2)
+    assert o['flux'].shape == (3, 24)
+    for i in range(3):
+        oi = scalc.diff_flux_threshold(c[i], fn, 25.0, 3.0)
+        assert_allclose(o['flux'][i], oi['flux'], rtol=1E-6)
+        assert_allclose(o['npred'][i], oi['npred'], rtol=1E-6)
+
+    o = scalc.flux_threshold_batch(c, fn, 25.0, 3.0, integral=True,
+                                   chunk_size=2)
+    assert o['flux'].shape == (3,)
+    assert o['bins']['flux'].shape == (3, 24)
+    for i in range(3):
+        oi = scalc.int_flux_threshold(c[i], fn, 25.0, 3.0)
+        assert_allclose(o['flux'][i], oi['flux'], rtol=1E-6)
+
+
 @requires_file(galdiff_path)
 def test_flux_sensitivity_script(tmpdir):
 
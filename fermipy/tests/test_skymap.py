@@ -1,5 +1,6 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
+from collections import OrderedDict
 import numpy as np
 from numpy.testing import assert_allclose
 from fermipy.hpx_utils import HPX
@@ -43,3 +44,305 @@ def test_hpx():
     ebins = np.logspace(2, 5, 8)
     hpx1 = HPX(2**3, False, 'GAL', region='DISK(110.,75.,10.)', ebins=ebins)
     assert_allclose(hpx1[hpx1._ipix], np.arange(len(hpx1._ipix)))
+
+
+def interpolate_cube_ref(hpx_map, lon, lat, egy, interp_log=True):
+    """Reference implementation of HpxMap.interpolate for cubes with
+    map_coordinates."""
+    import healpy as hp
+    from scipy.ndimage import map_coordinates
+    from fermipy import utils
+
+    theta = np.pi / 2. - np.radians(lat)
+    phi = np.radians(lon)
+    vals = np.array([hp.get_interp_val(hpx_map.counts[i], theta, phi,
+                                       nest=hpx_map.hpx.nest)
+                     for i in range(len(hpx_map.hpx.evals))])
+    if interp_log:
+        xvals = utils.val_to_pix(np.log(hpx_map.hpx.evals), np.log(egy))
+    else:
+        xvals = utils.val_to_pix(hpx_map.hpx.evals, egy)
+    return map_coordinates(vals.T, [np.arange(len(lon)), xvals], order=1)
+
+
+def test_hpxmap_interpolate():
+    import healpy as hp
+
+    rng = np.random.RandomState(1)
+    ebins = np.logspace(2, 5, 9)
+    lon = rng.uniform(0, 360, 50)
+    lat = rng.uniform(-90, 90, 50)
+    # Include energies below and above the first/last energy plane
+    egy = 10**rng.uniform(1.5, 5.5, 50)
+    theta = np.pi / 2. - np.radians(lat)
+    phi = np.radians(lon)
+
+    for nest in [True, False]:
+        hpx = HPX(16, nest, 'GAL', ebins=ebins)
+        hpx_map = HpxMap(rng.uniform(size=(8, hpx.npix)), hpx)
+
+        vals = np.array([hp.get_interp_val(hpx_map.counts[i], theta, phi,
+                                           nest=nest) for i in range(8)])
+        assert_allclose(hpx_map.interpolate(lon, lat), vals)
+
+        for interp_log in [True, False]:
+            expected = interpolate_cube_ref(hpx_map, lon, lat, egy,
+                                            interp_log)
+            v = hpx_map.interpolate(lon, lat, egy, interp_log=interp_log)
+            assert_allclose(v, expected, atol=1E-12)
+
+        # Out of range energies are clamped to the first/last plane
+        m0 = egy < hpx.evals[0]
+        m1 = egy > hpx.evals[-1]
+        assert np.any(m0) and np.any(m1)
+        v = hpx_map.interpolate(lon, lat, egy)
+        assert_allclose(v[m0], vals[0, m0])
+        assert_allclose(v[m1], vals[-1, m1])
+
+        # Repeated evaluation reuses the cached interpolator
+        fn = hpx_map.get_interpolator(lon, lat, egy, interp_log=True)
+        assert fn is hpx_map.get_interpolator(lon, lat, egy, interp_log=True)
+        expected = interpolate_cube_ref(hpx_map, lon, lat, egy)
+        assert_allclose(fn(2.0 * hpx_map.counts), 2.0 * expected, atol=1E-12)
+
+
+def test_hpxmap_swap_scheme():
+
+    import healpy as hp
+    rs = np.random.RandomState(1)
+    for nest in [True, False]:
+        hpx = HPX(16, nest, 'GAL', ebins=np.logspace(2, 5, 4))
+        data = rs.uniform(size=(3, hpx.npix))
+        m = HpxMap(data, hpx).swap_scheme()
+        assert m.hpx.nest != nest
+        for i in range(3):
+            assert_allclose(m.counts[i], hp.reorder(data[i], n2r=nest,
+                                                    r2n=not nest))
+
+        m32 = HpxMap(data, hpx).swap_scheme(dtype=np.float32)
+        assert m32.counts.dtype == np.float32
+        assert_allclose(m32.counts, m.counts, rtol=1E-6)
+
+
+def test_index_cache(monkeypatch):
+
+    from fermipy import hpx_utils
+    monkeypatch.setattr(hpx_utils, '_index_cache', OrderedDict())
+    nbytes = hpx_utils.get_reorder_index(16, True).nbytes
+    monkeypatch.setattr(hpx_utils, '_index_cache_max_bytes', 2 * nbytes)
+
+    # The least recently used maps are dropped to bound the total size
+    idx = hpx_utils.get_reorder_index(16, True)
+    assert hpx_utils.get_reorder_index(16, True) is idx
+    hpx_utils.get_reorder_index(16, False)
+    hpx_utils.get_reorder_index(8, True)
+    assert list(hpx_utils._index_cache.keys()) == [('reorder', 16, False),
+                                                   ('reorder', 8, True)]
+    assert hpx_utils.get_reorder_index(16, True) is not idx
+
+    # Maps larger than the limit are not cached
+    hpx_utils.get_reorder_index(32, True)
+    assert ('reorder', 32, True) not in hpx_utils._index_cache
+    assert sum(v.nbytes for v in hpx_utils._index_cache.values()) <= \
+        2 * nbytes
+
+
+def test_hpxmap_ud_grade():
+
+    import healpy as hp
+    rs = np.random.RandomState(2)
+    for nest, order, preserve_counts in [(True, 2, False), (True, 5, True),
+                                         (False, 2, True), (False, 5, False)]:
+        hpx = HPX(8, nest, 'GAL', ebins=np.logspace(2, 5, 4))
+        data = rs.uniform(size=(3, hpx.npix))
+        m = HpxMap(data, hpx).ud_grade(order, preserve_counts=preserve_counts)
+        assert m.hpx.nside == 2**order
+        power = -2 if preserve_counts else 0
+        ordering = 'NESTED' if nest else 'RING'
+        for i in range(3):
+            assert_allclose(m.counts[i],
+                            hp.ud_grade(data[i], 2**order, power=power,
+                                        order_in=ordering,
+                                        order_out=ordering))
+        if preserve_counts:
+            assert_allclose(np.sum(m.counts), np.sum(data))
+
+        m32 = HpxMap(data, hpx).ud_grade(order, dtype=np.float32,
+                                         preserve_counts=preserve_counts)
+        assert m32.counts.dtype == np.float32
+        assert_allclose(m32.counts, m.counts, rtol=1E-5)
+
+    # Integer maps are promoted to float64
+    for nest, order, preserve_counts in [(True, 2, True), (False, 2, False),
+                                         (True, 4, True), (False, 4, False)]:
+        hpx = HPX(8, nest, 'GAL', ebins=np.logspace(2, 5, 4))
+        data = rs.poisson(3.0, size=(3, hpx.npix))
+        m = HpxMap(data, hpx).ud_grade(order, preserve_counts=preserve_counts)
+        assert m.counts.dtype == np.float64
+        power = -2 if preserve_counts else 0
+        ordering = 'NESTED' if nest else 'RING'
+        for i in range(3):
+            assert_allclose(m.counts[i],
+                            hp.ud_grade(data[i].astype(float), 2**order,
+                                        power=power, order_in=ordering,
+                                        order_out=ordering))
+
+    hpx = HPX(32, True, 'GAL', region='DISK(110.,75.,10.)',
+              ebins=np.logspace(2, 5, 4))
+    data = rs.poisson(3.0, size=(3, hpx.npix))
+    m = HpxMap(data, hpx).ud_grade(3, preserve_counts=True)
+    assert m.counts.dtype == np.float64
+    assert_allclose(m.counts, HpxMap(data.astype(float), hpx).ud_grade(
+        3, preserve_counts=True).counts)
+
+
+def test_hpxmap_sparse_io(tmpdir):
+
+    from astropy.io import fits
+    ebins = np.logspace(2, 5, 4)
+    hpx = HPX(64, False, 'GAL', region='DISK(110.,75.,5.)', ebins=ebins)
+    assert hpx.npix == len(hpx.ipix) < hpx.maxpix
+    data = np.random.RandomState(3).uniform(size=(3, hpx.npix))
+
+    hdu = HpxMap(data, hpx).create_image_hdu('SKYMAP')
+    assert hdu.header['INDXSCHM'] == 'EXPLICIT'
+    assert hdu.columns.names[0] == 'PIX'
+    filename = str(tmpdir / 'test_hpx_sparse.fits')
+    fits.HDUList([fits.PrimaryHDU(), hdu,
+                  hpx.make_energy_bounds_hdu()]).writeto(filename)
+
+    m = HpxMap.create_from_fits(filename)
+    assert_allclose(m.hpx.ipix, hpx.ipix)
+    assert_allclose(m.counts, data)
+
+    # Explicit pixels in arbitrary order
+    ipix = hpx.ipix[::-1]
+    hpx1 = HPX(64, False, 'GAL', ipix=ipix)
+    assert_allclose(hpx1[ipix], np.arange(len(ipix)))
+    assert_allclose(hpx1[np.array([0, ipix[3]])], [-1, 3])
+
+    lon, lat = np.array([110., 200.]), np.array([75., -10.])
+    vals = HpxMap(data, hpx).get_map_values(lon, lat)
+    vals_allsky = HpxMap(data, hpx).to_allsky().get_map_values(lon, lat)
+    assert_allclose(vals[:, 0], vals_allsky[:, 0])
+    assert np.all(np.isnan(vals[:, 1]))
+
+
+def test_hpxmap_sparse_ud_grade():
+
+    import healpy as hp
+    rs = np.random.RandomState(4)
+    for nest, order, preserve_counts in [(True, 3, False), (True, 6, True),
+                                         (False, 3, True), (False, 6, False)]:
+        hpx = HPX(32, nest, 'GAL', region='DISK(110.,75.,10.)',
+                  ebins=np.logspace(2, 5, 4))
+        data = rs.uniform(size=(3, hpx.npix))
+        m = HpxMap(data, hpx).ud_grade(order, preserve_counts=preserve_counts)
+        assert m.hpx.nside == 2**order
+        assert m.counts.shape == (3, m.hpx.npix)
+
+        power = -2 if preserve_counts else 0
+        ordering = 'NESTED' if nest else 'RING'
+        allsky = HpxMap(data, hpx).to_allsky(hp.UNSEEN).counts
+        for i in range(3):
+            v = hp.ud_grade(allsky[i], 2**order, power=power,
+                            order_in=ordering, order_out=ordering)
+            assert_allclose(m.counts[i], v[m.hpx.ipix])
+            assert_allclose(np.where(np.abs(v) < 1E20)[0], m.hpx.ipix)
+
+        m1 = HpxMap(data, hpx).swap_scheme()
+        m2 = HpxMap(allsky, HPX(32, nest, 'GAL')).swap_scheme()
+        assert_allclose(m1.counts, m2.counts[:, m1.hpx.ipix])
+
+
+def test_hpxmap_sparse_arithmetic():
+
+    hpx0 = HPX(32, True, 'GAL', region='DISK(110.,75.,10.)')
+    hpx1 = HPX(32, True, 'GAL', region='DISK(115.,70.,10.)')
+    m0 = HpxMap(np.ones(hpx0.npix), hpx0)
+    m1 = HpxMap(2.0 * np.ones(hpx1.npix), hpx1)
+
+    m = m0 + m1
+    assert_allclose(m.hpx.ipix, np.union1d(hpx0.ipix, hpx1.ipix))
+    expected = (np.in1d(m.hpx.ipix, hpx0.ipix) +
+                2.0 * np.in1d(m.hpx.ipix, hpx1.ipix))
+    assert_allclose(m.counts, expected)
+    assert_allclose((m0 * 3.0).counts, 3.0)
+    assert_allclose((m0 - m0).counts, 0.0)
+
+    m = m0 + HpxMap(np.ones(hpx0.maxpix), HPX(32, True, 'GAL'))
+    assert m.hpx.is_allsky
+    assert_allclose(m.counts[hpx0.ipix], 2.0)
+    assert_allclose(np.sum(m.counts), hpx0.maxpix + hpx0.npix)
+
+    # Products and ratios are evaluated on the intersection
+    ipix = np.intersect1d(hpx0.ipix, hpx1.ipix)
+    for m in [m0 * m1, m1 * m0, m0 / m1]:
+        assert_allclose(m.hpx.ipix, ipix)
+    assert_allclose((m0 * m1).counts, 2.0)
+    assert_allclose((m1 / m0).counts, 2.0)
+    assert_allclose((m0 / m1).counts, 0.5)
+
+    m2 = HpxMap(4.0 * np.ones(hpx0.maxpix), HPX(32, True, 'GAL'))
+    for m in [m0 * m2, m2 * m0]:
+        assert_allclose(m.hpx.ipix, hpx0.ipix)
+        assert_allclose(m.counts, 4.0)
+    assert_allclose((m2 / m0).counts, 4.0)
+    assert_allclose((m0 / m2).counts, 0.25)
+
+    # Scalars and arrays on the left-hand side
+    for m in [3.0 * m0, np.float64(3.0) * m0, np.full(hpx0.npix, 3.0) * m0,
+              2.0 + m0, 4.0 - m0, 3.0 / m0]:
+        assert isinstance(m, HpxMap)
+        assert_allclose(m.hpx.ipix, hpx0.ipix)
+        assert_allclose(m.counts, 3.0)
+
+    m = sum([m0, m1, m0])
+    assert isinstance(m, HpxMap)
+    assert_allclose(m.hpx.ipix, np.union1d(hpx0.ipix, hpx1.ipix))
+    assert_allclose(m.counts, 2.0 * np.in1d(m.hpx.ipix, hpx0.ipix) +
+                    2.0 * np.in1d(m.hpx.ipix, hpx1.ipix))
+
+
+def interpolate_map_ref(m, lon, lat, egy=None):
+    """Reference implementation of Map.interpolate with
+    RegularGridInterpolator."""
+    from scipy.interpolate import RegularGridInterpolator
+    from fermipy import utils
+
+    if len(m.npix) == 2:
+        pixcrd = m.wcs.wcs_world2pix(lon, lat, 0)
+    else:
+        pixcrd = m.wcs.wcs_world2pix(lon, lat, egy, 0)
+        pixcrd[2] = np.array(utils.val_to_pix(np.log(m._ectr),
+                                              np.log(egy)), ndmin=1)
+    points = [np.linspace(0, n - 1., n) for n in m.npix]
+    fn = RegularGridInterpolator(points, m.counts.T, bounds_error=False,
+                                 fill_value=None)
+    return fn(np.column_stack(pixcrd))
+
+
+def test_map_interpolate():
+    from astropy.coordinates import SkyCoord
+    from fermipy import wcs_utils
+    from fermipy.skymap import Map
+
+    rng = np.random.RandomState(2)
+    skydir = SkyCoord(0.0, 0.0, unit='deg', frame='galactic')
+    ebins = np.logspace(2, 5, 6)
+    lon = rng.uniform(-4.0, 4.0, 40)
+    lat = rng.uniform(-4.0, 4.0, 40)
+    egy = 10**rng.uniform(1.5, 5.5, 40)
+
+    wcs = wcs_utils.create_wcs(skydir, coordsys='GAL', projection='CAR',
+                               cdelt=0.5, crpix=10.5)
+    m = Map(rng.uniform(size=(20, 20)), wcs)
+    assert_allclose(m.interpolate(lon, lat),
+                    interpolate_map_ref(m, lon, lat), atol=1E-12)
+
+    wcs = wcs_utils.create_wcs(skydir, coordsys='GAL', projection='CAR',
+                               cdelt=0.5, crpix=10.5, naxis=3,
+                               energies=ebins)
+    m = Map(rng.uniform(size=(5, 20, 20)), wcs, ebins=ebins)
+    assert_allclose(m.interpolate(lon, lat, egy),
+                    interpolate_map_ref(m, lon, lat, egy), atol=1E-12)
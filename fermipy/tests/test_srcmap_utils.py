@@ -0,0 +1,150 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from astropy.tests.helper import pytest
+from fermipy.srcmap_utils import ModelCountsCache, integrate_srcmap
+
+
+def make_point_source(shape, x0, y0, sigma, norm):
+
+    yy, xx = np.mgrid[:shape[1], :shape[2]]
+    r2 = (xx - x0)**2 + (yy - y0)**2
+    sigma = sigma * np.linspace(2.0, 1.0, shape[0])[:, None, None]
+    return norm * np.exp(-r2[None, :, :] / (2.0 * sigma**2))
+
+
+def test_model_counts_cache():
+
+    shape = (3, 40, 40)
+    cache = ModelCountsCache(shape, threshold=1E-6)
+
+    srcs = {'a': make_point_source(shape, 8.0, 10.0, 1.0, 5.0),
+            'b': make_point_source(shape, 30.0, 25.0, 1.5, 2.0),
+            'c': make_point_source(shape, 20.0, 5.0, 0.8, 1.0),
+            'diffuse': np.ones(shape)}
+
+    for k, v in srcs.items():
+        cache.update(k, 0, v, sparse=(k != 'diffuse'))
+
+    # Point sources are stored within a box around the source in each
+    # energy plane
+    _, ipix, vals = cache.get('a')
+    assert len(ipix) == len(vals) == 3
+    for t, x in zip(ipix, vals):
+        assert x.shape == t.shape
+        assert len(t) < 0.3 * 40 * 40
+        iy, ix = np.unravel_index(t, shape[1:])
+        assert np.min(ix) <= 8 <= np.max(ix)
+        assert len(t) == ((np.max(ix) - np.min(ix) + 1) *
+                          (np.max(iy) - np.min(iy) + 1))
+    assert len(ipix[2]) < len(ipix[0])
+    assert cache.get('diffuse')[1] is None
+    assert cache.get('a', 1) is None
+
+    names = list(srcs.keys())
+    for sel in [names, ['a'], ['a', 'b', 'diffuse'], ['b', 'c']]:
+        v = sum([srcs[k] for k in sel])
+        assert_allclose(cache.model_counts(sel), v, atol=1E-5)
+
+    # Update a source and check the running total
+    srcs['b'] = 3.0 * srcs['b']
+    cache.update('b', 1, srcs['b'])
+    v = sum([srcs[k] for k in ['a', 'b', 'diffuse']])
+    assert_allclose(cache.model_counts(['a', 'b', 'diffuse']), v, atol=1E-5)
+
+    cache.remove('a')
+    assert 'a' not in cache.names
+    assert_allclose(cache.model_counts(['b', 'c', 'diffuse']),
+                    srcs['b'] + srcs['c'] + srcs['diffuse'], atol=1E-5)
+    with pytest.raises(Exception):
+        cache.model_counts(['a'])
+
+
+def test_model_counts_cache_hpx():
+
+    shape = (2, 100)
+    cache = ModelCountsCache(shape, threshold=0.0)
+    v = np.zeros(shape)
+    v[:, [3, 50, 51]] = [[1.0, 2.0, 3.0], [0.5, 0.0, 1.0]]
+    cache.update('a', 0, v)
+    ipix = cache.get('a')[1]
+    assert_array_equal(ipix[0], [3, 50, 51])
+    assert_array_equal(ipix[1], [3, 51])
+    cache.update('b', 0, np.ones(shape), sparse=False)
+    assert_array_equal(cache.model_counts(['a']), v)
+    assert_array_equal(cache.model_counts(['a', 'b']), v + 1.0)
+
+
+
+def test_model_counts_cache_truncation():
+
+    shape = (4, 60, 60)
+    threshold = 1E-3
+    cache = ModelCountsCache(shape, threshold=threshold)
+
+    srcs = {'a': make_point_source(shape, 20.0, 25.0, 1.5, 5.0),
+            'b': make_point_source(shape, 40.0, 30.0, 2.0, 2.0),
+            'c': make_point_source(shape, 30.0, 30.0, 1.0, 1.0)}
+    # Power-law tails extending over the full map
+    yy, xx = np.mgrid[:shape[1], :shape[2]]
+    srcs['c'] += 1E-3 / (1.0 + (xx - 30.0)**2 + (yy - 30.0)**2)
+
+    for k, v in srcs.items():
+        assert cache.update(k, 0, v)
+        ipix = cache.get(k)[1]
+        assert sum([len(t) for t in ipix]) < 0.5 * np.prod(shape)
+
+    # The neglected model counts of each energy plane are bounded by
+    # the threshold
+    names = list(srcs.keys())
+    for sel in [names, ['a'], ['a', 'c'], ['b', 'c']]:
+        v = sum([srcs[k] for k in sel])
+        z = cache.model_counts(sel)
+        assert np.all(z >= 0.0)
+        assert np.all(np.sum(np.abs(z - v), axis=(1, 2)) <=
+                      threshold * np.sum(v, axis=(1, 2)))
+
+    # A point source covering most of the map is not cached
+    assert not cache.update('d', 0, np.ones(shape))
+    assert 'd' not in cache.names
+    assert cache.update('d', 0, np.ones(shape), sparse=False)
+    assert cache.get('d')[1] is None
+    assert_allclose(cache.model_counts(['a', 'd']), srcs['a'] + 1.0,
+                    atol=threshold * np.max(srcs['a']))
+
+def pixel_counts(emin, emax, y1, y2):
+    """Integral of a power law through (emin, y1) and (emax, y2) or
+    of a straight line if y1 or y2 is zero."""
+
+    if y1 > 0 and y2 > 0:
+        gam = np.log(y2 / y1) / np.log(emax / emin)
+        if gam == -1:
+            return y1 * emin * np.log(emax / emin)
+        return y1 / (gam + 1) * (emax * (emax / emin)**gam - emin)
+    return 0.5 * (y1 + y2) * (emax - emin)
+
+
+def test_integrate_srcmap():
+
+    rs = np.random.RandomState(1)
+    energies = np.logspace(2.0, 4.0, 6)
+    dnde = 1E-10 * (energies / 1E3)**-2.2
+    srcmap = rs.uniform(0.5, 2.0, (len(energies), 4, 5))
+    srcmap[2, 0, :] = 0.0
+    srcmap[:, 1, 0] = energies  # product is proportional to E^-1.2
+    srcmap[:, 1, 1] = 1.0 / dnde  # product is constant
+
+    counts = integrate_srcmap(srcmap, energies, dnde)
+    assert counts.shape == (len(energies) - 1, 4, 5)
+    y = srcmap * dnde[:, None, None]
+    for idx in np.ndindex(counts.shape):
+        i, j, k = idx
+        assert_allclose(counts[idx],
+                        pixel_counts(energies[i], energies[i + 1],
+                                     y[i, j, k], y[i + 1, j, k]),
+                        rtol=1E-10)
+
+    assert_allclose(counts[:, 1, 1], energies[1:] - energies[:-1])
+    assert_allclose(counts[1, 0, :], 0.5 * y[1, 0, :] *
+                    (energies[2] - energies[1]))
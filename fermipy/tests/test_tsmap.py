@@ -0,0 +1,90 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.optimize import minimize_scalar
+from fermipy.tests.utils import requires_dependency
+
+try:
+    from fermipy import tsmap
+except ImportError:
+    pass
+
+# Skip tests in this file if Fermi ST aren't available
+pytestmark = requires_dependency('Fermi ST')
+
+
+def make_cube_data(npix, seed):
+    """Create counts, background and test source kernels for two
+    components with four and two energy planes."""
+
+    rs = np.random.RandomState(seed)
+    ebin_index = [np.array([0, 1, 2, 3]), np.array([2, 3])]
+    x = np.arange(-3, 4)
+    k = np.exp(-0.5 * (x[:, None]**2 + x[None, :]**2) / 1.5)
+    counts, bkg, model = [], [], []
+    for eidx in ebin_index:
+        mm = np.array([k * (i + 1) for i in range(len(eidx))])
+        b = rs.uniform(0.5, 2.0, (len(eidx), npix, npix))
+        mu = b.copy()
+        mu[:, 4:11, 6:13] += 0.7 * mm
+        counts += [rs.poisson(mu).astype(float)]
+        bkg += [b]
+        model += [mm]
+    return counts, bkg, model, ebin_index
+
+
+def loglike(norm, pos, counts, bkg, model, ebin_index, ebins=None):
+
+    ix, iy = pos
+    v = 0.0
+    for c, b, mm, eidx in zip(counts, bkg, model, ebin_index):
+        for i, ie in enumerate(eidx):
+            if ebins is not None and ie not in ebins:
+                continue
+            s = (i, slice(max(ix - 3, 0), ix + 4), slice(max(iy - 3, 0), iy + 4))
+            m = mm[i, max(3 - ix, 0):, max(3 - iy, 0):]
+            m = m[:c[s].shape[0], :c[s].shape[1]]
+            mu = b[s] + norm * m
+            v += np.sum(c[s] * np.log(mu)) - np.sum(mu)
+    return v
+
+
+def test_ts_cube_value():
+
+    npix = 15
+    counts, bkg, model, ebin_index = make_cube_data(npix, 3)
+    args = (counts, bkg, model, ebin_index)
+
+    for pos in [(7, 9), (1, 0), (14, 13)]:
+
+        p = [[len(t) // 2, pos[0], pos[1]] for t in ebin_index]
+        o = tsmap._ts_cube_value(p, counts, bkg, model, ebin_index, 4,
+                                 tol=1E-8, nnorm=6)
+
+        r = minimize_scalar(lambda x: -loglike(x, pos, *args),
+                            bounds=(0.0, 50.0), method='bounded',
+                            options={'xatol': 1E-9})
+        ts = 2.0 * (loglike(r.x, pos, *args) - loglike(0.0, pos, *args))
+        assert_allclose(o['fit_norm'], r.x, atol=1E-4)
+        assert_allclose(o['fit_ts'], max(ts, 0.0), atol=1E-5)
+
+        for ie in range(4):
+            r = minimize_scalar(lambda x: -loglike(x, pos, *args, ebins=[ie]),
+                                bounds=(0.0, 50.0), method='bounded',
+                                options={'xatol': 1E-9})
+            assert_allclose(o['norm'][ie], r.x, atol=1E-3)
+
+            l0 = loglike(o['norm'][ie], pos, *args, ebins=[ie])
+            dloglike = [loglike(x, pos, *args, ebins=[ie]) - l0
+                        for x in o['norm_scan'][ie]]
+            assert_allclose(o['loglike'][ie], l0)
+            assert_allclose(o['dloglike_scan'][ie], dloglike, atol=1E-6)
+            assert np.all(o['dloglike_scan'][ie] <= 1E-8)
+
+    blocks = [[[[len(t) // 2, i, j] for t in ebin_index]
+               for j in range(npix)] for i in range(npix)]
+    data = tsmap._ts_cube_block(blocks[7], counts, bkg, model,
+                                ebin_index, 4, nnorm=6)
+    assert data['norm_scan'].shape == (npix, 4, 6)
+    assert data['fit_ts'][9] > 25.0
@@ -0,0 +1,62 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import os
+import numpy as np
+import pytest
+from numpy.testing import assert_allclose
+from fermipy import utils
+
+
+def test_snap_to_points():
+
+    xvals = np.linspace(0.0, 10.0, 11)
+    xpts = [0.0, 2.3, 2.4, 5.6, 9.95, 20.0]
+    x = utils.snap_to_points(xvals, xpts)
+
+    assert_allclose(x, [0.0, 1.0, 2.3, 3.0, 4.0, 5.0,
+                        5.6, 7.0, 8.0, 9.0, 9.95])
+    assert np.all(np.diff(x) > 0)
+
+    # Points outside the tolerance are left unchanged
+    x = utils.snap_to_points(xvals, [2.5, 7.5], tol=0.4)
+    assert_allclose(x, xvals)
+
+
+def _pool_map_fn(x, offset, scale):
+    if x < 0:
+        raise ValueError('negative argument')
+    return scale(x) + offset
+
+
+def _pool_map_pid(x, offset):
+    return os.getpid() + offset
+
+
+def test_pool_map():
+
+    # The state is inherited by the workers and need not be picklable
+    state = dict(offset=np.arange(3), scale=lambda x: 2 * x)
+    results = utils.pool_map(_pool_map_fn, [1, 2, 3], nthread=2,
+                             state=state)
+    assert_allclose(np.array(results),
+                    [[2, 3, 4], [4, 5, 6], [6, 7, 8]])
+    assert utils._worker_state == {}
+
+    with pytest.raises(ValueError):
+        utils.pool_map(_pool_map_fn, [1, -1], nthread=2, state=state)
+    assert utils._worker_state == {}
+
+
+@pytest.mark.parametrize('nthread', [1, 2])
+def test_pool_map_serial(monkeypatch, nthread):
+
+    # Without fork the elements are evaluated in the calling process
+    monkeypatch.setattr(utils, '_fork_available', lambda: False)
+    pids = utils.pool_map(_pool_map_pid, [1, 2, 3], nthread=nthread,
+                          state=dict(offset=1))
+    assert pids == [os.getpid() + 1] * 3
+    assert utils._worker_state == {}
+
+    with pytest.raises(ValueError):
+        utils.pool_map(_pool_map_fn, [1, -1], nthread=nthread,
+                       state=dict(offset=0, scale=lambda x: x))
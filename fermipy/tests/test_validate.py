@@ -0,0 +1,103 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import itertools
+import numpy as np
+from numpy.testing import assert_array_equal
+from astropy.table import Table
+from astropy.coordinates import SkyCoord
+from fermipy import utils
+from fermipy.validate.tools import AGNValidator, decode_bits, hist_index
+
+
+def make_events(nevt, seed):
+
+    rs = np.random.RandomState(seed)
+    evclass = rs.uniform(size=(nevt, 32)) < 0.3
+    evtype = rs.uniform(size=(nevt, 32)) < 0.2
+    return {'ENERGY': 10**rs.uniform(1.5, 5.5, nevt),
+            'RA': rs.uniform(0.0, 40.0, nevt),
+            'DEC': rs.uniform(-20.0, 20.0, nevt),
+            'PtRaz': rs.uniform(0.0, 40.0, nevt),
+            'PtDecz': rs.uniform(-20.0, 20.0, nevt),
+            'EVENT_CLASS': evclass,
+            'EVENT_TYPE': evtype}
+
+
+def fill_dense(val, evts, src_dirs):
+    """Reference implementation that evaluates all source/event pairs
+    and fills each histogram bin by bin."""
+
+    evt_dirs = SkyCoord(evts['RA'], evts['DEC'], unit='deg')
+    lat_dirs = SkyCoord(evts['PtRaz'], evts['PtDecz'], unit='deg')
+    sep = evt_dirs.separation(src_dirs[:, None]).deg.ravel()
+    ctheta = np.cos(lat_dirs.separation(src_dirs[:, None]).rad).ravel()
+    ievt = np.tile(np.arange(len(evt_dirs)), len(src_dirs))
+    ebin = utils.val_to_bin(val._energy_bins, evts['ENERGY'][ievt])
+    xsep = sep / val._psf_scale[np.clip(ebin, 0, 39)]
+    m = (xsep < 1.0) | (sep < 4.0)
+    ievt, sep, xsep, ctheta = ievt[m], sep[m], xsep[m], ctheta[m]
+
+    evclass = evts['EVENT_CLASS'][ievt][:, ::-1]
+    evtype = evts['EVENT_TYPE'][ievt][:, ::-1]
+    energy = evts['ENERGY'][ievt]
+    mon, moff = val.create_onoff_mask(sep, None)
+
+    hists = {}
+    for m, lbl in zip([mon, moff], ['on', 'off']):
+        for fill_sep, fill_evtype in itertools.product([False, True],
+                                                       [False, True]):
+            vals = [energy[m], ctheta[m]]
+            bins = [val._energy_bins, val._ctheta_bins]
+            if fill_sep:
+                vals += [xsep[m]]
+                bins += [val._xsep_bins]
+            nbit = [16, 16] if fill_evtype else [16]
+            h = np.zeros(nbit + [len(b) - 1 for b in bins])
+            for t in itertools.product(*[range(16)] * len(nbit)):
+                mt = evclass[m][:, t[0]].copy()
+                if fill_evtype:
+                    mt &= evtype[m][:, t[1]]
+                h[t] = np.histogramdd(np.vstack(vals).T[mt], bins=bins)[0]
+            k = '%s%s_%s' % ('evtype' if fill_evtype else 'evclass',
+                             '_psf' if fill_sep else '', lbl)
+            hists[k] = h
+    return hists
+
+
+def test_validate_decode_bits():
+
+    bits = np.zeros((3, 32), dtype=bool)
+    bits[0, 31] = True
+    bits[1, 31 - 7] = True
+    bits[2, [0, 31 - 4]] = True
+    v = decode_bits(bits)
+    assert_array_equal(v, [1, 128, 2**31 + 16])
+    assert_array_equal(decode_bits(np.packbits(bits, axis=1)), v)
+    assert_array_equal(decode_bits(np.array([3, 5])), [3, 5])
+
+
+def test_validate_hist_index():
+
+    edges = np.array([0.0, 1.0, 2.0])
+    assert_array_equal(hist_index(edges, np.array([-1., 0., 0.5, 1.0, 2.0,
+                                                   2.5])),
+                       [-1, 0, 0, 1, 1, -1])
+
+
+def test_validate_fill(tmpdir):
+
+    scfile = str(tmpdir.join('ft2.fits'))
+    Table({'START': [0.0], 'STOP': [1.0]}).write(scfile)
+
+    evts = make_events(3000, 1)
+    src_dirs = SkyCoord([10.0, 12.0, 30.0], [0.0, 1.0, -5.0], unit='deg')
+
+    val = AGNValidator(scfile, 100., chunk_size=700)
+    val._src_xyz = utils.angle_to_cartesian(src_dirs.ra.rad,
+                                            src_dirs.dec.rad)
+    val.load_events(evts)
+
+    hists = fill_dense(val, evts, src_dirs)
+    for k, v in hists.items():
+        assert np.sum(v) > 0
+        assert_array_equal(val.hists[k], v)
@@ -9,7 +9,6 @@ import json
 from multiprocessing import Pool
 import numpy as np
 import warnings
-import pyLikelihood as pyLike
 from scipy.optimize import brentq
 import astropy
 from astropy.io import fits
@@ -18,14 +17,16 @@ import astropy.wcs as pywcs
 import fermipy.utils as utils
 import fermipy.wcs_utils as wcs_utils
 import fermipy.fits_utils as fits_utils
-import fermipy.plotting as plotting
 import fermipy.castro as castro
 from fermipy.skymap import Map
 from fermipy.roi_model import Source
 from fermipy.spectrum import PowerLaw
 from fermipy.config import ConfigSchema
 from fermipy.timing import Timer
-from LikelihoodState import LikelihoodState
+from fermipy.lazy_import import LazyModule
+
+pyLike = LazyModule('pyLikelihood')
+gtutils = LazyModule('fermipy.gtutils')
 
 MAX_NITER = 100
 
@@ -641,10 +642,227 @@ def _ts_value_newton(position, counts, bkg, model, C_0_map):
     return (C_0 - C_1) * np.sign(amplitude), amplitude, niter
 
 
+def _loglike_norm_scan(counts, bkg, model, norms):
+    """Evaluate the Poisson log-likelihood of a set of energy bins for
+    a grid of test source normalizations.
+
+    Parameters
+    ----------
+    counts, bkg, model : `~numpy.ndarray`
+        Counts, background and test source model with shape (nbin,
+        npix).  Bins may be padded with pixels for which all three
+        arrays are zero.
+
+    norms : `~numpy.ndarray`
+        Normalizations with shape (nbin, nnorm).
+
+    Returns
+    -------
+    loglike : `~numpy.ndarray`
+        Log-likelihood with shape (nbin, nnorm).
+    """
+    mu = bkg[:, np.newaxis, :] + norms[..., np.newaxis] * \
+        model[:, np.newaxis, :]
+    m = np.broadcast_to(counts[:, np.newaxis, :] > 0, mu.shape)
+    logmu = np.log(mu, out=np.zeros_like(mu), where=m)
+    return np.sum(counts[:, np.newaxis, :] * logmu, axis=2) - np.sum(mu, axis=2)
+
+
+def _fit_norm_newton(counts, bkg, model, tol=1E-4, max_iter=MAX_NITER):
+    """Fit the test source normalization independently in each row of
+    a set of padded (nbin, npix) arrays with the Newton method used
+    by `_fit_amplitude_newton`.  All rows are updated together.
+
+    Returns
+    -------
+    norm : `~numpy.ndarray`
+        Best-fit normalization of each row.
+
+    hess : `~numpy.ndarray`
+        Second derivative of the negative log-likelihood at the
+        best-fit normalization.
+
+    status : `~numpy.ndarray`
+        Fit status of each row (0 = converged, 1 = maximum number of
+        iterations reached).
+    """
+    nbin = counts.shape[0]
+    norm = np.zeros(nbin)
+    status = np.zeros(nbin, dtype=int)
+    msum = np.sum(model, axis=1)
+    m = counts > 0
+    active = np.arange(nbin)
+
+    for iiter in range(max_iter):
+
+        if not len(active):
+            break
+
+        c, mm, mdl = counts[active], m[active], model[active]
+        mu = bkg[active] + norm[active, np.newaxis] * mdl
+        w = np.divide(c, mu, out=np.zeros_like(mu), where=mm)
+        grad = msum[active] - np.sum(w * mdl, axis=1)
+        hess = np.sum(np.divide(w, mu, out=np.zeros_like(mu),
+                                where=mm) * mdl**2, axis=1)
+
+        # Rows with a positive gradient at zero have norm = 0
+        if iiter == 0:
+            keep = grad <= 0
+            active, grad, hess = active[keep], grad[keep], hess[keep]
+
+        delta = np.divide(grad, hess, out=np.zeros_like(grad),
+                          where=hess > 0)
+        norm[active] = np.maximum(0.0, norm[active] - delta)
+        active = active[delta * grad >= tol]
+
+    status[active] = 1
+    mu = bkg + norm[:, np.newaxis] * model
+    w = np.divide(counts, mu**2, out=np.zeros_like(mu), where=m)
+    hess = np.sum(w * model**2, axis=1)
+    return norm, hess, status
+
+
+def _norm_scan_max(norm, hess, msum, norm_sigma):
+    """Upper edge of the normalization scan.  This is ``norm_sigma``
+    standard deviations above the best-fit normalization or, for bins
+    without counts, the normalization at which the log-likelihood
+    decreases by norm_sigma**2/2."""
+    nmax = np.ones_like(norm)
+    m = hess > 0
+    nmax[m] = norm[m] + norm_sigma / np.sqrt(hess[m])
+    m = ~m & (msum > 0)
+    nmax[m] = 0.5 * norm_sigma**2 / msum[m]
+    return nmax
+
+
+def _ts_cube_value(position, counts, bkg, model, ebin_index, nebin,
+                   **kwargs):
+    """Compute the global and energy bin-by-bin fit of the test source
+    normalization at a given pixel position.  The background model is
+    held fixed.
+
+    Parameters
+    ----------
+    position : list
+        Pixel position in each component.
+
+    counts, bkg, model : list
+        Counts, background and test source kernel of each component.
+
+    ebin_index : list
+        Index of the analysis energy bin of each plane of each
+        component.
+
+    nebin : int
+        Number of analysis energy bins.
+
+    Returns
+    -------
+    o : dict
+        Dictionary with the global TS, normalization and error
+        (``fit_ts``, ``fit_norm``, ``fit_norm_err``, ``fit_status``)
+        and the bin-by-bin TS, normalization, error, 95% CL upper
+        limit, status and likelihood scans (``ts``, ``norm``,
+        ``norm_err``, ``norm_ul``, ``bin_status``, ``loglike``,
+        ``norm_scan``, ``dloglike_scan``).  Errors and upper limits
+        use the parabolic approximation of the log-likelihood.
+    """
+    nnorm = kwargs.get('nnorm', 10)
+    norm_sigma = kwargs.get('norm_sigma', 5.0)
+    tol = kwargs.get('tol', 1E-3)
+    max_iter = kwargs.get('max_iter', 30)
+    do_sed = kwargs.get('do_sed', True)
+
+    extract_fn = _collect_wrapper(extract_large_array)
+    truncate_fn = _collect_wrapper(extract_small_array)
+
+    counts_slice = extract_fn(counts, model, position)
+    bkg_slice = extract_fn(bkg, model, position)
+    model_slice = truncate_fn(model, counts, position)
+
+    # Gather the pixels of every analysis energy bin into padded arrays
+    pix = [[] for i in range(nebin)]
+    for cs, bs, ms, eidx in zip(counts_slice, bkg_slice, model_slice,
+                                ebin_index):
+        for j, ie in enumerate(eidx):
+            pix[ie] += [np.vstack((cs[j].ravel(), bs[j].ravel(),
+                                   ms[j].ravel()))]
+    pix = [np.hstack(t) if t else np.zeros((3, 0)) for t in pix]
+    npix = max([t.shape[1] for t in pix])
+    data = np.zeros((3, nebin, npix))
+    for i, t in enumerate(pix):
+        data[:, i, :t.shape[1]] = t
+    c, b, m = data
+
+    # Global fit
+    gc, gb, gm = c.reshape(1, -1), b.reshape(1, -1), m.reshape(1, -1)
+    norm, hess, status = _fit_norm_newton(gc, gb, gm, tol, max_iter)
+    loglike = _loglike_norm_scan(gc, gb, gm,
+                                 np.array([[0.0, norm[0]]]))[0]
+    o = {'fit_ts': 2.0 * (loglike[1] - loglike[0]),
+         'fit_norm': norm[0],
+         'fit_norm_err': 1.0 / np.sqrt(hess[0]) if hess[0] > 0 else np.nan,
+         'fit_status': status[0],
+         'fit_loglike': loglike[1]}
+
+    if not do_sed:
+        for k in ['ts', 'norm', 'norm_err', 'norm_ul', 'loglike']:
+            o[k] = np.zeros(nebin)
+        o['bin_status'] = np.zeros(nebin, dtype=int)
+        o['norm_scan'] = np.zeros((nebin, nnorm))
+        o['dloglike_scan'] = np.zeros((nebin, nnorm))
+        return o
+
+    # Bin-by-bin fits and likelihood scans
+    norm, hess, status = _fit_norm_newton(c, b, m, tol, max_iter)
+    msum = np.sum(m, axis=1)
+    nmax = _norm_scan_max(norm, hess, msum, norm_sigma)
+    norm_scan = np.linspace(0.0, 1.0, nnorm)[np.newaxis, :] * \
+        nmax[:, np.newaxis]
+    loglike = _loglike_norm_scan(c, b, m, np.hstack((np.zeros((nebin, 1)),
+                                                     norm[:, np.newaxis],
+                                                     norm_scan)))
+    norm_err = np.full(nebin, np.nan)
+    norm_err[hess > 0] = 1.0 / np.sqrt(hess[hess > 0])
+
+    o['ts'] = 2.0 * (loglike[:, 1] - loglike[:, 0])
+    o['norm'] = norm
+    o['norm_err'] = norm_err
+    o['norm_ul'] = _norm_scan_max(norm, hess, msum, np.sqrt(2.71))
+    o['bin_status'] = status
+    o['loglike'] = loglike[:, 1]
+    o['norm_scan'] = norm_scan
+    o['dloglike_scan'] = loglike[:, 2:] - loglike[:, 1:2]
+    return o
+
+
+def _ts_cube_block(positions, counts, bkg, model, ebin_index, nebin,
+                   **kwargs):
+    """Evaluate `_ts_cube_value` for a block of pixel positions and
+    stack the results."""
+    results = [_ts_cube_value(p, counts, bkg, model, ebin_index, nebin,
+                              **kwargs) for p in positions]
+    return {k: np.array([r[k] for r in results]) for k in results[0].keys()}
+
+
+def _copy_testsource_templates(tmpl):
+    """Return a copy of a cached test source template dictionary.  The
+    lists are copied such that the cache entry cannot be modified
+    through the returned dictionary while the read-only kernel arrays
+    are shared."""
+    o = dict(tmpl)
+    for k in ['model', 'dpix', 'ebin_index', 'deps']:
+        o[k] = list(tmpl[k])
+    return o
+
+
 class TSMapGenerator(object):
     """Mixin class for `~fermipy.gtanalysis.GTAnalysis` that
     generates TS maps."""
 
+    # Maximum number of test source templates kept in the cache
+    _testsource_cache_size = 8
+
     def tsmap(self, prefix='', **kwargs):
         """Generate a spatial TS map for a source component with
         properties defined by the `model` argument.  The TS map will
@@ -695,11 +913,7 @@ class TSMapGenerator(object):
         o = self._make_tsmap_fast(prefix, **config)
 
         if config['make_plots']:
-            plotter = plotting.AnalysisPlotter(self.config['plotting'],
-                                               fileio=self.config['fileio'],
-                                               logging=self.config['logging'])
-
-            plotter.make_tsmap_plots(o, self.roi)
+            self.plotter.make_tsmap_plots(o, self.roi)
 
         self.logger.log(config['loglevel'], 'Finished TS map')
 
@@ -800,11 +1014,9 @@ class TSMapGenerator(object):
 
         counts = []
         bkg = []
-        model = []
         c0_map = []
         eslices = []
         enumbins = []
-        model_npred = 0
         for c in self.components:
 
             imin = utils.val_to_edge(c.log_energies, loge_bounds[0])[0]
@@ -821,41 +1033,13 @@ class TSMapGenerator(object):
             eslices += [eslice]
             enumbins += [cm.shape[0]]
 
-        self.add_source('tsmap_testsource', src_dict, free=True,
-                        init_source=False, use_single_psf=True,
-                        use_pylike=use_pylike,
-                        loglevel=logging.DEBUG)
-        src = self.roi['tsmap_testsource']
-        # self.logger.info(str(src_dict))
-        modelname = utils.create_model_name(src)
-        for c, eslice in zip(self.components, eslices):
-            mm = c.model_counts_map('tsmap_testsource').counts.astype('float')[
-                eslice, ...]
-            model_npred += np.sum(mm)
-            model += [mm]
-
-        self.delete_source('tsmap_testsource', loglevel=logging.DEBUG)
-
-        for i, mm in enumerate(model):
-
-            dpix = 3
-            for j in range(mm.shape[0]):
-
-                ix, iy = np.unravel_index(
-                    np.argmax(mm[j, ...]), mm[j, ...].shape)
-
-                mx = mm[j, ix, :] > mm[j, ix, iy] * threshold
-                my = mm[j, :, iy] > mm[j, ix, iy] * threshold
-                dpix = max(dpix, np.round(np.sum(mx) / 2.))
-                dpix = max(dpix, np.round(np.sum(my) / 2.))
-
-            if max_kernel_radius is not None and \
-                    dpix > int(max_kernel_radius / self.components[i].binsz):
-                dpix = int(max_kernel_radius / self.components[i].binsz)
-
-            xslice = slice(max(int(xpix - dpix), 0),
-                           min(int(xpix + dpix + 1), self.npix))
-            model[i] = model[i][:, xslice, xslice]
+        tmpl = self._get_testsource_templates(src_dict, eslices, xpix,
+                                              threshold=threshold,
+                                              max_kernel_radius=max_kernel_radius,
+                                              use_pylike=use_pylike)
+        model = tmpl['model']
+        model_npred = tmpl['npred']
+        modelname = tmpl['modelname']
 
         ts_values = np.zeros((self.npix, self.npix))
         amp_values = np.zeros((self.npix, self.npix))
@@ -913,7 +1097,7 @@ class TSMapGenerator(object):
         ts_map = Map(ts_values, map_wcs)
         sqrt_ts_map = Map(ts_values**0.5, map_wcs)
         npred_map = Map(amp_values * model_npred, map_wcs)
-        amp_map = Map(amp_values * src.get_norm(), map_wcs)
+        amp_map = Map(amp_values * tmpl['norm'], map_wcs)
 
         o = {'name': utils.join_strings([prefix, modelname]),
              'src_dict': copy.deepcopy(src_dict),
@@ -928,6 +1112,130 @@ class TSMapGenerator(object):
 
         return o
 
+    def _get_testsource_templates(self, src_dict, eslices, cpix, **kwargs):
+        """Return the model-counts kernels of a test source at the
+        pixel ``cpix`` of each component, cropped to the region
+        where the kernel is larger than ``threshold`` times its peak
+        value.  Kernels are cached on the test source definition, the
+        binning of the components and the PSF and exposure objects of
+        the components such that repeated TS maps with the same test
+        source do not add and delete the source from the likelihood.
+
+        Parameters
+        ----------
+        src_dict : dict
+            Test source definition.
+
+        eslices : list
+            Energy slice of each component.
+
+        cpix : float
+            Pixel coordinate of the test source.
+
+        Returns
+        -------
+        tmpl : dict
+            Dictionary with the cropped kernels (``model``), the kernel
+            half-widths in pixels (``dpix``), the total model counts
+            (``npred``), the source normalization (``norm``), the
+            model name (``modelname``), the index of the analysis
+            energy bin of each kernel plane (``ebin_index``) and the
+            reference spectrum of the test source in the analysis
+            energy bins (``ref_spec``).
+        """
+        threshold = kwargs.get('threshold', 1E-2)
+        max_kernel_radius = kwargs.get('max_kernel_radius', None)
+        use_pylike = kwargs.get('use_pylike', True)
+
+        key = [json.dumps(src_dict, sort_keys=True, default=str), cpix,
+               threshold, max_kernel_radius, use_pylike, self.npix,
+               tuple(self._skywcs.wcs.crval)]
+        for c, eslice in zip(self.components, eslices):
+            key += [(tuple(c.log_energies), eslice.start, eslice.stop,
+                     c.binsz, c.npix, c.config['gtlike']['edisp'])]
+        key = tuple(key)
+        deps = [(getattr(c, '_psf', None), getattr(c, '_bexp', None))
+                for c in self.components]
+
+        tmpl = self._testsource_cache.pop(key, None)
+        if tmpl is not None and all([x[0] is y[0] and x[1] is y[1] for x, y
+                                     in zip(tmpl['deps'], deps)]):
+            self._testsource_cache[key] = tmpl
+            return _copy_testsource_templates(tmpl)
+
+        self.add_source('tsmap_testsource', src_dict, free=True,
+                        init_source=False, use_single_psf=True,
+                        use_pylike=use_pylike,
+                        loglevel=logging.DEBUG)
+        src = self.roi['tsmap_testsource']
+        modelname = utils.create_model_name(src)
+        norm = src.get_norm()
+        model = []
+        for c, eslice in zip(self.components, eslices):
+            mm = c.model_counts_map('tsmap_testsource').counts.astype('float')[
+                eslice, ...]
+            model += [mm]
+
+        emin = 10**self.log_energies[:-1]
+        emax = 10**self.log_energies[1:]
+        like_src = self.like['tsmap_testsource']
+        ref_flux = np.array([like_src.flux(e0, e1)
+                             for e0, e1 in zip(emin, emax)])
+        ref_eflux = np.array([like_src.energyFlux(e0, e1)
+                              for e0, e1 in zip(emin, emax)])
+        ref_dnde = np.array([like_src.spectrum()(pyLike.dArg(e))
+                             for e in np.sqrt(emin * emax)])
+
+        self.delete_source('tsmap_testsource', loglevel=logging.DEBUG)
+
+        model_npred = 0
+        dpixs = []
+        ebin_index = []
+        ref_npred = np.zeros(len(emin))
+        for i, mm in enumerate(model):
+
+            c = self.components[i]
+            ectr = utils.edge_to_center(c.log_energies)[eslices[i]]
+            ebin_index += [utils.val_to_bin(self.log_energies, ectr)]
+            np.add.at(ref_npred, ebin_index[-1], np.sum(mm, axis=(1, 2)))
+
+            model_npred += np.sum(mm)
+            dpix = 3
+            for j in range(mm.shape[0]):
+
+                ix, iy = np.unravel_index(
+                    np.argmax(mm[j, ...]), mm[j, ...].shape)
+
+                mx = mm[j, ix, :] > mm[j, ix, iy] * threshold
+                my = mm[j, :, iy] > mm[j, ix, iy] * threshold
+                dpix = max(dpix, np.round(np.sum(mx) / 2.))
+                dpix = max(dpix, np.round(np.sum(my) / 2.))
+
+            if max_kernel_radius is not None and \
+                    dpix > int(max_kernel_radius / self.components[i].binsz):
+                dpix = int(max_kernel_radius / self.components[i].binsz)
+
+            xslice = slice(max(int(cpix - dpix), 0),
+                           min(int(cpix + dpix + 1), self.npix))
+            model[i] = model[i][:, xslice, xslice]
+            dpixs += [dpix]
+
+        ref_spec = castro.ReferenceSpec(emin, emax, ref_dnde, ref_flux,
+                                        ref_eflux, ref_npred)
+        # The cached kernels are shared between calls and are
+        # therefore made read-only
+        for x in model + ebin_index:
+            x.flags.writeable = False
+
+        tmpl = {'model': model, 'dpix': dpixs, 'npred': model_npred,
+                'norm': norm, 'modelname': modelname, 'deps': deps,
+                'ebin_index': ebin_index, 'ref_spec': ref_spec}
+
+        self._testsource_cache[key] = tmpl
+        while len(self._testsource_cache) > self._testsource_cache_size:
+            self._testsource_cache.popitem(last=False)
+        return _copy_testsource_templates(tmpl)
+
     def _tsmap_pylike(self, prefix, **kwargs):
         """Evaluate the TS for an additional source component at each point
         in the ROI.  This is the brute force implementation of TS map
@@ -937,7 +1245,7 @@ class TSMapGenerator(object):
         logLike0 = -self.like()
         self.logger.info('LogLike: %f' % logLike0)
 
-        saved_state = LikelihoodState(self.like)
+        saved_state = gtutils.LikelihoodState(self.like)
 
         # Get the ROI geometry
 
@@ -1047,6 +1355,15 @@ class TSCubeGenerator(object):
 
         st_scan_level : int
 
+        engine : str
+           Fitting engine.  With ``numpy`` the test source is fit
+           with a vectorized Newton method and the normalizations of
+           the background components are held fixed.
+
+        multithread : bool
+           Split the pixels of the ``numpy`` engine across
+           ``nthread`` processes.
+
         make_plots : bool
            Write image files.
 
@@ -1070,14 +1387,16 @@ class TSCubeGenerator(object):
         schema.add_option('write_npy', True)
         config = schema.create_config(self.config['tscube'], **kwargs)
 
-        maps = self._make_ts_cube(prefix, **config)
+        if config['engine'] == 'gttscube':
+            maps = self._make_ts_cube(prefix, **config)
+        elif config['engine'] == 'numpy':
+            maps = self._make_ts_cube_numpy(prefix, **config)
+        else:
+            raise Exception('Unrecognized TS cube engine: %s' %
+                            config['engine'])
 
         if config['make_plots']:
-            plotter = plotting.AnalysisPlotter(self.config['plotting'],
-                                               fileio=self.config['fileio'],
-                                               logging=self.config['logging'])
-
-            plotter.make_tsmap_plots(maps, self.roi, suffix='tscube')
+            self.plotter.make_tsmap_plots(maps, self.roi, suffix='tscube')
 
         self.logger.info("Finished TS cube")
         return maps
@@ -1184,7 +1503,149 @@ class TSCubeGenerator(object):
 
         if not kwargs['write_fits']:
             os.remove(outfile)
-            os['file'] = None
+            o['file'] = None
 
         self.logger.info("Done")
         return o
+
+    def _make_ts_cube_numpy(self, prefix, **kwargs):
+        """Make a TS cube with the numpy engine.  The global and
+        bin-by-bin normalizations of the test source are fit at each
+        pixel with all background components held fixed and the
+        results are filled directly into a `~fermipy.castro.TSCube`.
+        """
+        skywcs = self._skywcs
+        npix = self.npix
+
+        src_dict = copy.deepcopy(kwargs.setdefault('model', {}))
+        src_dict = {} if src_dict is None else src_dict
+
+        xpix, ypix = (np.round((npix - 1.0) / 2.),
+                      np.round((npix - 1.0) / 2.))
+        skydir = wcs_utils.pix_to_skydir(xpix, ypix, skywcs)
+
+        src_dict['ra'] = skydir.ra.deg
+        src_dict['dec'] = skydir.dec.deg
+        src_dict.setdefault('SpatialModel', 'PointSource')
+        src_dict.setdefault('SpatialWidth', 0.3)
+        src_dict.setdefault('Index', 2.0)
+        src_dict.setdefault('Prefactor', 1E-13)
+
+        counts = []
+        bkg = []
+        eslices = []
+        enumbins = []
+        for c in self.components:
+            cm = c.counts_map().counts.astype('float')
+            counts += [cm]
+            bkg += [c.model_counts_map().counts.astype('float')]
+            eslices += [slice(0, cm.shape[0])]
+            enumbins += [cm.shape[0]]
+
+        tmpl = self._get_testsource_templates(src_dict, eslices, xpix)
+        ref_spec = tmpl['ref_spec']
+        nebin = len(self.log_energies) - 1
+
+        # Each block holds one row of pixels
+        blocks = [[[[k // 2, i, j] for k in enumbins] for j in range(npix)]
+                  for i in range(npix)]
+
+        fit_kwargs = {'nnorm': kwargs['nnorm'],
+                      'norm_sigma': kwargs['norm_sigma'],
+                      'tol': kwargs['tol'],
+                      'max_iter': kwargs['max_iter'],
+                      'do_sed': kwargs['do_sed']}
+
+        self.logger.info("Running tscube")
+        if kwargs['multithread']:
+            # The counts, background and kernel arrays are inherited by
+            # the forked workers rather than pickled for each block
+            state = dict(counts=counts, bkg=bkg, model=tmpl['model'],
+                         ebin_index=tmpl['ebin_index'], nebin=nebin,
+                         **fit_kwargs)
+            results = utils.pool_map(_ts_cube_block, blocks,
+                                     nthread=kwargs['nthread'], state=state)
+        else:
+            results = [_ts_cube_block(b, counts, bkg, tmpl['model'],
+                                      tmpl['ebin_index'], nebin,
+                                      **fit_kwargs) for b in blocks]
+
+        data = {}
+        for k in results[0].keys():
+            data[k] = np.concatenate([r[k] for r in results])
+
+        shape = (npix, npix)
+        wcs_3d = wcs_utils.wcs_add_energy_axis(skywcs, ref_spec.emin)
+        ts_map = Map(data['fit_ts'].reshape(shape), skywcs)
+        norm_map = Map(data['fit_norm'].reshape(shape), skywcs)
+        ts_cube = Map(np.rollaxis(data['ts'].reshape(shape + (nebin,)), 2, 0),
+                      wcs_3d)
+        norm_cube = Map(np.rollaxis(data['norm'].reshape(shape + (nebin,)),
+                                    2, 0), wcs_3d)
+        norm_vals = data['norm_scan'] * \
+            ref_spec.ref_flux[np.newaxis, :, np.newaxis]
+        tscube = castro.TSCube(ts_map, norm_map, ts_cube, norm_cube,
+                               norm_vals, -data['dloglike_scan'],
+                               ref_spec, 'flux')
+
+        npred_map = copy.deepcopy(norm_map)
+        npred_map._counts *= ref_spec.ref_npred.sum()
+        amp_map = copy.deepcopy(norm_map)
+        amp_map._counts *= tmpl['norm']
+        sqrt_ts_map = copy.deepcopy(ts_map)
+        sqrt_ts_map._counts = np.abs(sqrt_ts_map._counts)**0.5
+
+        o = {'name': utils.join_strings([prefix, tmpl['modelname']]),
+             'src_dict': copy.deepcopy(src_dict),
+             'file': None,
+             'ts': ts_map,
+             'sqrt_ts': sqrt_ts_map,
+             'npred': npred_map,
+             'amplitude': amp_map,
+             'config': kwargs,
+             'tscube': tscube
+             }
+
+        nfail = np.sum(data['fit_status'] != 0)
+        if nfail:
+            self.logger.warning('Fit failed to converge in %i of %i pixels.',
+                                nfail, npix * npix)
+
+        if kwargs['write_fits']:
+            outfile = utils.format_filename(self.config['fileio']['workdir'],
+                                            'tscube.fits',
+                                            prefix=[prefix])
+            self.logger.info("Writing FITS output")
+            self._make_ts_cube_fits(data, tscube, outfile)
+            o['file'] = os.path.basename(outfile)
+
+        self.logger.info("Done")
+        return o
+
+    def _make_ts_cube_fits(self, data, tscube, filename):
+        """Write the output of the numpy TS cube engine to a FITS file
+        with the format of `convert_tscube`."""
+
+        hdu_image = fits.PrimaryHDU(tscube.tsmap.counts,
+                                    header=tscube.tsmap.wcs.to_header())
+
+        scan_cols = ['ts', 'bin_status', 'norm', 'norm_ul', 'norm_err',
+                     'loglike', 'norm_scan', 'dloglike_scan']
+        tab_s = Table([data[k] for k in scan_cols], names=scan_cols)
+        tab_s['norm_errp'] = data['norm_err']
+        tab_s['norm_errn'] = data['norm_err']
+        hdu_scan = fits.table_to_hdu(tab_s)
+        hdu_scan.name = 'SCANDATA'
+
+        fit_cols = ['fit_ts', 'fit_status', 'fit_norm', 'fit_norm_err']
+        tab_f = Table([data[k] for k in fit_cols], names=fit_cols)
+        tab_f['fit_norm_errp'] = data['fit_norm_err']
+        tab_f['fit_norm_errn'] = data['fit_norm_err']
+        hdu_fit = fits.table_to_hdu(tab_f)
+        hdu_fit.name = 'FITDATA'
+
+        hdu_ebounds = fits.table_to_hdu(tscube.refSpec.build_ebound_table())
+        hdu_ebounds.name = 'EBOUNDS'
+
+        hdulist = fits.HDUList([hdu_image, hdu_scan, hdu_fit, hdu_ebounds])
+        hdulist.writeto(filename, clobber=True)
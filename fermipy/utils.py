@@ -3,20 +3,30 @@ from __future__ import absolute_import, division, print_function
 import os
 import re
 import copy
+import zlib
+import struct
+import time
 import tempfile
 import functools
 from collections import OrderedDict
 import xml.etree.cElementTree as et
 import yaml
 import numpy as np
-import scipy.optimize
-from scipy.ndimage import map_coordinates
-from scipy.interpolate import UnivariateSpline
-from scipy.optimize import brentq
-from scipy.ndimage.measurements import label
-import scipy.special as special
 from numpy.core import defchararray
 from astropy.extern import six
+from fermipy.lazy_import import LazyModule
+from fermipy.kernel_cache import cached_kernel
+
+# scipy submodules are only imported when first used
+optimize = LazyModule('scipy.optimize')
+interpolate = LazyModule('scipy.interpolate')
+ndimage = LazyModule('scipy.ndimage')
+special = LazyModule('scipy.special')
+
+# State shared with the worker processes of `pool_map`.  It is set
+# before the process pool is forked such that each worker inherits a
+# copy without it being pickled.
+_worker_state = {}
 
 
 def init_matplotlib_backend(backend=None):
@@ -61,14 +71,19 @@ def load_npy(infile):
 
 
 def load_data(infile, workdir=None):
-    """Load python data structure from either a YAML or numpy file. """
+    """Load python data structure from either a YAML, numpy, or
+    checkpoint file. """
     infile = resolve_path(infile, workdir=workdir)
     infile, ext = os.path.splitext(infile)
 
-    if os.path.isfile(infile + '.npy'):
+    if ext == '.ckpt' and os.path.isfile(infile + ext):
+        infile += ext
+    elif os.path.isfile(infile + '.npy'):
         infile += '.npy'
     elif os.path.isfile(infile + '.yaml'):
         infile += '.yaml'
+    elif os.path.isfile(infile + '.ckpt'):
+        infile += '.ckpt'
     else:
         raise Exception('Input file does not exist.')
 
@@ -78,6 +93,9 @@ def load_data(infile, workdir=None):
         return infile, load_npy(infile)
     elif ext == '.yaml':
         return infile, load_yaml(infile)
+    elif ext == '.ckpt':
+        from fermipy.checkpoint import load_checkpoint
+        return infile, load_checkpoint(infile)
     else:
         raise Exception('Unrecognized extension.')
 
@@ -149,6 +167,171 @@ def resolve_file_path_list(pathlist, workdir, prefix='',
     return tmppath
 
 
+def gzip_file(infile, outfile=None, nthread=1, blocksize=2**24,
+              compresslevel=9, remove=True):
+    """Compress a file with gzip.  The file is split into blocks of
+    ``blocksize`` bytes that are deflated independently and then
+    concatenated into a single gzip member.  When ``nthread`` is
+    greater than one the blocks are compressed concurrently with a
+    thread pool (zlib releases the GIL while deflating).
+
+    Parameters
+    ----------
+    infile : str
+        Path to the input file.
+
+    outfile : str
+        Path to the output file.  Defaults to ``infile`` with a
+        ``.gz`` suffix.
+
+    nthread : int
+        Number of compression threads.
+
+    blocksize : int
+        Size in bytes of the blocks that are compressed independently.
+
+    remove : bool
+        Delete the input file after compression (as ``gzip`` does).
+
+    Returns
+    -------
+    outfile : str
+        Path to the compressed file.
+    """
+
+    if outfile is None:
+        outfile = infile + '.gz'
+
+    def deflate(args):
+        block, last = args
+        c = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return c.compress(block) + c.flush(zlib.Z_FINISH if last else
+                                           zlib.Z_SYNC_FLUSH)
+
+    def read_blocks(fin):
+        block = fin.read(blocksize)
+        while True:
+            next_block = fin.read(blocksize)
+            yield block, len(next_block) == 0
+            if not next_block:
+                break
+            block = next_block
+
+    def write_blocks(fin, fout, mapfn):
+        crc = 0
+        size = 0
+        blocks = read_blocks(fin)
+        while True:
+            chunk = [b for _, b in zip(range(max(nthread, 1)), blocks)]
+            if not chunk:
+                break
+            for block, last in chunk:
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+            for t in mapfn(deflate, chunk):
+                fout.write(t)
+        return crc, size
+
+    with open(infile, 'rb') as fin, open(outfile, 'wb') as fout:
+
+        fout.write(b'\x1f\x8b\x08\x00' +
+                   struct.pack('<I', int(time.time()) & 0xffffffff) +
+                   b'\x02\xff')
+
+        if nthread > 1:
+            from multiprocessing.pool import ThreadPool
+            with ThreadPool(nthread) as pool:
+                crc, size = write_blocks(fin, fout, pool.map)
+        else:
+            crc, size = write_blocks(fin, fout,
+                                     lambda fn, x: [fn(t) for t in x])
+
+        fout.write(struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+
+    if remove:
+        os.remove(infile)
+
+    return outfile
+
+
+def _fork_available():
+    """Return True if worker processes can be created with fork."""
+    import multiprocessing
+
+    try:
+        return 'fork' in multiprocessing.get_all_start_methods()
+    except AttributeError:
+        return hasattr(os, 'fork')
+
+
+def _pool_map_worker(fn, arg):
+    return fn(arg, **_worker_state)
+
+
+def pool_map(fn, args, nthread=None, state=None, chunksize=None):
+    """Evaluate ``fn(arg, **state)`` for every element of ``args`` in
+    a pool of forked worker processes.  The objects in ``state`` (e.g.
+    an analysis object or large arrays) are inherited by the workers
+    when the pool is forked instead of being pickled for every task.
+    The pool is terminated when the evaluation finishes or any task
+    raises.
+
+    Parameters
+    ----------
+    fn : function
+        Module-level function (or `functools.partial` of one) called
+        with an element of ``args`` and the keyword arguments in
+        ``state``.
+
+    args : list
+        Arguments for which ``fn`` is evaluated.
+
+    nthread : int
+        Number of processes.  If None one process is created for each
+        available core.  The elements are evaluated serially in the
+        calling process if ``nthread`` is 1 or the platform does not
+        support the 'fork' start method (e.g. Windows).
+
+    state : dict
+        Keyword arguments shared with all workers.
+
+    chunksize : int
+        Number of elements of ``args`` sent to a worker at once.
+
+    Returns
+    -------
+    results : list
+        Return values of ``fn`` in the order of ``args``.
+    """
+    import multiprocessing
+
+    state = state or {}
+    if nthread == 1 or not _fork_available():
+        # The state cannot be inherited by spawned workers so the
+        # evaluation is done in this process
+        return [fn(arg, **state) for arg in args]
+
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 always forks on POSIX systems
+        ctx = multiprocessing
+
+    _worker_state.update(state)
+    pool = None
+    try:
+        pool = ctx.Pool(processes=nthread)
+        results = pool.map(functools.partial(_pool_map_worker, fn), args,
+                           chunksize=chunksize)
+        pool.close()
+        pool.join()
+        return results
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _worker_state.clear()
+
+
 def is_fits_file(path):
 
     if (path.endswith('.fit') or path.endswith('.fits') or
@@ -612,10 +795,10 @@ def onesided_dlnl_to_cl(dlnl):
 
 
 def interpolate_function_min(x, y):
-    sp = scipy.interpolate.splrep(x, y, k=2, s=0)
+    sp = interpolate.splrep(x, y, k=2, s=0)
 
     def fn(t):
-        return scipy.interpolate.splev(t, sp, der=1)
+        return interpolate.splev(t, sp, der=1)
 
     if np.sign(fn(x[0])) == np.sign(fn(x[-1])):
 
@@ -624,9 +807,9 @@ def interpolate_function_min(x, y):
         else:
             return x[0]
 
-    x0 = scipy.optimize.brentq(fn,
-                               x[0], x[-1],
-                               xtol=1e-10 * np.median(x))
+    x0 = optimize.brentq(fn,
+                         x[0], x[-1],
+                         xtol=1e-10 * np.median(x))
 
     return x0
 
@@ -674,7 +857,7 @@ def find_function_root(fn, x0, xb, delta=0.0, bounds=None):
     else:
         xtol = 1e-10 * np.abs(xb + x0)
 
-    return brentq(lambda t: fn(t) + delta, x0, xb, xtol=xtol)
+    return optimize.brentq(lambda t: fn(t) + delta, x0, xb, xtol=xtol)
 
 
 def get_parameter_limits(xval, loglike, cl_limit=0.95, cl_err=0.68269, tol=1E-2,
@@ -756,9 +939,9 @@ def get_parameter_limits(xval, loglike, cl_limit=0.95, cl_err=0.68269, tol=1E-2,
         #    y = np.concatenate((loglike, y))
         # else:
         x, y = xval, loglike
-        spline = UnivariateSpline(x, y, k=2,
-                                  #k=min(len(xval) - 1, 3),
-                                  w=(1 / tol) * np.ones(len(x)))
+        spline = interpolate.UnivariateSpline(x, y, k=2,
+                                              #k=min(len(xval) - 1, 3),
+                                              w=(1 / tol) * np.ones(len(x)))
     except:
         print("Failed to create spline: ", xval, loglike)
         return {'x0': np.nan, 'ul': np.nan, 'll': np.nan,
@@ -909,7 +1092,7 @@ def get_region_mask(z, delta, xy=None):
         ix, iy = xy
 
     mz = (z > z[ix, iy] - delta)
-    labels = label(mz)[0]
+    labels = ndimage.label(mz)[0]
     mz &= labels == labels[ix, iy]
     return mz
 
@@ -968,9 +1151,9 @@ def fit_parabola(z, ix, iy, dpix=3, zmin=None):
         bounds[0][2] = -0.5
         bounds[1][1] = z.shape[0] - 0.5
         bounds[1][2] = z.shape[1] - 0.5
-        popt, pcov = scipy.optimize.curve_fit(curve_fit_fn,
-                                              (np.ravel(x[m]), np.ravel(y[m])),
-                                              np.ravel(z[m]), p0, bounds=bounds)
+        popt, pcov = optimize.curve_fit(curve_fit_fn,
+                                        (np.ravel(x[m]), np.ravel(y[m])),
+                                        np.ravel(z[m]), p0, bounds=bounds)
     except Exception:
         popt = copy.deepcopy(p0)
         o['fit_success'] = False
@@ -1026,6 +1209,53 @@ def split_bin_edges(edges, npts=2):
     return np.unique(np.ravel(x))
 
 
+def snap_to_points(xvals, xpts, tol=0.5):
+    """Move the elements of a sorted grid onto a set of reference
+    points.  Each grid point is replaced by the nearest reference
+    point if their separation is less than ``tol`` times the distance
+    to the closest neighbouring grid point.  A reference point is
+    used at most once and the ordering of the grid is preserved for
+    ``tol <= 0.5``.
+
+    Parameters
+    ----------
+    xvals : `~numpy.ndarray`
+        Sorted grid array.
+
+    xpts : `~numpy.ndarray`
+        Array of reference points.
+
+    tol : float
+        Maximum displacement of a grid point in units of the local
+        grid spacing.
+
+    Returns
+    -------
+    xvals : `~numpy.ndarray`
+        Grid array with snapped points.
+
+    """
+    xvals = np.array(xvals, dtype=float, ndmin=1)
+    xpts = np.unique(np.array(xpts, dtype=float, ndmin=1))
+
+    if len(xvals) < 2 or len(xpts) == 0:
+        return xvals
+
+    dx = np.abs(np.diff(xvals))
+    spacing = np.minimum(np.append(dx, np.inf), np.insert(dx, 0, np.inf))
+    used = np.zeros(len(xpts), dtype=bool)
+
+    for i, x in enumerate(xvals):
+        delta = np.abs(xpts - x)
+        delta[used] = np.inf
+        j = np.argmin(delta)
+        if delta[j] < tol * spacing[i]:
+            xvals[i] = xpts[j]
+            used[j] = True
+
+    return xvals
+
+
 def center_to_edge(center):
 
     if len(center) == 1:
@@ -1496,7 +1726,7 @@ def convolve2d_gauss(fn, r, sig, nstep=200):
         t = 10 ** np.linspace(-8, 8, 1000)
         t = np.insert(t, 0, [0])
         je = special.ive(0, t)
-        convolve2d_gauss.je_fn = UnivariateSpline(t, je, k=2, s=0)
+        convolve2d_gauss.je_fn = interpolate.UnivariateSpline(t, je, k=2, s=0)
 
     je = convolve2d_gauss.je_fn(x.flat).reshape(x.shape)
     #je2 = special.ive(0,x)
@@ -1573,6 +1803,7 @@ def make_disk_kernel(radius, npix=501, cdelt=0.01, xpix=None, ypix=None):
     return k
 
 
+@cached_kernel
 def make_cdisk_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
                       normalize=False):
     """Make a kernel for a PSF-convolved 2D disk.
@@ -1593,12 +1824,14 @@ def make_cdisk_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
 
     x = make_pixel_distance(npix, xpix, ypix)
     x *= cdelt
+    dtheta = dtheta[:np.searchsorted(dtheta, np.max(x)) + 1]
 
+    z = eval_radial_kernels(psf, convolve2d_disk, sigma,
+                            dtheta * np.ones((len(egy), 1)), psf_scale_fn,
+                            rres=max(0.5 * sigma, 0.01))
     k = np.zeros((len(egy), npix, npix))
     for i in range(len(egy)):
-        def fn(t): return psf.eval(i, t, scale_fn=psf_scale_fn)
-        psfc = convolve2d_disk(fn, dtheta, sigma)
-        k[i] = np.interp(np.ravel(x), dtheta, psfc).reshape(x.shape)
+        k[i] = np.interp(np.ravel(x), dtheta, z[i]).reshape(x.shape)
 
     if normalize:
         k /= (np.sum(k, axis=0)[np.newaxis, ...] * np.radians(cdelt) ** 2)
@@ -1606,6 +1839,7 @@ def make_cdisk_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
     return k
 
 
+@cached_kernel
 def make_cgauss_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
                        normalize=False):
     """Make a kernel for a PSF-convolved 2D gaussian.
@@ -1626,12 +1860,14 @@ def make_cgauss_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
 
     x = make_pixel_distance(npix, xpix, ypix)
     x *= cdelt
+    dtheta = dtheta[:np.searchsorted(dtheta, np.max(x)) + 1]
 
+    z = eval_radial_kernels(psf, convolve2d_gauss, sigma,
+                            dtheta * np.ones((len(egy), 1)), psf_scale_fn,
+                            rres=max(0.5 * sigma, 0.01))
     k = np.zeros((len(egy), npix, npix))
     for i in range(len(egy)):
-        def fn(t): return psf.eval(i, t, scale_fn=psf_scale_fn)
-        psfc = convolve2d_gauss(fn, dtheta, sigma)
-        k[i] = np.interp(np.ravel(x), dtheta, psfc).reshape(x.shape)
+        k[i] = np.interp(np.ravel(x), dtheta, z[i]).reshape(x.shape)
 
     if normalize:
         k /= (np.sum(k, axis=0)[np.newaxis, ...] * np.radians(cdelt) ** 2)
@@ -1652,6 +1888,7 @@ def memoize(obj):
     return memoizer
 
 
+@cached_kernel
 def make_radial_kernel(psf, fn, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
                        normalize=False, klims=None, sparse=False):
     """Make a kernel for a general radially symmetric 2D function.
@@ -1691,15 +1928,19 @@ def make_radial_kernel(psf, fn, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=Non
         rmax = np.maximum(rmax, 2.0 * r34 + 3.0 * sigma)
     rmax = np.minimum(rmax, max_ang_dist)
 
+    if sparse:
+        dtheta = np.linspace(0.0, 1.0, 100)[np.newaxis, :]**2.0
+        dtheta = dtheta * rmax[:, np.newaxis]
+    else:
+        dtheta = np.linspace(0.0, max_ang_dist**0.5, 200)**2.0
+        dtheta = dtheta * np.ones((len(egy), 1))
+
+    z = eval_radial_kernels(psf, fn, sigma, dtheta, psf_scale_fn,
+                            rres=np.min(rmin))
+
     for i in range(len(egy)):
 
         rebin = min(int(np.ceil(cdelt / rmin[i])), 8)
-        if sparse:
-            dtheta = np.linspace(0.0, rmax[i]**0.5, 100)**2.0
-        else:
-            dtheta = np.linspace(0.0, max_ang_dist**0.5, 200)**2.0
-
-        z = eval_radial_kernel(psf, fn, sigma, i, dtheta, psf_scale_fn)
         xdist = make_pixel_distance(npix * rebin,
                                     xpix * rebin + (rebin - 1.0) / 2.,
                                     ypix * rebin + (rebin - 1.0) / 2.)
@@ -1710,10 +1951,11 @@ def make_radial_kernel(psf, fn, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=Non
             m = np.ravel(xdist) < rmax[i]
             kk = np.zeros(xdist.size)
             #kk[m] = map_coordinates(z, [x[m]], order=2, prefilter=False)
-            kk[m] = np.interp(np.ravel(xdist)[m], dtheta, z)
+            kk[m] = np.interp(np.ravel(xdist)[m], dtheta[i], z[i])
             kk = kk.reshape(xdist.shape)
         else:
-            kk = np.interp(np.ravel(xdist), dtheta, z).reshape(xdist.shape)
+            kk = np.interp(np.ravel(xdist), dtheta[i],
+                           z[i]).reshape(xdist.shape)
             # kk = map_coordinates(z, [x], order=2,
             #                     prefilter=False).reshape(xdist.shape)
 
@@ -1739,6 +1981,62 @@ def eval_radial_kernel(psf, fn, sigma, idx, dtheta, psf_scale_fn):
                   dtheta, sigma)
 
 
+def eval_radial_kernels(psf, fn, sigma, dtheta, psf_scale_fn, rres=None):
+    """Evaluate a radial kernel for every energy bin of a PSF model.
+    Convolutions with `convolve2d_gauss` and `convolve2d_disk` are
+    evaluated for all energy bins at once with the Hankel transform
+    (see `~fermipy.hankel`).
+
+    Parameters
+    ----------
+    psf : `~fermipy.irfs.PSFModel`
+
+    fn : callable
+        Convolution function or None for a point source.
+
+    sigma : float
+        Width parameter of the convolution function.
+
+    dtheta : `~numpy.ndarray`
+        2D array with the angular offsets at which the kernel is
+        evaluated in each energy bin.
+
+    rres : float
+        Smallest angular scale in degrees that should be resolved by
+        the convolution.
+
+    Returns
+    -------
+    z : `~numpy.ndarray`
+        Array with the same shape as ``dtheta``.
+    """
+
+    from fermipy import hankel
+
+    dtheta = np.array(dtheta, ndmin=2)
+    negy = dtheta.shape[0]
+
+    if fn is convolve2d_gauss:
+        hankel_fn = hankel.convolve2d_gauss
+    elif fn is convolve2d_disk:
+        hankel_fn = hankel.convolve2d_disk
+    else:
+        return np.vstack([eval_radial_kernel(psf, fn, sigma, i, dtheta[i],
+                                             psf_scale_fn)
+                          for i in range(negy)])
+
+    def psf_fn(t):
+        return np.vstack([psf.eval(i, t, scale_fn=psf_scale_fn)
+                          for i in range(negy)])
+
+    # Evaluate the inverse transform only once if all energy bins
+    # share the same offsets
+    if np.all(dtheta == dtheta[:1]):
+        return hankel_fn(psf_fn, dtheta[0], sigma, rres=rres)
+    else:
+        return hankel_fn(psf_fn, dtheta, sigma, rres=rres)
+
+
 #@memoize
 def create_kernel_function_lookup(psf, fn, sigma, egy, dtheta, psf_scale_fn):
 
@@ -1,7 +1,6 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
 
-import itertools
 import gzip
 
 import numpy as np
@@ -13,6 +12,9 @@ from astropy.io import fits
 from fermipy import utils
 from fermipy import catalog
 from fermipy.ltcube import LTCube
+from fermipy.lazy_import import LazyModule
+
+spatial = LazyModule('scipy.spatial')
 
 agn_src_list = ['3FGL J1104.4+3812', '3FGL J2158.8-3013', '3FGL J1555.7+1111',
                 '3FGL J0538.8-4405', '3FGL J1427.0+2347', '3FGL J0222.6+4301',
@@ -38,6 +40,40 @@ def fill_evclass_hist(evts, axes):
     pass
 
 
+def _process_file_worker(filename, val):
+
+    val.init()
+    val._ltc = None
+    val.process(filename)
+    return val.hists, val._ltc
+
+
+def decode_bits(v):
+    """Convert a column of bit fields to integers.  The input can be
+    an integer column, a boolean array with one element per bit (most
+    significant bit first) or the raw bytes of a FITS X column."""
+
+    v = np.asarray(v)
+    if v.dtype == bool:
+        v = np.packbits(v, axis=-1)
+    if v.dtype == np.uint8 and v.ndim == 2:
+        w = 256**np.arange(v.shape[1] - 1, -1, -1, dtype=np.int64)
+        return np.dot(v.astype(np.int64), w)
+    return v.astype(np.int64)
+
+
+def hist_index(edges, x):
+    """Compute the bin index of each value of ``x`` with the
+    conventions of `~numpy.histogramdd` (the last bin is closed).
+    Values outside the bins are assigned an index of -1."""
+
+    nbin = len(edges) - 1
+    idx = np.searchsorted(edges, x, side='right') - 1
+    idx[x == edges[-1]] = nbin - 1
+    idx[(idx < 0) | (idx >= nbin)] = -1
+    return idx
+
+
 def calc_quantiles(sep, non, noff, alpha, quantiles, axis=2, nsample=11):
 
     non_sim = np.random.poisson(non[..., None],
@@ -110,13 +146,19 @@ def calc_eff(ns0, nb0, ns1, nb1, alpha, sum_axes=None):
 
 class Validator(object):
 
+    # Columns of the EVENTS table that are used to fill the histograms
+    _colnames = ['ENERGY', 'RA', 'DEC', 'PtRaz', 'PtDecz', 'EVENT_CLASS',
+                 'EVENT_TYPE', 'PULSE_PHASE']
+
     defaults = {
         'scfile': (None, '', str)
     }
 
-    def __init__(self, scfile, zmax):
+    def __init__(self, scfile, zmax, chunk_size=1000000):
 
         self._scfile = scfile
+        self._chunk_size = chunk_size
+        self._src_xyz = None
         self._energy_bins = 10**np.linspace(1.0, 6.0, 41)
         self._ctheta_bins = np.linspace(0.0, 1.0, 11)
         self._xsep_bins = np.linspace(0.0, 1.0, 101)**2
@@ -134,7 +176,7 @@ class Validator(object):
         self.init()
         self._tab_sc = Table.read(scfile)
         self._zmax = zmax
-        self._ltc = LTCube.create_empty()
+        self._ltc = None
 
     @property
     def hists(self):
@@ -162,18 +204,61 @@ class Validator(object):
                            )
 
     def process(self, filename):
+        """Fill the histograms with the events of an FT1 file.  The
+        EVENTS table is read with memory mapping in chunks of
+        ``chunk_size`` rows."""
 
-        tab = Table.read(filename, 'EVENTS')
-        tab_gti = Table.read(filename, 'GTI')
         print('loading events')
-        self.load_events(tab)
+        with fits.open(filename, memmap=True) as hdulist:
+            data = hdulist['EVENTS'].data
+            raw = np.asarray(data)
+            colnames = [c for c in self._colnames if c in data.columns.names]
+            for i0 in range(0, len(data), self._chunk_size):
+                s = slice(i0, i0 + self._chunk_size)
+                # Bit-field columns are read as raw bytes to avoid
+                # their expansion to boolean arrays
+                evts = {c: (raw[c][s] if c in ['EVENT_CLASS', 'EVENT_TYPE']
+                            else data.field(c)[s]) for c in colnames}
+                self.load_events(evts)
 
+        tab_gti = Table.read(filename, 'GTI')
         skydir = SkyCoord(0.0, 0.0, unit='deg')
 
         print('creating LT Cube')
         ltc = LTCube.create_from_gti(skydir, self._tab_sc, tab_gti,
                                      self._zmax)
-        self._ltc.load(ltc)
+        self._load_ltcube(ltc)
+
+    def process_files(self, filenames, nthread=1):
+        """Fill the histograms with the events of a list of FT1
+        files.  If ``nthread`` is greater than one the files are
+        processed in parallel and the histograms of each file are
+        summed."""
+
+        if nthread == 1 or len(filenames) < 2:
+            for f in filenames:
+                print('processing', f)
+                self.process(f)
+            return
+
+        results = utils.pool_map(_process_file_worker, filenames,
+                                 nthread=nthread,
+                                 state=dict(val=self))
+
+        for hists, ltc in results:
+            for k, v in hists.items():
+                if 'alpha' in k:
+                    self._hists[k] = v
+                else:
+                    self._hists[k] += v
+            self._load_ltcube(ltc)
+
+    def _load_ltcube(self, ltc):
+
+        if self._ltc is None:
+            self._ltc = ltc
+        else:
+            self._ltc.load(ltc)
 
     def load(self, filename, fill=False):
 
@@ -232,122 +317,157 @@ class Validator(object):
         else:
             hdulist.writeto(outfile, clobber=True)
 
-    def calc_sep(self, tab, src_list):
-
-        print('calculating separations')
-
-        src_tab = catalog.Catalog3FGL().table
-        m = utils.find_rows_by_string(
-            src_tab, src_list, ['Source_Name', 'ASSOC1', 'ASSOC2'])
-        rows = src_tab[m]
-        src_skydir = SkyCoord(rows['RAJ2000'], rows['DEJ2000'], unit='deg')
-        evt_skydir = SkyCoord(tab['RA'], tab['DEC'], unit='deg')
-        lat_skydir = SkyCoord(tab['PtRaz'], tab['PtDecz'], unit='deg')
-        evt_sep = evt_skydir.separation(src_skydir[:, None]).deg
-        evt_ebin = utils.val_to_bin(self._energy_bins, tab['ENERGY'])
-        evt_xsep = evt_sep / self._psf_scale[evt_ebin][None, :]
-        evt_ctheta = np.cos(lat_skydir.separation(src_skydir[:, None]).rad)
-
-        return evt_sep, evt_xsep, evt_ctheta
-
-    def load_events(self, tab):
-
-        hists = self._hists
-        evclass = tab['EVENT_CLASS'][:, ::-1]
-        evtype = tab['EVENT_TYPE'][:, ::-1]
-
-        import time
-        t0 = time.time()
-
-        evt_sep, evt_xsep, evt_ctheta = self.calc_sep(tab, self._src_list)
-        if 'PULSE_PHASE' in tab.colnames:
-            phase = np.repeat(tab['PULSE_PHASE'].data,
-                              evt_sep.shape[0], axis=0)
-        else:
-            phase = np.zeros(evt_sep.size)
-
-        energy = np.repeat(tab['ENERGY'].data, evt_sep.shape[0], axis=0)
-        evclass = evclass * np.ones(evt_sep.shape + (32,), dtype=bool)
-        evtype = evtype * np.ones(evt_sep.shape + (32,), dtype=bool)
-        evclass = evclass.reshape(energy.shape + (-1,))
-        evtype = evtype.reshape(energy.shape + (-1,))
-        evt_sep = np.ravel(evt_sep)
-        evt_xsep = np.ravel(evt_xsep)
-        evt_ctheta = np.ravel(evt_ctheta)
-
-        def mask_arrays(mask, *args):
-            return tuple([t[mask] for t in args])
-        args = (evclass, evtype, evt_sep,
-                evt_xsep, energy, evt_ctheta, phase)
-        args = mask_arrays((evt_xsep < 1.0) | (evt_sep < 4.0), *args)
-        (evclass, evtype, evt_sep,
-         evt_xsep, energy, evt_ctheta, phase) = args
-
-        t1 = time.time()
-
-        self.fill_alpha()
-
-        print('creating onoff mask')
-
-        mon, moff = self.create_onoff_mask(evt_sep, phase)
-
-        print('filling')
-
-        for m, lbl in zip([mon, moff], ['on', 'off']):
-            args_in = mask_arrays(
-                m, *(evclass, evtype, evt_xsep, energy, evt_ctheta))
-            hists['evclass_%s' % lbl] += self.create_hist(*args_in)
-            hists['evtype_%s' % lbl] += self.create_hist(*args_in,
-                                                         fill_evtype=True)
-            hists['evclass_psf_%s' % lbl] += self.create_hist(*args_in,
-                                                              fill_sep=True)
-            hists['evtype_psf_%s' % lbl] += self.create_hist(*args_in, fill_sep=True,
-                                                             fill_evtype=True)
-
-        t2 = time.time()
-
-        print(t2 - t1, t1 - t0)
-
-    def create_hist(self, evclass, evtype, xsep, energy, ctheta,
-                    fill_sep=False, fill_evtype=False):
-        """Load into a histogram."""
-
-        nevt = len(evclass)
+    def get_source_vectors(self):
+        """Return the cartesian unit vectors of the sources in the
+        source list."""
+
+        if self._src_xyz is None:
+            src_tab = catalog.Catalog3FGL().table
+            m = utils.find_rows_by_string(
+                src_tab, self._src_list, ['Source_Name', 'ASSOC1', 'ASSOC2'])
+            rows = src_tab[m]
+            self._src_xyz = utils.angle_to_cartesian(
+                np.radians(np.array(rows['RAJ2000'], dtype=float)),
+                np.radians(np.array(rows['DEJ2000'], dtype=float)))
+        return self._src_xyz
+
+    def calc_sep(self, evts):
+        """Find the pairs of sources and events that are within the
+        region used to fill the histograms.  Candidate pairs are
+        selected with a KD-tree of the event directions such that the
+        separations are only computed for nearby pairs.
+
+        Returns
+        -------
+        ievt : `~numpy.ndarray`
+            Event index of each pair.
+
+        sep : `~numpy.ndarray`
+            Angular separation in degrees.
+
+        xsep : `~numpy.ndarray`
+            Angular separation in units of the PSF scale.
+
+        ctheta : `~numpy.ndarray`
+            Cosine of the angle between the source and the LAT
+            boresight.
+        """
+
+        src_xyz = self.get_source_vectors()
+        evt_xyz = utils.angle_to_cartesian(np.radians(evts['RA']),
+                                           np.radians(evts['DEC']))
+        rmax = max(4.0, np.max(self._psf_scale))
+
+        tree = spatial.cKDTree(evt_xyz)
+        idx = tree.query_ball_point(src_xyz, 2.0 * np.sin(np.radians(rmax) / 2.))
+        ievt = np.concatenate([np.array(t, dtype=int) for t in idx] +
+                              [np.zeros(0, dtype=int)])
+        isrc = np.repeat(np.arange(len(idx)), [len(t) for t in idx])
+
+        cth = utils.dot_prod(evt_xyz[ievt], src_xyz[isrc])
+        sep = np.degrees(np.arccos(np.clip(cth, -1.0, 1.0)))
+        xsep = sep / self._get_psf_scale(evts['ENERGY'][ievt])
+
+        lat_xyz = utils.angle_to_cartesian(np.radians(evts['PtRaz'][ievt]),
+                                           np.radians(evts['PtDecz'][ievt]))
+        ctheta = utils.dot_prod(lat_xyz, src_xyz[isrc])
+
+        m = (xsep < 1.0) | (sep < 4.0)
+        return ievt[m], sep[m], xsep[m], ctheta[m]
+
+    def _get_psf_scale(self, energy):
         ebin = utils.val_to_bin(self._energy_bins, energy)
-        scale = self._psf_scale[ebin]
+        return self._psf_scale[np.clip(ebin, 0, len(self._psf_scale) - 1)]
 
-        vals = [energy, ctheta]
-        bins = [self._energy_bins, self._ctheta_bins]
+    def load_events(self, evts):
+        """Fill the histograms with a table of events.  Events are
+        processed in chunks of ``chunk_size`` rows.
 
-        if fill_sep:
-            vals += [xsep]
-            bins += [self._xsep_bins]
+        Parameters
+        ----------
+        evts : dict
+            Table or dictionary of event columns.
+        """
 
-        if fill_evtype:
-            loopv = [self._evclass_bins[:-1], self._evtype_bins[:-1]]
-            shape = [16, 16] + [len(b) - 1 for b in bins]
+        self.fill_alpha()
+        nevt = len(evts['ENERGY'])
+        for i0 in range(0, nevt, self._chunk_size):
+            s = slice(i0, i0 + self._chunk_size)
+            chunk = {k: np.asarray(evts[k][s]) for k in self._colnames
+                     if k in evts}
+            self._fill_chunk(chunk)
+
+    def _fill_chunk(self, evts):
+
+        ievt, sep, xsep, ctheta = self.calc_sep(evts)
+        if 'PULSE_PHASE' in evts:
+            phase = evts['PULSE_PHASE'][ievt]
         else:
-            loopv = [self._evclass_bins[:-1]]
-            shape = [16] + [len(b) - 1 for b in bins]
-
-        h = np.zeros(shape)
-        for t in itertools.product(*loopv):
-
-            m = (evclass[:, int(t[0])] == True)
-            if fill_evtype:
-                m &= (evtype[:, int(t[1])] == True)
-            if not np.sum(m):
-                continue
+            phase = np.zeros(len(ievt))
 
-            z = np.vstack(vals)
-            z = z[:, m]
+        mon, moff = self.create_onoff_mask(sep, phase)
+        evclass = decode_bits(evts['EVENT_CLASS'])[ievt]
+        evtype = decode_bits(evts['EVENT_TYPE'])[ievt]
+        energy = evts['ENERGY'][ievt]
 
-            if fill_evtype:
-                h[int(t[0]), int(t[1])] += np.histogramdd(z.T, bins=bins)[0]
-            else:
-                h[int(t[0])] += np.histogramdd(z.T, bins=bins)[0]
-
-        return h
+        for m, lbl in zip([mon, moff], ['on', 'off']):
+            self.fill_hists(lbl, evclass[m], evtype[m], xsep[m], energy[m],
+                            ctheta[m])
+
+    def fill_hists(self, lbl, evclass, evtype, xsep, energy, ctheta):
+        """Fill the evclass, evtype, evclass_psf and evtype_psf
+        histograms of the on or off region in a single pass.
+
+        Parameters
+        ----------
+        lbl : str
+            Region label ('on' or 'off').
+
+        evclass : `~numpy.ndarray`
+            Event class bit field of each event.
+
+        evtype : `~numpy.ndarray`
+            Event type bit field of each event.
+        """
+
+        nclass = len(self._evclass_bins) - 1
+        ntype = len(self._evtype_bins) - 1
+        ne = len(self._energy_bins) - 1
+        nc = len(self._ctheta_bins) - 1
+        nx = len(self._xsep_bins) - 1
+
+        ie = hist_index(self._energy_bins, energy)
+        ic = hist_index(self._ctheta_bins, ctheta)
+        ix = hist_index(self._xsep_bins, xsep)
+        m = (ie >= 0) & (ic >= 0)
+        mpsf = m & (ix >= 0)
+        bits = np.arange(nclass, dtype=np.int64)
+
+        # Expand each event over its set event class bits
+        jc, bc = np.nonzero(((evclass[:, None] >> bits) & 1).astype(bool) &
+                            m[:, None])
+        idx = (bc * ne + ie[jc]) * nc + ic[jc]
+        mc = mpsf[jc]
+        h = self._hists
+        h['evclass_%s' % lbl] += np.bincount(
+            idx, minlength=nclass * ne * nc).reshape(nclass, ne, nc)
+        h['evclass_psf_%s' % lbl] += np.bincount(
+            idx[mc] * nx + ix[jc[mc]],
+            minlength=nclass * ne * nc * nx).reshape(nclass, ne, nc, nx)
+
+        # Expand each (event, class bit) pair over its set event type
+        # bits
+        bits = np.arange(ntype, dtype=np.int64)
+        jt, bt = np.nonzero(((evtype[jc][:, None] >> bits) & 1).astype(bool))
+        jct = jc[jt]
+        idx = ((bc[jt] * ntype + bt) * ne + ie[jct]) * nc + ic[jct]
+        mt = mpsf[jct]
+        shape = (nclass, ntype, ne, nc)
+        h['evtype_%s' % lbl] += np.bincount(
+            idx, minlength=np.prod(shape)).reshape(shape)
+        h['evtype_psf_%s' % lbl] += np.bincount(
+            idx[mt] * nx + ix[jct[mt]],
+            minlength=np.prod(shape) * nx).reshape(shape + (nx,))
 
     def calc_eff(self):
         """Calculate the efficiency."""
@@ -415,23 +535,23 @@ class Validator(object):
 
 class GRValidator(Validator):
 
-    def __init__(self, scfile, zmax):
-        super(GRValidator, self).__init__(scfile, zmax)
+    _colnames = ['ENERGY', 'THETA', 'B', 'EVENT_CLASS', 'EVENT_TYPE',
+                 'PULSE_PHASE']
+
+    def __init__(self, scfile, zmax, **kwargs):
+        super(GRValidator, self).__init__(scfile, zmax, **kwargs)
         self._type = 'ridge'
         self._src_list = []
 
-    def calc_sep(self, tab, src_list):
-
-        evt_ctheta = np.cos(np.radians(tab['THETA']))
-        evt_sep = np.abs(tab['B'])
-        evt_ebin = utils.val_to_bin(self._energy_bins, tab['ENERGY'])
-        evt_xsep = evt_sep / self._psf_scale[evt_ebin][None, :]
+    def calc_sep(self, evts):
 
-        evt_ctheta = evt_ctheta.reshape((1, -1))
-        evt_sep = evt_sep.reshape((1, -1))
-        evt_xsep = evt_xsep.reshape((1, -1))
+        evt_ctheta = np.cos(np.radians(evts['THETA']))
+        evt_sep = np.abs(evts['B'])
+        evt_xsep = evt_sep / self._get_psf_scale(evts['ENERGY'])
+        m = (evt_xsep < 1.0) | (evt_sep < 4.0)
+        ievt = np.flatnonzero(m)
 
-        return evt_sep, evt_xsep, evt_ctheta
+        return ievt, evt_sep[m], evt_xsep[m], evt_ctheta[m]
 
     def create_onoff_mask(self, sep, phase):
 
@@ -450,8 +570,8 @@ class GRValidator(Validator):
 
 class AGNValidator(Validator):
 
-    def __init__(self, scfile, zmax):
-        super(AGNValidator, self).__init__(scfile, zmax)
+    def __init__(self, scfile, zmax, **kwargs):
+        super(AGNValidator, self).__init__(scfile, zmax, **kwargs)
         self._type = 'agn'
         self._src_list = agn_src_list
 
@@ -469,8 +589,8 @@ class AGNValidator(Validator):
 
 class PSRValidator(Validator):
 
-    def __init__(self, scfile, zmax):
-        super(PSRValidator, self).__init__(scfile, zmax)
+    def __init__(self, scfile, zmax, **kwargs):
+        super(PSRValidator, self).__init__(scfile, zmax, **kwargs)
         self._type = 'psr'
         self._src_list = ['Vela']
 
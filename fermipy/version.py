@@ -35,7 +35,7 @@ import os
 import subprocess
 from subprocess import check_output
 
-__all__ = ("get_git_version")
+__all__ = ("get_git_version", "get_version")
 
 _refname = '$Format: %D$'
 _tree_hash = '$Format: %t$'
@@ -176,5 +176,35 @@ def get_git_version(abbrev=4):
     return version
 
 
+def read_metadata_version():
+    """Read the version from the metadata of the installed package."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        return None
+
+    try:
+        return metadata.version('fermipy')
+    except Exception:
+        return None
+
+
+def get_version():
+    """Get the package version without calling git.  The version is
+    read from ``_version.py``, which is generated by ``setup.py`` when
+    the package is built or installed, or from the metadata of the
+    installed package.  Returns 'unknown' if neither is available
+    (e.g. in a fresh checkout that was never built)."""
+
+    version = read_release_version()
+    if version is None:
+        version = render_pep440(read_release_keywords(_refname))
+    if version is None:
+        version = read_metadata_version()
+    if version is None:
+        version = 'unknown'
+    return version
+
+
 if __name__ == "__main__":
     print(get_git_version())